@@ -0,0 +1,9 @@
+"""
+Запуск интерфейса командной строки: python -m bookkeeper
+"""
+
+import sys
+
+from bookkeeper.cli import main
+
+sys.exit(main())
@@ -0,0 +1,371 @@
+"""
+Архивирование старых расходов.
+
+Расходы, сделанные раньше заданной даты, переносятся из оперативной базы
+в отдельные файлы по годам (database_archive_2015.sqlite и т. д.),
+лежащие рядом с основным файлом. Исторические запросы подключают
+нужные архивы через ATTACH и объединяют результаты.
+"""
+
+import glob
+import os.path
+import re
+import sqlite3
+from datetime import datetime
+from typing import Collection, Iterator, NamedTuple
+
+from bookkeeper import rates
+
+# Ограничение SQLite на число одновременно подключённых баз
+MAX_ATTACHED: int = 10
+
+DATE_FORMAT: str = "%Y-%m-%d %H:%M:%S.%f"
+
+EXPENSE_COLUMNS: tuple[str, ...] = (
+    "obj_id", "amount", "category_id", "expense_date", "comment", "currency"
+)
+
+ARCHIVE_SCHEMA: str = """
+    CREATE TABLE IF NOT EXISTS {schema}."Expense" (
+        "obj_id" INTEGER PRIMARY KEY,
+        "amount" REAL NOT NULL,
+        "category_id" INTEGER NOT NULL,
+        "expense_date" DATETIME NOT NULL,
+        "comment" TEXT NOT NULL,
+        "currency" TEXT NOT NULL DEFAULT '{base}'
+    );
+    CREATE INDEX IF NOT EXISTS {schema}."idx_archive_expense_date"
+        ON "Expense" ("expense_date");
+"""
+
+
+class ArchivedExpense(NamedTuple):
+    """
+    Расход, прочитанный в обход ORM
+    (из оперативной базы или из архива).
+    Имеет те же поля, что и сущность Expense.
+    """
+
+    obj_id: int
+    amount: float
+    category_id: int
+    expense_date: datetime
+    comment: str
+    currency: str = rates.BASE_CURRENCY
+
+
+def archive_path(db_filename: str, year: int) -> str:
+    """
+    Путь к архивному файлу за год year для базы db_filename
+    """
+
+    stem, ext = os.path.splitext(db_filename)
+    return f"{stem}_archive_{year}{ext}"
+
+
+def list_archives(db_filename: str) -> dict[int, str]:
+    """
+    Находит архивы базы db_filename.
+    Возвращает словарь "год - путь к файлу", упорядоченный по годам.
+    """
+
+    stem, ext = os.path.splitext(db_filename)
+    pattern: re.Pattern = re.compile(
+        re.escape(os.path.basename(stem)) + r"_archive_(\d{4})" + re.escape(ext) + "$"
+    )
+    archives: dict[int, str] = {}
+    for path in glob.glob(glob.escape(stem) + "_archive_*" + ext):
+        match = pattern.match(os.path.basename(path))
+        if match:
+            archives[int(match.group(1))] = path
+    return dict(sorted(archives.items()))
+
+
+def _format_date(date: datetime) -> str:
+    return date.strftime(DATE_FORMAT)
+
+
+def _connect(db_filename: str) -> sqlite3.Connection:
+    return sqlite3.connect(db_filename, isolation_level=None)
+
+
+def _prepare_archive(con: sqlite3.Connection, schema: str) -> None:
+    """
+    Создаёт таблицу расходов в подключённом архиве, а в архивах,
+    созданных до появления валют, добавляет столбец валюты
+    """
+
+    con.executescript(ARCHIVE_SCHEMA.format(schema=schema, base=rates.BASE_CURRENCY))
+    columns: set[str] = {
+        row[1] for row in con.execute(f'PRAGMA {schema}.table_info("Expense")')
+    }
+    if "currency" not in columns:
+        con.execute(
+            f'ALTER TABLE {schema}."Expense" ADD COLUMN "currency" TEXT NOT NULL '
+            f"DEFAULT '{rates.BASE_CURRENCY}'"
+        )
+
+
+def archive_expenses(db_filename: str, cutoff: datetime) -> int:
+    """
+    Переносит расходы с датой раньше cutoff в архивы по годам.
+    Перенос каждого года выполняется одной транзакцией,
+    охватывающей оперативную базу и архив.
+    Возвращает число перенесённых расходов.
+    """
+
+    columns: str = ", ".join(f'"{col}"' for col in EXPENSE_COLUMNS)
+    moved: int = 0
+
+    con: sqlite3.Connection = _connect(db_filename)
+    try:
+        years: list[int] = [
+            int(year) for (year,) in con.execute(
+                'SELECT DISTINCT substr("expense_date", 1, 4) FROM "Expense" '
+                'WHERE "expense_date" < ?',
+                (_format_date(cutoff),)
+            )
+        ]
+        tracked: bool = con.execute(
+            "SELECT 1 FROM main.sqlite_master WHERE type='table' AND name='SyncRow'"
+        ).fetchone() is not None
+        for year in sorted(years):
+            start: str = _format_date(datetime(year, 1, 1))
+            end: str = _format_date(min(cutoff, datetime(year + 1, 1, 1)))
+
+            con.execute(
+                "ATTACH DATABASE ? AS archive", (archive_path(db_filename, year),)
+            )
+            try:
+                _prepare_archive(con, "archive")
+                con.execute("BEGIN IMMEDIATE")
+                try:
+                    cursor: sqlite3.Cursor = con.execute(
+                        f'INSERT INTO archive."Expense" ({columns}) '
+                        f'SELECT {columns} FROM main."Expense" '
+                        'WHERE "expense_date" >= ? AND "expense_date" < ?',
+                        (start, end)
+                    )
+                    moved += cursor.rowcount
+                    if tracked:
+                        # перенос в архив --- не удаление,
+                        # другим копиям базы (см. bookkeeper.sync) он не передаётся
+                        con.execute(
+                            'DELETE FROM main."SyncRow" WHERE "tbl" = \'Expense\' '
+                            'AND "obj_id" IN (SELECT "obj_id" FROM main."Expense" '
+                            'WHERE "expense_date" >= ? AND "expense_date" < ?)',
+                            (start, end)
+                        )
+                    con.execute(
+                        'DELETE FROM main."Expense" '
+                        'WHERE "expense_date" >= ? AND "expense_date" < ?',
+                        (start, end)
+                    )
+                    con.execute("COMMIT")
+                except sqlite3.Error:
+                    con.execute("ROLLBACK")
+                    raise
+            finally:
+                con.execute("DETACH DATABASE archive")
+    finally:
+        con.close()
+
+    return moved
+
+
+def _archives_in_range(
+        db_filename: str, start: datetime | None, end: datetime | None
+) -> list[str]:
+    return [
+        path for year, path in list_archives(db_filename).items()
+        if (start is None or year >= start.year) and (end is None or year <= end.year)
+    ]
+
+
+def _range_condition(
+        start: datetime | None,
+        end: datetime | None,
+        category_ids: Collection[int] | None = None
+) -> tuple[str, list[str | int]]:
+    conditions: list[str] = []
+    params: list[str | int] = []
+    if start is not None:
+        conditions.append('"expense_date" >= ?')
+        params.append(_format_date(start))
+    if end is not None:
+        conditions.append('"expense_date" < ?')
+        params.append(_format_date(end))
+    if category_ids is not None:
+        conditions.append(
+            '"category_id" IN (' + ", ".join("?" * len(category_ids)) + ")"
+        )
+        params.extend(category_ids)
+    if not conditions:
+        return "", params
+    return "WHERE " + " AND ".join(conditions), params
+
+
+def fan_out(
+        db_filename: str,
+        start: datetime | None,
+        end: datetime | None,
+        select: str,
+        suffix: str = "",
+        category_ids: Collection[int] | None = None
+) -> Iterator[sqlite3.Cursor]:
+    """
+    Выполняет запрос select по оперативной базе и всем подходящим архивам.
+    Таблица расходов {table} доступна в запросе под псевдонимом e.
+    Условие {where} отбирает расходы за промежуток [start, end)
+    и, если задан category_ids, только из этих категорий.
+    Архивы подключаются группами не больше MAX_ATTACHED,
+    запросы по базам группы объединяются через UNION ALL,
+    к объединённому запросу дописывается suffix (например, ORDER BY).
+    Для каждой группы выдаёт курсор с результатом.
+    """
+
+    where, params = _range_condition(start, end, category_ids)
+    archives: list[str] = _archives_in_range(db_filename, start, end)
+
+    con: sqlite3.Connection = _connect(db_filename)
+    try:
+        batches: list[list[str]] = [
+            archives[i:i + MAX_ATTACHED] for i in range(0, len(archives), MAX_ATTACHED)
+        ]
+        # оперативная база идёт последней, так как содержит самые новые расходы
+        batches.append([])
+        for batch_num, batch in enumerate(batches):
+            schemas: list[str] = [f"archive{i}" for i in range(len(batch))]
+            for schema, path in zip(schemas, batch):
+                con.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+                _prepare_archive(con, schema)
+            try:
+                tables: list[str] = schemas if batch_num < len(batches) - 1 else ["main"]
+                query: str = " UNION ALL ".join(
+                    select.format(table=f'{schema}."Expense" AS e', where=where)
+                    for schema in tables
+                )
+                cursor: sqlite3.Cursor = con.execute(
+                    f"{query} {suffix}", params * len(tables)
+                )
+                try:
+                    yield cursor
+                finally:
+                    cursor.close()
+            finally:
+                for schema in schemas:
+                    con.execute(f"DETACH DATABASE {schema}")
+    finally:
+        con.close()
+
+
+def iter_expenses(
+        db_filename: str, start: datetime | None = None, end: datetime | None = None
+) -> Iterator[ArchivedExpense]:
+    """
+    Перебирает расходы за промежуток [start, end) в порядке дат,
+    просматривая архивы и оперативную базу.
+    """
+
+    columns: str = ", ".join(f'"{col}"' for col in EXPENSE_COLUMNS)
+    select: str = f"SELECT {columns} FROM {{table}} {{where}}"
+    order: str = 'ORDER BY "expense_date", "obj_id"'
+    for cursor in fan_out(db_filename, start, end, select, order):
+        for obj_id, amount, category_id, expense_date, comment, code in cursor:
+            yield ArchivedExpense(
+                obj_id, amount, category_id,
+                datetime.strptime(expense_date, DATE_FORMAT), comment, code
+            )
+
+
+def sum_expenses(
+        db_filename: str, start: datetime | None = None, end: datetime | None = None
+) -> float:
+    """
+    Вычисляет сумму расходов в основной валюте за промежуток [start, end)
+    по архивам и оперативной базе. Курсы берутся из оперативной базы
+    в том же запросе (см. bookkeeper.rates).
+    """
+
+    select: str = f'SELECT total({rates.converted("e")}) FROM {{table}} {{where}}'
+    return sum(
+        value for cursor in fan_out(db_filename, start, end, select)
+        for (value,) in cursor
+    )
+
+
+def sum_by_category(
+        db_filename: str, start: datetime | None = None, end: datetime | None = None
+) -> dict[int, float]:
+    """
+    Вычисляет суммы расходов в основной валюте по id категорий
+    за промежуток [start, end) по архивам и оперативной базе.
+    """
+
+    select: str = (
+        f'SELECT "category_id", total({rates.converted("e")}) FROM {{table}} {{where}} '
+        'GROUP BY "category_id"'
+    )
+    totals: dict[int, float] = {}
+    for cursor in fan_out(db_filename, start, end, select):
+        for cat_id, total in cursor:
+            totals[cat_id] = totals.get(cat_id, 0) + total
+    return totals
+
+
+def count_expenses(
+        db_filename: str, category_ids: Collection[int] | None = None
+) -> int:
+    """
+    Считает расходы (всех категорий или только category_ids)
+    в оперативной базе и архивах
+    """
+
+    select: str = "SELECT count(*) FROM {table} {where}"
+    return sum(
+        value
+        for cursor in fan_out(db_filename, None, None, select, category_ids=category_ids)
+        for (value,) in cursor
+    )
+
+
+def reassign_category(db_filename: str, cat_id: int, new_cat_id: int | None) -> int:
+    """
+    Переносит архивные расходы категории cat_id в категорию new_cat_id,
+    а если она None --- удаляет их. Каждый архив изменяется одним запросом.
+    Возвращает число изменённых расходов.
+    """
+
+    changed: int = 0
+    for path in list_archives(db_filename).values():
+        con: sqlite3.Connection = _connect(path)
+        try:
+            if new_cat_id is None:
+                cursor: sqlite3.Cursor = con.execute(
+                    'DELETE FROM "Expense" WHERE "category_id" = ?', (cat_id,)
+                )
+            else:
+                cursor = con.execute(
+                    'UPDATE "Expense" SET "category_id" = ? WHERE "category_id" = ?',
+                    (new_cat_id, cat_id)
+                )
+            changed += cursor.rowcount
+        finally:
+            con.close()
+    return changed
+
+
+def orphan_category_ids(db_filename: str) -> set[int]:
+    """
+    Находит id несуществующих категорий, на которые ссылаются расходы
+    в оперативной базе и архивах
+    """
+
+    select: str = (
+        'SELECT DISTINCT "category_id" FROM {table} {where} '
+        'EXCEPT SELECT "obj_id" FROM main."Category"'
+    )
+    return {
+        cat_id for cursor in fan_out(db_filename, None, None, select)
+        for (cat_id,) in cursor
+    }
@@ -0,0 +1,92 @@
+"""
+Курсоры заполнения данных миграций по таблице расходов.
+
+Заполнение производной таблицы (дневных сумм, записей отслеживания
+изменений) по существующим расходам идёт порциями в порядке obj_id.
+Пока оно не закончено, в таблице BackfillCursor хранится id последнего
+обработанного расхода. Расходы с большим id, в том числе внесённые после
+начала заполнения, ещё не обработаны: их учтёт следующая порция.
+Поэтому триггеры, поддерживающие производную таблицу, пропускают такие
+расходы (условие processed), иначе расход был бы учтён дважды.
+Когда заполнение закончено, запись курсора удаляется и условие
+выполняется для всех расходов.
+"""
+
+import sqlite3
+
+CURSOR_SCHEMA: str = """
+    CREATE TABLE IF NOT EXISTS "BackfillCursor" (
+        "name" TEXT PRIMARY KEY,
+        "cursor" INTEGER NOT NULL
+    ) WITHOUT ROWID;
+"""
+
+
+def processed(name: str, row: str) -> str:
+    """
+    SQL-условие: строка row (например, NEW в триггере) уже обработана
+    заполнением name или это заполнение закончено
+    """
+
+    return (
+        f'{row}."obj_id" <= coalesce((SELECT "cursor" FROM "BackfillCursor" '
+        f"WHERE \"name\" = '{name}'), {row}.\"obj_id\")"
+    )
+
+
+def start(con: sqlite3.Connection, name: str, table: str) -> None:
+    """
+    Начинает заполнение name по строкам таблицы table, если они есть.
+    Вызывается внутри транзакции, создающей производную таблицу.
+    """
+
+    con.execute(CURSOR_SCHEMA)
+    if con.execute(f'SELECT 1 FROM "{table}" LIMIT 1').fetchone() is not None:
+        con.execute(
+            'INSERT OR IGNORE INTO "BackfillCursor" ("name", "cursor") VALUES (?, 0)',
+            (name,)
+        )
+
+
+def batch(
+        con: sqlite3.Connection, name: str, table: str, size: int
+) -> tuple[int, int, int]:
+    """
+    Следующая порция заполнения name: не больше size строк таблицы table
+    с id после курсора. Возвращает промежуток id (after, upto] порции
+    и число строк в ней и сдвигает курсор на конец промежутка;
+    вызывающий обрабатывает строки порции той же транзакцией.
+    Если строк не осталось, удаляет курсор и возвращает пустую порцию.
+    """
+
+    row: tuple | None = con.execute(
+        'SELECT "cursor" FROM "BackfillCursor" WHERE "name" = ?', (name,)
+    ).fetchone()
+    if row is None:
+        return 0, 0, 0
+    after: int = row[0]
+    count, upto = con.execute(
+        f'SELECT count(*), max("obj_id") FROM (SELECT "obj_id" FROM "{table}" '
+        'WHERE "obj_id" > ? ORDER BY "obj_id" LIMIT ?)',
+        (after, size)
+    ).fetchone()
+    if not count:
+        con.execute('DELETE FROM "BackfillCursor" WHERE "name" = ?', (name,))
+        return after, after, 0
+    con.execute('UPDATE "BackfillCursor" SET "cursor" = ? WHERE "name" = ?', (upto, name))
+    return after, upto, count
+
+
+def remaining(con: sqlite3.Connection, name: str, table: str) -> int:
+    """
+    Число строк таблицы table, ещё не обработанных заполнением name
+    """
+
+    row: tuple | None = con.execute(
+        'SELECT "cursor" FROM "BackfillCursor" WHERE "name" = ?', (name,)
+    ).fetchone()
+    if row is None:
+        return 0
+    return con.execute(
+        f'SELECT count(*) FROM "{table}" WHERE "obj_id" > ?', (row[0],)
+    ).fetchone()[0]
@@ -0,0 +1,321 @@
+"""
+Текущие суммы бюджетов и оповещения о приближении к лимиту.
+
+Бюджет ограничивает расходы всех категорий, одной категории или,
+если у него задан флаг subcategories, категории вместе со всеми
+её потомками (см. bookkeeper.hierarchy). Для каждого бюджета
+BudgetTracker хранит в памяти сумму расходов за текущий период.
+
+Суммы загружаются одним запросом к дневным суммам (DailyTotal) за
+объединение периодов всех бюджетов, после чего обновляются
+по изменениям: триггеры на DailyTotal пишут каждое изменение дневной
+суммы в журнал DailyTotalLog, и новая запись журнала меняет суммы только
+тех бюджетов, которые учитывают её категорию и день. Поэтому запись
+расхода стоит нескольких сложений, а состояние сотен бюджетов читается
+без запросов к базе. Изменения бюджетов и дерева категорий увеличивают
+счётчик BudgetRevision, и тогда суммы загружаются заново, так же
+как при смене дня. Журнал общий для всех процессов; когда он длиннее
+LOG_SIZE записей, старая половина удаляется, а отставший процесс
+загружает суммы заново.
+
+Когда доля потраченного лимита переходит через один из порогов
+ALERT_THRESHOLDS, создаётся оповещение BudgetAlert.
+"""
+
+import sqlite3
+import threading
+from datetime import date
+from typing import NamedTuple
+
+from bookkeeper import periods
+
+# Доли лимита, при переходе через которые создаётся оповещение
+ALERT_THRESHOLDS: tuple[float, ...] = (0.8, 1.0)
+
+# Сколько записей журнала дневных сумм хранится
+LOG_SIZE: int = 10000
+
+BUDGET_TRACKING_SCHEMA: str = """
+    CREATE TABLE IF NOT EXISTS "DailyTotalLog" (
+        "seq" INTEGER PRIMARY KEY AUTOINCREMENT,
+        "day" TEXT NOT NULL,
+        "category_id" INTEGER NOT NULL,
+        "delta" REAL NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS "BudgetRevision" (
+        "id" INTEGER PRIMARY KEY CHECK ("id" = 1),
+        "revision" INTEGER NOT NULL
+    );
+
+    INSERT OR IGNORE INTO "BudgetRevision" ("id", "revision") VALUES (1, 0);
+
+    CREATE TRIGGER IF NOT EXISTS "trg_dailytotal_insert_log"
+    AFTER INSERT ON "DailyTotal" BEGIN
+        INSERT INTO "DailyTotalLog" ("day", "category_id", "delta")
+        VALUES (NEW."day", NEW."category_id", NEW."amount");
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_dailytotal_update_log"
+    AFTER UPDATE ON "DailyTotal" BEGIN
+        INSERT INTO "DailyTotalLog" ("day", "category_id", "delta")
+        VALUES (OLD."day", OLD."category_id", -OLD."amount"),
+               (NEW."day", NEW."category_id", NEW."amount");
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_dailytotal_delete_log"
+    AFTER DELETE ON "DailyTotal" BEGIN
+        INSERT INTO "DailyTotalLog" ("day", "category_id", "delta")
+        VALUES (OLD."day", OLD."category_id", -OLD."amount");
+    END;
+"""
+
+# Изменения, после которых суммы бюджетов загружаются заново
+_REVISION_TRIGGERS: tuple[tuple[str, str], ...] = (
+    ("budget_insert", 'AFTER INSERT ON "Budget"'),
+    ("budget_update", 'AFTER UPDATE ON "Budget"'),
+    ("budget_delete", 'AFTER DELETE ON "Budget"'),
+    ("category_insert", 'AFTER INSERT ON "Category" WHEN NEW."parent_id" IS NOT NULL'),
+    ("category_update", 'AFTER UPDATE OF "parent_id" ON "Category"'),
+    ("category_delete", 'AFTER DELETE ON "Category"'),
+)
+
+# Категории каждого бюджета, ограничивающего одну категорию:
+# сама категория и, если задан subcategories, её потомки
+_COVERED_QUERY: str = """
+    WITH RECURSIVE "Covered" ("budget_id", "category_id", "subcategories") AS (
+        SELECT "obj_id", "category_id", "subcategories" FROM "Budget"
+        WHERE "category_id" <> ?
+        UNION
+        SELECT c."budget_id", k."obj_id", c."subcategories" FROM "Covered" AS c
+        JOIN "Category" AS k ON k."parent_id" = c."category_id"
+        WHERE c."subcategories"
+    )
+    SELECT "budget_id", "category_id" FROM "Covered"
+"""
+
+
+class BudgetAlert(NamedTuple):
+    """
+    Оповещение: расходы бюджета budget_id за текущий период
+    дошли до доли threshold лимита limit и составляют spent
+    """
+
+    budget_id: int
+    threshold: float
+    spent: float
+    limit: float
+
+
+class _Tracked(NamedTuple):
+    start: str
+    end: str
+    limit: float
+
+
+def install_budget_tracking(con: sqlite3.Connection) -> None:
+    """
+    Добавляет бюджетам флаг учёта подкатегорий, создаёт журнал дневных
+    сумм, счётчик изменений бюджетов и поддерживающие их триггеры
+    """
+
+    columns: set[str] = {row[1] for row in con.execute('PRAGMA table_info("Budget")')}
+    with con:
+        if "subcategories" not in columns:
+            con.execute(
+                'ALTER TABLE "Budget" '
+                'ADD COLUMN "subcategories" INTEGER NOT NULL DEFAULT 0'
+            )
+        con.executescript("BEGIN;" + BUDGET_TRACKING_SCHEMA + "".join(
+            f'CREATE TRIGGER IF NOT EXISTS "trg_{name}_budget_revision" {event} BEGIN '
+            'UPDATE "BudgetRevision" SET "revision" = "revision" + 1; END;'
+            for name, event in _REVISION_TRIGGERS
+        ))
+
+
+def fraction(spent: float, limit: float) -> float:
+    """
+    Доля потраченного лимита; бюджеты без лимита оповещений не создают
+    """
+
+    return spent / limit if limit > 0 else 0.0
+
+
+def crossed(old: float, new: float) -> list[float]:
+    """
+    Пороги ALERT_THRESHOLDS, через которые доля потраченного лимита
+    перешла вверх при изменении с old на new
+    """
+
+    return [threshold for threshold in ALERT_THRESHOLDS if old < threshold <= new]
+
+
+class BudgetTracker:
+    """
+    Суммы расходов бюджетов за их текущие периоды: id бюджета -> сумма.
+    Загружаются одним запросом и обновляются по журналу дневных сумм,
+    когда PRAGMA data_version показывает, что база изменилась.
+    """
+
+    def __init__(self, db_filename: str):
+        # ожидание короткое: очистка журнала откладывается, если база занята
+        self._con: sqlite3.Connection = sqlite3.connect(
+            db_filename, check_same_thread=False, isolation_level=None, timeout=0.1
+        )
+        self._lock: threading.Lock = threading.Lock()
+        self._version: int | None = None
+        self._revision: int = -1
+        self._today: date | None = None
+        self._seq: int = 0
+        self._budgets: dict[int, _Tracked] = {}
+        # категория -> бюджеты, которые её учитывают
+        self._by_category: dict[int, list[int]] = {}
+        self._spent: dict[int, float] = {}
+
+    def _load(self) -> None:
+        """
+        Загружает бюджеты и их суммы. Вызывается внутри читающей транзакции.
+        """
+
+        today: date = date.today()
+        self._budgets = {}
+        self._by_category = {}
+        for bdg_id, period, param, category_id, limit in self._con.execute(
+                'SELECT "obj_id", "period", "param", "category_id", "limit" FROM "Budget"'
+        ):
+            start, end = periods.make_period(period, param).bounds(today)
+            self._budgets[bdg_id] = _Tracked(start.isoformat(), end.isoformat(), limit)
+            if category_id == periods.ALL_CATEGORIES:
+                self._by_category.setdefault(periods.ALL_CATEGORIES, []).append(bdg_id)
+        for bdg_id, category_id in self._con.execute(
+                _COVERED_QUERY, (periods.ALL_CATEGORIES,)
+        ):
+            self._by_category.setdefault(category_id, []).append(bdg_id)
+
+        self._spent = dict.fromkeys(self._budgets, 0.0)
+        self._seq = self._con.execute(
+            'SELECT coalesce(max("seq"), 0) FROM "DailyTotalLog"'
+        ).fetchone()[0]
+        if self._budgets:
+            for day, category_id, amount in self._con.execute(
+                    'SELECT "day", "category_id", "amount" FROM "DailyTotal" '
+                    'WHERE "day" BETWEEN ? AND ?',
+                    (
+                        min(bdg.start for bdg in self._budgets.values()),
+                        max(bdg.end for bdg in self._budgets.values())
+                    )
+            ):
+                self._add(day, category_id, amount)
+        self._today = today
+
+    def _add(self, day: str, category_id: int, delta: float) -> None:
+        for bdg_id in self._by_category.get(category_id, ()):
+            self._count(bdg_id, day, delta)
+        for bdg_id in self._by_category.get(periods.ALL_CATEGORIES, ()):
+            self._count(bdg_id, day, delta)
+
+    def _count(self, bdg_id: int, day: str, delta: float) -> None:
+        bdg: _Tracked = self._budgets[bdg_id]
+        if bdg.start <= day <= bdg.end:
+            self._spent[bdg_id] += delta
+
+    def _replay(self) -> None:
+        for seq, day, category_id, delta in self._con.execute(
+                'SELECT "seq", "day", "category_id", "delta" FROM "DailyTotalLog" '
+                'WHERE "seq" > ? ORDER BY "seq"',
+                (self._seq,)
+        ):
+            self._add(day, category_id, delta)
+            self._seq = seq
+
+    def refresh(self) -> list[BudgetAlert]:
+        """
+        Обновляет суммы, если база изменилась с прошлого раза или
+        наступил новый день. Возвращает оповещения о порогах,
+        пройденных при этом обновлении.
+        """
+
+        with self._lock:
+            version: int = self._con.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._version and self._today == date.today():
+                return []
+            loaded: bool = self._version is not None
+            old: dict[int, float] = {
+                bdg_id: fraction(self._spent[bdg_id], bdg.limit)
+                for bdg_id, bdg in self._budgets.items()
+            }
+            self._con.execute("BEGIN")
+            try:
+                revision: int = self._con.execute(
+                    'SELECT "revision" FROM "BudgetRevision"'
+                ).fetchone()[0]
+                first: int | None = self._con.execute(
+                    'SELECT min("seq") FROM "DailyTotalLog"'
+                ).fetchone()[0]
+                if (
+                        revision != self._revision or self._today != date.today()
+                        or first is not None and first > self._seq + 1
+                ):
+                    # бюджеты или дерево категорий изменились, начался
+                    # новый период или нужные записи журнала уже удалены
+                    self._load()
+                    self._revision = revision
+                else:
+                    self._replay()
+            finally:
+                self._con.execute("COMMIT")
+            self._version = version
+            if first is not None and self._seq - first >= LOG_SIZE:
+                self._trim()
+
+            if not loaded:
+                # первая загрузка ничего не пересекает, а только задаёт начальные суммы
+                return []
+            alerts: list[BudgetAlert] = []
+            for bdg_id, spent in self._spent.items():
+                limit: float = self._budgets[bdg_id].limit
+                # доля может вырасти и от уменьшения лимита
+                alerts.extend(
+                    BudgetAlert(bdg_id, threshold, spent, limit)
+                    for threshold in crossed(old.get(bdg_id, 0.0), fraction(spent, limit))
+                )
+            return alerts
+
+    def _trim(self) -> None:
+        """
+        Удаляет старую половину журнала.
+        Если база занята другим процессом, очистка откладывается.
+        """
+
+        try:
+            self._con.execute(
+                'DELETE FROM "DailyTotalLog" WHERE "seq" <= ?',
+                (self._seq - LOG_SIZE // 2,)
+            )
+        except sqlite3.OperationalError:
+            pass
+
+    def spent(self, bdg_id: int) -> float | None:
+        """
+        Сумма расходов бюджета bdg_id за его текущий период
+        по состоянию на последнее обновление; None для неизвестного бюджета
+        """
+
+        return self._spent.get(bdg_id)
+
+    def reset(self) -> None:
+        """
+        Забывает суммы: при следующем обновлении они загружаются заново.
+        Нужно, если база заменена целиком (см. bookkeeper.writebehind).
+        """
+
+        with self._lock:
+            self._version = None
+            self._revision = -1
+
+    def close(self) -> None:
+        """
+        Закрывает соединение с базой
+        """
+
+        self._con.close()
@@ -0,0 +1,158 @@
+"""
+Кэш недавно прочитанных записей.
+
+Представление многократно запрашивает одни и те же расходы
+и категории по id: при каждом редактировании ячейки и для каждой
+строки списков. EntityCache хранит последние size прочитанных
+записей и отдаёт их без обращения к базе; когда кэш полон,
+вытесняется запись, к которой дольше всего не обращались (LRU).
+
+Кэш не следит за базой сам: изменяющий код сообщает, какие записи
+устарели (invalidate). Внутри транзакции записи помечаются устаревшими
+отложенно (defer) и удаляются из кэша после её фиксации
+(invalidate_deferred): иначе другой поток мог бы успеть положить
+в кэш прежнее, ещё зафиксированное значение.
+
+Счётчики попаданий, промахов и вытеснений показывают, насколько
+кэш помогает при текущем размере (stats).
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple, TypeVar
+
+# Сколько записей хранится по умолчанию
+CACHE_SIZE: int = 1024
+
+_Value = TypeVar("_Value")
+
+
+class CacheStats(NamedTuple):
+    """
+    Состояние кэша: наибольшее и текущее число записей,
+    число попаданий, промахов и вытеснений
+    """
+
+    size: int
+    entries: int
+    hits: int
+    misses: int
+    evictions: int
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Доля запросов, обслуженных из кэша
+        """
+
+        requests: int = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+
+class EntityCache:
+    """
+    LRU-кэш записей: ключ (например, (сущность, id)) -> запись.
+    Потокобезопасен. При размере 0 ничего не хранит.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self._lock: threading.Lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._deferred: set[Hashable] = set()
+        self._size: int = 0
+        # растёт при каждом удалении записей: загруженное до удаления
+        # значение могло устареть, и в кэш оно не кладётся
+        self._generation: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.resize(size)
+
+    def get(self, key: Hashable, load: Callable[[], _Value]) -> _Value:
+        """
+        Возвращает запись по ключу, при промахе загружая её вызовом load.
+        Исключение load передаётся вызывающему, и в кэш ничего не попадает.
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            generation: int = self._generation
+        # загрузка идёт без блокировки, чтобы не задерживать другие потоки
+        value: _Value = load()
+        with self._lock:
+            if generation == self._generation and self._size:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                self._evict()
+        return value
+
+    def _evict(self) -> None:
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """
+        Удаляет записи из кэша
+        """
+
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def defer(self, *keys: Hashable) -> None:
+        """
+        Запоминает записи, изменённые текущей транзакцией;
+        они удаляются из кэша вызовом invalidate_deferred после её фиксации
+        """
+
+        with self._lock:
+            self._deferred.update(keys)
+
+    def invalidate_deferred(self) -> None:
+        """
+        Удаляет из кэша записи, отложенные вызовами defer
+        """
+
+        with self._lock:
+            if not self._deferred:
+                return
+            self._generation += 1
+            for key in self._deferred:
+                self._entries.pop(key, None)
+            self._deferred.clear()
+
+    def clear(self) -> None:
+        """
+        Удаляет из кэша все записи. Счётчики сохраняются.
+        """
+
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def resize(self, size: int) -> None:
+        """
+        Задаёт наибольшее число записей, при уменьшении вытесняя лишние
+        """
+
+        if size < 0:
+            raise ValueError("Cache size must not be negative")
+        with self._lock:
+            self._size = size
+            self._evict()
+
+    def stats(self) -> CacheStats:
+        """
+        Возвращает размер кэша и счётчики
+        """
+
+        with self._lock:
+            return CacheStats(
+                self._size, len(self._entries), self.hits, self.misses, self.evictions
+            )
@@ -0,0 +1,733 @@
+"""
+Интерфейс командной строки.
+
+Работает с Presenter напрямую и не импортирует Qt,
+поэтому подходит для скриптов и заданий cron.
+Пример:
+    bookkeeper expense add 100 Продукты --comment хлеб
+    bookkeeper expense add 12.5 Кафе --currency EUR
+    bookkeeper rates курсы.csv
+    bookkeeper category add Фрукты --parent Продукты
+    bookkeeper category tree --parent Продукты --period week
+    bookkeeper tag add отпуск 12 13 14
+    bookkeeper report --tags 'отпуск AND NOT "к возмещению"'
+    bookkeeper budget add month 20000 --category Продукты --subcategories
+    bookkeeper --json budget status --forecast
+    bookkeeper recurring add 30000 Аренда monthly:5 --comment квартира
+    bookkeeper export расходы.csv.gz --from 2020-01-01 --category Продукты
+    bookkeeper import выписка.csv --duplicates flag
+    bookkeeper sync /media/flash/database.sqlite
+    bookkeeper migrate --batch-size 10000
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+from typing import Any, Callable, Sequence
+
+# Имена периодов бюджета и их коды (см. bookkeeper.periods)
+PERIODS: dict[str, int] = {
+    "day": 0, "week": 1, "month": 2,
+    "calendar-week": 3, "calendar-month": 4, "since-day": 5, "days": 6,
+}
+
+DEFAULT_PERIODS: tuple[str, ...] = ("day", "week", "month")
+
+# Политики обработки дубликатов (см. bookkeeper.duplicates)
+DUPLICATE_POLICIES: tuple[str, ...] = ("allow", "skip", "flag", "merge")
+
+UNKNOWN_CATEGORY: str = "Неизвестная категория"
+
+# Основная валюта (см. bookkeeper.rates)
+BASE_CURRENCY: str = "RUB"
+
+
+def _parse_date(text: str) -> datetime:
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Некорректная дата: {text}")
+
+
+def expense_to_dict(expense: Any, names: dict[int, str]) -> dict[str, Any]:
+    """
+    Представляет расход в виде словаря для вывода в JSON.
+    names - словарь "id категории - имя".
+    """
+
+    return {
+        "id": expense.obj_id,
+        "date": expense.expense_date.isoformat(sep=" "),
+        "amount": expense.amount,
+        "category_id": expense.category_id,
+        "category": names.get(expense.category_id, UNKNOWN_CATEGORY),
+        "comment": expense.comment,
+        "currency": expense.currency,
+    }
+
+
+def category_names(presenter: Any) -> dict[int, str]:
+    """
+    Получает словарь "id категории - имя" одним запросом
+    """
+
+    return {cat.obj_id: cat.name for cat in presenter.categories_get_list()}
+
+
+def expense_add(presenter: Any, args: argparse.Namespace) -> Any:
+    exp_id: int = presenter.expense_add(
+        args.amount, args.category, args.comment, args.date, args.duplicates,
+        args.currency
+    )
+    return {"id": exp_id}
+
+
+def expense_list(presenter: Any, args: argparse.Namespace) -> Any:
+    if args.tags is not None:
+        expenses: list = [
+            presenter.expense_get_by_id(exp_id)
+            for exp_id in presenter.expenses_find_by_tags(args.tags)
+        ]
+    elif args.history or args.start or args.end:
+        expenses = presenter.expenses_get_history(args.start, args.end)
+    else:
+        expenses = presenter.expenses_get_list()
+    names: dict[int, str] = category_names(presenter)
+    return [expense_to_dict(expense, names) for expense in expenses]
+
+
+def expense_edit(presenter: Any, args: argparse.Namespace) -> Any:
+    presenter.expense_get_by_id(args.id)
+    if args.amount is not None:
+        presenter.expense_edit_cost(args.id, args.amount)
+    if args.category is not None:
+        presenter.expense_edit_category_by_name(args.id, args.category)
+    if args.date is not None:
+        presenter.expense_edit_date(args.id, args.date)
+    if args.comment is not None:
+        presenter.expense_edit_comment(args.id, args.comment)
+    if args.currency is not None:
+        presenter.expense_edit_currency(args.id, args.currency)
+    return expense_to_dict(
+        presenter.expense_get_by_id(args.id), category_names(presenter)
+    )
+
+
+def expense_delete(presenter: Any, args: argparse.Namespace) -> Any:
+    for exp_id in args.ids:
+        presenter.expense_delete(exp_id)
+    return {"deleted": args.ids}
+
+
+def expense_duplicates(presenter: Any, args: argparse.Namespace) -> Any:
+    names: dict[int, str] = category_names(presenter)
+    return [
+        [expense_to_dict(presenter.expense_get_by_id(exp_id), names) for exp_id in group]
+        for group in presenter.expenses_find_duplicates()
+    ]
+
+
+def recurring_to_dict(rule: Any, names: dict[int, str]) -> dict[str, Any]:
+    """
+    Представляет правило повторяющегося расхода в виде словаря для вывода в JSON
+    """
+
+    return {
+        "id": rule.obj_id,
+        "amount": rule.amount,
+        "category_id": rule.category_id,
+        "category": names.get(rule.category_id, UNKNOWN_CATEGORY),
+        "comment": rule.comment,
+        "schedule": rule.schedule,
+        "next_date": rule.next_date.isoformat(sep=" ") if rule.next_date else None,
+        "end_date": rule.end_date.isoformat(sep=" ") if rule.end_date else None,
+    }
+
+
+def recurring_add(presenter: Any, args: argparse.Namespace) -> Any:
+    rule_id: int = presenter.recurring_add(
+        args.amount, args.category, args.comment, args.schedule, args.start, args.end
+    )
+    return {"id": rule_id}
+
+
+def recurring_list(presenter: Any, args: argparse.Namespace) -> Any:
+    names: dict[int, str] = category_names(presenter)
+    return [recurring_to_dict(rule, names) for rule in presenter.recurring_get_list()]
+
+
+def recurring_delete(presenter: Any, args: argparse.Namespace) -> Any:
+    for rule_id in args.ids:
+        presenter.recurring_delete(rule_id)
+    return {"deleted": args.ids}
+
+
+def category_add(presenter: Any, args: argparse.Namespace) -> Any:
+    parent_id: int | None = None
+    if args.parent is not None:
+        parent_id = category_ids(presenter, [args.parent])[0]
+    return {"id": presenter.category_add(args.name, parent_id)}
+
+
+def category_list(presenter: Any, args: argparse.Namespace) -> Any:
+    return [
+        {"id": cat.obj_id, "name": cat.name, "parent_id": cat.parent_id}
+        for cat in presenter.categories_get_list()
+    ]
+
+
+def category_move(presenter: Any, args: argparse.Namespace) -> Any:
+    parent_id: int | None = None
+    if args.parent is not None:
+        parent_id = category_ids(presenter, [args.parent])[0]
+    presenter.category_set_parent(args.id, parent_id)
+    return {"id": args.id, "parent_id": parent_id}
+
+
+def category_tree(presenter: Any, args: argparse.Namespace) -> Any:
+    parent_id: int | None = None
+    if args.parent is not None:
+        parent_id = category_ids(presenter, [args.parent])[0]
+    return [
+        {
+            "id": node.obj_id,
+            "name": node.name,
+            "has_children": node.has_children,
+            "own": node.own,
+            "total": node.total,
+        }
+        for node in presenter.categories_get_children(parent_id, PERIODS[args.period])
+    ]
+
+
+def category_rename(presenter: Any, args: argparse.Namespace) -> Any:
+    presenter.category_get_by_id(args.id)
+    presenter.category_edit_name(args.id, args.name)
+    return {"id": args.id, "name": args.name}
+
+
+def category_delete(presenter: Any, args: argparse.Namespace) -> Any:
+    reassign_to: int | None = None
+    if args.reassign is not None:
+        reassign_to = category_ids(presenter, [args.reassign])[0]
+    changed: int = 0
+    for cat_id in args.ids:
+        changed += presenter.category_delete(cat_id, reassign_to, args.cascade)
+    return {"deleted": args.ids, "expenses": changed}
+
+
+def category_repair(presenter: Any, args: argparse.Namespace) -> Any:
+    reassign_to: int | None = None
+    if args.reassign is not None:
+        reassign_to = category_ids(presenter, [args.reassign])[0]
+    return {"repaired": presenter.category_repair(reassign_to, args.delete)}
+
+
+def budget_set(presenter: Any, args: argparse.Namespace) -> Any:
+    budget = presenter.budget_get_by_period(PERIODS[args.period])
+    presenter.budget_edit_limit(budget.obj_id, args.limit)
+    return {"period": args.period, "limit": args.limit}
+
+
+def budget_add(presenter: Any, args: argparse.Namespace) -> Any:
+    category_id: int = 0
+    if args.category is not None:
+        cats: list = presenter.categories_get_by_name(args.category)
+        if not cats:
+            raise NameError(f"No category named {args.category}")
+        category_id = cats[0].obj_id
+    return {"id": presenter.budget_add(
+        PERIODS[args.period], args.limit, args.param, category_id, args.subcategories
+    )}
+
+
+def budget_delete(presenter: Any, args: argparse.Namespace) -> Any:
+    presenter.budget_delete(args.id)
+    return {"deleted": [args.id]}
+
+
+def budget_status(presenter: Any, args: argparse.Namespace) -> Any:
+    period_names: dict[int, str] = {code: name for name, code in PERIODS.items()}
+    names: dict[int, str] = category_names(presenter)
+    status: list[dict[str, Any]] = []
+    risks: dict[int, float] = presenter.budgets_forecast() if args.forecast else {}
+    for bdg in presenter.budgets_get_list():
+        spent: float = presenter.budget_get_sum(bdg)
+        status.append({
+            "id": bdg.obj_id,
+            "period": period_names.get(bdg.period, str(bdg.period)),
+            "param": bdg.param,
+            "category": names.get(bdg.category_id, UNKNOWN_CATEGORY)
+            if bdg.category_id else None,
+            "subcategories": bdg.subcategories,
+            "spent": spent,
+            "limit": bdg.limit,
+            "exceeded": spent > bdg.limit,
+        })
+        if args.forecast:
+            status[-1]["exceed_probability"] = risks[bdg.obj_id]
+        if args.tags is not None:
+            status[-1]["tagged"] = presenter.budget_get_sum_by_tags(bdg, args.tags)
+    return status
+
+
+def report(presenter: Any, args: argparse.Namespace) -> Any:
+    return [
+        {"category": name, "total": total}
+        for name, total in sorted(
+            presenter.report_by_category(args.start, args.end, args.tags).items()
+        )
+    ]
+
+
+def tag_add(presenter: Any, args: argparse.Namespace) -> Any:
+    return {"tagged": presenter.expenses_tag(args.ids, args.name)}
+
+
+def tag_remove(presenter: Any, args: argparse.Namespace) -> Any:
+    return {"untagged": presenter.expenses_untag(args.ids, args.name)}
+
+
+def tag_list(presenter: Any, args: argparse.Namespace) -> Any:
+    return [
+        {"name": name, "expenses": count}
+        for name, count in presenter.tags_get_list().items()
+    ]
+
+
+def tag_delete(presenter: Any, args: argparse.Namespace) -> Any:
+    presenter.tag_delete(args.name)
+    return {"deleted": [args.name]}
+
+
+def archive(presenter: Any, args: argparse.Namespace) -> Any:
+    return {"archived": presenter.expenses_archive(args.before)}
+
+
+def category_ids(presenter: Any, names: Sequence[str] | None) -> list[int] | None:
+    """
+    Переводит имена категорий в их id.
+    Возвращает None, если имена не заданы.
+    """
+
+    if not names:
+        return None
+    ids: list[int] = []
+    for name in names:
+        cats: list = presenter.categories_get_by_name(name)
+        if not cats:
+            raise NameError(f"No category named {name}")
+        ids.append(cats[0].obj_id)
+    return ids
+
+
+def file_format(args: argparse.Namespace) -> tuple[str, bool]:
+    """
+    Определяет формат файла выгрузки и сжатие по аргументам
+    или по расширению файла
+    """
+
+    stem: str = args.file[:-3] if args.file.endswith(".gz") else args.file
+    fmt: str = args.format or ("jsonl" if stem.endswith(".jsonl") else "csv")
+    return fmt, args.gzip or args.file.endswith(".gz")
+
+
+def export(presenter: Any, args: argparse.Namespace) -> Any:
+    fmt, compress = file_format(args)
+    rows: int = presenter.expenses_export(
+        args.file, fmt, args.start, args.end,
+        category_ids(presenter, args.category), compress
+    )
+    return {"file": args.file, "format": fmt, "gzip": compress, "rows": rows}
+
+
+def import_(presenter: Any, args: argparse.Namespace) -> Any:
+    fmt, compress = file_format(args)
+    counts: dict[str, int] = presenter.expenses_import(
+        args.file, fmt, compress, args.duplicates
+    )
+    return {"file": args.file, "format": fmt, "gzip": compress, **counts}
+
+
+def rates_import(presenter: Any, args: argparse.Namespace) -> Any:
+    return {"file": args.file, "rates": presenter.rates_import(args.file)}
+
+
+def snapshot_save(presenter: Any, args: argparse.Namespace) -> Any:
+    return {"tables": presenter.snapshot_save(args.file)}
+
+
+def snapshot_restore(presenter: Any, args: argparse.Namespace) -> Any:
+    from bookkeeper import snapshot
+
+    return {"tables": snapshot.restore(args.file, args.target)}
+
+
+def migrate(presenter: Any, args: argparse.Namespace) -> Any:
+    def report(progress: Any) -> None:
+        total: int = progress.done + progress.remaining
+        print(f"{progress.name}: {progress.done}/{total}", file=sys.stderr)
+
+    return {"finished": presenter.migrate(args.batch_size, report)}
+
+
+def sync(presenter: Any, args: argparse.Namespace) -> Any:
+    return {"file": args.file, **presenter.sync(args.file)}
+
+
+def _add_command(
+        group: Any, name: str, handler: Callable, help_text: str
+) -> argparse.ArgumentParser:
+    command: argparse.ArgumentParser = group.add_parser(name, help=help_text)
+    command.set_defaults(handler=handler)
+    return command
+
+
+def _add_range(command: argparse.ArgumentParser) -> None:
+    command.add_argument(
+        "--from", dest="start", type=_parse_date, help="начало периода"
+    )
+    command.add_argument("--to", dest="end", type=_parse_date, help="конец периода")
+
+
+def _add_expense_commands(expense: argparse.ArgumentParser) -> None:
+    expense_commands = expense.add_subparsers(dest="action", required=True)
+
+    command = _add_command(expense_commands, "add", expense_add, "добавить расход")
+    command.add_argument("amount", type=float)
+    command.add_argument("category")
+    command.add_argument("--comment", default="")
+    command.add_argument("--date", type=_parse_date)
+    command.add_argument(
+        "--duplicates", choices=DUPLICATE_POLICIES, default="allow",
+        help="что делать, если такой расход за этот день уже есть"
+    )
+    command.add_argument(
+        "--currency", default=BASE_CURRENCY, help=f"валюта (по умолчанию {BASE_CURRENCY})"
+    )
+
+    command = _add_command(expense_commands, "list", expense_list, "список расходов")
+    _add_range(command)
+    command.add_argument(
+        "--history", action="store_true", help="включить архивные расходы"
+    )
+    command.add_argument(
+        "--tags", metavar="QUERY",
+        help="только расходы, отобранные запросом по меткам (без архива)"
+    )
+
+    command = _add_command(expense_commands, "edit", expense_edit, "изменить расход")
+    command.add_argument("id", type=int)
+    command.add_argument("--amount", type=float)
+    command.add_argument("--category")
+    command.add_argument("--date", type=_parse_date)
+    command.add_argument("--comment")
+    command.add_argument("--currency")
+
+    command = _add_command(expense_commands, "delete", expense_delete, "удалить расходы")
+    command.add_argument("ids", type=int, nargs="+")
+
+    _add_command(
+        expense_commands, "duplicates", expense_duplicates, "найти повторные расходы"
+    )
+
+
+def _add_recurring_commands(recurring: argparse.ArgumentParser) -> None:
+    recurring_commands = recurring.add_subparsers(dest="action", required=True)
+
+    command = _add_command(
+        recurring_commands, "add", recurring_add, "добавить повторяющийся расход"
+    )
+    command.add_argument("amount", type=float)
+    command.add_argument("category")
+    command.add_argument(
+        "schedule", help="monthly:ЧИСЛО или расписание cron, например '0 9 * * 1'"
+    )
+    command.add_argument("--comment", default="")
+    command.add_argument("--from", dest="start", type=_parse_date, help="начало действия")
+    command.add_argument("--until", dest="end", type=_parse_date, help="конец действия")
+
+    _add_command(
+        recurring_commands, "list", recurring_list, "список повторяющихся расходов"
+    )
+
+    command = _add_command(
+        recurring_commands, "delete", recurring_delete, "удалить повторяющиеся расходы"
+    )
+    command.add_argument("ids", type=int, nargs="+")
+
+
+def _add_category_commands(category: argparse.ArgumentParser) -> None:
+    category_commands = category.add_subparsers(dest="action", required=True)
+
+    command = _add_command(category_commands, "add", category_add, "добавить категорию")
+    command.add_argument("name")
+    command.add_argument("--parent", metavar="CATEGORY", help="родительская категория")
+
+    _add_command(category_commands, "list", category_list, "список категорий")
+
+    command = _add_command(
+        category_commands, "move", category_move, "перенести категорию в другую"
+    )
+    command.add_argument("id", type=int)
+    command.add_argument(
+        "--parent", metavar="CATEGORY",
+        help="новая родительская категория (по умолчанию --- верхний уровень)"
+    )
+
+    command = _add_command(
+        category_commands, "tree", category_tree,
+        "дочерние категории с суммами расходов, своими и по поддереву"
+    )
+    command.add_argument(
+        "--parent", metavar="CATEGORY",
+        help="чьи дочерние категории показать (по умолчанию --- верхний уровень)"
+    )
+    command.add_argument("--period", choices=DEFAULT_PERIODS, default="month")
+
+    command = _add_command(
+        category_commands, "rename", category_rename, "переименовать категорию"
+    )
+    command.add_argument("id", type=int)
+    command.add_argument("name")
+
+    command = _add_command(
+        category_commands, "delete", category_delete, "удалить категории"
+    )
+    command.add_argument("ids", type=int, nargs="+")
+    mode = command.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--reassign", metavar="CATEGORY", help="перенести расходы в категорию"
+    )
+    mode.add_argument("--cascade", action="store_true", help="удалить расходы категорий")
+
+    command = _add_command(
+        category_commands, "repair", category_repair,
+        "исправить расходы с несуществующей категорией"
+    )
+    mode = command.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--reassign", metavar="CATEGORY",
+        help=f"перенести расходы в категорию (по умолчанию \"{UNKNOWN_CATEGORY}\")"
+    )
+    mode.add_argument("--delete", action="store_true", help="удалить такие расходы")
+
+
+def _add_budget_commands(budget: argparse.ArgumentParser) -> None:
+    budget_commands = budget.add_subparsers(dest="action", required=True)
+
+    command = _add_command(budget_commands, "set", budget_set, "установить лимит")
+    command.add_argument("period", choices=DEFAULT_PERIODS)
+    command.add_argument("limit", type=float)
+
+    command = _add_command(budget_commands, "add", budget_add, "добавить бюджет")
+    command.add_argument("period", choices=PERIODS)
+    command.add_argument("limit", type=float)
+    command.add_argument(
+        "--param", type=int, default=0,
+        help="число месяца для since-day или число дней для days"
+    )
+    command.add_argument("--category", help="ограничить расходы одной категорией")
+    command.add_argument(
+        "--subcategories", action="store_true",
+        help="учитывать и расходы дочерних категорий (вместе с --category)"
+    )
+
+    command = _add_command(budget_commands, "delete", budget_delete, "удалить бюджет")
+    command.add_argument("id", type=int)
+
+    command = _add_command(budget_commands, "status", budget_status, "состояние бюджета")
+    command.add_argument(
+        "--forecast", action="store_true",
+        help="оценить вероятность превышения лимита к концу периода"
+    )
+    command.add_argument(
+        "--tags", metavar="QUERY",
+        help="также посчитать расходы, отобранные запросом по меткам"
+    )
+
+
+def _add_tag_commands(tag: argparse.ArgumentParser) -> None:
+    tag_commands = tag.add_subparsers(dest="action", required=True)
+
+    command = _add_command(tag_commands, "add", tag_add, "поставить метку расходам")
+    command.add_argument("name")
+    command.add_argument("ids", type=int, nargs="+")
+
+    command = _add_command(tag_commands, "remove", tag_remove, "снять метку с расходов")
+    command.add_argument("name")
+    command.add_argument("ids", type=int, nargs="+")
+
+    _add_command(tag_commands, "list", tag_list, "список меток")
+
+    command = _add_command(tag_commands, "delete", tag_delete, "удалить метку")
+    command.add_argument("name")
+
+
+def _add_snapshot_commands(snapshot: argparse.ArgumentParser) -> None:
+    snapshot_commands = snapshot.add_subparsers(dest="action", required=True)
+
+    command = _add_command(snapshot_commands, "save", snapshot_save, "сохранить снимок")
+    command.add_argument("file")
+
+    command = _add_command(
+        snapshot_commands, "restore", snapshot_restore, "восстановить базу из снимка"
+    )
+    command.add_argument("file")
+    command.add_argument("target", help="новый файл базы данных")
+    # восстановление пишет в новый файл и не открывает текущую базу
+    command.set_defaults(standalone=True)
+
+
+def build_parser(argv: Sequence[str] | None = None) -> argparse.ArgumentParser:
+    """
+    Создаёт разборщик аргументов со всеми подкомандами.
+    Если задан argv, подкоманды добавляются только в группы, названные
+    в argv: разборщики остальных групп не нужны ни для разбора, ни для
+    общей справки, а их создание заметно замедляет запуск.
+    """
+
+    def wanted(group: str) -> bool:
+        return argv is None or group in argv
+
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="bookkeeper", description="Учёт личных расходов"
+    )
+    parser.add_argument("--db", help="файл базы данных")
+    parser.add_argument(
+        "--json", action="store_true", help="вывод в формате JSON"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    expense = commands.add_parser("expense", help="расходы")
+    if wanted("expense"):
+        _add_expense_commands(expense)
+
+    recurring = commands.add_parser("recurring", help="повторяющиеся расходы")
+    if wanted("recurring"):
+        _add_recurring_commands(recurring)
+
+    category = commands.add_parser("category", help="категории")
+    if wanted("category"):
+        _add_category_commands(category)
+
+    budget = commands.add_parser("budget", help="бюджет")
+    if wanted("budget"):
+        _add_budget_commands(budget)
+
+    tag = commands.add_parser("tag", help="метки расходов")
+    if wanted("tag"):
+        _add_tag_commands(tag)
+
+    command = _add_command(commands, "report", report, "суммы по категориям")
+    _add_range(command)
+    command.add_argument(
+        "--tags", metavar="QUERY",
+        help="только расходы, отобранные запросом по меткам, например "
+             "'отпуск AND NOT \"к возмещению\"' (без архива)"
+    )
+
+    command = _add_command(
+        commands, "archive", archive, "перенести старые расходы в архив"
+    )
+    command.add_argument("before", type=_parse_date, help="дата отсечения")
+
+    command = _add_command(commands, "export", export, "выгрузить расходы в файл")
+    command.add_argument("file")
+    command.add_argument(
+        "--format", choices=("csv", "jsonl"),
+        help="формат файла, по умолчанию определяется по расширению"
+    )
+    _add_range(command)
+    command.add_argument(
+        "--category", action="append", help="выгрузить только эту категорию"
+    )
+    command.add_argument(
+        "--gzip", action="store_true", help="сжать gzip (также для файлов *.gz)"
+    )
+
+    command = _add_command(commands, "import", import_, "загрузить расходы из выгрузки")
+    command.add_argument("file")
+    command.add_argument(
+        "--format", choices=("csv", "jsonl"),
+        help="формат файла, по умолчанию определяется по расширению"
+    )
+    command.add_argument(
+        "--gzip", action="store_true", help="файл сжат gzip (также для файлов *.gz)"
+    )
+    command.add_argument(
+        "--duplicates", choices=DUPLICATE_POLICIES, default="skip",
+        help="что делать с уже внесёнными расходами (по умолчанию пропустить)"
+    )
+
+    command = _add_command(commands, "rates", rates_import, "загрузить курсы валют")
+    command.add_argument("file", help="CSV со столбцами date, currency, rate")
+
+    command = _add_command(
+        commands, "migrate", migrate, "заполнить данные новых версий схемы базы"
+    )
+    command.add_argument(
+        "--batch-size", type=int, default=5000, help="строк в одной транзакции"
+    )
+
+    command = _add_command(
+        commands, "sync", sync, "обменяться изменениями с другой копией базы"
+    )
+    command.add_argument("file", help="файл другой копии базы")
+
+    snapshot = commands.add_parser("snapshot", help="резервные копии")
+    if wanted("snapshot"):
+        _add_snapshot_commands(snapshot)
+
+    return parser
+
+
+def _print_text(result: Any) -> None:
+    if isinstance(result, dict):
+        result = [result]
+    for index, row in enumerate(result):
+        if isinstance(row, list):
+            # группы строк (например, повторные расходы) разделяются пустой строкой
+            if index:
+                print()
+            _print_text(row)
+        else:
+            print("\t".join(str(value) for value in row.values()))
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """
+    Точка входа консольной команды bookkeeper.
+    Возвращает код завершения.
+    """
+
+    if argv is None:
+        argv = sys.argv[1:]
+    args: argparse.Namespace = build_parser(argv).parse_args(argv)
+
+    presenter: Any = None
+    try:
+        if not getattr(args, "standalone", False):
+            # презентер импортируется только после разбора аргументов,
+            # чтобы --help и ошибки в аргументах не ждали загрузки ORM
+            from bookkeeper.presenter import Presenter
+
+            presenter = Presenter(args.db) if args.db else Presenter()
+        result: Any = args.handler(presenter, args)
+    except (NameError, ValueError, OSError) as error:
+        if args.json:
+            print(json.dumps({"error": str(error)}, ensure_ascii=False))
+        else:
+            print(f"Ошибка: {error}", file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        _print_text(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Отпечатки расходов для поиска повторно внесённых расходов.
+
+Отпечаток --- хэш суммы (с точностью до копеек), дня, категории,
+комментария (без учёта регистра и лишних пробелов) и валюты. Расходы
+с одинаковым отпечатком считаются дубликатами: так выглядит
+повторный импорт той же выписки или двойное нажатие кнопки.
+Отпечаток хранится в индексированном столбце Expense.fingerprint,
+поэтому проверка нового расхода --- один поиск по индексу.
+
+Что делать с дубликатом, задаёт политика:
+    allow  добавить, не проверяя
+    skip   не добавлять, оставить существующий расход
+    flag   добавить и отметить, дубликатом какого расхода он является
+    merge  не добавлять, а обновить существующий расход
+           датой и комментарием нового
+"""
+
+import hashlib
+from datetime import datetime
+
+from bookkeeper.rates import BASE_CURRENCY
+
+ALLOW: str = "allow"
+SKIP: str = "skip"
+FLAG: str = "flag"
+MERGE: str = "merge"
+
+POLICIES: tuple[str, ...] = (ALLOW, SKIP, FLAG, MERGE)
+
+
+def fingerprint(
+        amount: float,
+        expense_date: datetime,
+        category_id: int,
+        comment: str,
+        currency: str = BASE_CURRENCY
+) -> str:
+    """
+    Вычисляет отпечаток расхода.
+    Валюта входит в отпечаток, только если она не основная,
+    поэтому отпечатки расходов в основной валюте не менялись
+    с появлением валют.
+    """
+
+    fields: tuple[str, ...] = (
+        f"{amount:.2f}",
+        expense_date.date().isoformat(),
+        str(category_id),
+        " ".join(comment.split()).casefold(),
+    )
+    if currency != BASE_CURRENCY:
+        fields += (currency,)
+    key: str = "\x1f".join(fields)
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+
+def check_policy(policy: str) -> None:
+    """
+    Проверяет, что политика обработки дубликатов известна
+    """
+
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown duplicate policy: {policy}")
@@ -0,0 +1,199 @@
+"""
+Потоковая выгрузка расходов в CSV и JSON Lines.
+
+Расходы читаются курсором по оперативной базе и архивам (см. bookkeeper.archive)
+порциями по EXPORT_BATCH_SIZE строк, имя категории подставляется
+в том же запросе через LEFT JOIN. Текст копится в буфере и отдаётся
+кусками примерно по CHUNK_SIZE байт, при необходимости сжатыми gzip,
+поэтому расход памяти не зависит от числа расходов.
+
+Файлы выгрузки можно загрузить обратно (iter_import), тоже построчно.
+"""
+
+import csv
+import gzip
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import IO, Any, Callable, Collection, Iterable, Iterator
+
+from bookkeeper import archive, rates
+
+FORMATS: tuple[str, ...] = ("csv", "jsonl")
+
+FIELDS: tuple[str, ...] = (
+    "id", "date", "amount", "category_id", "category", "comment", "currency"
+)
+
+UNKNOWN_CATEGORY: str = "Неизвестная категория"
+
+EXPORT_BATCH_SIZE: int = 1000
+
+CHUNK_SIZE: int = 1 << 16
+
+# Расходы с именами категорий; Category есть только в оперативной базе
+EXPORT_SELECT: str = (
+    'SELECT e."obj_id", e."expense_date", e."amount", e."category_id", '
+    'c."name", e."comment", e."currency" '
+    'FROM {table} LEFT JOIN main."Category" AS c ON c."obj_id" = e."category_id" '
+    "{where}"
+)
+
+# В составном запросе ORDER BY ссылается на номера столбцов результата
+EXPORT_ORDER: str = "ORDER BY 2, 1"
+
+
+def _iter_rows(
+        db_filename: str,
+        start: datetime | None,
+        end: datetime | None,
+        category_ids: Collection[int] | None
+) -> Iterator[list[tuple]]:
+    """
+    Перебирает порции строк
+    (id, дата, сумма, id категории, имя, комментарий, валюта) в порядке дат
+    """
+
+    for cursor in archive.fan_out(
+            db_filename, start, end, EXPORT_SELECT, EXPORT_ORDER, category_ids
+    ):
+        while True:
+            rows: list[tuple] = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            yield [
+                (
+                    obj_id, datetime.fromisoformat(expense_date).isoformat(sep=" "),
+                    amount, category_id,
+                    UNKNOWN_CATEGORY if name is None else name, comment, code
+                )
+                for obj_id, expense_date, amount, category_id, name, comment, code in rows
+            ]
+
+
+def _format_batches(fmt: str, batches: Iterable[list[tuple]]) -> Iterator[str]:
+    if fmt == "csv":
+        buffer: io.StringIO = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(FIELDS)
+        for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif fmt == "jsonl":
+        for rows in batches:
+            yield "".join(
+                json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + "\n"
+                for row in rows
+            )
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+
+def _chunks(texts: Iterable[str], compress: bool) -> Iterator[bytes]:
+    # wbits=31 --- формат gzip, который понимают gunzip и браузеры
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending: list[bytes] = []
+    size: int = 0
+    for text in texts:
+        data: bytes = text.encode()
+        if compressor is not None:
+            data = compressor.compress(data)
+        pending.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b"".join(pending)
+            pending.clear()
+            size = 0
+    if compressor is not None:
+        pending.append(compressor.flush())
+    if pending:
+        yield b"".join(pending)
+
+
+def iter_export(
+        db_filename: str,
+        fmt: str = "csv",
+        start: datetime | None = None,
+        end: datetime | None = None,
+        category_ids: Collection[int] | None = None,
+        compress: bool = False
+) -> Iterator[bytes]:
+    """
+    Выгружает расходы за промежуток [start, end) из категорий category_ids
+    (или из всех категорий) в формате fmt ("csv" или "jsonl").
+    Выдаёт куски байтов, сжатые gzip, если задан compress.
+    Генератор нужно дочитать в том же потоке, в котором он начат.
+    """
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return _chunks(
+        _format_batches(fmt, _iter_rows(db_filename, start, end, category_ids)), compress
+    )
+
+
+def export_file(
+        db_filename: str,
+        filename: str,
+        fmt: str = "csv",
+        start: datetime | None = None,
+        end: datetime | None = None,
+        category_ids: Collection[int] | None = None,
+        compress: bool = False
+) -> int:
+    """
+    Выгружает расходы в файл filename (см. iter_export).
+    Возвращает число выгруженных расходов.
+    """
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    count: int = 0
+
+    def counted(batches: Iterator[list[tuple]]) -> Iterator[list[tuple]]:
+        nonlocal count
+        for rows in batches:
+            count += len(rows)
+            yield rows
+
+    batches: Iterator[list[tuple]] = counted(
+        _iter_rows(db_filename, start, end, category_ids)
+    )
+    with open(filename, "wb") as out:
+        for chunk in _chunks(_format_batches(fmt, batches), compress):
+            out.write(chunk)
+    return count
+
+
+def iter_import(
+        filename: str, fmt: str = "csv", compress: bool = False
+) -> Iterator[tuple[datetime, float, str, str, str]]:
+    """
+    Построчно читает файл в формате выгрузки fmt (при compress --- сжатый gzip).
+    Перебирает расходы в виде (дата, сумма, имя категории, комментарий, валюта),
+    столбцы id и category_id не используются. В файлах без столбца валюты
+    расходы считаются сделанными в основной валюте.
+    """
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    opener: Callable[..., IO[str]] = gzip.open if compress else open
+    with opener(filename, "rt", encoding="utf-8", newline="") as source:
+        records: Iterable[dict[str, Any]] = (
+            csv.DictReader(source) if fmt == "csv"
+            else (json.loads(line) for line in source if line.strip())
+        )
+        for record in records:
+            try:
+                expense: tuple[datetime, float, str, str, str] = (
+                    datetime.fromisoformat(record["date"]), float(record["amount"]),
+                    record["category"], record["comment"],
+                    record.get("currency") or rates.BASE_CURRENCY
+                )
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Wrong expense record: {record}")
+            yield expense
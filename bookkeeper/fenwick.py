@@ -0,0 +1,78 @@
+"""
+Дерево Фенвика (двоичное индексированное дерево)
+"""
+
+from typing import Iterable
+
+
+class FenwickTree:
+    """
+    Массив чисел с префиксными суммами.
+    Изменение элемента и сумма на отрезке выполняются за O(log n).
+    """
+
+    def __init__(self, size: int):
+        self.size: int = size
+        self._tree: list[float] = [0.0] * (size + 1)
+
+    @classmethod
+    def from_values(cls, values: Iterable[float]) -> "FenwickTree":
+        """
+        Строит дерево по массиву значений за O(n)
+        """
+
+        values = list(values)
+        fenwick: FenwickTree = cls(len(values))
+        tree: list[float] = fenwick._tree
+        for i, value in enumerate(values, start=1):
+            tree[i] += value
+            parent: int = i + (i & -i)
+            if parent <= fenwick.size:
+                tree[parent] += tree[i]
+        return fenwick
+
+    def values(self) -> list[float]:
+        """
+        Восстанавливает массив значений за O(n)
+        """
+
+        tree: list[float] = self._tree.copy()
+        for i in range(self.size, 0, -1):
+            parent: int = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] -= tree[i]
+        return tree[1:]
+
+    def add(self, index: int, delta: float) -> None:
+        """
+        Прибавляет delta к элементу с индексом index (нумерация с нуля)
+        """
+
+        if not 0 <= index < self.size:
+            raise IndexError("Fenwick tree index out of range")
+        i: int = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, stop: int) -> float:
+        """
+        Сумма элементов с индексами [0, stop).
+        stop обрезается до границ массива.
+        """
+
+        i: int = min(max(stop, 0), self.size)
+        result: float = 0.0
+        while i > 0:
+            result += self._tree[i]
+            i -= i & -i
+        return result
+
+    def range_sum(self, start: int, stop: int) -> float:
+        """
+        Сумма элементов с индексами [start, stop)
+        """
+
+        if stop <= start:
+            return 0.0
+        return self.prefix_sum(stop) - self.prefix_sum(start)
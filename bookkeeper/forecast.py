@@ -0,0 +1,201 @@
+"""
+Прогноз расходов и риск превышения бюджетов.
+
+Для каждой категории по дневным суммам за последние HISTORY_DAYS дней
+(таблица DailyTotal, см. bookkeeper.periods) оценивается распределение
+дневных расходов: вероятность того, что в день есть расходы,
+и эмпирическое распределение ненулевых дневных сумм. Остаток текущего дня
+и оставшиеся дни периодов моделируются методом Монте-Карло сразу
+для всех испытаний (массивами numpy). Категории независимы, поэтому
+при большом их числе моделируются параллельно в пуле процессов.
+
+Для бюджета вероятность превышения --- доля испытаний, в которых
+уже потраченная сумма вместе с моделируемыми расходами до конца
+периода больше лимита. Для бюджета на все категории испытания
+складываются по всем категориям.
+"""
+
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import Iterable, NamedTuple, Sequence
+
+import numpy as np
+
+from bookkeeper.periods import ALL_CATEGORIES
+
+# За сколько прошлых дней оценивается распределение расходов
+HISTORY_DAYS: int = 90
+
+SIMULATIONS: int = 10000
+
+# С какого числа категорий моделирование распределяется по процессам;
+# для меньшего числа запуск процессов дороже самого моделирования
+PARALLEL_MIN_CATEGORIES: int = 8
+
+_executor: ProcessPoolExecutor | None = None
+_executor_workers: int | None = None
+
+
+class BudgetState(NamedTuple):
+    """
+    Состояние бюджета для прогноза: категория (или ALL_CATEGORIES),
+    последний день периода, лимит и уже потраченная сумма
+    """
+
+    category_id: int
+    end: date
+    limit: float
+    spent: float
+
+
+class CategoryTask(NamedTuple):
+    """
+    Задание на моделирование расходов одной категории.
+    horizon --- число полных дней после сегодняшнего.
+    """
+
+    chance: float
+    amounts: np.ndarray
+    spent_today: float
+    horizon: int
+    simulations: int
+    seed: np.random.SeedSequence
+
+
+def load_history(
+        db_filename: str, today: date, days: int = HISTORY_DAYS
+) -> tuple[dict[int, np.ndarray], dict[int, float]]:
+    """
+    Читает дневные суммы за days дней до today (не включая today).
+    Возвращает массивы дневных сумм по категориям
+    и суммы за сегодняшний день по категориям.
+    Если расходы начались позже, история начинается с первого дня расходов.
+    """
+
+    first: date = today - timedelta(days=days)
+    con: sqlite3.Connection = sqlite3.connect(db_filename)
+    try:
+        rows: list[tuple[str, int, float]] = con.execute(
+            'SELECT "day", "category_id", "amount" FROM "DailyTotal" '
+            'WHERE "day" >= ? AND "day" <= ?',
+            (first.isoformat(), today.isoformat())
+        ).fetchall()
+        first_day: str | None = con.execute(
+            'SELECT min("day") FROM "DailyTotal" WHERE "amount" != 0'
+        ).fetchone()[0]
+    finally:
+        con.close()
+
+    if first_day is not None:
+        first = max(first, date.fromisoformat(first_day))
+    size: int = max((today - first).days, 0)
+    history: dict[int, np.ndarray] = {}
+    spent_today: dict[int, float] = {}
+    for day, cat_id, amount in rows:
+        offset: int = (date.fromisoformat(day) - first).days
+        if offset >= size:
+            spent_today[cat_id] = spent_today.get(cat_id, 0.0) + amount
+        elif offset >= 0:
+            history.setdefault(cat_id, np.zeros(size))[offset] += amount
+    return history, spent_today
+
+
+def simulate_category(task: CategoryTask) -> np.ndarray:
+    """
+    Моделирует расходы категории.
+    Возвращает массив размера (horizon + 1, simulations): в строке h ---
+    расходы за остаток сегодняшнего дня и h следующих дней в каждом испытании.
+    """
+
+    rng: np.random.Generator = np.random.default_rng(task.seed)
+    totals: np.ndarray = np.zeros((task.horizon + 1, task.simulations))
+    if task.chance == 0 or not len(task.amounts):
+        return totals
+
+    # сегодняшняя сумма моделируется целиком, уже потраченное вычитается
+    today: np.ndarray = np.where(
+        rng.random(task.simulations) < task.chance,
+        rng.choice(task.amounts, task.simulations),
+        0.0
+    )
+    totals[0] = np.maximum(today - task.spent_today, 0.0)
+    if task.horizon:
+        shape: tuple[int, int] = (task.horizon, task.simulations)
+        days: np.ndarray = np.where(
+            rng.random(shape) < task.chance, rng.choice(task.amounts, shape), 0.0
+        )
+        np.cumsum(days, axis=0, out=totals[1:])
+        totals[1:] += totals[0]
+    return totals
+
+
+def _map(tasks: list[CategoryTask], max_workers: int | None) -> Iterable[np.ndarray]:
+    global _executor, _executor_workers
+
+    if max_workers == 1 or len(tasks) < PARALLEL_MIN_CATEGORIES:
+        return map(simulate_category, tasks)
+    # пул переиспользуется: запуск процессов дороже одного прогноза
+    if _executor is None or _executor_workers != max_workers:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = ProcessPoolExecutor(max_workers)
+        _executor_workers = max_workers
+    return _executor.map(simulate_category, tasks)
+
+
+def exceed_probabilities(
+        db_filename: str,
+        budgets: Sequence[BudgetState],
+        today: date | None = None,
+        simulations: int = SIMULATIONS,
+        max_workers: int | None = None,
+        seed: int | None = None
+) -> list[float]:
+    """
+    Вычисляет для каждого бюджета из budgets вероятность того,
+    что к концу периода расходы превысят лимит.
+    max_workers ограничивает число процессов (1 --- без пула),
+    seed делает результат воспроизводимым.
+    """
+
+    today = date.today() if today is None else today
+    history, spent_today = load_history(db_filename, today)
+
+    horizons: dict[int, int] = {}
+    for bdg in budgets:
+        cat_ids: Iterable[int] = (
+            history.keys() if bdg.category_id == ALL_CATEGORIES else [bdg.category_id]
+        )
+        for cat_id in cat_ids:
+            horizons[cat_id] = max(horizons.get(cat_id, 0), (bdg.end - today).days)
+
+    cat_ids_order: list[int] = sorted(cat_id for cat_id in horizons if cat_id in history)
+    seeds: list[np.random.SeedSequence] = np.random.SeedSequence(seed).spawn(
+        len(cat_ids_order)
+    )
+    tasks: list[CategoryTask] = []
+    for cat_id, cat_seed in zip(cat_ids_order, seeds):
+        days: np.ndarray = history[cat_id]
+        amounts: np.ndarray = days[days > 0]
+        tasks.append(CategoryTask(
+            len(amounts) / len(days), amounts, spent_today.get(cat_id, 0.0),
+            max(horizons[cat_id], 0), simulations, cat_seed
+        ))
+    simulated: dict[int, np.ndarray] = dict(
+        zip(cat_ids_order, _map(tasks, max_workers))
+    )
+
+    result: list[float] = []
+    for bdg in budgets:
+        if bdg.spent > bdg.limit:
+            result.append(1.0)
+            continue
+        horizon: int = (bdg.end - today).days
+        future: np.ndarray = np.zeros(simulations)
+        if horizon >= 0:
+            for cat_id, totals in simulated.items():
+                if bdg.category_id in (ALL_CATEGORIES, cat_id):
+                    future += totals[horizon]
+        result.append(float(np.mean(bdg.spent + future > bdg.limit)))
+    return result
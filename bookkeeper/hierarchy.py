@@ -0,0 +1,121 @@
+"""
+Иерархия категорий.
+
+У категории может быть родительская категория (столбец Category.parent_id,
+NULL у категорий верхнего уровня). Дерево категорий показывается
+по уровням: при раскрытии узла одним запросом (children_query) читаются
+его дочерние категории, признак наличия у каждой своих дочерних
+и суммы расходов за период --- собственные и по всему поддереву.
+Суммы берутся из дневных сумм (DailyTotal, см. bookkeeper.periods),
+поэтому таблица расходов не просматривается. Рекурсивный запрос
+поднимается к раскрываемому узлу только от категорий, в которых
+за период были расходы, а не обходит поддеревья целиком,
+так что время раскрытия не зависит от размера дерева категорий.
+
+При удалении категории её дочерние категории переходят к её родителю
+(триггер), так что дерево не рвётся, кто бы ни удалил категорию.
+"""
+
+import sqlite3
+from datetime import date
+from typing import Any, NamedTuple
+
+HIERARCHY_SCHEMA: str = """
+    CREATE INDEX IF NOT EXISTS "idx_category__parent_id" ON "Category" ("parent_id");
+
+    CREATE TRIGGER IF NOT EXISTS "trg_category_delete_children"
+    AFTER DELETE ON "Category" BEGIN
+        UPDATE "Category" SET "parent_id" = OLD."parent_id"
+        WHERE "parent_id" = OLD."obj_id";
+    END;
+"""
+
+# Предки категории $cat_id, начиная с неё самой.
+# UNION, а не UNION ALL: цикл, пришедший, например, при синхронизации,
+# не зацикливает запрос
+ANCESTORS_QUERY: str = """
+    WITH RECURSIVE "Ancestor" ("obj_id") AS (
+        SELECT $cat_id
+        UNION
+        SELECT c."parent_id" FROM "Ancestor" AS a
+        JOIN "Category" AS c ON c."obj_id" = a."obj_id"
+        WHERE c."parent_id" IS NOT NULL
+    )
+    SELECT "obj_id" FROM "Ancestor"
+"""
+
+_CHILDREN_QUERY: str = """
+    WITH RECURSIVE "Spent" ("category_id", "amount") AS (
+        SELECT "category_id", sum("amount") FROM "DailyTotal"
+        WHERE "day" BETWEEN $start AND $end GROUP BY "category_id"
+    ),
+    "Up" ("origin", "obj_id", "parent_id", "amount") AS (
+        SELECT c."obj_id", c."obj_id", c."parent_id", p."amount"
+        FROM "Spent" AS p JOIN "Category" AS c ON c."obj_id" = p."category_id"
+        UNION
+        SELECT u."origin", c."obj_id", c."parent_id", u."amount" FROM "Up" AS u
+        JOIN "Category" AS c ON c."obj_id" = u."parent_id"
+        WHERE {climbing}
+    )
+    SELECT c."obj_id", c."name",
+        EXISTS (SELECT 1 FROM "Category" AS k WHERE k."parent_id" = c."obj_id"),
+        coalesce(p."amount", 0.0), coalesce(t."amount", 0.0)
+    FROM "Category" AS c
+    LEFT JOIN "Spent" AS p ON p."category_id" = c."obj_id"
+    LEFT JOIN (
+        SELECT "obj_id", total("amount") AS "amount" FROM "Up"
+        WHERE {level} GROUP BY "obj_id"
+    ) AS t ON t."obj_id" = c."obj_id"
+    WHERE c.{level}
+    ORDER BY c."name", c."obj_id"
+"""
+
+
+class CategoryNode(NamedTuple):
+    """
+    Узел дерева категорий.
+    has_children - есть ли у категории дочерние категории
+    own - сумма расходов самой категории за период
+    total - сумма расходов категории и всех её потомков за период
+    """
+
+    obj_id: int
+    name: str
+    has_children: bool
+    own: float
+    total: float
+
+
+def install_hierarchy(con: sqlite3.Connection) -> None:
+    """
+    Добавляет категориям ссылку на родителя с индексом
+    и триггер, переносящий дочерние категории удаляемой к её родителю
+    """
+
+    columns: set[str] = {row[1] for row in con.execute('PRAGMA table_info("Category")')}
+    with con:
+        if "parent_id" not in columns:
+            con.execute('ALTER TABLE "Category" ADD COLUMN "parent_id" INTEGER')
+        con.executescript("BEGIN;" + HIERARCHY_SCHEMA)
+
+
+def children_query(
+        parent_id: int | None, start: date, end: date
+) -> tuple[str, dict[str, Any]]:
+    """
+    Строит запрос дочерних категорий parent_id (None --- категорий
+    верхнего уровня) с суммами расходов с дня start по день end включительно
+    в синтаксисе параметров Pony ($имя). Строки запроса соответствуют
+    полям CategoryNode. Возвращает текст запроса и значения параметров.
+    """
+
+    params: dict[str, Any] = {"start": start.isoformat(), "end": end.isoformat()}
+    if parent_id is None:
+        # у категории верхнего уровня нет родителя, подъём кончается сам
+        level: str = '"parent_id" IS NULL'
+        climbing: str = "1"
+    else:
+        level = '"parent_id" = $parent_id'
+        climbing = 'u."parent_id" <> $parent_id'
+        params["parent_id"] = parent_id
+    return _CHILDREN_QUERY.format(level=level, climbing=climbing), params
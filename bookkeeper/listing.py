@@ -0,0 +1,124 @@
+"""
+Постраничный просмотр расходов с сортировкой и отбором на стороне SQL.
+
+Порядок и условия отбора переводятся в ORDER BY и WHERE запроса,
+а страницы выбираются по ключу (keyset): следующая страница начинается
+после последнего показанного расхода, его ключ сортировки берётся
+подзапросом по id. Поэтому любая страница, в том числе первая страница
+миллиона расходов, отсортированных по сумме, читается по индексу
+столбца сортировки без сортировки всей таблицы.
+
+Ключи сортировки (SORT_KEYS) дополняются id расхода, чтобы порядок
+был полным. Сортировка по категории --- по имени категории через JOIN:
+внешний цикл идёт по индексу имён категорий, внутренний --- по индексу
+category_id, расходы с несуществующей категорией в такой выборке
+не участвуют (см. Presenter.category_repair). Суммы сортируются
+и отбираются в валюте расхода, без пересчёта.
+"""
+
+from datetime import datetime
+from typing import Any, NamedTuple
+
+# Ключ сортировки -> выражения ORDER BY (перед id расхода)
+SORT_KEYS: dict[str, tuple[str, ...]] = {
+    "id": (),
+    "date": ('e."expense_date"',),
+    "amount": ('e."amount"',),
+    "category": ('c."name"', 'c."obj_id"'),
+    "comment": ('e."comment"',),
+}
+
+_EXPENSES: str = '"Expense" AS e'
+_WITH_CATEGORIES: str = (
+    '"Expense" AS e JOIN "Category" AS c ON c."obj_id" = e."category_id"'
+)
+
+
+class ExpenseFilter(NamedTuple):
+    """
+    Условия отбора расходов; None --- условие не задано.
+    start, end - промежуток дат [start, end)
+    category_ids - id допустимых категорий
+    min_amount, max_amount - границы суммы включительно
+    comment - подстрока комментария (с учётом регистра)
+    """
+
+    start: datetime | None = None
+    end: datetime | None = None
+    category_ids: tuple[int, ...] | None = None
+    min_amount: float | None = None
+    max_amount: float | None = None
+    comment: str | None = None
+
+
+def _format_date(value: datetime) -> str:
+    # в том виде, в каком Pony хранит даты
+    return value.isoformat(" ", "microseconds")
+
+
+def _conditions(filters: ExpenseFilter) -> tuple[list[str], dict[str, Any]]:
+    conditions: list[str] = []
+    params: dict[str, Any] = {}
+    if filters.start is not None:
+        conditions.append('e."expense_date" >= $start')
+        params["start"] = _format_date(filters.start)
+    if filters.end is not None:
+        conditions.append('e."expense_date" < $end')
+        params["end"] = _format_date(filters.end)
+    if filters.category_ids is not None:
+        names: list[str] = [f"cat{i}" for i in range(len(filters.category_ids))]
+        conditions.append(
+            'e."category_id" IN (' + ", ".join(f"${name}" for name in names) + ")"
+            if names else "0"
+        )
+        params.update(zip(names, filters.category_ids))
+    if filters.min_amount is not None:
+        conditions.append('e."amount" >= $min_amount')
+        params["min_amount"] = filters.min_amount
+    if filters.max_amount is not None:
+        conditions.append('e."amount" <= $max_amount')
+        params["max_amount"] = filters.max_amount
+    if filters.comment:
+        conditions.append('instr(e."comment", $comment) > 0')
+        params["comment"] = filters.comment
+    return conditions, params
+
+
+def page_query(
+        sort: str = "id",
+        descending: bool = False,
+        filters: ExpenseFilter | None = None,
+        after_id: int = 0,
+        limit: int = 100
+) -> tuple[str, dict[str, Any]]:
+    """
+    Строит запрос страницы расходов в синтаксисе параметров Pony ($имя):
+    не больше limit расходов, прошедших отбор filters, в порядке sort,
+    начиная после расхода after_id (0 --- с начала).
+    Возвращает текст запроса и значения параметров.
+    """
+
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key: {sort}")
+    keys: tuple[str, ...] = SORT_KEYS[sort] + ('e."obj_id"',)
+    source: str = _WITH_CATEGORIES if sort == "category" else _EXPENSES
+    conditions, params = _conditions(filters or ExpenseFilter())
+
+    if after_id:
+        # ключ последнего показанного расхода; подзапрос со своим псевдонимом e
+        last: str = ", ".join(
+            f'(SELECT {key} FROM {source} WHERE e."obj_id" = $after_id)' for key in keys
+        )
+        conditions.append(
+            f'({", ".join(keys)}) {"<" if descending else ">"} ({last})'
+        )
+        params["after_id"] = after_id
+
+    direction: str = "DESC" if descending else "ASC"
+    where: str = "WHERE " + " AND ".join(conditions) if conditions else ""
+    params["limit"] = limit
+    return (
+        f"SELECT e.* FROM {source} {where} "
+        f'ORDER BY {", ".join(f"{key} {direction}" for key in keys)} LIMIT $limit',
+        params
+    )
@@ -0,0 +1,485 @@
+"""
+Версионные миграции схемы базы.
+
+Pony создаёт недостающие таблицы, но не умеет менять существующие,
+поэтому схема базы меняется миграциями из списка MIGRATIONS.
+Применённые миграции записываются в таблицу SchemaVersion,
+и при подключении к базе выполняются только новые, по порядку номеров.
+
+Миграция состоит из двух частей:
+    upgrade   быстрое изменение схемы (таблица, столбец, триггер);
+              выполняется при подключении к базе до привязки Pony.
+              Шаги идемпотентны: прерванная миграция просто повторяется,
+              а базы, созданные до появления SchemaVersion, проходят
+              все миграции, не меняясь там, где схема уже новая.
+    backfill  заполнение данных для уже существующих строк
+              (например, вычисление нового столбца или производной
+              таблицы, см. bookkeeper.backfill). Выполняется
+              порциями, каждая порция --- отдельная транзакция, поэтому
+              между порциями базой пользуются приложение и другие процессы.
+              Прерванное заполнение продолжается с того места, где
+              остановилось: порция выбирает ещё не заполненные строки.
+Пока заполнение не закончено, миграция отмечена в SchemaVersion
+как незавершённая (finished IS NULL), там же хранится число уже
+обработанных строк для отчёта о ходе заполнения.
+"""
+
+import re
+import sqlite3
+from datetime import datetime
+from typing import Callable, NamedTuple
+
+from bookkeeper import (
+    backfill, budgets, duplicates, export, hierarchy, periods, rates, sync, tags,
+    writebehind
+)
+
+# Число строк в одной порции заполнения
+BATCH_SIZE: int = 5000
+
+VERSION_SCHEMA: str = """
+    CREATE TABLE IF NOT EXISTS "SchemaVersion" (
+        "version" INTEGER PRIMARY KEY,
+        "name" TEXT NOT NULL,
+        "applied" TEXT NOT NULL,
+        "finished" TEXT,
+        "done" INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+# Имя таблицы в её определении
+_TABLE_NAME: re.Pattern = re.compile(r'^(CREATE\s+TABLE\s+)"?Expense"?', re.IGNORECASE)
+
+# Определение столбца категории в таблице расходов
+_CATEGORY_COLUMN: re.Pattern = re.compile(
+    r'"category_id"\s+INTEGER(\s+NOT\s+NULL)?', re.IGNORECASE
+)
+
+
+class Migration(NamedTuple):
+    """
+    Миграция: номер, имя, изменение схемы и, если нужно,
+    заполнение данных. backfill(con, size) обрабатывает не больше
+    size строк и возвращает их число (0 --- заполнение закончено),
+    remaining(con) возвращает число ещё не обработанных строк.
+    """
+
+    version: int
+    name: str
+    upgrade: Callable[[sqlite3.Connection], None]
+    backfill: Callable[[sqlite3.Connection, int], int] | None = None
+    remaining: Callable[[sqlite3.Connection], int] | None = None
+
+
+class Progress(NamedTuple):
+    """
+    Ход заполнения данных миграции
+    """
+
+    version: int
+    name: str
+    done: int
+    remaining: int
+
+
+def _columns(con: sqlite3.Connection, table: str) -> set[str]:
+    return {row[1] for row in con.execute(f'PRAGMA table_info("{table}")')}
+
+
+def _create_tables(con: sqlite3.Connection) -> None:
+    """
+    Таблицы первой версии программы
+    """
+
+    with con:
+        con.execute(
+            'CREATE TABLE IF NOT EXISTS "Budget" ('
+            '"obj_id" INTEGER PRIMARY KEY AUTOINCREMENT, '
+            '"period" INTEGER NOT NULL, "limit" REAL NOT NULL)'
+        )
+        con.execute(
+            'CREATE TABLE IF NOT EXISTS "Category" ('
+            '"obj_id" INTEGER PRIMARY KEY AUTOINCREMENT, "name" TEXT NOT NULL)'
+        )
+        con.execute(
+            'CREATE TABLE IF NOT EXISTS "Expense" ('
+            '"obj_id" INTEGER PRIMARY KEY AUTOINCREMENT, '
+            '"amount" REAL NOT NULL, "category_id" INTEGER NOT NULL, '
+            '"expense_date" DATETIME NOT NULL, "comment" TEXT NOT NULL)'
+        )
+
+
+def _add_budget_categories(con: sqlite3.Connection) -> None:
+    """
+    Бюджеты с параметром периода и категорией
+    """
+
+    if "param" in _columns(con, "Budget"):
+        return
+    with con:
+        # Прежние версии добавляли по три бюджета при каждом запуске.
+        # Оставляем бюджет с наименьшим id: именно его возвращал
+        # budget_get_by_period, и именно его лимит редактировался.
+        con.execute(
+            'DELETE FROM "Budget" WHERE "obj_id" NOT IN '
+            '(SELECT min("obj_id") FROM "Budget" GROUP BY "period")'
+        )
+        # Уникальность по одному периоду заменяется уникальностью
+        # по (период, параметр, категория); SQLite позволяет снять
+        # ограничение только пересозданием таблицы, она маленькая.
+        con.execute(
+            'CREATE TABLE "Budget_new" ('
+            '"obj_id" INTEGER PRIMARY KEY AUTOINCREMENT, '
+            '"period" INTEGER NOT NULL, "limit" REAL NOT NULL, '
+            '"param" INTEGER NOT NULL, "category_id" INTEGER NOT NULL, '
+            'UNIQUE ("period", "param", "category_id"))'
+        )
+        con.execute(
+            'INSERT INTO "Budget_new" '
+            '("obj_id", "period", "limit", "param", "category_id") '
+            'SELECT "obj_id", "period", "limit", 0, 0 FROM "Budget"'
+        )
+        con.execute('DROP TABLE "Budget"')
+        con.execute('ALTER TABLE "Budget_new" RENAME TO "Budget"')
+
+
+def _create_recurring(con: sqlite3.Connection) -> None:
+    """
+    Правила повторяющихся расходов
+    """
+
+    with con:
+        con.execute(
+            'CREATE TABLE IF NOT EXISTS "RecurringExpense" ('
+            '"obj_id" INTEGER PRIMARY KEY AUTOINCREMENT, '
+            '"amount" REAL NOT NULL, "category_id" INTEGER NOT NULL, '
+            '"comment" TEXT NOT NULL, "schedule" TEXT NOT NULL, '
+            '"next_date" DATETIME, "end_date" DATETIME)'
+        )
+        con.execute(
+            'CREATE INDEX IF NOT EXISTS "idx_recurringexpense__next_date" '
+            'ON "RecurringExpense" ("next_date")'
+        )
+
+
+def _add_fingerprints(con: sqlite3.Connection) -> None:
+    """
+    Отпечатки расходов для поиска дубликатов (см. bookkeeper.duplicates).
+    Добавление столбцов не переписывает таблицу, отпечатки
+    существующих расходов вычисляются заполнением.
+    """
+
+    with con:
+        if "fingerprint" not in _columns(con, "Expense"):
+            con.execute(
+                'ALTER TABLE "Expense" '
+                'ADD COLUMN "fingerprint" TEXT NOT NULL DEFAULT \'\''
+            )
+            con.execute('ALTER TABLE "Expense" ADD COLUMN "duplicate_of" INTEGER')
+        con.execute(
+            'CREATE INDEX IF NOT EXISTS "idx_expense__fingerprint" '
+            'ON "Expense" ("fingerprint")'
+        )
+
+
+def _fill_fingerprints(con: sqlite3.Connection, size: int) -> int:
+    # строки без отпечатка находятся по индексу отпечатков
+    rows: list[tuple] = con.execute(
+        'SELECT "obj_id", "amount", "category_id", "expense_date", "comment" '
+        'FROM "Expense" WHERE "fingerprint" = \'\' LIMIT ?',
+        (size,)
+    ).fetchall()
+    con.executemany(
+        'UPDATE "Expense" SET "fingerprint" = ? WHERE "obj_id" = ?',
+        [
+            (
+                duplicates.fingerprint(
+                    amount, datetime.fromisoformat(expense_date), category_id, comment
+                ),
+                obj_id
+            )
+            for obj_id, amount, category_id, expense_date, comment in rows
+        ]
+    )
+    return len(rows)
+
+
+def _count_fingerprints(con: sqlite3.Connection) -> int:
+    return con.execute(
+        'SELECT count(*) FROM "Expense" WHERE "fingerprint" = \'\''
+    ).fetchone()[0]
+
+
+def _repair_orphan_expenses(con: sqlite3.Connection) -> None:
+    """
+    Переносит расходы, ссылающиеся на несуществующие категории
+    (оставшиеся от прежних версий, удалявших категории без расходов),
+    в категорию "Неизвестная категория", которая создаётся при необходимости
+    """
+
+    orphans: str = '"category_id" NOT IN (SELECT "obj_id" FROM "Category")'
+    if con.execute(f'SELECT 1 FROM "Expense" WHERE {orphans} LIMIT 1').fetchone() is None:
+        return
+    row: tuple | None = con.execute(
+        'SELECT "obj_id" FROM "Category" WHERE "name" = ? ORDER BY "obj_id" LIMIT 1',
+        (export.UNKNOWN_CATEGORY,)
+    ).fetchone()
+    cat_id: int = row[0] if row else con.execute(
+        'INSERT INTO "Category" ("name") VALUES (?)', (export.UNKNOWN_CATEGORY,)
+    ).lastrowid
+    con.execute(f'UPDATE "Expense" SET "category_id" = ? WHERE {orphans}', (cat_id,))
+
+
+def _add_expense_foreign_key(con: sqlite3.Connection) -> None:
+    """
+    Делает Expense.category_id внешним ключом на Category с индексом.
+    Pony не создаёт внешний ключ для целочисленного поля, а SQLite
+    не умеет добавлять его в существующую таблицу, поэтому таблица
+    пересоздаётся по порядку, описанному в документации SQLite к ALTER TABLE:
+    новая таблица, копирование строк, удаление старой, переименование
+    и восстановление её индексов и триггеров. Расходы с несуществующей
+    категорией сначала переносятся в "Неизвестную категорию",
+    и вся перестройка проверяется PRAGMA foreign_key_check.
+    """
+
+    if not con.execute('PRAGMA foreign_key_list("Expense")').fetchall():
+        # вне транзакции: внутри неё PRAGMA foreign_keys не действует
+        con.execute("PRAGMA foreign_keys = OFF")
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            _repair_orphan_expenses(con)
+            sql: str = con.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'Expense'"
+            ).fetchone()[0]
+            column: re.Match | None = _CATEGORY_COLUMN.search(sql)
+            if column is None:
+                raise ValueError("Unexpected definition of the Expense table")
+            # индексы и триггеры удаляются вместе со старой таблицей
+            dependent: list[str] = [
+                row_sql for (row_sql,) in con.execute(
+                    "SELECT sql FROM sqlite_master WHERE tbl_name = 'Expense' "
+                    "AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+                )
+            ]
+            # счётчик AUTOINCREMENT удаляется вместе со старой таблицей,
+            # а id удалённых расходов не должны достаться новым
+            sequence: tuple | None = con.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'Expense'"
+            ).fetchone()
+            create: str = (
+                sql[:column.end()] + ' REFERENCES "Category" ("obj_id")'
+                + sql[column.end():]
+            )
+            con.execute(_TABLE_NAME.sub(r'\1"Expense_new"', create, count=1))
+            con.execute('INSERT INTO "Expense_new" SELECT * FROM "Expense"')
+            con.execute('DROP TABLE "Expense"')
+            con.execute('ALTER TABLE "Expense_new" RENAME TO "Expense"')
+            if sequence is not None:
+                con.execute("DELETE FROM sqlite_sequence WHERE name = 'Expense'")
+                con.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('Expense', ?)",
+                    sequence
+                )
+            for row_sql in dependent:
+                con.execute(row_sql)
+            if con.execute('PRAGMA foreign_key_check("Expense")').fetchone():
+                raise ValueError("Expenses refer to missing categories")
+    with con:
+        con.execute(
+            'CREATE INDEX IF NOT EXISTS "idx_expense__category_id" '
+            'ON "Expense" ("category_id")'
+        )
+
+
+def _fill_daily_totals(con: sqlite3.Connection, size: int) -> int:
+    # триггеры уже пересчитывают суммы в основную валюту (миграция currencies)
+    after, upto, count = backfill.batch(
+        con, periods.DAILY_TOTALS_BACKFILL, "Expense", size
+    )
+    con.execute(
+        'INSERT INTO "DailyTotal" ("day", "category_id", "amount") '
+        f'SELECT date(e."expense_date"), e."category_id", total({rates.converted("e")}) '
+        'FROM "Expense" AS e WHERE e."obj_id" > ? AND e."obj_id" <= ? GROUP BY 1, 2 '
+        'ON CONFLICT ("day", "category_id") '
+        'DO UPDATE SET "amount" = "amount" + excluded."amount"',
+        (after, upto)
+    )
+    return count
+
+
+def _count_daily_totals(con: sqlite3.Connection) -> int:
+    return backfill.remaining(con, periods.DAILY_TOTALS_BACKFILL, "Expense")
+
+
+def _count_expense_rows(con: sqlite3.Connection) -> int:
+    return backfill.remaining(con, sync.EXPENSE_ROWS_BACKFILL, "Expense")
+
+
+def _add_lookup_indexes(con: sqlite3.Connection) -> None:
+    """
+    Индексы для поиска категории по имени и расходов по промежутку дат
+    (отчёты, история и выгрузка за период)
+    """
+
+    with con:
+        con.execute(
+            'CREATE INDEX IF NOT EXISTS "idx_category__name" ON "Category" ("name")'
+        )
+        con.execute(
+            'CREATE INDEX IF NOT EXISTS "idx_expense__expense_date" '
+            'ON "Expense" ("expense_date")'
+        )
+
+
+def _add_currencies(con: sqlite3.Connection) -> None:
+    """
+    Валюта расходов и таблица курсов (см. bookkeeper.rates).
+    Валюта передаётся при синхронизации, поэтому триггеры
+    отслеживания изменений пересоздаются с новым столбцом.
+    """
+
+    rates.install_currencies(con)
+    sync.reinstall_triggers(con)
+
+
+def _add_sort_indexes(con: sqlite3.Connection) -> None:
+    """
+    Индексы для постраничного просмотра расходов,
+    отсортированных по сумме или комментарию (см. bookkeeper.listing)
+    """
+
+    with con:
+        con.execute(
+            'CREATE INDEX IF NOT EXISTS "idx_expense__amount" ON "Expense" ("amount")'
+        )
+        con.execute(
+            'CREATE INDEX IF NOT EXISTS "idx_expense__comment" ON "Expense" ("comment")'
+        )
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(1, "initial", _create_tables),
+    Migration(2, "budget_categories", _add_budget_categories),
+    Migration(3, "recurring_expenses", _create_recurring),
+    Migration(
+        4, "expense_fingerprints", _add_fingerprints,
+        _fill_fingerprints, _count_fingerprints
+    ),
+    Migration(5, "expense_foreign_key", _add_expense_foreign_key),
+    Migration(
+        6, "daily_totals", periods.install_daily_totals,
+        _fill_daily_totals, _count_daily_totals
+    ),
+    Migration(
+        7, "change_tracking", sync.install_change_tracking,
+        sync.fill_expense_rows, _count_expense_rows
+    ),
+    Migration(8, "lookup_indexes", _add_lookup_indexes),
+    Migration(9, "currencies", _add_currencies),
+    Migration(10, "sort_indexes", _add_sort_indexes),
+    Migration(11, "tags", tags.install_tags),
+    Migration(12, "write_behind", writebehind.install_write_behind),
+    Migration(13, "category_hierarchy", hierarchy.install_hierarchy),
+    Migration(14, "budget_tracking", budgets.install_budget_tracking),
+)
+
+LATEST_VERSION: int = MIGRATIONS[-1].version
+
+
+def _now() -> str:
+    return datetime.now().isoformat(" ", "seconds")
+
+
+def applied(con: sqlite3.Connection) -> dict[int, str | None]:
+    """
+    Применённые миграции: номер -> время окончания заполнения
+    (None, если заполнение ещё не закончено)
+    """
+
+    with con:
+        con.execute(VERSION_SCHEMA)
+        con.execute(backfill.CURSOR_SCHEMA)
+    return dict(con.execute('SELECT "version", "finished" FROM "SchemaVersion"'))
+
+
+def migrate(con: sqlite3.Connection) -> list[int]:
+    """
+    Применяет изменения схемы всех новых миграций по порядку.
+    Заполнение данных не выполняется (см. run_backfills),
+    кроме случая, когда заполнять нечего.
+    Возвращает номера применённых миграций.
+    """
+
+    versions: dict[int, str | None] = applied(con)
+    if versions and max(versions) > LATEST_VERSION:
+        raise ValueError("Database was created by a newer version of the program")
+
+    result: list[int] = []
+    for migration in MIGRATIONS:
+        if migration.version in versions:
+            continue
+        migration.upgrade(con)
+        finished: str | None = _now()
+        if migration.remaining is not None and migration.remaining(con):
+            finished = None
+        with con:
+            con.execute(
+                'INSERT INTO "SchemaVersion" ("version", "name", "applied", "finished") '
+                'VALUES (?, ?, ?, ?)',
+                (migration.version, migration.name, _now(), finished)
+            )
+        result.append(migration.version)
+    return result
+
+
+def pending_backfills(con: sqlite3.Connection) -> list[Migration]:
+    """
+    Миграции с незаконченным заполнением данных
+    """
+
+    versions: dict[int, str | None] = applied(con)
+    return [
+        migration for migration in MIGRATIONS
+        if migration.version in versions and versions[migration.version] is None
+    ]
+
+
+def run_backfills(
+        con: sqlite3.Connection,
+        size: int = BATCH_SIZE,
+        progress: Callable[[Progress], None] | None = None,
+        max_batches: int | None = None
+) -> bool:
+    """
+    Заполняет данные незавершённых миграций порциями по size строк,
+    каждая порция --- отдельная транзакция. После каждой порции
+    вызывает progress. max_batches ограничивает число порций
+    (например, одна порция за проход цикла событий интерфейса).
+    Возвращает True, если заполнение всех миграций закончено.
+    """
+
+    batches: int = 0
+    for migration in pending_backfills(con):
+        while True:
+            if max_batches is not None and batches >= max_batches:
+                return False
+            with con:
+                count: int = migration.backfill(con, size)
+                finished: str | None = None if count else _now()
+                con.execute(
+                    'UPDATE "SchemaVersion" SET "done" = "done" + ?, "finished" = ? '
+                    'WHERE "version" = ?',
+                    (count, finished, migration.version)
+                )
+            batches += 1
+            if progress is not None:
+                done: int = con.execute(
+                    'SELECT "done" FROM "SchemaVersion" WHERE "version" = ?',
+                    (migration.version,)
+                ).fetchone()[0]
+                progress(Progress(
+                    migration.version, migration.name, done, migration.remaining(con)
+                ))
+            if not count:
+                break
+    return True
@@ -0,0 +1,366 @@
+"""
+Периоды бюджетов и индекс сумм расходов по дням.
+
+Период по текущей дате определяет отрезок дней, за который считаются
+расходы. Суммы за любой отрезок берутся из дерева Фенвика
+по дневным суммам, поэтому стоят O(log дней) и не требуют
+просмотра таблицы расходов.
+
+Дневные суммы хранятся в таблице DailyTotal, которую поддерживают
+триггеры на таблице Expense. Так она остаётся согласованной при записи
+из любого процесса (окно, консольная команда, сервер). Дерево в памяти
+строится по ней один раз и затем обновляется по журналу её изменений.
+"""
+
+import calendar
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import date, timedelta
+from typing import Callable, Iterable
+
+from bookkeeper import backfill
+from bookkeeper.fenwick import FenwickTree
+
+# Коды периодов, хранящиеся в Budget.period.
+# Первые три --- скользящие окна, существовавшие с первой версии.
+PERIOD_DAY: int = 0
+PERIOD_WEEK: int = 1
+PERIOD_MONTH: int = 2
+PERIOD_CALENDAR_WEEK: int = 3
+PERIOD_CALENDAR_MONTH: int = 4
+PERIOD_SINCE_DAY_OF_MONTH: int = 5
+PERIOD_DAYS: int = 6
+
+# Категория 0 в бюджете означает "все категории"
+ALL_CATEGORIES: int = 0
+
+# Заполнение дневных сумм по расходам, внесённым до их появления
+# (см. bookkeeper.backfill); пока оно идёт, триггеры учитывают
+# только уже обработанные им расходы
+DAILY_TOTALS_BACKFILL: str = "daily_totals"
+
+# На сколько дней с запасом расширяется дерево дневных сумм,
+# когда изменяется день за его пределами
+GROWTH_DAYS: int = 366
+
+DAILY_TOTALS_SCHEMA: str = f"""
+    CREATE TABLE IF NOT EXISTS "DailyTotal" (
+        "day" TEXT NOT NULL,
+        "category_id" INTEGER NOT NULL,
+        "amount" REAL NOT NULL,
+        PRIMARY KEY ("day", "category_id")
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_expense_insert_daily_total"
+    AFTER INSERT ON "Expense"
+    WHEN {backfill.processed(DAILY_TOTALS_BACKFILL, "NEW")} BEGIN
+        INSERT INTO "DailyTotal" ("day", "category_id", "amount")
+        VALUES (date(NEW."expense_date"), NEW."category_id", NEW."amount")
+        ON CONFLICT ("day", "category_id")
+        DO UPDATE SET "amount" = "amount" + excluded."amount";
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_expense_delete_daily_total"
+    AFTER DELETE ON "Expense"
+    WHEN {backfill.processed(DAILY_TOTALS_BACKFILL, "OLD")} BEGIN
+        UPDATE "DailyTotal" SET "amount" = "amount" - OLD."amount"
+        WHERE "day" = date(OLD."expense_date") AND "category_id" = OLD."category_id";
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_expense_update_daily_total"
+    AFTER UPDATE OF "amount", "category_id", "expense_date" ON "Expense"
+    WHEN {backfill.processed(DAILY_TOTALS_BACKFILL, "NEW")} BEGIN
+        UPDATE "DailyTotal" SET "amount" = "amount" - OLD."amount"
+        WHERE "day" = date(OLD."expense_date") AND "category_id" = OLD."category_id";
+        INSERT INTO "DailyTotal" ("day", "category_id", "amount")
+        VALUES (date(NEW."expense_date"), NEW."category_id", NEW."amount")
+        ON CONFLICT ("day", "category_id")
+        DO UPDATE SET "amount" = "amount" + excluded."amount";
+    END;
+"""
+
+
+class Period(ABC):
+    """
+    Период бюджета.
+    По текущей дате определяет отрезок дней [start, end], за который
+    считаются расходы.
+    """
+
+    @abstractmethod
+    def bounds(self, today: date) -> tuple[date, date]:
+        """
+        Первый и последний день периода, содержащего today
+        """
+
+
+class RollingDays(Period):
+    """
+    Последние days дней, включая сегодняшний
+    """
+
+    def __init__(self, days: int):
+        if days < 1:
+            raise ValueError("Period must contain at least one day")
+        self.days: int = days
+
+    def bounds(self, today: date) -> tuple[date, date]:
+        return today - timedelta(days=self.days - 1), today
+
+
+class CalendarWeek(Period):
+    """
+    Текущая календарная неделя (с понедельника)
+    """
+
+    def bounds(self, today: date) -> tuple[date, date]:
+        start: date = today - timedelta(days=today.weekday())
+        return start, start + timedelta(days=6)
+
+
+class CalendarMonth(Period):
+    """
+    Текущий календарный месяц
+    """
+
+    def bounds(self, today: date) -> tuple[date, date]:
+        last_day: int = calendar.monthrange(today.year, today.month)[1]
+        return today.replace(day=1), today.replace(day=last_day)
+
+
+class SinceDayOfMonth(Period):
+    """
+    Период с заданного числа месяца (например, дня зарплаты)
+    до дня перед этим числом в следующем месяце.
+    Если в месяце нет такого числа, берётся последний день месяца.
+    """
+
+    def __init__(self, day: int):
+        if not 1 <= day <= 31:
+            raise ValueError("Day of month must be between 1 and 31")
+        self.day: int = day
+
+    def _in_month(self, year: int, month: int) -> date:
+        return date(year, month, min(self.day, calendar.monthrange(year, month)[1]))
+
+    def bounds(self, today: date) -> tuple[date, date]:
+        start: date = self._in_month(today.year, today.month)
+        if start > today:
+            year, month = (today.year - 1, 12) if today.month == 1 else (
+                today.year, today.month - 1
+            )
+            start = self._in_month(year, month)
+        year, month = (start.year + 1, 1) if start.month == 12 else (
+            start.year, start.month + 1
+        )
+        return start, self._in_month(year, month) - timedelta(days=1)
+
+
+# Код периода -> функция, создающая период по параметру
+PERIOD_TYPES: dict[int, Callable[[int], Period]] = {
+    PERIOD_DAY: lambda param: RollingDays(1),
+    PERIOD_WEEK: lambda param: RollingDays(7),
+    PERIOD_MONTH: lambda param: RollingDays(30),
+    PERIOD_CALENDAR_WEEK: lambda param: CalendarWeek(),
+    PERIOD_CALENDAR_MONTH: lambda param: CalendarMonth(),
+    PERIOD_SINCE_DAY_OF_MONTH: SinceDayOfMonth,
+    PERIOD_DAYS: RollingDays,
+}
+
+
+def make_period(code: int, param: int = 0) -> Period:
+    """
+    Создаёт период по коду и параметру, хранящимся в бюджете
+    """
+
+    if code not in PERIOD_TYPES:
+        raise ValueError("Wrong period")
+    return PERIOD_TYPES[code](param)
+
+
+def install_daily_totals(con: sqlite3.Connection) -> None:
+    """
+    Создаёт пустую таблицу дневных сумм и поддерживающие её триггеры.
+    Если таблица создаётся впервые, начинает её заполнение
+    по существующим расходам (см. migrations.run_backfills).
+    """
+
+    exists: bool = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='DailyTotal'"
+    ).fetchone() is not None
+    with con:
+        con.executescript("BEGIN;" + backfill.CURSOR_SCHEMA + DAILY_TOTALS_SCHEMA)
+        if not exists:
+            backfill.start(con, DAILY_TOTALS_BACKFILL, "Expense")
+
+
+class _DaySums:
+    """
+    Дерево Фенвика по дням одной категории (или всех категорий),
+    начиная с дня first_day. При изменении дня за пределами дерева
+    оно расширяется с запасом GROWTH_DAYS дней.
+    """
+
+    def __init__(self, first_day: int, values: list[float]):
+        self.first_day: int = first_day
+        self.tree: FenwickTree = FenwickTree.from_values(values)
+
+    def add(self, day: int, delta: float) -> None:
+        """
+        Прибавляет delta к сумме за день day (порядковый номер даты)
+        """
+
+        if not self.tree.size:
+            self.first_day = day
+        last: int = self.first_day + self.tree.size - 1
+        if not self.first_day <= day <= last:
+            first: int = min(self.first_day, day - GROWTH_DAYS)
+            last = max(last, day + GROWTH_DAYS)
+            values: list[float] = [0.0] * (last - first + 1)
+            offset: int = self.first_day - first
+            values[offset:offset + self.tree.size] = self.tree.values()
+            self.first_day = first
+            self.tree = FenwickTree.from_values(values)
+        self.tree.add(day - self.first_day, delta)
+
+    def range_sum(self, start: int, end: int) -> float:
+        """
+        Сумма за дни с start по end включительно
+        """
+
+        return self.tree.range_sum(start - self.first_day, end - self.first_day + 1)
+
+
+class DailyTotals:
+    """
+    Суммы расходов по дням в виде деревьев Фенвика:
+    одно дерево для всех категорий и по одному на каждую категорию,
+    у которой есть расходы. Элемент дерева --- сумма расходов за один день.
+
+    Деревья строятся по таблице DailyTotal один раз, а затем, когда
+    PRAGMA data_version показывает, что база изменилась, обновляются
+    по новым записям журнала DailyTotalLog (см. bookkeeper.budgets):
+    каждая стоит O(log дней). Если нужные записи журнала уже удалены,
+    деревья строятся заново.
+    """
+
+    def __init__(self, db_filename: str):
+        self._con: sqlite3.Connection = sqlite3.connect(
+            db_filename, check_same_thread=False, isolation_level=None
+        )
+        self._lock: threading.Lock = threading.Lock()
+        self._version: int | None = None
+        self._seq: int = 0
+        self._total: _DaySums = _DaySums(0, [])
+        self._by_category: dict[int, _DaySums] = {}
+
+    def _load(self) -> None:
+        """
+        Строит деревья по таблице DailyTotal.
+        Вызывается внутри читающей транзакции.
+        """
+
+        self._seq = self._con.execute(
+            'SELECT coalesce(max("seq"), 0) FROM "DailyTotalLog"'
+        ).fetchone()[0]
+        by_category: dict[int, dict[int, float]] = {}
+        for day, cat_id, amount in self._con.execute(
+                'SELECT "day", "category_id", "amount" FROM "DailyTotal" '
+                'WHERE "amount" <> 0'
+        ):
+            ordinal: int = date.fromisoformat(day).toordinal()
+            by_category.setdefault(cat_id, {})[ordinal] = amount
+
+        total: dict[int, float] = {}
+        self._by_category = {}
+        for cat_id, amounts in by_category.items():
+            first: int = min(amounts)
+            values: list[float] = [0.0] * (max(amounts) - first + 1)
+            for day, amount in amounts.items():
+                values[day - first] += amount
+                total[day] = total.get(day, 0.0) + amount
+            self._by_category[cat_id] = _DaySums(first, values)
+        first = min(total, default=0)
+        values = [0.0] * (max(total, default=-1) - first + 1)
+        for day, amount in total.items():
+            values[day - first] += amount
+        self._total = _DaySums(first, values)
+
+    def _replay(self) -> None:
+        for seq, day, cat_id, delta in self._con.execute(
+                'SELECT "seq", "day", "category_id", "delta" FROM "DailyTotalLog" '
+                'WHERE "seq" > ? ORDER BY "seq"',
+                (self._seq,)
+        ):
+            ordinal: int = date.fromisoformat(day).toordinal()
+            self._total.add(ordinal, delta)
+            if cat_id not in self._by_category:
+                self._by_category[cat_id] = _DaySums(ordinal, [0.0])
+            self._by_category[cat_id].add(ordinal, delta)
+            self._seq = seq
+
+    def refresh(self) -> None:
+        """
+        Обновляет деревья, если база изменилась с прошлого раза
+        """
+
+        with self._lock:
+            version: int = self._con.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._version:
+                return
+            self._con.execute("BEGIN")
+            try:
+                first: int | None = self._con.execute(
+                    'SELECT min("seq") FROM "DailyTotalLog"'
+                ).fetchone()[0]
+                if self._version is None or first is not None and first > self._seq + 1:
+                    self._load()
+                else:
+                    self._replay()
+            finally:
+                self._con.execute("COMMIT")
+            self._version = version
+
+    def get_sum(
+            self, start: date, end: date, category_ids: Iterable[int] | None = None
+    ) -> float:
+        """
+        Сумма расходов с дня start по день end включительно.
+        Если задан category_ids, учитываются только эти категории.
+        """
+
+        self.refresh()
+        first: int = start.toordinal()
+        last: int = end.toordinal()
+        if category_ids is None:
+            return self._total.range_sum(first, last)
+        return sum(
+            self._by_category[cat_id].range_sum(first, last)
+            for cat_id in set(category_ids) if cat_id in self._by_category
+        )
+
+    def revision(self) -> int:
+        """
+        Номер последнего изменения дневных сумм (записи журнала
+        DailyTotalLog); меняется при любом изменении таблицы DailyTotal
+        """
+
+        self.refresh()
+        return self._seq
+
+    def reset(self) -> None:
+        """
+        Забывает деревья: при следующем обновлении они строятся заново.
+        Нужно, если база заменена целиком (см. bookkeeper.writebehind).
+        """
+
+        with self._lock:
+            self._version = None
+
+    def close(self) -> None:
+        """
+        Закрывает соединение с базой
+        """
+
+        self._con.close()
@@ -3,53 +3,314 @@
 осуществляющий взаимодействие с базой данных
 """
 
+import atexit
+import contextlib
+import functools
+import itertools
+import json
+import os.path
+import random
+import sqlite3
+import time
 from pony import orm
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Collection, Iterator, TypeVar
+
+from bookkeeper import (
+    archive, budgets, cache, duplicates, export, hierarchy, listing, migrations, periods,
+    rates, recurring, snapshot, sync, tags, writebehind
+)
+
+DEFAULT_DB_FILENAME: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'database.sqlite'
+)
 
 db = orm.Database()
-db.bind(provider='sqlite', filename='database.sqlite', create_db=True)
+
+# Рабочая копия базы в памяти (см. bookkeeper.writebehind),
+# если база привязана в этом режиме
+_write_behind: writebehind.WriteBehind | None = None
 
 
 class Budget(db.Entity):
     """
     Бюджет, хранит лимит расходов (бюджет) за период (день/неделя/месяц)
 
-    period - 0 если день, 1 если неделя, 2 если месяц
+    period - код периода (см. bookkeeper.periods):
+        0 если день, 1 если неделя, 2 если месяц,
+        3 календарная неделя, 4 календарный месяц,
+        5 с param-го числа месяца, 6 последние param дней
+    param - параметр периода
+    category_id - категория, расходы которой ограничивает бюджет,
+        0 если все категории
+    subcategories - учитывать и расходы потомков категории
+        (см. bookkeeper.hierarchy)
     limit - бюджет за этот период
     """
 
     obj_id = orm.PrimaryKey(int, auto=True)
     period = orm.Required(int)
     limit = orm.Required(float)
+    param = orm.Required(int, default=0)
+    category_id = orm.Required(int, default=periods.ALL_CATEGORIES)
+    subcategories = orm.Required(bool, default=False)
+    orm.composite_key(period, param, category_id)
 
 
 class Category(db.Entity):
     """
-    Класс категории, хранит название и TODO ссылку на родителя
+    Класс категории, хранит название и id родительской категории
+    (None у категорий верхнего уровня, см. bookkeeper.hierarchy)
     """
 
     obj_id = orm.PrimaryKey(int, auto=True)
-    name = orm.Required(str)
+    name = orm.Required(str, index=True)
+    parent_id = orm.Optional(int, index=True)
 
 
 class Expense(db.Entity):
     """
     Расходная операция.
-    amount - сумма
+    amount - сумма в валюте расхода
+    currency - код валюты (см. bookkeeper.rates)
     category - id категории расходов
     expense_date - дата расхода
     comment - комментарий
     pk - id записи в базе данных
+    fingerprint - отпечаток для поиска дубликатов (см. bookkeeper.duplicates),
+        пересчитывается при каждом сохранении
+    duplicate_of - id расхода, дубликатом которого отмечен этот расход
+    """
+
+    obj_id = orm.PrimaryKey(int, auto=True)
+    amount = orm.Required(float, index=True)
+    category_id = orm.Required(int)
+    expense_date = orm.Required(datetime, index=True)
+    comment = orm.Required(str, index=True)
+    fingerprint = orm.Optional(str, index=True)
+    duplicate_of = orm.Optional(int)
+    currency = orm.Required(str, default=rates.BASE_CURRENCY)
+
+    def _update_fingerprint(self) -> None:
+        self.fingerprint = duplicates.fingerprint(
+            self.amount, self.expense_date, self.category_id, self.comment, self.currency
+        )
+
+    def before_insert(self) -> None:
+        self._update_fingerprint()
+
+    def before_update(self) -> None:
+        self._update_fingerprint()
+
+
+class Tag(db.Entity):
+    """
+    Метка расходов ("отпуск", "к возмещению").
+    Связи меток с расходами хранятся в таблице ExpenseTag,
+    запросы по меткам выполняются по битовым картам (см. bookkeeper.tags).
+    """
+
+    obj_id = orm.PrimaryKey(int, auto=True)
+    name = orm.Required(str, unique=True)
+
+
+class RecurringExpense(db.Entity):
+    """
+    Правило повторяющегося расхода (аренда, подписка, платёж по кредиту).
+    amount, category_id, comment - как у расхода
+    schedule - расписание (см. bookkeeper.recurring)
+    next_date - ближайший ещё не внесённый в расходы момент,
+        None если расписание закончилось
+    end_date - момент, после которого правило перестаёт действовать
     """
 
     obj_id = orm.PrimaryKey(int, auto=True)
     amount = orm.Required(float)
     category_id = orm.Required(int)
-    expense_date = orm.Required(datetime)
     comment = orm.Required(str)
+    schedule = orm.Required(str)
+    next_date = orm.Optional(datetime, index=True)
+    end_date = orm.Optional(datetime)
+
+
+BUDGET_PERIODS: tuple[int, ...] = (0, 1, 2)
+
+UNKNOWN_CATEGORY: str = "Неизвестная категория"
+
+# Сколько секунд SQLite ждёт освобождения блокировки базы другим процессом
+BUSY_TIMEOUT: float = 5.0
+
+# Повтор транзакции, так и не дождавшейся блокировки:
+# число попыток и задержка перед второй попыткой (удваивается до предела)
+RETRY_ATTEMPTS: int = 5
+RETRY_DELAY: float = 0.05
+RETRY_MAX_DELAY: float = 1.0
+
+# Сколько расходов загружается из файла одной транзакцией
+IMPORT_BATCH_SIZE: int = 500
+
+_Result = TypeVar("_Result")
+
+
+def _is_locked(error: Exception) -> bool:
+    # Pony оборачивает ошибку SQLite, сохраняя её текст
+    return "database is locked" in str(error)
+
+
+def retry_locked(func: Callable[..., _Result]) -> Callable[..., _Result]:
+    """
+    Повторяет транзакцию func, если база заблокирована другим процессом
+    дольше BUSY_TIMEOUT, с растущей случайной задержкой между попытками.
+    Внутри уже открытой db_session повтор невозможен (транзакция
+    принадлежит внешнему вызову), там func вызывается как есть.
+    После транзакции её изменения записываются в журнал рабочей копии,
+    если база открыта в памяти, а у методов презентера из кэша записей
+    удаляются изменённые транзакцией записи, обновляются суммы
+    бюджетов и рассылаются оповещения о пройденных порогах.
+    Декоратор ставится над @orm.db_session.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> _Result:
+        if orm.core.local.db_session is not None:
+            return func(*args, **kwargs)
+        delay: float = RETRY_DELAY
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                result: _Result = func(*args, **kwargs)
+                break
+            except (orm.core.OrmError, orm.dbapiprovider.DBException,
+                    sqlite3.OperationalError) as error:
+                if not _is_locked(error) or attempt == RETRY_ATTEMPTS - 1:
+                    raise
+            time.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+        _capture()
+        if args and isinstance(args[0], Presenter):
+            args[0]._entity_cache.invalidate_deferred()
+            args[0]._check_budgets()
+        return result
+
+    return wrapper
+
+
+def _capture() -> None:
+    """
+    Записывает изменения рабочей копии в журнал на диске,
+    если база открыта в памяти
+    """
+
+    if _write_behind is not None:
+        _write_behind.capture()
+
+
+def _reassign_expenses(cat_id: int, reassign_to: int) -> int:
+    """
+    Переносит расходы оперативной базы из категории cat_id в reassign_to
+    и пересчитывает их отпечатки. Вызывается внутри db_session.
+    Возвращает число перенесённых расходов.
+    """
+
+    rows: list[tuple] = db.select(
+        '"obj_id", "amount", "expense_date", "comment", "currency" FROM "Expense" '
+        'WHERE "category_id" = $cat_id'
+    )
+    db.execute(
+        'UPDATE "Expense" SET "category_id" = $reassign_to WHERE "category_id" = $cat_id'
+    )
+    db.get_connection().executemany(
+        'UPDATE "Expense" SET "fingerprint" = ? WHERE "obj_id" = ?',
+        [
+            (
+                duplicates.fingerprint(
+                    amount, datetime.fromisoformat(expense_date), reassign_to, comment,
+                    currency
+                ),
+                obj_id
+            )
+            for obj_id, amount, expense_date, comment, currency in rows
+        ]
+    )
+    return len(rows)
+
+
+def bind_database(filename: str = DEFAULT_DB_FILENAME, in_memory: bool = False) -> str:
+    """
+    Привязывает базу данных к файлу, применив к ней новые миграции
+    (см. bookkeeper.migrations). Заполнение данных миграций
+    выполняется позже, методом Presenter.migrate.
+    Если задан in_memory, Pony привязывается к рабочей копии базы в памяти,
+    а изменения переносятся в файл в фоне (см. bookkeeper.writebehind);
+    при выходе из программы все они переносятся в файл. Журнал рабочей
+    копии, оставшийся после падения, переносится в файл в любом режиме.
+    Привязка возможна только один раз за процесс,
+    повторный вызов с тем же файлом ничего не делает.
+    Возвращает абсолютный путь к файлу базы.
+    """
+
+    global _write_behind
+
+    filename = os.path.abspath(filename)
+    if db.provider is not None:
+        bound: str = (
+            _write_behind.db_filename if _write_behind is not None
+            else db.provider.pool.filename
+        )
+        if bound != filename:
+            raise ValueError(f"Database is already bound to {bound}")
+        if in_memory != (_write_behind is not None):
+            raise ValueError(f"Database {bound} is already bound in another mode")
+        return filename
+
+    con: sqlite3.Connection = sqlite3.connect(filename, timeout=BUSY_TIMEOUT)
+    try:
+        migrations.migrate(con)
+        # в режиме WAL чтение не ждёт записи, а запись --- чтения,
+        # и процессы блокируют друг друга только при одновременной записи
+        con.execute("PRAGMA journal_mode=WAL")
+    finally:
+        con.close()
+    # журнал рабочей копии, оставшийся после падения, переносится в любом режиме:
+    # иначе следующий запуск в памяти положил бы его устаревшие образы строк
+    # поверх изменений, сделанных без рабочей копии
+    writebehind.recover(filename)
+    working: str = filename
+    if in_memory:
+        _write_behind = writebehind.WriteBehind(filename)
+        atexit.register(_write_behind.close)
+        working = _write_behind.filename
+    db.bind(provider='sqlite', filename=working, create_db=True, timeout=BUSY_TIMEOUT)
+    db.generate_mapping(create_tables=True)
+    db.disconnect()
+    return filename
+
 
+def prepare_database(filename: str) -> str:
+    """
+    Применяет все миграции, включая заполнение данных, к базе,
+    к которой не привязан Pony, например к другой копии базы
+    для синхронизации.
+    Возвращает абсолютный путь к файлу базы.
+    """
 
-db.generate_mapping(create_tables=True)
+    filename = os.path.abspath(filename)
+    if not os.path.exists(filename):
+        raise ValueError(f"Database file {filename} does not exist")
+    con: sqlite3.Connection = sqlite3.connect(filename)
+    try:
+        tables: set[str] = {
+            name for (name,) in con.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            )
+        }
+        if not {"Budget", "Category", "Expense"} <= tables:
+            raise ValueError(f"{filename} is not a bookkeeper database")
+        migrations.migrate(con)
+        writebehind.recover(filename)
+        migrations.run_backfills(con)
+    finally:
+        con.close()
+    return filename
 
 
 class Presenter:
@@ -58,17 +319,114 @@ class Presenter:
     Имеет методы для получения данных из базы и отправки данных в базу.
     """
 
-    @orm.db_session
-    def __init__(self):
+    def __init__(self, db_filename: str = DEFAULT_DB_FILENAME, in_memory: bool = False):
         """
         Конструктор презентера.
-        Создаёт фиксированные типы ограничения бюджета --- на день, неделю и месяц.
+        Подключается к базе данных в файле db_filename, а если задан
+        in_memory --- к её рабочей копии в памяти с отложенной записью
+        в файл (см. bookkeeper.writebehind).
+        Создаёт фиксированные типы ограничения бюджета --- на день, неделю и месяц,
+        если их ещё нет в базе.
         """
 
-        Budget(period=0, limit=0)
-        Budget(period=1, limit=0)
-        Budget(period=2, limit=0)
+        self.db_filename: str = bind_database(db_filename, in_memory)
+        # Файл, с которым работает Pony: сама база или её рабочая копия
+        self._working_filename: str = (
+            _write_behind.filename if _write_behind is not None else self.db_filename
+        )
+
+        # Кэш бюджетов: (период, параметр, категория) -> бюджет.
+        # Сбрасывается при изменении бюджетов и заполняется одним запросом.
+        self._budgets: dict[tuple[int, int, int], Budget] | None = None
+
+        # Суммы расходов по дням для подсчёта трат за любой период
+        self._daily_totals: periods.DailyTotals = periods.DailyTotals(
+            self._working_filename
+        )
+
+        # Битовые карты меток для запросов по меткам
+        self._tags: tags.TagIndex = tags.TagIndex(self._working_filename)
+
+        # Суммы бюджетов за текущие периоды, обновляемые после каждой записи,
+        # и подписчики на оповещения о пройденных порогах
+        self._budget_tracker: budgets.BudgetTracker = budgets.BudgetTracker(
+            self._working_filename
+        )
+        self._alert_listeners: list[Callable[[budgets.BudgetAlert], None]] = []
+
+        # Последний прогноз превышения бюджетов и то, по чему он посчитан:
+        # день, изменение дневных сумм, состояния бюджетов и параметры
+        self._forecast: tuple[tuple, dict[int, float]] | None = None
 
+        # Недавно прочитанные по id расходы и категории: (сущность, id) -> запись.
+        # Методы презентера удаляют из него изменённые записи;
+        # записи, изменённые другими процессами, обновляются только
+        # после вытеснения, как и кэш бюджетов.
+        self._entity_cache: cache.EntityCache = cache.EntityCache()
+
+        self._add_default_budgets()
+
+        # Ближайший момент, когда по правилам повторяющихся расходов
+        # появится новый расход. Пока он не наступил, проверять правила не нужно.
+        self._recurring_due: datetime | None = self._recurring_next_due()
+        self.recurring_materialize_due()
+
+    def _on_disk(self) -> str:
+        """
+        Возвращает путь к файлу базы для операций, читающих его
+        напрямую (архивы, выгрузка). В режиме рабочей копии сначала
+        переносит в файл все её изменения.
+        """
+
+        if _write_behind is not None:
+            _write_behind.flush()
+        return self.db_filename
+
+    @contextlib.contextmanager
+    def _direct(self) -> Iterator[str]:
+        """
+        Контекст для операций, изменяющих файл базы напрямую.
+        После операции кэш записей очищается, а в режиме рабочей копии
+        рабочая копия загружается из файла заново (см. WriteBehind.direct).
+        Возвращает путь к файлу базы.
+        """
+
+        if _write_behind is None:
+            try:
+                yield self.db_filename
+            finally:
+                self._entity_cache.clear()
+            return
+        try:
+            with _write_behind.direct() as filename:
+                yield filename
+        finally:
+            self._entity_cache.clear()
+            self._budgets = None
+            self._tags.reset()
+            self._budget_tracker.reset()
+            self._daily_totals.reset()
+
+    def flush(self) -> None:
+        """
+        Переносит в файл базы все изменения рабочей копии в памяти.
+        Если база открыта не в памяти, ничего не делает.
+        """
+
+        self._on_disk()
+
+    @staticmethod
+    @retry_locked
+    @orm.db_session
+    def _add_default_budgets() -> None:
+        for period in BUDGET_PERIODS:
+            db.execute(
+                'INSERT OR IGNORE INTO "Budget" '
+                '("period", "limit", "param", "category_id") '
+                'VALUES ($period, 0, 0, 0)'
+            )
+
+    @orm.db_session
     def categories_get_by_name(self, category_name: str) -> list[Category]:
         """
         Получает список категорий с заданным именем.
@@ -76,25 +434,68 @@ class Presenter:
         такой список будет содержать один или ноль элементов.
         """
 
-        count: int = Category.select().count()
-        if count:
-            return [
-                cat for cat in Category.select()[:] if cat.name == category_name
-            ]
-        return []
+        return Category.select(lambda cat: cat.name == category_name)[:]
 
+    @retry_locked
     @orm.db_session
-    def category_add(self, category_name: str) -> None:
+    def category_add(self, category_name: str, parent_id: int | None = None) -> int:
         """
-        Создаёт категорию с заданным именем.
+        Создаёт категорию с заданным именем,
+        дочернюю категории parent_id, если он задан.
         Проверяет, что имя уникально.
+        Возвращает id созданной категории.
         """
 
         if self.categories_get_by_name(category_name):
             raise NameError(f"Category with name {category_name} already exists")
+        if parent_id is not None:
+            self.category_get_by_id(parent_id)
 
-        Category(name=category_name)
+        cat: Category = Category(name=category_name, parent_id=parent_id)
+        cat.flush()
+        return cat.obj_id
 
+    @retry_locked
+    @orm.db_session
+    def category_set_parent(self, cat_id: int, parent_id: int | None) -> None:
+        """
+        Делает категорию cat_id дочерней категории parent_id
+        (None --- категорией верхнего уровня).
+        Проверяет, что категория не становится потомком самой себя.
+        """
+
+        cat: Category = self.category_get_by_id(cat_id)
+        if parent_id is not None:
+            self.category_get_by_id(parent_id)
+            ancestors: list[tuple[int]] = db.execute(
+                hierarchy.ANCESTORS_QUERY, {"cat_id": parent_id}
+            ).fetchall()
+            if (cat_id,) in ancestors:
+                raise ValueError("Category cannot be moved into its own subtree")
+        cat.parent_id = parent_id
+        self._entity_cache.defer((Category, cat_id))
+
+    def categories_get_children(
+            self, parent_id: int | None = None, period: int = BUDGET_PERIODS[-1]
+    ) -> list[hierarchy.CategoryNode]:
+        """
+        Получает дочерние категории parent_id (None --- категории
+        верхнего уровня), упорядоченные по имени, с суммами расходов
+        за текущий период бюджета period: собственными и по поддереву.
+        Выполняет один запрос и не просматривает таблицу расходов.
+        """
+
+        self.recurring_materialize_due()
+        start, end = periods.make_period(period).bounds(date.today())
+        sql, params = hierarchy.children_query(parent_id, start, end)
+        with orm.db_session:
+            return [
+                hierarchy.CategoryNode(obj_id, name, bool(has_children), own, total)
+                for obj_id, name, has_children, own, total
+                in db.execute(sql, params).fetchall()
+            ]
+
+    @retry_locked
     @orm.db_session
     def category_edit_name(self, cat_id: int, new_name: str) -> None:
         """
@@ -105,6 +506,7 @@ class Presenter:
         if self.categories_get_by_name(new_name):
             raise NameError(f"Category with name {new_name} already exists")
         Category[cat_id].name = new_name
+        self._entity_cache.defer((Category, cat_id))
 
     @orm.db_session
     def categories_get_list(self) -> list[Category]:
@@ -114,27 +516,132 @@ class Presenter:
 
         return Category.select()[:]
 
-    @orm.db_session
     def category_get_by_id(self, cat_id: int) -> Category:
         """
         Получает категорию по id.
         Проверяет корректность id.
+        Вне db_session категория берётся из кэша записей,
+        внутри --- читается из базы, чтобы её можно было изменить.
         """
 
+        if orm.core.local.db_session is not None:
+            return self._category_load(cat_id)
+        return self._entity_cache.get(
+            (Category, cat_id), functools.partial(self._category_load, cat_id)
+        )
+
+    @staticmethod
+    @orm.db_session
+    def _category_load(cat_id: int) -> Category:
         try:
             return Category[cat_id]
         except orm.core.ObjectNotFound:
             raise ValueError("Category id is incorrect")
 
-    @orm.db_session
-    def category_delete(self, cat_id: int) -> None:
+    def category_delete(
+            self, cat_id: int, reassign_to: int | None = None, cascade: bool = False
+    ) -> int:
         """
         Удаляет категорию по id.
+        Если задан reassign_to, расходы и повторяющиеся расходы категории
+        переносятся в категорию reassign_to, если задан cascade --- удаляются
+        вместе с ней. Без этих параметров удалить можно только категорию
+        без расходов. Бюджеты категории удаляются.
+        Возвращает число перенесённых или удалённых расходов.
         """
 
-        Category[cat_id].delete()
+        self.category_get_by_id(cat_id)
+        if reassign_to is not None:
+            if reassign_to == cat_id:
+                raise ValueError("Cannot reassign expenses to the deleted category")
+            self.category_get_by_id(reassign_to)
+        elif not cascade and archive.count_expenses(self._on_disk(), [cat_id]):
+            raise ValueError("Category has expenses")
+
+        changed: int = self._category_delete(cat_id, reassign_to)
+        # Архивы в отдельных файлах, ссылки из них проверить некому
+        changed += archive.reassign_category(self.db_filename, cat_id, reassign_to)
+        self._budgets = None
+        # расходы категории перенесены или удалены, дочерние категории перешли к родителю
+        self._entity_cache.clear()
+        return changed
 
+    @retry_locked
     @orm.db_session
+    def _category_delete(self, cat_id: int, reassign_to: int | None) -> int:
+        """
+        Удаляет категорию и переносит или удаляет её расходы
+        в оперативной базе одной транзакцией
+        """
+
+        if reassign_to is None:
+            changed: int = db.execute(
+                'DELETE FROM "Expense" WHERE "category_id" = $cat_id'
+            ).rowcount
+            db.execute('DELETE FROM "RecurringExpense" WHERE "category_id" = $cat_id')
+        else:
+            changed = _reassign_expenses(cat_id, reassign_to)
+            db.execute(
+                'UPDATE "RecurringExpense" SET "category_id" = $reassign_to '
+                'WHERE "category_id" = $cat_id'
+            )
+        db.execute('DELETE FROM "Budget" WHERE "category_id" = $cat_id')
+        db.execute('DELETE FROM "Category" WHERE "obj_id" = $cat_id')
+        return changed
+
+    def category_repair(
+            self, reassign_to: int | None = None, delete: bool = False
+    ) -> int:
+        """
+        Исправляет расходы, ссылающиеся на несуществующие категории
+        (оставшиеся от прежних версий, удалявших категории без расходов).
+        Если задан delete, такие расходы удаляются, иначе переносятся
+        в категорию reassign_to, а по умолчанию --- в категорию
+        "Неизвестная категория", которая создаётся при необходимости.
+        Возвращает число исправленных расходов.
+        """
+
+        orphans: set[int] = archive.orphan_category_ids(self._on_disk())
+        if not orphans:
+            return 0
+        if not delete:
+            if reassign_to is not None:
+                self.category_get_by_id(reassign_to)
+            else:
+                cats: list[Category] = self.categories_get_by_name(UNKNOWN_CATEGORY)
+                reassign_to = (
+                    cats[0].obj_id if cats else self.category_add(UNKNOWN_CATEGORY)
+                )
+        else:
+            reassign_to = None
+
+        changed: int = 0
+        for cat_id in orphans:
+            with orm.db_session:
+                if reassign_to is None:
+                    changed += db.execute(
+                        'DELETE FROM "Expense" WHERE "category_id" = $cat_id'
+                    ).rowcount
+                else:
+                    changed += _reassign_expenses(cat_id, reassign_to)
+            changed += archive.reassign_category(self.db_filename, cat_id, reassign_to)
+        _capture()
+        self._entity_cache.clear()
+        return changed
+
+    def _budget_cache(self) -> dict[tuple[int, int, int], Budget]:
+        """
+        Возвращает кэш бюджетов, при необходимости заполняя его из базы
+        """
+
+        if self._budgets is None:
+            with orm.db_session:
+                self._budgets = {
+                    (bdg.period, bdg.param, bdg.category_id): bdg
+                    for bdg in Budget.select()
+                }
+        return self._budgets
+
     def budgets_get_by_period(self, period: int) -> list[Budget]:
         """
         Получает список бюджетов, соответствующих данному периоду
@@ -145,12 +652,10 @@ class Presenter:
         список будет состоять из одного или нуля элементов.
         """
 
-        count: int = Budget.select().count()
-        if count:
-            return [bdg for bdg in Budget.select()[:] if bdg.period == period]
-        return []
+        key: tuple[int, int, int] = (period, 0, periods.ALL_CATEGORIES)
+        budgets: dict[tuple[int, int, int], Budget] = self._budget_cache()
+        return [budgets[key]] if key in budgets else []
 
-    @orm.db_session
     def budget_get_by_period(self, period: int) -> Budget:
         """
         Получает бюджет, соответствующий данному периоду
@@ -165,7 +670,6 @@ class Presenter:
             raise ValueError("Wrong period")
         return bdgs[0]
 
-    @orm.db_session
     def budget_get_limit_for_period(self, period: int) -> float:
         """
         Получает лимит бюджета по периоду.
@@ -173,6 +677,7 @@ class Presenter:
 
         return self.budget_get_by_period(period).limit
 
+    @retry_locked
     @orm.db_session
     def budget_edit_limit(self, bdg_id: int, new_limit: float) -> None:
         """
@@ -184,58 +689,409 @@ class Presenter:
             Budget[bdg_id].limit = new_limit
         except orm.core.ObjectNotFound:
             raise ValueError("Budget id is incorrect")
+        self._budgets = None
 
+    @retry_locked
     @orm.db_session
+    def budget_add(
+            self,
+            period: int,
+            limit: float,
+            param: int = 0,
+            category_id: int = periods.ALL_CATEGORIES,
+            subcategories: bool = False
+    ) -> int:
+        """
+        Создаёт бюджет на период с кодом period и параметром param
+        (см. bookkeeper.periods), ограничивающий расходы категории category_id
+        (с subcategories --- вместе с её потомками) или все расходы.
+        Проверяет корректность периода и категории
+        и то, что такого бюджета ещё нет.
+        Возвращает id созданного бюджета.
+        """
+
+        periods.make_period(period, param)
+        if category_id != periods.ALL_CATEGORIES:
+            self.category_get_by_id(category_id)
+        if Budget.exists(period=period, param=param, category_id=category_id):
+            raise ValueError("Budget for this period already exists")
+
+        bdg: Budget = Budget(
+            period=period, limit=limit, param=param, category_id=category_id,
+            subcategories=subcategories
+        )
+        bdg.flush()
+        self._budgets = None
+        return bdg.obj_id
+
+    @retry_locked
+    @orm.db_session
+    def budget_delete(self, bdg_id: int) -> None:
+        """
+        Удаляет бюджет, заданный с помощью id.
+        Бюджеты на день, неделю и месяц удалить нельзя.
+        """
+
+        try:
+            bdg: Budget = Budget[bdg_id]
+        except orm.core.ObjectNotFound:
+            raise ValueError("Budget id is incorrect")
+        if bdg.period in BUDGET_PERIODS and bdg.category_id == periods.ALL_CATEGORIES:
+            raise ValueError("Default budgets cannot be deleted")
+        bdg.delete()
+        self._budgets = None
+
+    def budgets_get_list(self) -> list[Budget]:
+        """
+        Получает список всех бюджетов
+        """
+
+        return sorted(self._budget_cache().values(), key=lambda bdg: bdg.obj_id)
+
+    def expenses_get_sum(
+            self, start: date, end: date, category_id: int = periods.ALL_CATEGORIES
+    ) -> float:
+        """
+        Вычисляет сумму расходов с дня start по день end включительно,
+        по всем категориям или по категории category_id.
+        Использует индекс дневных сумм и не просматривает таблицу расходов.
+        """
+
+        self.recurring_materialize_due()
+        category_ids: list[int] | None = (
+            None if category_id == periods.ALL_CATEGORIES else [category_id]
+        )
+        return self._daily_totals.get_sum(start, end, category_ids)
+
+    def budget_get_sum(self, bdg: Budget) -> float:
+        """
+        Получает сумму расходов, учитываемых бюджетом bdg,
+        за текущий период этого бюджета.
+        Суммы всех бюджетов поддерживаются в памяти (см. bookkeeper.budgets),
+        поэтому запросов к базе нет, если она не изменилась.
+        """
+
+        self.recurring_materialize_due()
+        self._check_budgets()
+        spent: float | None = self._budget_tracker.spent(bdg.obj_id)
+        if spent is None:
+            raise ValueError("Budget id is incorrect")
+        return spent
+
     def budget_get_sum_for_period(self, period: int) -> float:
         """
         Вычисляет сумму расходов за заданный период
         """
 
-        match period:
-            case 0:
-                delta: timedelta = timedelta(days=1)
-            case 1:
-                delta: timedelta = timedelta(days=7)
-            case 2:
-                delta: timedelta = timedelta(days=30)
-            case _:
-                raise ValueError("Wrong period")
+        return self.budget_get_sum(self.budget_get_by_period(period))
 
-        dn: datetime = datetime.now()
+    def budgets_subscribe(self, listener: Callable[[budgets.BudgetAlert], None]) -> None:
+        """
+        Подписывает listener на оповещения о том, что расходы бюджета
+        дошли до порога его лимита (см. bookkeeper.budgets.ALERT_THRESHOLDS).
+        Оповещения приходят после записей этого презентера,
+        а о записях других процессов --- при следующем чтении сумм бюджетов.
+        """
+
+        self._alert_listeners.append(listener)
 
-        return sum(
-            [exp.amount for exp in Expense.select()[:] if dn - exp.expense_date <= delta]
+    def _check_budgets(self) -> list[budgets.BudgetAlert]:
+        """
+        Обновляет суммы бюджетов и рассылает оповещения подписчикам
+        """
+
+        alerts: list[budgets.BudgetAlert] = self._budget_tracker.refresh()
+        for alert in alerts:
+            for listener in self._alert_listeners:
+                listener(alert)
+        return alerts
+
+    def budgets_forecast(
+            self,
+            budgets: list[Budget] | None = None,
+            simulations: int | None = None,
+            max_workers: int | None = None,
+            seed: int | None = None
+    ) -> dict[int, float]:
+        """
+        Оценивает для бюджетов budgets (по умолчанию всех) вероятность
+        превышения лимита к концу текущего периода (см. bookkeeper.forecast).
+        Возвращает словарь id бюджета -> вероятность.
+        Пока не сменился день и не изменились дневные суммы и бюджеты,
+        повторный вызов возвращает прошлый прогноз без моделирования.
+        """
+
+        # numpy загружается долго, поэтому прогноз импортируется по требованию
+        from bookkeeper import forecast
+
+        budgets = self.budgets_get_list() if budgets is None else budgets
+        today: date = date.today()
+        states: list[forecast.BudgetState] = [
+            forecast.BudgetState(
+                bdg.category_id,
+                periods.make_period(bdg.period, bdg.param).bounds(today)[1],
+                bdg.limit,
+                self.budget_get_sum(bdg)
+            )
+            for bdg in budgets
+        ]
+        key: tuple = (
+            today, self._daily_totals.revision(),
+            tuple(zip((bdg.obj_id for bdg in budgets), states)), simulations, seed
         )
+        if self._forecast is not None and self._forecast[0] == key:
+            return dict(self._forecast[1])
+        probabilities: list[float] = forecast.exceed_probabilities(
+            self._working_filename, states, today,
+            forecast.SIMULATIONS if simulations is None else simulations,
+            max_workers, seed
+        )
+        result: dict[int, float] = {
+            bdg.obj_id: prob for bdg, prob in zip(budgets, probabilities)
+        }
+        self._forecast = (key, result)
+        return dict(result)
 
+    @retry_locked
     @orm.db_session
-    def expense_add(self, cost: float, category_name: str, comment: str) -> None:
+    def expense_add(
+            self,
+            cost: float,
+            category_name: str,
+            comment: str,
+            expense_date: datetime | None = None,
+            on_duplicate: str = duplicates.ALLOW,
+            currency: str = rates.BASE_CURRENCY
+    ) -> int:
         """
-        Добавляет расход в базу
+        Добавляет расход в базу.
+        Если дата не указана, расход датируется текущим моментом.
+        on_duplicate --- политика для уже внесённого такого же расхода
+        (см. bookkeeper.duplicates).
+        currency --- валюта расхода; для валюты, отличной от основной,
+        в базе должен быть хотя бы один курс (см. rates_import).
+        Возвращает id созданного расхода, а если расход не добавлен
+        из-за политики --- id существующего.
         """
 
+        duplicates.check_policy(on_duplicate)
         cats: list[Category] = self.categories_get_by_name(category_name)
         if not cats:
-            print(f"No category named {category_name}")
             raise NameError(f"No category named {category_name}")
 
+        exp_id, outcome = self._expense_add(
+            cost, cats[0].obj_id, comment, expense_date or datetime.now(), on_duplicate,
+            self._check_currency(currency)
+        )
+        if outcome == "merged":
+            self._entity_cache.defer((Expense, exp_id))
+        return exp_id
+
+    @orm.db_session
+    def expense_find_duplicate(
+            self,
+            cost: float,
+            category_name: str,
+            comment: str,
+            expense_date: datetime | None = None,
+            currency: str = rates.BASE_CURRENCY
+    ) -> int | None:
+        """
+        Ищет уже внесённый такой же расход (см. bookkeeper.duplicates).
+        Возвращает его id или None.
+        """
+
+        cats: list[Category] = self.categories_get_by_name(category_name)
+        if not cats:
+            raise NameError(f"No category named {category_name}")
+        existing: Expense | None = self._find_duplicate(
+            cost, cats[0].obj_id, comment if comment else "-",
+            expense_date or datetime.now(), currency.upper()
+        )
+        return None if existing is None else existing.obj_id
+
+    @staticmethod
+    def _check_currency(currency: str) -> str:
+        """
+        Проверяет внутри db_session, что валюту можно пересчитать
+        в основную. Возвращает код валюты в верхнем регистре.
+        """
+
+        currency = currency.upper()
+        if currency != rates.BASE_CURRENCY and not db.exists(
+                '* FROM "Rate" WHERE "currency" = $currency'
+        ):
+            raise ValueError(f"No exchange rate for currency {currency}")
+        return currency
+
+    @staticmethod
+    def _find_duplicate(
+            cost: float,
+            cat_id: int,
+            comment: str,
+            expense_date: datetime,
+            currency: str = rates.BASE_CURRENCY
+    ) -> Expense | None:
+        fingerprint: str = duplicates.fingerprint(
+            cost, expense_date, cat_id, comment, currency
+        )
+        return Expense.select(
+            lambda exp: exp.fingerprint == fingerprint
+        ).order_by(Expense.obj_id).first()
+
+    @staticmethod
+    def _expense_add(
+            cost: float,
+            cat_id: int,
+            comment: str,
+            expense_date: datetime,
+            on_duplicate: str,
+            currency: str = rates.BASE_CURRENCY
+    ) -> tuple[int, str]:
+        """
+        Добавляет расход с учётом политики on_duplicate внутри db_session.
+        Возвращает id расхода и что с ним сделано:
+        "added", "skipped", "flagged" или "merged".
+        """
+
         comment = comment if comment else "-"
-        Expense(
-            amount=cost, category_id=cats[0].obj_id,
-            expense_date=datetime.now(), comment=comment
+        duplicate_of: int | None = None
+        if on_duplicate != duplicates.ALLOW:
+            existing: Expense | None = Presenter._find_duplicate(
+                cost, cat_id, comment, expense_date, currency
+            )
+            if existing is not None:
+                if on_duplicate == duplicates.SKIP:
+                    return existing.obj_id, "skipped"
+                if on_duplicate == duplicates.MERGE:
+                    existing.expense_date = expense_date
+                    existing.comment = comment
+                    return existing.obj_id, "merged"
+                duplicate_of = existing.obj_id
+
+        exp: Expense = Expense(
+            amount=cost, category_id=cat_id, expense_date=expense_date,
+            comment=comment, duplicate_of=duplicate_of, currency=currency
+        )
+        exp.flush()
+        return exp.obj_id, "added" if duplicate_of is None else "flagged"
+
+    def expenses_import(
+            self,
+            filename: str,
+            fmt: str = "csv",
+            compress: bool = False,
+            on_duplicate: str = duplicates.SKIP
+    ) -> dict[str, int]:
+        """
+        Загружает расходы из файла в формате выгрузки (см. bookkeeper.export).
+        Файл читается и проверяется целиком до записи, а записывается
+        короткими транзакциями по IMPORT_BATCH_SIZE расходов, чтобы
+        не задерживать другие процессы, работающие с базой.
+        Категории ищутся по имени, недостающие создаются.
+        Каждый расход проверяется по отпечатку согласно политике on_duplicate,
+        в том числе против расходов, загруженных из этого же файла.
+        Возвращает число добавленных, пропущенных, отмеченных
+        и объединённых расходов.
+        """
+
+        duplicates.check_policy(on_duplicate)
+        rows: list[tuple[datetime, float, str, str, str]] = list(
+            export.iter_import(filename, fmt, compress)
+        )
+        self._check_currencies({row[4] for row in rows})
+        counts: dict[str, int] = dict.fromkeys(
+            ("added", "skipped", "flagged", "merged"), 0
         )
+        for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+            outcomes: list[str] = self._import_batch(
+                rows[start:start + IMPORT_BATCH_SIZE], on_duplicate
+            )
+            for outcome in outcomes:
+                counts[outcome] += 1
+            if "merged" in outcomes:
+                # какие расходы объединены, не запоминается
+                self._entity_cache.clear()
+        return counts
+
+    @retry_locked
+    @orm.db_session
+    def _import_batch(
+            self, rows: list[tuple[datetime, float, str, str, str]], on_duplicate: str
+    ) -> list[str]:
+        cat_ids: dict[str, int] = {cat.name: cat.obj_id for cat in Category.select()}
+        outcomes: list[str] = []
+        for expense_date, cost, cat_name, comment, currency in rows:
+            if cat_name not in cat_ids:
+                cat_ids[cat_name] = self.category_add(cat_name)
+            outcomes.append(self._expense_add(
+                cost, cat_ids[cat_name], comment, expense_date, on_duplicate, currency
+            )[1])
+        return outcomes
+
+    @orm.db_session
+    def _check_currencies(self, currencies: set[str]) -> None:
+        for currency in currencies:
+            self._check_currency(currency)
 
     @orm.db_session
+    def expenses_find_duplicates(self) -> list[list[int]]:
+        """
+        Находит в оперативной базе группы расходов с одинаковым отпечатком.
+        Использует индекс отпечатков, а не попарное сравнение.
+        Возвращает списки id расходов, упорядоченные по первому id.
+        """
+
+        rows: list[tuple[int, str]] = db.select(
+            '"obj_id", "fingerprint" FROM "Expense" WHERE "fingerprint" IN ('
+            'SELECT "fingerprint" FROM "Expense" WHERE "fingerprint" != \'\' '
+            'GROUP BY "fingerprint" HAVING count(*) > 1) '
+            'ORDER BY "fingerprint", "obj_id"'
+        )
+        groups: list[list[int]] = [
+            [obj_id for obj_id, _ in group]
+            for _, group in itertools.groupby(rows, key=lambda row: row[1])
+        ]
+        return sorted(groups)
+
     def expense_get_by_id(self, exp_id: int) -> Expense:
         """
         Получает расход по id.
         Проверяет корректность id.
+        Вне db_session расход берётся из кэша записей,
+        внутри --- читается из базы, чтобы его можно было изменить.
         """
 
+        if orm.core.local.db_session is not None:
+            return self._expense_load(exp_id)
+        return self._entity_cache.get(
+            (Expense, exp_id), functools.partial(self._expense_load, exp_id)
+        )
+
+    @staticmethod
+    @orm.db_session
+    def _expense_load(exp_id: int) -> Expense:
         try:
             return Expense[exp_id]
         except orm.core.ObjectNotFound:
             raise ValueError("Expense id is incorrect")
 
+    def entity_cache_stats(self) -> cache.CacheStats:
+        """
+        Возвращает размер кэша записей, прочитанных по id,
+        и счётчики его попаданий, промахов и вытеснений
+        """
+
+        return self._entity_cache.stats()
+
+    def entity_cache_resize(self, size: int) -> None:
+        """
+        Задаёт наибольшее число записей в кэше; 0 отключает кэш
+        """
+
+        self._entity_cache.resize(size)
+
+    @retry_locked
     @orm.db_session
     def expense_edit_cost(self, exp_id: int, new_cost: float) -> None:
         """
@@ -243,7 +1099,9 @@ class Presenter:
         """
 
         self.expense_get_by_id(exp_id).amount = new_cost
+        self._entity_cache.defer((Expense, exp_id))
 
+    @retry_locked
     @orm.db_session
     def expense_edit_category_by_name(self, exp_id: int, new_category_name: str) -> None:
         """
@@ -255,7 +1113,20 @@ class Presenter:
         if not cats:
             raise NameError(f"No category named {new_category_name}")
         Expense[exp_id].category_id = cats[0].obj_id
+        self._entity_cache.defer((Expense, exp_id))
 
+    @retry_locked
+    @orm.db_session
+    def expense_edit_currency(self, exp_id: int, new_currency: str) -> None:
+        """
+        Позволяет редактировать валюту расхода.
+        Проверяет, что для новой валюты есть курс.
+        """
+
+        self.expense_get_by_id(exp_id).currency = self._check_currency(new_currency)
+        self._entity_cache.defer((Expense, exp_id))
+
+    @retry_locked
     @orm.db_session
     def expense_edit_date(self, exp_id: int, new_date: datetime) -> None:
         """
@@ -263,7 +1134,9 @@ class Presenter:
         """
 
         Expense[exp_id].expense_date = new_date
+        self._entity_cache.defer((Expense, exp_id))
 
+    @retry_locked
     @orm.db_session
     def expense_edit_comment(self, exp_id: int, new_comment: str) -> None:
         """
@@ -272,7 +1145,9 @@ class Presenter:
 
         new_comment = new_comment if new_comment else "-"
         Expense[exp_id].comment = new_comment
+        self._entity_cache.defer((Expense, exp_id))
 
+    @retry_locked
     @orm.db_session
     def expense_delete(self, exp_id: int) -> None:
         """
@@ -280,10 +1155,467 @@ class Presenter:
         """
 
         self.expense_get_by_id(exp_id).delete()
+        self._entity_cache.defer((Expense, exp_id))
 
-    @orm.db_session
     def expenses_get_list(self) -> list[Expense]:
         """
         Получает список всех расходов.
         """
-        return Expense.select()[:]
+
+        self.recurring_materialize_due()
+        with orm.db_session:
+            return Expense.select()[:]
+
+    def expenses_get_page(
+            self,
+            after_id: int = 0,
+            limit: int = 100,
+            start: datetime | None = None,
+            end: datetime | None = None
+    ) -> list[Expense]:
+        """
+        Получает не больше limit расходов с id больше after_id
+        (и датой в промежутке [start, end), если он задан), упорядоченных по id.
+        Чтобы получить следующую страницу, передайте id последнего расхода.
+        """
+
+        if after_id == 0:
+            self.recurring_materialize_due()
+        with orm.db_session:
+            query = Expense.select(lambda e: e.obj_id > after_id)
+            if start is not None:
+                query = query.filter(lambda e: e.expense_date >= start)
+            if end is not None:
+                query = query.filter(lambda e: e.expense_date < end)
+            return query.order_by(Expense.obj_id)[:limit]
+
+    def expenses_get_sorted_page(
+            self,
+            sort: str = "id",
+            descending: bool = False,
+            filters: listing.ExpenseFilter | None = None,
+            after_id: int = 0,
+            limit: int = 100
+    ) -> list[Expense]:
+        """
+        Получает не больше limit расходов, прошедших отбор filters,
+        в порядке sort ("id", "date", "amount", "category" или "comment"),
+        начиная после расхода after_id. Сортировка и отбор выполняются
+        запросом (см. bookkeeper.listing), поэтому читается только
+        сама страница. Чтобы получить следующую страницу,
+        передайте id последнего расхода.
+        """
+
+        if after_id == 0:
+            self.recurring_materialize_due()
+        sql, params = listing.page_query(sort, descending, filters, after_id, limit)
+        with orm.db_session:
+            return Expense.select_by_sql(sql, globals=params)
+
+    @staticmethod
+    def _check_tag_name(tag_name: str) -> str:
+        tag_name = tag_name.strip()
+        if not tag_name or '"' in tag_name:
+            raise ValueError(f"Wrong tag name: {tag_name!r}")
+        return tag_name
+
+    @retry_locked
+    @orm.db_session
+    def expenses_tag(self, exp_ids: Collection[int], tag_name: str) -> int:
+        """
+        Ставит метку tag_name расходам exp_ids, создавая метку, если её ещё нет.
+        Несуществующие расходы и расходы, уже имеющие метку, пропускаются.
+        Возвращает число расходов, получивших метку.
+        """
+
+        tag_name = self._check_tag_name(tag_name)
+        tag: Tag | None = Tag.get(name=tag_name)
+        if tag is None:
+            tag = Tag(name=tag_name)
+            tag.flush()
+        return db.execute(
+            'INSERT OR IGNORE INTO "ExpenseTag" ("tag_id", "expense_id") '
+            'SELECT $tag_id, e."obj_id" FROM json_each($ids) AS j '
+            'JOIN "Expense" AS e ON e."obj_id" = j."value"',
+            {"tag_id": tag.obj_id, "ids": json.dumps(list(exp_ids))}
+        ).rowcount
+
+    @retry_locked
+    @orm.db_session
+    def expenses_untag(self, exp_ids: Collection[int], tag_name: str) -> int:
+        """
+        Снимает метку tag_name с расходов exp_ids.
+        Возвращает число расходов, с которых метка снята.
+        """
+
+        tag: Tag | None = Tag.get(name=tag_name)
+        if tag is None:
+            raise NameError(f"No tag named {tag_name}")
+        return db.execute(
+            'DELETE FROM "ExpenseTag" WHERE "tag_id" = $tag_id '
+            'AND "expense_id" IN (SELECT "value" FROM json_each($ids))',
+            {"tag_id": tag.obj_id, "ids": json.dumps(list(exp_ids))}
+        ).rowcount
+
+    @retry_locked
+    @orm.db_session
+    def tag_delete(self, tag_name: str) -> None:
+        """
+        Удаляет метку и снимает её со всех расходов
+        """
+
+        tag: Tag | None = Tag.get(name=tag_name)
+        if tag is None:
+            raise NameError(f"No tag named {tag_name}")
+        tag.delete()
+
+    def tags_get_list(self) -> dict[str, int]:
+        """
+        Получает метки и число расходов с каждой из них
+        """
+
+        return dict(sorted(self._tags.counts().items()))
+
+    @orm.db_session
+    def expense_get_tags(self, exp_id: int) -> list[str]:
+        """
+        Получает имена меток расхода по алфавиту
+        """
+
+        return db.select(
+            't."name" FROM "ExpenseTag" AS et '
+            'JOIN "Tag" AS t ON t."obj_id" = et."tag_id" '
+            'WHERE et."expense_id" = $exp_id ORDER BY t."name"'
+        )
+
+    def expenses_find_by_tags(self, query: str) -> list[int]:
+        """
+        Находит id расходов, отобранных запросом по меткам,
+        например "отпуск AND NOT к_возмещению" (см. bookkeeper.tags)
+        """
+
+        return list(tags.bits(self._tags.evaluate(query)))
+
+    def expenses_get_sum_by_tags(
+            self,
+            query: str,
+            start: datetime | None = None,
+            end: datetime | None = None,
+            category_id: int = periods.ALL_CATEGORIES
+    ) -> float:
+        """
+        Вычисляет сумму в основной валюте расходов за промежуток [start, end),
+        отобранных запросом по меткам, по всем категориям или по категории
+        category_id. Метки есть только у расходов оперативной базы.
+        """
+
+        self.recurring_materialize_due()
+        totals: dict[int, float] = self._tags.sum_by_category(query, start, end)
+        if category_id != periods.ALL_CATEGORIES:
+            return totals.get(category_id, 0)
+        return sum(totals.values())
+
+    def budget_get_sum_by_tags(self, bdg: Budget, query: str) -> float:
+        """
+        Вычисляет сумму расходов, учитываемых бюджетом bdg,
+        за текущий период этого бюджета, отобранных запросом по меткам
+        """
+
+        start, end = periods.make_period(bdg.period, bdg.param).bounds(date.today())
+        return self.expenses_get_sum_by_tags(
+            query,
+            datetime.combine(start, datetime.min.time()),
+            datetime.combine(end + timedelta(days=1), datetime.min.time()),
+            bdg.category_id
+        )
+
+    @retry_locked
+    @orm.db_session
+    def recurring_add(
+            self,
+            cost: float,
+            category_name: str,
+            comment: str,
+            schedule: str,
+            start: datetime | None = None,
+            end: datetime | None = None
+    ) -> int:
+        """
+        Создаёт правило повторяющегося расхода с расписанием schedule
+        (см. bookkeeper.recurring), действующее с start (по умолчанию
+        с текущего момента) до end. Расходы за прошедшие моменты расписания
+        вносятся сразу, будущие --- по мере наступления.
+        Возвращает id правила.
+        """
+
+        cats: list[Category] = self.categories_get_by_name(category_name)
+        if not cats:
+            raise NameError(f"No category named {category_name}")
+        first: datetime | None = recurring.parse_schedule(schedule).next_from(
+            start or datetime.now()
+        )
+        if first is not None and end is not None and first > end:
+            first = None
+
+        rule: RecurringExpense = RecurringExpense(
+            amount=cost, category_id=cats[0].obj_id, comment=comment if comment else "-",
+            schedule=schedule, next_date=first, end_date=end
+        )
+        rule.flush()
+        if first is not None and (
+                self._recurring_due is None or first < self._recurring_due
+        ):
+            self._recurring_due = first
+        return rule.obj_id
+
+    @orm.db_session
+    def recurring_get_list(self) -> list[RecurringExpense]:
+        """
+        Получает список всех правил повторяющихся расходов
+        """
+
+        return RecurringExpense.select()[:]
+
+    @retry_locked
+    @orm.db_session
+    def recurring_delete(self, rule_id: int) -> None:
+        """
+        Удаляет правило повторяющегося расхода.
+        Уже внесённые по нему расходы остаются.
+        """
+
+        try:
+            RecurringExpense[rule_id].delete()
+        except orm.core.ObjectNotFound:
+            raise ValueError("Recurring expense id is incorrect")
+
+    @orm.db_session
+    def _recurring_next_due(self) -> datetime | None:
+        return orm.min(rule.next_date for rule in RecurringExpense)
+
+    @retry_locked
+    @orm.db_session
+    def recurring_materialize(self, until: datetime | None = None) -> int:
+        """
+        Вносит в расходы все моменты правил повторяющихся расходов
+        до until (по умолчанию до текущего момента) одной транзакцией.
+        Возвращает число внесённых расходов.
+        """
+
+        until = until or datetime.now()
+        count: int = 0
+        for rule in RecurringExpense.select(lambda r: r.next_date <= until):
+            schedule: recurring.Schedule = recurring.parse_schedule(rule.schedule)
+            last: datetime | None = None
+            for moment in recurring.occurrences(
+                    schedule, rule.next_date, until, rule.end_date
+            ):
+                Expense(
+                    amount=rule.amount, category_id=rule.category_id,
+                    expense_date=moment, comment=rule.comment
+                )
+                last = moment
+                count += 1
+            next_date: datetime | None = schedule.next_from(
+                (last or until) + recurring.MINUTE
+            )
+            if (
+                    next_date is not None and rule.end_date is not None
+                    and next_date > rule.end_date
+            ):
+                next_date = None
+            # Pony проверяет, что next_date не изменился с момента чтения,
+            # поэтому два процесса не внесут одни и те же расходы дважды
+            rule.next_date = next_date
+        orm.flush()
+        self._recurring_due = self._recurring_next_due()
+        return count
+
+    def recurring_is_due(self) -> bool:
+        """
+        Есть ли наступившие, но ещё не внесённые повторяющиеся расходы
+        """
+
+        return self._recurring_due is not None and self._recurring_due <= datetime.now()
+
+    def recurring_materialize_due(self) -> None:
+        """
+        Вносит наступившие повторяющиеся расходы, если такие есть
+        """
+
+        if not self.recurring_is_due():
+            return
+        try:
+            self.recurring_materialize()
+        except orm.core.OptimisticCheckError:
+            # расходы уже внёс другой процесс
+            self._recurring_due = self._recurring_next_due()
+
+    def expenses_archive(self, cutoff: datetime) -> int:
+        """
+        Переносит расходы, сделанные раньше cutoff, в архивные базы по годам.
+        Повседневные запросы после этого работают только с оперативной базой.
+        Не позволяет архивировать расходы, попадающие в текущий период
+        какого-либо бюджета: начало самого раннего из этих периодов
+        определяется по настроенным бюджетам, включая длинные (PERIOD_DAYS).
+        Возвращает число перенесённых расходов.
+        """
+
+        today: date = date.today()
+        hot_start: date = min(
+            periods.make_period(bdg.period, bdg.param).bounds(today)[0]
+            for bdg in self.budgets_get_list()
+        )
+        if cutoff > datetime.combine(hot_start, datetime.min.time()):
+            raise ValueError("Cutoff date is inside the budget period")
+        with self._direct() as filename:
+            return archive.archive_expenses(filename, cutoff)
+
+    def expenses_get_history(
+            self, start: datetime | None = None, end: datetime | None = None
+    ) -> list[archive.ArchivedExpense]:
+        """
+        Получает расходы за промежуток [start, end) из оперативной базы
+        и из всех архивов, пересекающихся с этим промежутком.
+        Расходы упорядочены по дате.
+        """
+
+        return list(archive.iter_expenses(self._on_disk(), start, end))
+
+    def expenses_get_sum_history(
+            self, start: datetime | None = None, end: datetime | None = None
+    ) -> float:
+        """
+        Вычисляет сумму расходов за промежуток [start, end)
+        с учётом архивных баз.
+        """
+
+        return archive.sum_expenses(self._on_disk(), start, end)
+
+    def expenses_export(
+            self,
+            filename: str,
+            fmt: str = "csv",
+            start: datetime | None = None,
+            end: datetime | None = None,
+            category_ids: Collection[int] | None = None,
+            compress: bool = False
+    ) -> int:
+        """
+        Выгружает расходы за промежуток [start, end) с учётом архивов
+        в файл filename в формате "csv" или "jsonl", при необходимости сжимая gzip.
+        Если задан category_ids, выгружаются только расходы этих категорий.
+        Возвращает число выгруженных расходов.
+        """
+
+        return export.export_file(
+            self._on_disk(), filename, fmt, start, end, category_ids, compress
+        )
+
+    def expenses_export_chunks(
+            self,
+            fmt: str = "csv",
+            start: datetime | None = None,
+            end: datetime | None = None,
+            category_ids: Collection[int] | None = None,
+            compress: bool = False
+    ) -> Iterator[bytes]:
+        """
+        То же, что expenses_export, но выдаёт выгрузку кусками байтов
+        (например, для отправки по сети)
+        """
+
+        return export.iter_export(
+            self._on_disk(), fmt, start, end, category_ids, compress
+        )
+
+    @retry_locked
+    def rates_import(self, filename: str) -> int:
+        """
+        Загружает курсы валют из файла CSV со столбцами date, currency, rate
+        (см. bookkeeper.rates). Курс --- стоимость единицы валюты в основной
+        валюте начиная с этого дня. Дневные суммы расходов в этих валютах
+        пересчитываются той же транзакцией.
+        Возвращает число загруженных курсов.
+        """
+
+        loaded: list[tuple[str, date, float]] = list(rates.read_rates(filename))
+        with self._direct() as db_filename:
+            con: sqlite3.Connection = sqlite3.connect(db_filename, timeout=BUSY_TIMEOUT)
+            try:
+                return rates.import_rates(con, loaded)
+            finally:
+                con.close()
+
+    def snapshot_save(self, snapshot_filename: str) -> dict[str, int]:
+        """
+        Сохраняет согласованный двоичный снимок базы в файл.
+        Возвращает словарь "таблица - число строк".
+        Восстановить базу из снимка можно функцией snapshot.restore.
+        """
+
+        return snapshot.save(self._on_disk(), snapshot_filename)
+
+    def migrate(
+            self,
+            batch_size: int = migrations.BATCH_SIZE,
+            progress: Callable[[migrations.Progress], None] | None = None,
+            max_batches: int | None = None
+    ) -> bool:
+        """
+        Заполняет данные незавершённых миграций порциями по batch_size строк,
+        не блокируя базу надолго (см. migrations.run_backfills).
+        Возвращает True, если заполнение закончено.
+        """
+
+        with self._direct() as db_filename:
+            con: sqlite3.Connection = sqlite3.connect(db_filename)
+            try:
+                return migrations.run_backfills(con, batch_size, progress, max_batches)
+            finally:
+                con.close()
+
+    def sync(self, other_filename: str) -> dict[str, int]:
+        """
+        Синхронизирует базу с другой её копией в файле other_filename:
+        каждая база получает изменения расходов, категорий и бюджетов,
+        сделанные в другой после прошлой синхронизации.
+        Возвращает число полученных и отправленных изменений,
+        конфликтов, сохранённых категорий и совпавших новых расходов.
+        """
+
+        other_filename = prepare_database(other_filename)
+        if other_filename == self.db_filename:
+            raise ValueError("Cannot sync the database with itself")
+        # расходы, до которых не дошло заполнение, ещё не отслеживаются
+        self.migrate()
+        with self._direct() as db_filename:
+            result: dict[str, int] = sync.sync(db_filename, other_filename)
+        self._budgets = None
+        return result
+
+    @orm.db_session
+    def report_by_category(
+            self,
+            start: datetime | None = None,
+            end: datetime | None = None,
+            tag_query: str | None = None
+    ) -> dict[str, float]:
+        """
+        Вычисляет суммы расходов по категориям за промежуток [start, end)
+        с учётом архивных баз.
+        Если задан запрос по меткам tag_query, учитываются только отобранные им
+        расходы оперативной базы (у архивных расходов меток нет).
+        Расходы с удалённой категорией учитываются как "Неизвестная категория".
+        """
+
+        names: dict[int, str] = {cat.obj_id: cat.name for cat in Category.select()}
+        totals: dict[int, float] = (
+            archive.sum_by_category(self._on_disk(), start, end) if tag_query is None
+            else self._tags.sum_by_category(tag_query, start, end)
+        )
+        report: dict[str, float] = {}
+        for cat_id, total in totals.items():
+            name: str = names.get(cat_id, UNKNOWN_CATEGORY)
+            report[name] = report.get(name, 0) + total
+        return report
@@ -0,0 +1,185 @@
+"""
+Валюты расходов и курсы обмена.
+
+Сумма расхода хранится в той валюте, в которой он сделан (Expense.currency),
+а бюджеты и отчёты считаются в основной валюте BASE_CURRENCY.
+Курсы хранятся в таблице Rate: сколько единиц основной валюты стоит
+единица валюты начиная с дня day. Для расхода берётся последний курс
+не позже дня расхода, а если таких нет --- самый ранний известный.
+Таблица курсов ведётся локально и пополняется загрузкой файла
+(см. read_rates), между копиями базы она не синхронизируется.
+
+Пересчёт выполняется в SQL: выражение converted подставляет курс
+коррелированным подзапросом по первичному ключу Rate, поэтому сумма
+за любой промежуток --- один запрос без перебора расходов в Python.
+Дневные суммы (см. bookkeeper.periods) триггеры пишут уже в основной
+валюте; после загрузки курсов затронутые дневные суммы пересчитываются.
+"""
+
+import csv
+import sqlite3
+from datetime import date
+from typing import Collection, Iterator
+
+from bookkeeper import backfill, periods
+
+BASE_CURRENCY: str = "RUB"
+
+RATE_SCHEMA: str = """
+    CREATE TABLE IF NOT EXISTS "Rate" (
+        "currency" TEXT NOT NULL,
+        "day" TEXT NOT NULL,
+        "rate" REAL NOT NULL,
+        PRIMARY KEY ("currency", "day")
+    ) WITHOUT ROWID
+"""
+
+# Триггеры дневных сумм, пересчитывающие расход в основную валюту.
+# Заменяют триггеры из bookkeeper.periods и так же пропускают расходы,
+# ещё не обработанные заполнением дневных сумм.
+DAILY_TOTALS_TRIGGERS: str = """
+    DROP TRIGGER IF EXISTS "trg_expense_insert_daily_total";
+    DROP TRIGGER IF EXISTS "trg_expense_delete_daily_total";
+    DROP TRIGGER IF EXISTS "trg_expense_update_daily_total";
+
+    CREATE TRIGGER "trg_expense_insert_daily_total"
+    AFTER INSERT ON "Expense" WHEN {processed_new} BEGIN
+        INSERT INTO "DailyTotal" ("day", "category_id", "amount")
+        VALUES (date(NEW."expense_date"), NEW."category_id", {new})
+        ON CONFLICT ("day", "category_id")
+        DO UPDATE SET "amount" = "amount" + excluded."amount";
+    END;
+
+    CREATE TRIGGER "trg_expense_delete_daily_total"
+    AFTER DELETE ON "Expense" WHEN {processed_old} BEGIN
+        UPDATE "DailyTotal" SET "amount" = "amount" - {old}
+        WHERE "day" = date(OLD."expense_date") AND "category_id" = OLD."category_id";
+    END;
+
+    CREATE TRIGGER "trg_expense_update_daily_total"
+    AFTER UPDATE OF "amount", "category_id", "expense_date", "currency" ON "Expense"
+    WHEN {processed_new} BEGIN
+        UPDATE "DailyTotal" SET "amount" = "amount" - {old}
+        WHERE "day" = date(OLD."expense_date") AND "category_id" = OLD."category_id";
+        INSERT INTO "DailyTotal" ("day", "category_id", "amount")
+        VALUES (date(NEW."expense_date"), NEW."category_id", {new})
+        ON CONFLICT ("day", "category_id")
+        DO UPDATE SET "amount" = "amount" + excluded."amount";
+    END;
+"""
+
+
+def converted(expense: str, rates: str = 'main."Rate"') -> str:
+    """
+    SQL-выражение суммы расхода в основной валюте.
+    expense --- имя или псевдоним таблицы расходов (или NEW/OLD в триггере),
+    rates --- таблица курсов. Если курса валюты нет совсем,
+    выражение равно NULL и сумма не учитывается.
+    """
+
+    return (
+        f'CASE WHEN {expense}."currency" = \'{BASE_CURRENCY}\' THEN {expense}."amount" '
+        f'ELSE {expense}."amount" * coalesce('
+        f'(SELECT "rate" FROM {rates} WHERE "currency" = {expense}."currency" '
+        f'AND "day" <= date({expense}."expense_date") ORDER BY "day" DESC LIMIT 1), '
+        f'(SELECT "rate" FROM {rates} WHERE "currency" = {expense}."currency" '
+        f'ORDER BY "day" LIMIT 1)) END'
+    )
+
+
+def install_currencies(con: sqlite3.Connection) -> None:
+    """
+    Добавляет расходам столбец валюты, создаёт таблицу курсов
+    и заменяет триггеры дневных сумм пересчитывающими.
+    Существующие расходы считаются сделанными в основной валюте.
+    """
+
+    columns: set[str] = {row[1] for row in con.execute('PRAGMA table_info("Expense")')}
+    with con:
+        if "currency" not in columns:
+            con.execute(
+                'ALTER TABLE "Expense" ADD COLUMN "currency" TEXT NOT NULL '
+                f"DEFAULT '{BASE_CURRENCY}'"
+            )
+        con.execute(RATE_SCHEMA)
+        con.execute(backfill.CURSOR_SCHEMA)
+        # в триггерах нельзя ссылаться на таблицы с указанием базы;
+        # расход в валюте без курса (например, полученный синхронизацией)
+        # учитывается нулём, пока курс не загрузят
+        rates: str = '"Rate"'
+        con.executescript("BEGIN;" + DAILY_TOTALS_TRIGGERS.format(
+            new=f"coalesce({converted('NEW', rates)}, 0)",
+            old=f"coalesce({converted('OLD', rates)}, 0)",
+            processed_new=backfill.processed(periods.DAILY_TOTALS_BACKFILL, "NEW"),
+            processed_old=backfill.processed(periods.DAILY_TOTALS_BACKFILL, "OLD")
+        ))
+
+
+def read_rates(filename: str) -> Iterator[tuple[str, date, float]]:
+    """
+    Построчно читает файл курсов в формате CSV
+    со столбцами date, currency, rate.
+    Перебирает курсы в виде (валюта, день, курс).
+    """
+
+    with open(filename, encoding="utf-8", newline="") as source:
+        for record in csv.DictReader(source):
+            try:
+                rate: tuple[str, date, float] = (
+                    record["currency"].strip().upper(),
+                    date.fromisoformat(record["date"].strip()[:10]),
+                    float(record["rate"])
+                )
+            except (AttributeError, KeyError, TypeError, ValueError):
+                raise ValueError(f"Wrong rate record: {record}")
+            if not rate[0] or rate[2] <= 0:
+                raise ValueError(f"Wrong rate record: {record}")
+            yield rate
+
+
+def import_rates(con: sqlite3.Connection, rates: list[tuple[str, date, float]]) -> int:
+    """
+    Записывает курсы (заменяя курсы тех же валют за те же дни)
+    и пересчитывает дневные суммы, в которые входят расходы
+    в этих валютах. Всё выполняется одной транзакцией.
+    Возвращает число записанных курсов.
+    """
+
+    if any(currency == BASE_CURRENCY for currency, _, _ in rates):
+        raise ValueError(f"Rate of the base currency {BASE_CURRENCY} is always 1")
+    with con:
+        con.executemany(
+            'INSERT OR REPLACE INTO "Rate" ("currency", "day", "rate") VALUES (?, ?, ?)',
+            [(currency, day.isoformat(), rate) for currency, day, rate in rates]
+        )
+        refresh_daily_totals(con, {currency for currency, _, _ in rates})
+    return len(rates)
+
+
+def refresh_daily_totals(con: sqlite3.Connection, currencies: Collection[str]) -> None:
+    """
+    Пересчитывает дневные суммы за дни и категории,
+    в которых есть расходы в валютах currencies.
+    Расходы, ещё не обработанные заполнением дневных сумм, не учитываются.
+    """
+
+    if not currencies:
+        return
+    marks: str = ", ".join("?" * len(currencies))
+    affected: str = (
+        'SELECT date("expense_date"), "category_id" FROM "Expense" '
+        f'WHERE "currency" IN ({marks})'
+    )
+    con.execute(
+        f'DELETE FROM "DailyTotal" WHERE ("day", "category_id") IN ({affected})',
+        list(currencies)
+    )
+    con.execute(
+        'INSERT INTO "DailyTotal" ("day", "category_id", "amount") '
+        f'SELECT date(e."expense_date"), e."category_id", total({converted("e")}) '
+        'FROM "Expense" AS e '
+        f'WHERE (date(e."expense_date"), e."category_id") IN ({affected}) '
+        f'AND {backfill.processed(periods.DAILY_TOTALS_BACKFILL, "e")} '
+        "GROUP BY 1, 2",
+        list(currencies)
+    )
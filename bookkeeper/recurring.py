@@ -0,0 +1,171 @@
+"""
+Расписания повторяющихся расходов.
+
+Расписание записывается строкой одного из видов:
+    monthly:D        ежемесячно D-го числа в полночь; если в месяце нет
+                     такого числа, берётся последний день месяца
+    M H DOM MON DOW  как в cron: минута, час, число, месяц, день недели
+                     (0 или 7 --- воскресенье); в полях допустимы *,
+                     списки через запятую, диапазоны a-b и шаги /n
+    @daily, @weekly, @monthly, @yearly --- сокращения cron
+Расписание определяет моменты расходов с точностью до минуты.
+"""
+
+import calendar
+from abc import ABC, abstractmethod
+from datetime import date, datetime, time, timedelta
+from typing import Iterator
+
+# Сколько дней вперёд искать следующий момент расписания cron.
+# Самое редкое осмысленное расписание (29 февраля в заданный день недели)
+# повторяется раз в 28 лет.
+MAX_SEARCH_DAYS: int = 366 * 29
+
+CRON_ALIASES: dict[str, str] = {
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+}
+
+# Допустимые значения полей cron
+CRON_FIELDS: tuple[tuple[int, int], ...] = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+MINUTE: timedelta = timedelta(minutes=1)
+
+
+class Schedule(ABC):
+    """
+    Расписание повторяющегося расхода
+    """
+
+    @abstractmethod
+    def next_from(self, moment: datetime) -> datetime | None:
+        """
+        Ближайший момент расписания не раньше moment
+        или None, если таких моментов нет
+        """
+
+
+class MonthlySchedule(Schedule):
+    """
+    Ежемесячно в полночь day-го числа
+    (или последнего дня месяца, если он раньше)
+    """
+
+    def __init__(self, day: int):
+        if not 1 <= day <= 31:
+            raise ValueError("Day of month must be between 1 and 31")
+        self.day: int = day
+
+    def _in_month(self, year: int, month: int) -> datetime:
+        day: int = min(self.day, calendar.monthrange(year, month)[1])
+        return datetime(year, month, day)
+
+    def next_from(self, moment: datetime) -> datetime | None:
+        candidate: datetime = self._in_month(moment.year, moment.month)
+        if candidate >= moment:
+            return candidate
+        year, month = (moment.year + 1, 1) if moment.month == 12 else (
+            moment.year, moment.month + 1
+        )
+        return self._in_month(year, month)
+
+
+def _parse_cron_field(text: str, low: int, high: int) -> set[int]:
+    values: set[int] = set()
+    for part in text.split(","):
+        body, _, step_text = part.partition("/")
+        step: int = int(step_text) if step_text else 1
+        if body == "*":
+            first, last = low, high
+        elif "-" in body:
+            first, last = (int(value) for value in body.split("-", 1))
+        else:
+            first = int(body)
+            last = high if step_text else first
+        if step < 1 or not low <= first <= last <= high:
+            raise ValueError(f"Wrong schedule field: {text}")
+        values.update(range(first, last + 1, step))
+    return values
+
+
+class CronSchedule(Schedule):
+    """
+    Расписание в формате cron
+    """
+
+    def __init__(self, expression: str):
+        fields: list[str] = CRON_ALIASES.get(expression, expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Wrong schedule: {expression}")
+        try:
+            minutes, hours, days, months, weekdays = (
+                _parse_cron_field(field, low, high)
+                for field, (low, high) in zip(fields, CRON_FIELDS)
+            )
+        except ValueError:
+            raise ValueError(f"Wrong schedule: {expression}")
+        self.minutes: list[int] = sorted(minutes)
+        self.hours: list[int] = sorted(hours)
+        self.days: set[int] = days
+        self.months: set[int] = months
+        # в cron воскресенье --- и 0, и 7; в Python понедельник --- 0
+        self.weekdays: set[int] = {(day - 1) % 7 for day in weekdays}
+        # как в cron: если ограничены и число, и день недели,
+        # достаточно совпадения любого из них
+        self.days_or_weekdays: bool = fields[2] != "*" and fields[4] != "*"
+
+    def _day_matches(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        by_day: bool = day.day in self.days
+        by_weekday: bool = day.weekday() in self.weekdays
+        if self.days_or_weekdays:
+            return by_day or by_weekday
+        return by_day and by_weekday
+
+    def next_from(self, moment: datetime) -> datetime | None:
+        day: date = moment.date()
+        for _ in range(MAX_SEARCH_DAYS):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate: datetime = datetime.combine(day, time(hour, minute))
+                        if candidate >= moment:
+                            return candidate
+            day += timedelta(days=1)
+        return None
+
+
+def parse_schedule(text: str) -> Schedule:
+    """
+    Создаёт расписание по строке (см. описание модуля)
+    """
+
+    text = text.strip()
+    if text.startswith("monthly:"):
+        try:
+            return MonthlySchedule(int(text[len("monthly:"):]))
+        except ValueError:
+            raise ValueError(f"Wrong schedule: {text}")
+    return CronSchedule(text)
+
+
+def occurrences(
+        schedule: Schedule,
+        start: datetime,
+        until: datetime,
+        end: datetime | None = None
+) -> Iterator[datetime]:
+    """
+    Перебирает моменты расписания с start по until включительно,
+    но не позже end, если он задан
+    """
+
+    if end is not None:
+        until = min(until, end)
+    moment: datetime | None = schedule.next_from(start)
+    while moment is not None and moment <= until:
+        yield moment
+        moment = schedule.next_from(moment + MINUTE)
@@ -0,0 +1,664 @@
+"""
+Локальный HTTP-сервер с JSON API поверх Presenter.
+
+Позволяет нескольким клиентам (браузерной панели, скриптам, окну Qt)
+работать с одной базой. Запросы на чтение выполняются пулом потоков,
+у каждого из которых своё соединение с SQLite, а все изменения идут через
+единственный поток-писатель. База переводится в режим WAL,
+чтобы чтение не блокировалось записью.
+
+Запуск:
+    python -m bookkeeper.server --port 8080 --readers 4
+
+Точки доступа:
+    GET    /expenses?from=&to=     список расходов (потоковый ответ)
+    GET    /expenses/export?format=csv|jsonl&from=&to=&category=&gzip=1
+                                   выгрузка расходов с архивами (потоковый ответ)
+    POST   /expenses               {"amount", "category", "comment", "date", "currency",
+                                    "duplicates": allow|skip|flag|merge}
+    GET    /expenses/duplicates    группы повторных расходов
+    GET    /expenses/<id>
+    PATCH  /expenses/<id>          {"amount", "category", "date", "comment", "currency"}
+    DELETE /expenses/<id>
+    GET    /recurring
+    POST   /recurring              {"amount", "category", "schedule", "comment",
+                                    "from", "until"}
+    DELETE /recurring/<id>
+    GET    /categories
+    POST   /categories             {"name", "parent"}
+    PATCH  /categories/<id>        {"name"}
+    DELETE /categories/<id>?reassign=<имя>|cascade=1
+    GET    /budget?forecast=1&tags=
+                                   с forecast --- и вероятность превышения лимита,
+                                   с tags --- и сумма расходов, отобранных
+                                   запросом по меткам
+    PUT    /budget/<day|week|month> {"limit"}
+    GET    /report?from=&to=&tags=
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import re
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Iterator, NamedTuple
+from urllib.parse import parse_qsl, urlsplit
+
+from bookkeeper import cli
+from bookkeeper.presenter import Presenter
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Число расходов в одном фрагменте потокового ответа
+STREAM_PAGE_SIZE: int = 500
+
+# Число кусков выгрузки, ожидающих отправки клиенту
+EXPORT_QUEUE_SIZE: int = 4
+
+MAX_BODY_SIZE: int = 1 << 20
+
+CONTENT_TYPES: dict[str, str] = {
+    "json": "application/json; charset=utf-8",
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/jsonl; charset=utf-8",
+}
+
+REASONS: dict[int, str] = {
+    200: "OK", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+
+class HttpError(Exception):
+    """
+    Ошибка обработки запроса, возвращаемая клиенту с заданным статусом
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status: int = status
+
+
+class Request(NamedTuple):
+    """
+    Разобранный HTTP-запрос
+    """
+
+    method: str
+    path: str
+    query: dict[str, str]
+    headers: dict[str, str]
+    body: bytes
+
+    def json(self) -> dict[str, Any]:
+        """
+        Тело запроса, разобранное как JSON-объект
+        """
+
+        if not self.body:
+            return {}
+        try:
+            data: Any = json.loads(self.body)
+        except ValueError:
+            raise HttpError(400, "Request body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "Request body must be a JSON object")
+        return data
+
+
+def _date_or_none(value: str | None) -> datetime | None:
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f"Invalid date: {value}")
+
+
+def _number_or_none(value: Any) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f"Invalid number: {value}")
+
+
+def _args(**kwargs: Any) -> argparse.Namespace:
+    return argparse.Namespace(**kwargs)
+
+
+class Route(NamedTuple):
+    """
+    Точка доступа API.
+    handler получает запрос и параметры из пути и возвращает
+    пару (функция из cli, её аргументы), write показывает,
+    что запрос изменяет данные.
+    """
+
+    method: str
+    pattern: re.Pattern
+    handler: Callable[..., tuple[Callable, argparse.Namespace]]
+    write: bool
+
+
+def _expense_add(request: Request) -> tuple[Callable, argparse.Namespace]:
+    data: dict[str, Any] = request.json()
+    if "amount" not in data or "category" not in data:
+        raise HttpError(400, "Fields 'amount' and 'category' are required")
+    return cli.expense_add, _args(
+        amount=_number_or_none(data["amount"]),
+        category=str(data["category"]),
+        comment=str(data.get("comment", "")),
+        date=_date_or_none(data.get("date")),
+        duplicates=str(data.get("duplicates", "allow")),
+        currency=str(data.get("currency", cli.BASE_CURRENCY)),
+    )
+
+
+def _expense_duplicates(request: Request) -> tuple[Callable, argparse.Namespace]:
+    return cli.expense_duplicates, _args()
+
+
+def _expense_get(request: Request, exp_id: str) -> tuple[Callable, argparse.Namespace]:
+    return cli.expense_edit, _args(
+        id=int(exp_id), amount=None, category=None, date=None, comment=None, currency=None
+    )
+
+
+def _expense_edit(request: Request, exp_id: str) -> tuple[Callable, argparse.Namespace]:
+    data: dict[str, Any] = request.json()
+    return cli.expense_edit, _args(
+        id=int(exp_id),
+        amount=_number_or_none(data.get("amount")),
+        category=data.get("category"),
+        date=_date_or_none(data.get("date")),
+        comment=data.get("comment"),
+        currency=data.get("currency"),
+    )
+
+
+def _expense_delete(request: Request, exp_id: str) -> tuple[Callable, argparse.Namespace]:
+    return cli.expense_delete, _args(ids=[int(exp_id)])
+
+
+def _recurring_list(request: Request) -> tuple[Callable, argparse.Namespace]:
+    return cli.recurring_list, _args()
+
+
+def _recurring_add(request: Request) -> tuple[Callable, argparse.Namespace]:
+    data: dict[str, Any] = request.json()
+    if "amount" not in data or "category" not in data or "schedule" not in data:
+        raise HttpError(400, "Fields 'amount', 'category' and 'schedule' are required")
+    return cli.recurring_add, _args(
+        amount=_number_or_none(data["amount"]),
+        category=str(data["category"]),
+        comment=str(data.get("comment", "")),
+        schedule=str(data["schedule"]),
+        start=_date_or_none(data.get("from")),
+        end=_date_or_none(data.get("until")),
+    )
+
+
+def _recurring_delete(
+        request: Request, rule_id: str
+) -> tuple[Callable, argparse.Namespace]:
+    return cli.recurring_delete, _args(ids=[int(rule_id)])
+
+
+def _category_list(request: Request) -> tuple[Callable, argparse.Namespace]:
+    return cli.category_list, _args()
+
+
+def _category_add(request: Request) -> tuple[Callable, argparse.Namespace]:
+    data: dict[str, Any] = request.json()
+    name: Any = data.get("name")
+    if not name:
+        raise HttpError(400, "Field 'name' is required")
+    parent: Any = data.get("parent")
+    return cli.category_add, _args(
+        name=str(name), parent=None if parent is None else str(parent)
+    )
+
+
+def _category_rename(
+        request: Request, cat_id: str
+) -> tuple[Callable, argparse.Namespace]:
+    name: Any = request.json().get("name")
+    if not name:
+        raise HttpError(400, "Field 'name' is required")
+    return cli.category_rename, _args(id=int(cat_id), name=str(name))
+
+
+def _category_delete(
+        request: Request, cat_id: str
+) -> tuple[Callable, argparse.Namespace]:
+    return cli.category_delete, _args(
+        ids=[int(cat_id)],
+        reassign=request.query.get("reassign"),
+        cascade=request.query.get("cascade", "") in ("1", "true"),
+    )
+
+
+def _budget_status(request: Request) -> tuple[Callable, argparse.Namespace]:
+    return cli.budget_status, _args(
+        forecast=request.query.get("forecast", "") in ("1", "true"),
+        tags=request.query.get("tags"),
+    )
+
+
+def _budget_set(request: Request, period: str) -> tuple[Callable, argparse.Namespace]:
+    limit: float | None = _number_or_none(request.json().get("limit"))
+    if limit is None:
+        raise HttpError(400, "Field 'limit' is required")
+    return cli.budget_set, _args(period=period, limit=limit)
+
+
+def _report(request: Request) -> tuple[Callable, argparse.Namespace]:
+    return cli.report, _args(
+        start=_date_or_none(request.query.get("from")),
+        end=_date_or_none(request.query.get("to")),
+        tags=request.query.get("tags"),
+    )
+
+
+ROUTES: list[Route] = [
+    Route("POST", re.compile(r"/expenses"), _expense_add, True),
+    Route("GET", re.compile(r"/expenses/duplicates"), _expense_duplicates, False),
+    Route("GET", re.compile(r"/expenses/(\d+)"), _expense_get, False),
+    Route("PATCH", re.compile(r"/expenses/(\d+)"), _expense_edit, True),
+    Route("DELETE", re.compile(r"/expenses/(\d+)"), _expense_delete, True),
+    Route("GET", re.compile(r"/recurring"), _recurring_list, False),
+    Route("POST", re.compile(r"/recurring"), _recurring_add, True),
+    Route("DELETE", re.compile(r"/recurring/(\d+)"), _recurring_delete, True),
+    Route("GET", re.compile(r"/categories"), _category_list, False),
+    Route("POST", re.compile(r"/categories"), _category_add, True),
+    Route("PATCH", re.compile(r"/categories/(\d+)"), _category_rename, True),
+    Route("DELETE", re.compile(r"/categories/(\d+)"), _category_delete, True),
+    Route("GET", re.compile(r"/budget"), _budget_status, False),
+    Route("PUT", re.compile(r"/budget/(day|week|month)"), _budget_set, True),
+    Route("GET", re.compile(r"/report"), _report, False),
+]
+
+
+def _find_route(request: Request) -> tuple[Route, tuple[str, ...]]:
+    """
+    Точка доступа для запроса и параметры из его пути
+    """
+
+    allowed: bool = False
+    for route in ROUTES:
+        match: re.Match | None = route.pattern.fullmatch(request.path)
+        if match is None:
+            continue
+        allowed = True
+        if route.method == request.method:
+            return route, match.groups()
+    if allowed:
+        raise HttpError(405, f"Method {request.method} is not allowed")
+    raise HttpError(404, f"No such endpoint: {request.path}")
+
+
+def enable_wal(db_filename: str) -> None:
+    """
+    Переводит базу в режим WAL, при котором чтение
+    не блокируется одновременной записью.
+    Режим сохраняется в файле базы.
+    """
+
+    con: sqlite3.Connection = sqlite3.connect(db_filename)
+    try:
+        con.execute("PRAGMA journal_mode=WAL")
+    finally:
+        con.close()
+
+
+class ApiServer:
+    """
+    HTTP-сервер JSON API.
+    Presenter вызывается из пула потоков: readers потоков для чтения
+    и один поток для записи. Pony держит отдельное соединение
+    с базой в каждом потоке, так что число соединений ограничено
+    размером пулов. Наступившие повторяющиеся расходы перед чтением
+    вносит поток записи.
+    """
+
+    def __init__(self, presenter: Presenter, readers: int = 4):
+        self.presenter: Presenter = presenter
+        self.readers: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=readers, thread_name_prefix="bookkeeper-reader"
+        )
+        self.writer: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="bookkeeper-writer"
+        )
+        self.server: asyncio.AbstractServer | None = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        """
+        Начинает принимать соединения
+        """
+
+        enable_wal(self.presenter.db_filename)
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+
+    @property
+    def port(self) -> int:
+        """
+        Порт, на котором сервер принимает соединения
+        """
+
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        """
+        Обслуживает запросы до остановки
+        """
+
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self) -> None:
+        """
+        Останавливает сервер и пулы потоков
+        """
+
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.readers.shutdown()
+        self.writer.shutdown()
+
+    def _run(self, write: bool, func: Callable, *args: Any) -> Awaitable[Any]:
+        pool: ThreadPoolExecutor = self.writer if write else self.readers
+        return asyncio.get_running_loop().run_in_executor(pool, func, *args)
+
+    async def _materialize_due(self) -> None:
+        """
+        Вносит наступившие повторяющиеся расходы в потоке записи.
+        Presenter вносит их и при чтении, поэтому перед запросом на чтение
+        это делается заранее, чтобы потоки чтения не изменяли базу.
+        """
+
+        if self.presenter.recurring_is_due():
+            await self._run(True, self.presenter.recurring_materialize_due)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _abort_on_error(request: Request) -> Iterator[None]:
+        """
+        После отправки заголовков ответ уже нельзя заменить сообщением
+        об ошибке: соединение обрывается без завершающего куска,
+        чтобы клиент не принял неполные данные за полные
+        """
+
+        try:
+            yield
+        except ConnectionError:
+            raise
+        except Exception as error:
+            logger.exception("Failed to stream %s %s", request.method, request.path)
+            raise ConnectionAbortedError("Response was interrupted") from error
+
+    async def handle_client(
+            self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Обслуживает одно соединение, поддерживая keep-alive
+        """
+
+        try:
+            while True:
+                try:
+                    request: Request | None = await self._read_request(reader)
+                except HttpError as error:
+                    await self._send_json(
+                        writer, error.status, {"error": str(error)}, False
+                    )
+                    break
+                if request is None:
+                    break
+                connection: str = request.headers.get("connection", "")
+                keep_alive: bool = connection.lower() != "close"
+                await self.dispatch(request, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(
+            self, request: Request, writer: asyncio.StreamWriter, keep_alive: bool
+    ) -> None:
+        """
+        Находит точку доступа для запроса и отправляет ответ
+        """
+
+        try:
+            if request.method == "GET":
+                await self._materialize_due()
+            if request.method == "GET" and request.path == "/expenses":
+                await self._stream_expenses(request, writer, keep_alive)
+                return
+            if request.method == "GET" and request.path == "/expenses/export":
+                await self._stream_export(request, writer, keep_alive)
+                return
+
+            route, params = _find_route(request)
+            func, args = route.handler(request, *params)
+            result: Any = await self._run(route.write, func, self.presenter, args)
+            await self._send_json(writer, 200, result, keep_alive)
+        except HttpError as error:
+            await self._send_json(writer, error.status, {"error": str(error)}, keep_alive)
+        except (NameError, ValueError) as error:
+            await self._send_json(writer, 400, {"error": str(error)}, keep_alive)
+        except Exception:
+            logger.exception("Failed to handle %s %s", request.method, request.path)
+            await self._send_json(
+                writer, 500, {"error": "Internal server error"}, keep_alive
+            )
+
+    async def _stream_expenses(
+            self, request: Request, writer: asyncio.StreamWriter, keep_alive: bool
+    ) -> None:
+        """
+        Отправляет список расходов по частям (chunked transfer encoding),
+        читая базу постранично, так что память не растёт с числом расходов
+        """
+
+        start: datetime | None = _date_or_none(request.query.get("from"))
+        end: datetime | None = _date_or_none(request.query.get("to"))
+
+        def read_page(after_id: int) -> tuple[list[dict[str, Any]], int]:
+            names: dict[int, str] = cli.category_names(self.presenter)
+            page: list = self.presenter.expenses_get_page(
+                after_id, STREAM_PAGE_SIZE, start, end
+            )
+            last_id: int = page[-1].obj_id if page else after_id
+            return [cli.expense_to_dict(expense, names) for expense in page], last_id
+
+        writer.write(self._head(200, keep_alive, chunked=True))
+        after_id: int = 0
+        separator: str = "["
+        with self._abort_on_error(request):
+            while True:
+                rows, after_id = await self._run(False, read_page, after_id)
+                if rows:
+                    chunk: str = separator + ",".join(
+                        json.dumps(row, ensure_ascii=False) for row in rows
+                    )
+                    separator = ","
+                    self._write_chunk(writer, chunk.encode())
+                    await writer.drain()
+                if len(rows) < STREAM_PAGE_SIZE:
+                    break
+        self._write_chunk(writer, b"[]" if separator == "[" else b"]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _stream_export(
+            self, request: Request, writer: asyncio.StreamWriter, keep_alive: bool
+    ) -> None:
+        """
+        Отправляет выгрузку расходов по частям.
+        Выгрузка читает базу одним курсором, поэтому целиком выполняется
+        в одном потоке чтения и передаёт куски через ограниченную очередь:
+        если клиент читает медленно, поток ждёт, а не копит данные в памяти.
+        """
+
+        fmt: str = request.query.get("format", "jsonl")
+        if fmt not in CONTENT_TYPES or fmt == "json":
+            raise HttpError(400, f"Unknown export format: {fmt}")
+        start: datetime | None = _date_or_none(request.query.get("from"))
+        end: datetime | None = _date_or_none(request.query.get("to"))
+        compress: bool = request.query.get("gzip", "") in ("1", "true")
+        category: str | None = request.query.get("category")
+        # неизвестная категория должна дать ошибку до начала ответа
+        category_ids: list[int] | None = await self._run(
+            False, cli.category_ids, self.presenter, [category] if category else None
+        )
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(EXPORT_QUEUE_SIZE)
+        stopped: threading.Event = threading.Event()
+
+        def put(chunk: bytes | None) -> None:
+            asyncio.run_coroutine_threadsafe(queue.put(chunk), loop).result()
+
+        def produce() -> None:
+            try:
+                for chunk in self.presenter.expenses_export_chunks(
+                        fmt, start, end, category_ids, compress
+                ):
+                    if stopped.is_set():
+                        break
+                    put(chunk)
+            finally:
+                put(None)
+
+        producer: Awaitable[None] = self._run(False, produce)
+        writer.write(self._head(
+            200, keep_alive, chunked=True, content_type=CONTENT_TYPES[fmt],
+            encoding="gzip" if compress else None
+        ))
+        try:
+            while (chunk := await queue.get()) is not None:
+                self._write_chunk(writer, chunk)
+                await writer.drain()
+        finally:
+            # клиент мог отключиться: освобождаем поток, ждущий места в очереди
+            stopped.set()
+            while not queue.empty():
+                queue.get_nowait()
+            with self._abort_on_error(request):
+                await producer
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Request | None:
+        line: bytes = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split()
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+
+        headers: dict[str, str] = {}
+        while True:
+            header: bytes = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length: int = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HttpError(400, "Malformed Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise HttpError(413, "Request body is too large")
+        body: bytes = await reader.readexactly(length) if length else b""
+
+        url = urlsplit(target)
+        return Request(
+            method.upper(), url.path.rstrip("/") or "/",
+            dict(parse_qsl(url.query)), headers, body
+        )
+
+    @staticmethod
+    def _head(
+            status: int,
+            keep_alive: bool,
+            length: int | None = None,
+            chunked: bool = False,
+            content_type: str = CONTENT_TYPES["json"],
+            encoding: str | None = None
+    ) -> bytes:
+        lines: list[str] = [
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if encoding is not None:
+            lines.append(f"Content-Encoding: {encoding}")
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        else:
+            lines.append(f"Content-Length: {length}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+        writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+
+    async def _send_json(
+            self, writer: asyncio.StreamWriter, status: int, data: Any, keep_alive: bool
+    ) -> None:
+        body: bytes = json.dumps(data, ensure_ascii=False).encode()
+        writer.write(self._head(status, keep_alive, len(body)) + body)
+        await writer.drain()
+
+
+async def _serve(presenter: Presenter, host: str, port: int, readers: int) -> None:
+    server: ApiServer = ApiServer(presenter, readers)
+    await server.start(host, port)
+    print(f"Serving on http://{host}:{server.port}", file=sys.stderr)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Запускает сервер с параметрами командной строки
+    """
+
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="bookkeeper-server", description="Локальный JSON API для учёта расходов"
+    )
+    parser.add_argument("--db", help="файл базы данных")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--readers", type=int, default=4, help="число потоков для чтения"
+    )
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    presenter: Presenter = Presenter(args.db) if args.db else Presenter()
+    try:
+        asyncio.run(_serve(presenter, args.host, args.port, args.readers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+Двоичные снимки базы для резервного копирования и восстановления.
+
+Снимок хранит схему и содержимое всех таблиц по столбцам.
+Строки таблиц разбиты на группы по ROW_GROUP_SIZE, каждый столбец группы
+записывается отдельным сжатым блоком:
+    q - целые числа (int64)
+    d - вещественные числа (float64)
+    t - даты, микросекунды от начала эпохи (int64)
+    s - строки: таблица уникальных строк и массив индексов (int32)
+Для столбцов, допускающих NULL, добавляется блок-маска (по байту на строку).
+
+Формат файла:
+    MAGIC | блоки | оглавление (JSON) | смещение и длина оглавления | SHA-256
+Оглавление хранит схему базы и для каждого блока его смещение и размер.
+
+Снимок читается в одной транзакции чтения, так что он согласован,
+даже если приложение в это время пишет в базу.
+Восстановление отображает файл в память (mmap) и загружает таблицы
+пакетными вставками в новую базу, индексы и триггеры создаются в конце.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any, BinaryIO, Iterator
+
+MAGIC: bytes = b"BKSNAP\x00\x01"
+
+ROW_GROUP_SIZE: int = 1 << 18
+
+COMPRESSION_LEVEL: int = 1
+
+# Перевод даты в формате Pony в микросекунды и обратно средствами SQLite
+DATE_TO_MICROS: str = (
+    "(CAST(strftime('%s', {col}) AS INTEGER) * 1000000 "
+    "+ CAST(substr({col}, 21, 6) AS INTEGER))"
+)
+MICROS_TO_DATE: str = (
+    "(strftime('%Y-%m-%d %H:%M:%S', {param} / 1000000, 'unixepoch') "
+    "|| printf('.%06d', {param} % 1000000))"
+)
+
+ARRAY_TYPES: dict[str, str] = {"q": "q", "d": "d", "t": "q"}
+
+# Столбцы служебных таблиц SQLite, у которых не объявлен тип
+SERVICE_COLUMN_KINDS: dict[tuple[str, str], str] = {
+    ("sqlite_sequence", "name"): "s",
+    ("sqlite_sequence", "seq"): "q",
+}
+
+
+class SnapshotError(ValueError):
+    """
+    Файл не является корректным снимком
+    """
+
+
+def _column_kind(declared_type: str) -> str:
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        return "q"
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return "d"
+    if "DATETIME" in declared_type:
+        return "t"
+    return "s"
+
+
+def _table_columns(con: sqlite3.Connection, table: str) -> list[dict[str, Any]]:
+    return [
+        {
+            "name": name,
+            "kind": (
+                SERVICE_COLUMN_KINDS.get((table, name)) or _column_kind(declared_type)
+            ),
+            "nullable": not notnull and not pk,
+        }
+        for _, name, declared_type, notnull, _, pk
+        in con.execute(f'PRAGMA table_info("{table}")')
+    ]
+
+
+def _select_expression(column: dict[str, Any]) -> str:
+    col: str = f'"{column["name"]}"'
+    if column["kind"] == "t":
+        expr: str = DATE_TO_MICROS.format(col=col)
+    else:
+        expr = col
+    empty: str = "''" if column["kind"] == "s" else "0"
+    return f"ifnull({expr}, {empty})"
+
+
+def _encode_column(kind: str, values: tuple) -> list[tuple[str, bytes]]:
+    """
+    Кодирует значения столбца группы строк.
+    Возвращает список пар (вид блока, байты блока).
+    """
+
+    if kind != "s":
+        data: array = array(ARRAY_TYPES[kind], values)
+        if sys.byteorder != "little":
+            data.byteswap()
+        return [(kind, data.tobytes())]
+
+    strings: dict[str, int] = {}
+    indices: array = array(
+        "i", [strings.setdefault(value, len(strings)) for value in values]
+    )
+    if sys.byteorder != "little":
+        indices.byteswap()
+    if any("\x00" in value for value in strings):
+        raise SnapshotError("Strings with NUL characters are not supported")
+    return [("strings", "\x00".join(strings).encode()), ("indices", indices.tobytes())]
+
+
+def _decode_array(typecode: str, data: bytes | memoryview) -> array:
+    values: array = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class _Writer:
+    """
+    Записывает блоки снимка, считая их смещения и контрольную сумму
+    """
+
+    def __init__(self, out: BinaryIO):
+        self.out: BinaryIO = out
+        self.offset: int = 0
+        self.digest = hashlib.sha256()
+
+    def write(self, data: bytes) -> None:
+        self.out.write(data)
+        self.digest.update(data)
+        self.offset += len(data)
+
+    def write_block(self, data: bytes) -> dict[str, int]:
+        compressed: bytes = zlib.compress(data, COMPRESSION_LEVEL)
+        block: dict[str, int] = {"offset": self.offset, "size": len(compressed)}
+        self.write(compressed)
+        return block
+
+
+def save(db_filename: str, snapshot_filename: str) -> dict[str, int]:
+    """
+    Сохраняет снимок базы db_filename в файл snapshot_filename.
+    Возвращает словарь "таблица - число строк".
+    """
+
+    con: sqlite3.Connection = sqlite3.connect(db_filename, isolation_level=None)
+    tmp_filename: str = snapshot_filename + ".tmp"
+    try:
+        # Все запросы ниже видят одно и то же состояние базы
+        con.execute("BEGIN")
+        schema: list[tuple[str, str, str]] = con.execute(
+            "SELECT type, name, sql FROM sqlite_master "
+            "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+        ).fetchall()
+        tables: list[str] = [name for kind, name, _ in schema if kind == "table"]
+        if con.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'"
+        ).fetchone():
+            tables.append("sqlite_sequence")
+
+        manifest: dict[str, Any] = {
+            "schema": schema, "tables": [],
+        }
+        with open(tmp_filename, "wb") as out:
+            # оглавление пишется после блоков, когда известны их смещения
+            writer: _Writer = _Writer(out)
+            writer.write(MAGIC)
+            for table in tables:
+                manifest["tables"].append(_save_table(con, table, writer))
+
+            manifest_data: bytes = json.dumps(manifest).encode()
+            manifest_offset: int = writer.offset
+            writer.write(manifest_data)
+            writer.write(struct.pack("<QQ", manifest_offset, len(manifest_data)))
+            out.write(writer.digest.digest())
+        con.execute("COMMIT")
+    finally:
+        con.close()
+
+    os.replace(tmp_filename, snapshot_filename)
+    return {table["name"]: table["rows"] for table in manifest["tables"]}
+
+
+def _save_table(con: sqlite3.Connection, table: str, writer: _Writer) -> dict[str, Any]:
+    columns: list[dict[str, Any]] = _table_columns(con, table)
+    expressions: list[str] = [_select_expression(column) for column in columns]
+    expressions += [
+        f'"{column["name"]}" IS NULL' for column in columns if column["nullable"]
+    ]
+
+    cursor: sqlite3.Cursor = con.execute(
+        f'SELECT {", ".join(expressions)} FROM "{table}"'
+    )
+    groups: list[dict[str, Any]] = []
+    rows_total: int = 0
+    while True:
+        rows: list[tuple] = cursor.fetchmany(ROW_GROUP_SIZE)
+        if not rows:
+            break
+        rows_total += len(rows)
+        values: list[tuple] = list(zip(*rows))
+        group: dict[str, Any] = {"rows": len(rows), "columns": []}
+        nulls: Iterator[tuple] = iter(values[len(columns):])
+        for column, column_values in zip(columns, values):
+            blocks: dict[str, Any] = {
+                kind: writer.write_block(data)
+                for kind, data in _encode_column(column["kind"], column_values)
+            }
+            if column["nullable"]:
+                mask: tuple = next(nulls)
+                if any(mask):
+                    blocks["nulls"] = writer.write_block(bytes(mask))
+            group["columns"].append(blocks)
+        groups.append(group)
+
+    return {"name": table, "columns": columns, "rows": rows_total, "groups": groups}
+
+
+def _read_block(data: mmap.mmap, block: dict[str, int]) -> bytes:
+    start: int = block["offset"]
+    return zlib.decompress(memoryview(data)[start:start + block["size"]])
+
+
+def _decode_group_column(
+        data: mmap.mmap, column: dict[str, Any], blocks: dict[str, Any]
+) -> list:
+    kind: str = column["kind"]
+    if kind == "s":
+        strings: list[str] = _read_block(data, blocks["strings"]).decode().split("\x00")
+        values: list = [
+            strings[index]
+            for index in _decode_array("i", _read_block(data, blocks["indices"]))
+        ]
+    else:
+        values = _decode_array(
+            ARRAY_TYPES[kind], _read_block(data, blocks[kind])
+        ).tolist()
+
+    if "nulls" in blocks:
+        mask: bytes = _read_block(data, blocks["nulls"])
+        values = [None if null else value for value, null in zip(values, mask)]
+    return values
+
+
+def _open_snapshot(snapshot_filename: str) -> tuple[mmap.mmap, dict[str, Any]]:
+    with open(snapshot_filename, "rb") as file:
+        if os.fstat(file.fileno()).st_size < len(MAGIC) + 16 + 32:
+            raise SnapshotError("File is too short to be a snapshot")
+        data: mmap.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if data[:len(MAGIC)] != MAGIC:
+        data.close()
+        raise SnapshotError("File is not a bookkeeper snapshot")
+    if hashlib.sha256(memoryview(data)[:-32]).digest() != data[-32:]:
+        data.close()
+        raise SnapshotError("Snapshot checksum mismatch")
+
+    manifest_offset, manifest_size = struct.unpack("<QQ", data[-48:-32])
+    manifest: dict[str, Any] = json.loads(
+        data[manifest_offset:manifest_offset + manifest_size]
+    )
+    return data, manifest
+
+
+def restore(snapshot_filename: str, db_filename: str) -> dict[str, int]:
+    """
+    Восстанавливает базу из снимка snapshot_filename в новый файл db_filename.
+    Отказывается перезаписывать существующий файл.
+    Возвращает словарь "таблица - число строк".
+    """
+
+    if os.path.exists(db_filename):
+        raise FileExistsError(f"Database {db_filename} already exists")
+
+    data, manifest = _open_snapshot(snapshot_filename)
+    tmp_filename: str = db_filename + ".tmp"
+    if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+    con: sqlite3.Connection = sqlite3.connect(tmp_filename, isolation_level=None)
+    try:
+        # в новый файл журнал не нужен: при сбое файл просто удаляется
+        con.execute("PRAGMA journal_mode=OFF")
+        con.execute("PRAGMA synchronous=OFF")
+        con.execute("BEGIN")
+        schema: list[list[str]] = manifest["schema"]
+        for kind, _, sql in schema:
+            if kind == "table":
+                con.execute(sql)
+        for table in manifest["tables"]:
+            _restore_table(con, data, table)
+        for kind, _, sql in schema:
+            if kind != "table":
+                con.execute(sql)
+        con.execute("COMMIT")
+    except BaseException:
+        con.close()
+        os.remove(tmp_filename)
+        raise
+    finally:
+        data.close()
+    con.close()
+
+    os.replace(tmp_filename, db_filename)
+    return {table["name"]: table["rows"] for table in manifest["tables"]}
+
+
+def _restore_table(
+        con: sqlite3.Connection, data: mmap.mmap, table: dict[str, Any]
+) -> None:
+    columns: list[dict[str, Any]] = table["columns"]
+    placeholders: list[str] = []
+    for number, column in enumerate(columns, start=1):
+        if column["kind"] == "t":
+            placeholders.append(MICROS_TO_DATE.format(param=f"?{number}"))
+        else:
+            placeholders.append(f"?{number}")
+    names: str = ", ".join(f'"{column["name"]}"' for column in columns)
+    sql: str = (
+        f'INSERT INTO "{table["name"]}" ({names}) VALUES ({", ".join(placeholders)})'
+    )
+    if table["name"] == "sqlite_sequence":
+        # счётчики уже заполнены вставками с явными id, заменяем их сохранёнными
+        con.execute("DELETE FROM sqlite_sequence")
+
+    for group in table["groups"]:
+        values: list[list] = [
+            _decode_group_column(data, column, blocks)
+            for column, blocks in zip(columns, group["columns"])
+        ]
+        con.executemany(sql, zip(*values))
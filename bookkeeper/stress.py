@@ -0,0 +1,200 @@
+"""
+Нагрузочная проверка одновременной работы нескольких процессов с одной базой.
+
+Запускает processes процессов, каждый со своим Presenter, как если бы
+с базой одновременно работали окно, скрипты и загрузка выписок.
+Каждый процесс выполняет operations случайных операций в пропорциях MIX
+и замеряет время каждой. Итог --- пропускная способность, задержки
+(медиана, 99-й процентиль, максимум) по видам операций и число ошибок.
+Запуск:
+    python -m bookkeeper.stress --db /tmp/stress.sqlite --processes 4 --operations 500
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable
+
+# Доли видов операций
+MIX: dict[str, float] = {
+    "add": 0.4,
+    "edit": 0.15,
+    "delete": 0.05,
+    "page": 0.2,
+    "sum": 0.15,
+    "import": 0.05,
+}
+
+CATEGORIES: tuple[str, ...] = ("stress-food", "stress-rent", "stress-fun")
+
+# Сколько расходов в файле, загружаемом операцией import
+IMPORT_ROWS: int = 50
+
+
+def _percentile(values: list[float], share: float) -> float:
+    ordered: list[float] = sorted(values)
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+def _write_import_file(filename: str, rng: random.Random) -> None:
+    with open(filename, "w", encoding="utf-8") as out:
+        out.write("date,amount,category,comment\n")
+        for _ in range(IMPORT_ROWS):
+            out.write(
+                f"{datetime.now().isoformat(' ', 'seconds')},"
+                f"{rng.randint(1, 1000)},{rng.choice(CATEGORIES)},import\n"
+            )
+
+
+def worker(db_filename: str, operations: int, seed: int) -> dict[str, Any]:
+    """
+    Выполняет operations случайных операций над базой.
+    Возвращает задержки в секундах по видам операций и ошибки по их типам.
+    """
+
+    from bookkeeper.presenter import Presenter
+
+    rng: random.Random = random.Random(seed)
+    presenter: Presenter = Presenter(db_filename)
+    import_filename: str = os.path.join(
+        tempfile.mkdtemp(prefix="bookkeeper-stress-"), "import.csv"
+    )
+    _write_import_file(import_filename, rng)
+
+    own_ids: list[int] = []
+
+    def add() -> None:
+        own_ids.append(presenter.expense_add(
+            rng.randint(1, 1000), rng.choice(CATEGORIES), "stress"
+        ))
+
+    def edit() -> None:
+        if own_ids:
+            presenter.expense_edit_cost(rng.choice(own_ids), rng.randint(1, 1000))
+
+    def delete() -> None:
+        if own_ids:
+            presenter.expense_delete(own_ids.pop(rng.randrange(len(own_ids))))
+
+    actions: dict[str, Callable[[], Any]] = {
+        "add": add,
+        "edit": edit,
+        "delete": delete,
+        "page": lambda: presenter.expenses_get_page(0, 50),
+        "sum": lambda: presenter.budget_get_sum_for_period(2),
+        "import": lambda: presenter.expenses_import(
+            import_filename, on_duplicate="allow"
+        ),
+    }
+    latencies: dict[str, list[float]] = {name: [] for name in actions}
+    errors: dict[str, int] = {}
+    for name in rng.choices(list(MIX), weights=list(MIX.values()), k=operations):
+        started: float = time.perf_counter()
+        try:
+            actions[name]()
+        except Exception as error:  # pylint: disable=broad-except
+            key: str = f"{name}: {type(error).__name__}: {error}"
+            errors[key] = errors.get(key, 0) + 1
+            continue
+        latencies[name].append(time.perf_counter() - started)
+
+    os.remove(import_filename)
+    os.rmdir(os.path.dirname(import_filename))
+    return {"latencies": latencies, "errors": errors}
+
+
+def run(
+        db_filename: str, processes: int = 4, operations: int = 200, seed: int = 0
+) -> dict[str, Any]:
+    """
+    Запускает processes процессов по operations операций над базой db_filename
+    и собирает отчёт: общее число операций, время, операций в секунду,
+    задержки в миллисекундах по видам операций и ошибки.
+    """
+
+    _prepare_database(db_filename)
+
+    # процессы запускаются заново, а не копией текущего: в каждом
+    # своя привязка Pony и свои соединения с базой
+    context: Any = multiprocessing.get_context("spawn")
+    started: float = time.perf_counter()
+    with context.Pool(processes) as pool:
+        results: list[dict[str, Any]] = pool.starmap(
+            worker,
+            [(db_filename, operations, seed + number) for number in range(processes)]
+        )
+    elapsed: float = time.perf_counter() - started
+
+    latencies: dict[str, list[float]] = {name: [] for name in MIX}
+    errors: dict[str, int] = {}
+    for result in results:
+        for name, values in result["latencies"].items():
+            latencies[name].extend(values)
+        for key, count in result["errors"].items():
+            errors[key] = errors.get(key, 0) + count
+
+    done: int = sum(len(values) for values in latencies.values())
+    return {
+        "processes": processes,
+        "operations": done,
+        "errors": sum(errors.values()),
+        "seconds": round(elapsed, 3),
+        "throughput": round(done / elapsed, 1),
+        "latency_ms": {
+            name: {
+                "count": len(values),
+                "p50": round(_percentile(values, 0.5) * 1000, 2),
+                "p99": round(_percentile(values, 0.99) * 1000, 2),
+                "max": round(max(values) * 1000, 2),
+            }
+            for name, values in latencies.items() if values
+        },
+        "error_details": errors,
+    }
+
+
+def _prepare_database(db_filename: str) -> None:
+    """
+    Создаёт базу и категории для нагрузки в отдельном процессе,
+    чтобы текущий процесс не привязывал Pony
+    """
+
+    context: Any = multiprocessing.get_context("spawn")
+    process: Any = context.Process(target=_create_categories, args=(db_filename,))
+    process.start()
+    process.join()
+
+
+def _create_categories(db_filename: str) -> None:
+    from bookkeeper.presenter import Presenter
+
+    presenter: Presenter = Presenter(db_filename)
+    for name in CATEGORIES:
+        if not presenter.categories_get_by_name(name):
+            presenter.category_add(name)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="Нагрузочная проверка одновременной работы процессов с базой"
+    )
+    parser.add_argument("--db", required=True, help="файл базы (создаётся, если его нет)")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--operations", type=int, default=200, help="операций на процесс")
+    parser.add_argument("--seed", type=int, default=0)
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    report: dict[str, Any] = run(args.db, args.processes, args.operations, args.seed)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,706 @@
+"""
+Синхронизация двух копий базы (например, на ноутбуке и на настольном
+компьютере) обменом только изменённых строк.
+
+Изменения расходов, категорий и бюджетов отслеживают триггеры.
+Каждой строке соответствует запись в таблице SyncRow:
+    uid       постоянный идентификатор строки, общий для всех копий
+              (id строк в копиях независимы)
+    revision  номер изменения в этой базе, монотонно растёт
+    stamp, origin  время изменения и база, где оно сделано;
+              по ним разрешаются конфликты
+    deleted   строка удалена (надгробие)
+Идентификатор категории --- её имя при создании, бюджета --- период,
+параметр и идентификатор категории, поэтому одинаковые категории
+и бюджеты, созданные в разных копиях, совпадают. Расходы получают
+случайный идентификатор.
+
+Синхронизация читает из каждой базы записи с номером изменения больше,
+чем в прошлый раз (таблица SyncPeer), и применяет их к другой базе
+одной транзакцией. Поэтому её стоимость зависит от числа изменений,
+а не от размера базы. При конфликте побеждает более позднее изменение,
+при равном времени --- изменение из базы с большим идентификатором.
+Категория, на которую после синхронизации ещё ссылаются расходы
+или бюджеты, не удаляется, а восстанавливается и в другой копии.
+Новые расходы, внесённые в обе копии независимо (например, повторяющиеся
+расходы), с одинаковым отпечатком (см. bookkeeper.duplicates)
+считаются одним расходом.
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import Iterable, NamedTuple
+
+from bookkeeper import backfill, duplicates
+
+TRACKED_TABLES: tuple[str, ...] = ("Category", "Budget", "Expense")
+
+# Заведение записей для расходов, внесённых до включения отслеживания
+# (см. bookkeeper.backfill). Категорий и бюджетов мало, их записи
+# заводятся сразу.
+EXPENSE_ROWS_BACKFILL: str = "change_tracking"
+
+_NEXT_REVISION: str = '(SELECT coalesce(max("revision"), 0) + 1 FROM "SyncRow")'
+_NOW: str = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+_ORIGIN: str = '(SELECT "value" FROM "SyncMeta" WHERE "key" = \'origin\')'
+_RANDOM_UID: str = "lower(hex(randomblob(16)))"
+
+# Естественный идентификатор новой строки; NULL --- случайный
+_NATURAL_UIDS: dict[str, str] = {
+    "Category": 'NEW."name"',
+    "Budget": (
+        'NEW."period" || \':\' || NEW."param" || \':\' || coalesce('
+        '(SELECT "uid" FROM "SyncRow" WHERE "tbl" = \'Category\' '
+        'AND "obj_id" = NEW."category_id"), \'\')'
+    ),
+    "Expense": "NULL",
+}
+
+# Передаваемые столбцы; изменение остальных (например, отпечатка
+# расхода) не считается изменением строки
+_SYNCED_COLUMNS: dict[str, str] = {
+    "Category": '"name"',
+    "Budget": '"period", "limit", "param", "category_id"',
+    "Expense": '"amount", "category_id", "expense_date", "comment", "currency"',
+}
+
+SYNC_SCHEMA: str = """
+    CREATE TABLE IF NOT EXISTS "SyncMeta" (
+        "key" TEXT PRIMARY KEY,
+        "value" TEXT NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS "SyncPeer" (
+        "peer" TEXT PRIMARY KEY,
+        "revision" INTEGER NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS "SyncRow" (
+        "tbl" TEXT NOT NULL,
+        "uid" TEXT NOT NULL,
+        "obj_id" INTEGER,
+        "revision" INTEGER NOT NULL,
+        "stamp" TEXT NOT NULL,
+        "origin" TEXT NOT NULL,
+        "deleted" INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY ("tbl", "uid")
+    ) WITHOUT ROWID;
+
+    CREATE UNIQUE INDEX IF NOT EXISTS "idx_syncrow__obj_id"
+    ON "SyncRow" ("tbl", "obj_id") WHERE "obj_id" IS NOT NULL;
+
+    CREATE INDEX IF NOT EXISTS "idx_syncrow__revision" ON "SyncRow" ("revision");
+"""
+
+SYNC_TRIGGERS: str = """
+    CREATE TRIGGER IF NOT EXISTS "trg_{table}_insert_sync"
+    AFTER INSERT ON "{table}" BEGIN
+        DELETE FROM "SyncRow" WHERE "tbl" = '{table}' AND "uid" = {natural}
+            AND "obj_id" IS NULL;
+        INSERT INTO "SyncRow" ("tbl", "uid", "obj_id", "revision", "stamp", "origin")
+        VALUES (
+            '{table}',
+            coalesce(
+                CASE WHEN EXISTS (
+                    SELECT 1 FROM "SyncRow" WHERE "tbl" = '{table}' AND "uid" = {natural}
+                ) THEN NULL ELSE {natural} END,
+                {random}
+            ),
+            NEW."obj_id", {next}, {now}, {origin}
+        );
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_{table}_update_sync"
+    AFTER UPDATE OF {columns} ON "{table}" BEGIN
+        {adopt}
+        UPDATE "SyncRow" SET "revision" = {next}, "stamp" = {now}, "origin" = {origin}
+        WHERE "tbl" = '{table}' AND "obj_id" = NEW."obj_id";
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_{table}_delete_sync"
+    AFTER DELETE ON "{table}" BEGIN
+        {adopt}
+        UPDATE "SyncRow" SET "obj_id" = NULL, "deleted" = 1,
+            "revision" = {next}, "stamp" = {now}, "origin" = {origin}
+        WHERE "tbl" = '{table}' AND "obj_id" = OLD."obj_id";
+    END;
+"""
+
+# Строки, существовавшие до включения отслеживания. Время у них
+# самое раннее, поэтому любое изменение новее, а одинаковые строки
+# в двух копиях одной базы получают одинаковые идентификаторы.
+_BACKFILL: dict[str, str] = {
+    "Category": 'SELECT "name", "obj_id" FROM "Category"',
+    "Budget": (
+        'SELECT b."period" || \':\' || b."param" || \':\' || coalesce(s."uid", \'\'), '
+        'b."obj_id" FROM "Budget" AS b LEFT JOIN "SyncRow" AS s '
+        'ON s."tbl" = \'Category\' AND s."obj_id" = b."category_id"'
+    ),
+}
+
+
+def _legacy_uid(expense: str) -> str:
+    """
+    SQL-выражение идентификатора расхода, внесённого до включения
+    отслеживания; expense --- псевдоним таблицы расходов или OLD
+    """
+
+    return (
+        f'\'legacy:\' || {expense}."obj_id" || \':\' || {expense}."expense_date" '
+        f'|| \':\' || {expense}."amount"'
+    )
+
+
+# Изменение или удаление расхода, до которого ещё не дошло заполнение,
+# сначала заводит его запись, чтобы изменение не потерялось
+_ADOPT_EXPENSE: str = (
+    'INSERT OR IGNORE INTO "SyncRow" '
+    '("tbl", "uid", "obj_id", "revision", "stamp", "origin") '
+    f'SELECT \'Expense\', {_legacy_uid("OLD")}, OLD."obj_id", 1, \'\', \'\' '
+    f'WHERE NOT {backfill.processed(EXPENSE_ROWS_BACKFILL, "OLD")};'
+)
+
+# Изменения строк таблицы после заданного номера.
+# Для расходов и бюджетов вместо id категории передаются её uid и имя.
+_CHANGES: dict[str, str] = {
+    "Category": (
+        'SELECT s."uid", s."revision", s."stamp", s."origin", s."deleted", c."name" '
+        'FROM "SyncRow" AS s LEFT JOIN "Category" AS c ON c."obj_id" = s."obj_id" '
+        'WHERE s."tbl" = \'Category\' AND s."revision" > ?'
+    ),
+    "Budget": (
+        'SELECT s."uid", s."revision", s."stamp", s."origin", s."deleted", '
+        'b."period", b."param", b."limit", cs."uid", c."name" '
+        'FROM "SyncRow" AS s LEFT JOIN "Budget" AS b ON b."obj_id" = s."obj_id" '
+        'LEFT JOIN "SyncRow" AS cs '
+        'ON cs."tbl" = \'Category\' AND cs."obj_id" = b."category_id" '
+        'LEFT JOIN "Category" AS c ON c."obj_id" = b."category_id" '
+        'WHERE s."tbl" = \'Budget\' AND s."revision" > ?'
+    ),
+    "Expense": (
+        'SELECT s."uid", s."revision", s."stamp", s."origin", s."deleted", '
+        'e."amount", e."expense_date", e."comment", cs."uid", c."name", e."currency" '
+        'FROM "SyncRow" AS s LEFT JOIN "Expense" AS e ON e."obj_id" = s."obj_id" '
+        'LEFT JOIN "SyncRow" AS cs '
+        'ON cs."tbl" = \'Category\' AND cs."obj_id" = e."category_id" '
+        'LEFT JOIN "Category" AS c ON c."obj_id" = e."category_id" '
+        'WHERE s."tbl" = \'Expense\' AND s."revision" > ?'
+    ),
+}
+
+
+class Change(NamedTuple):
+    """
+    Изменение строки: идентификатор, время, база, где оно сделано,
+    признак удаления и значения столбцов (для удалённой строки --- None)
+    """
+
+    uid: str
+    stamp: str
+    origin: str
+    deleted: bool
+    data: tuple
+
+    def newer_than(self, local: tuple | None) -> bool:
+        """
+        Побеждает ли изменение локальную запись SyncRow (obj_id, stamp, origin)
+        """
+
+        return local is None or (self.stamp, self.origin) > (local[1], local[2])
+
+
+class ChangeSet(NamedTuple):
+    """
+    Изменения одной базы после прошлой синхронизации
+    """
+
+    origin: str
+    revision: int
+    changes: dict[str, list[Change]]
+
+
+def install_change_tracking(con: sqlite3.Connection) -> None:
+    """
+    Создаёт таблицы и триггеры отслеживания изменений.
+    Если отслеживание включается впервые, заводит записи
+    для уже существующих категорий и бюджетов, а для расходов
+    начинает заполнение (см. fill_expense_rows).
+    """
+
+    exists: bool = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='SyncRow'"
+    ).fetchone() is not None
+    triggers: str = "".join(
+        SYNC_TRIGGERS.format(
+            table=table, columns=_SYNCED_COLUMNS[table],
+            natural=_NATURAL_UIDS[table], random=_RANDOM_UID,
+            next=_NEXT_REVISION, now=_NOW, origin=_ORIGIN,
+            adopt=_ADOPT_EXPENSE if table == "Expense" else ""
+        )
+        for table in TRACKED_TABLES
+    )
+    with con:
+        con.executescript("BEGIN;" + backfill.CURSOR_SCHEMA + SYNC_SCHEMA + triggers)
+        con.execute(
+            'INSERT OR IGNORE INTO "SyncMeta" ("key", "value") '
+            f"VALUES ('origin', {_RANDOM_UID})"
+        )
+        if not exists:
+            for table, select in _BACKFILL.items():
+                # строки с неуникальным естественным идентификатором
+                # (например, одноимённые категории) получают случайный
+                con.execute(
+                    'INSERT OR IGNORE INTO "SyncRow" '
+                    '("tbl", "uid", "obj_id", "revision", "stamp", "origin") '
+                    f"SELECT '{table}', *, 1, '', '' FROM ({select})"
+                )
+                con.execute(
+                    'INSERT INTO "SyncRow" '
+                    '("tbl", "uid", "obj_id", "revision", "stamp", "origin") '
+                    f'SELECT \'{table}\', {_RANDOM_UID}, "obj_id", 1, \'\', \'\' '
+                    f'FROM "{table}" WHERE "obj_id" NOT IN '
+                    f'(SELECT "obj_id" FROM "SyncRow" WHERE "tbl" = \'{table}\' '
+                    'AND "obj_id" IS NOT NULL)'
+                )
+            backfill.start(con, EXPENSE_ROWS_BACKFILL, "Expense")
+
+
+def fill_expense_rows(con: sqlite3.Connection, size: int) -> int:
+    """
+    Заводит записи отслеживания для следующих size расходов,
+    внесённых до его включения. Возвращает число обработанных расходов.
+    """
+
+    after, upto, count = backfill.batch(con, EXPENSE_ROWS_BACKFILL, "Expense", size)
+    # у расходов, изменённых после включения отслеживания, запись уже есть
+    con.execute(
+        'INSERT OR IGNORE INTO "SyncRow" '
+        '("tbl", "uid", "obj_id", "revision", "stamp", "origin") '
+        f'SELECT \'Expense\', {_legacy_uid("e")}, e."obj_id", 1, \'\', \'\' '
+        'FROM "Expense" AS e WHERE e."obj_id" > ? AND e."obj_id" <= ?',
+        (after, upto)
+    )
+    return count
+
+
+def reinstall_triggers(con: sqlite3.Connection) -> None:
+    """
+    Пересоздаёт триггеры отслеживания изменений,
+    например после добавления передаваемого столбца
+    """
+
+    with con:
+        for table in TRACKED_TABLES:
+            for event in ("insert", "update", "delete"):
+                con.execute(f'DROP TRIGGER IF EXISTS "trg_{table}_{event}_sync"')
+    install_change_tracking(con)
+
+
+def _connect(db_filename: str) -> sqlite3.Connection:
+    con: sqlite3.Connection = sqlite3.connect(db_filename, isolation_level=None)
+    con.execute("PRAGMA foreign_keys = ON")
+    return con
+
+
+def origin(con: sqlite3.Connection) -> str:
+    """
+    Идентификатор базы
+    """
+
+    return con.execute(_ORIGIN[1:-1]).fetchone()[0]
+
+
+def received(con: sqlite3.Connection, peer: str) -> int:
+    """
+    До какого номера изменения база уже получила изменения базы peer
+    """
+
+    return con.execute(
+        'SELECT coalesce(max("revision"), 0) FROM "SyncPeer" WHERE "peer" = ?', (peer,)
+    ).fetchone()[0]
+
+
+def collect_changes(con: sqlite3.Connection, after: int) -> ChangeSet:
+    """
+    Читает изменения с номером больше after одной транзакцией чтения
+    """
+
+    revision: int = after
+    changes: dict[str, list[Change]] = {}
+    con.execute("BEGIN")
+    try:
+        for table in TRACKED_TABLES:
+            changes[table] = []
+            for uid, row_revision, stamp, row_origin, deleted, *data in con.execute(
+                    _CHANGES[table], (after,)
+            ):
+                revision = max(revision, row_revision)
+                changes[table].append(Change(
+                    uid, stamp, row_origin, bool(deleted),
+                    None if deleted else tuple(data)
+                ))
+        return ChangeSet(origin(con), revision, changes)
+    finally:
+        con.execute("COMMIT")
+
+
+def _local(con: sqlite3.Connection, table: str, uid: str) -> tuple | None:
+    return con.execute(
+        'SELECT "obj_id", "stamp", "origin" FROM "SyncRow" WHERE "tbl" = ? AND "uid" = ?',
+        (table, uid)
+    ).fetchone()
+
+
+def _adopt(con: sqlite3.Connection, table: str, obj_id: int, change: Change) -> None:
+    """
+    Записывает за строкой obj_id идентификатор и время изменения change
+    """
+
+    con.execute(
+        'DELETE FROM "SyncRow" WHERE "tbl" = ? AND "uid" = ? AND "obj_id" IS NULL',
+        (table, change.uid)
+    )
+    con.execute(
+        'UPDATE "SyncRow" SET "uid" = ?, "stamp" = ?, "origin" = ? '
+        'WHERE "tbl" = ? AND "obj_id" = ?',
+        (change.uid, change.stamp, change.origin, table, obj_id)
+    )
+
+
+def _bury(con: sqlite3.Connection, table: str, change: Change) -> None:
+    """
+    Записывает надгробие удалённой строки с временем изменения change
+    """
+
+    con.execute(
+        'INSERT INTO "SyncRow" '
+        '("tbl", "uid", "obj_id", "revision", "stamp", "origin", "deleted") '
+        f"VALUES (?, ?, NULL, {_NEXT_REVISION}, ?, ?, 1) "
+        'ON CONFLICT ("tbl", "uid") DO UPDATE SET "revision" = excluded."revision", '
+        '"stamp" = excluded."stamp", "origin" = excluded."origin"',
+        (table, change.uid, change.stamp, change.origin)
+    )
+
+
+def _category_id(con: sqlite3.Connection, uid: str, name: str | None) -> int | None:
+    """
+    Находит категорию по uid. Если в этой базе категория удалена,
+    восстанавливает её: ссылка на категорию важнее её удаления.
+    Восстановление получает новое время и поэтому попадёт и в другую базу.
+    """
+
+    local: tuple | None = _local(con, "Category", uid)
+    if local is not None and local[0] is not None:
+        return local[0]
+    if name is None:
+        return None
+    obj_id: int = con.execute(
+        'INSERT INTO "Category" ("name") VALUES (?)', (name,)
+    ).lastrowid
+    con.execute(
+        'DELETE FROM "SyncRow" '
+        'WHERE "tbl" = \'Category\' AND "uid" = ? AND "obj_id" IS NULL',
+        (uid,)
+    )
+    con.execute(
+        'UPDATE "SyncRow" SET "uid" = ? WHERE "tbl" = \'Category\' AND "obj_id" = ?',
+        (uid, obj_id)
+    )
+    return obj_id
+
+
+class _Applier:
+    """
+    Применяет изменения другой базы внутри транзакции
+    и считает применённые и отклонённые изменения
+    """
+
+    def __init__(self, con: sqlite3.Connection):
+        self.con: sqlite3.Connection = con
+        self.stats: dict[str, int] = {"applied": 0, "conflicts": 0, "kept": 0}
+
+    def _wins(self, change: Change, local: tuple | None) -> bool:
+        if change.newer_than(local):
+            self.stats["applied"] += 1
+            return True
+        # то же изменение, вернувшееся из другой базы, конфликтом не считается
+        if (change.stamp, change.origin) != (local[1], local[2]):
+            self.stats["conflicts"] += 1
+        return False
+
+    def categories(self, changes: Iterable[Change]) -> None:
+        for change in changes:
+            local: tuple | None = _local(self.con, "Category", change.uid)
+            if not self._wins(change, local):
+                continue
+            if local is not None and local[0] is not None:
+                self.con.execute(
+                    'UPDATE "Category" SET "name" = ? WHERE "obj_id" = ?',
+                    (change.data[0], local[0])
+                )
+                obj_id: int = local[0]
+            else:
+                obj_id = self.con.execute(
+                    'INSERT INTO "Category" ("name") VALUES (?)', change.data
+                ).lastrowid
+            _adopt(self.con, "Category", obj_id, change)
+
+    def budgets(self, changes: Iterable[Change]) -> None:
+        for change in changes:
+            local: tuple | None = _local(self.con, "Budget", change.uid)
+            if not self._wins(change, local):
+                continue
+            if change.deleted:
+                if local is not None and local[0] is not None:
+                    self.con.execute(
+                        'DELETE FROM "Budget" WHERE "obj_id" = ?', (local[0],)
+                    )
+                _bury(self.con, "Budget", change)
+                continue
+
+            period, param, limit, cat_uid, cat_name = change.data
+            cat_id: int | None = (
+                0 if cat_uid is None else _category_id(self.con, cat_uid, cat_name)
+            )
+            obj_id: int | None = None if local is None else local[0]
+            if obj_id is None:
+                # такой же бюджет, созданный в этой базе под другим uid:
+                # лимит выбирается как при конфликте, а обе базы
+                # оставляют за бюджетом меньший из двух uid
+                same: tuple | None = self.con.execute(
+                    'SELECT b."obj_id", s."stamp", s."origin", s."uid" '
+                    'FROM "Budget" AS b JOIN "SyncRow" AS s '
+                    'ON s."tbl" = \'Budget\' AND s."obj_id" = b."obj_id" '
+                    'WHERE b."period" = ? AND b."param" = ? AND b."category_id" = ?',
+                    (period, param, cat_id)
+                ).fetchone()
+                if same is not None:
+                    uid: str = min(change.uid, same[3])
+                    if change.newer_than(same):
+                        self.con.execute(
+                            'UPDATE "Budget" SET "limit" = ? WHERE "obj_id" = ?',
+                            (limit, same[0])
+                        )
+                        _adopt(self.con, "Budget", same[0], change._replace(uid=uid))
+                    else:
+                        self.stats["applied"] -= 1
+                        self.stats["conflicts"] += 1
+                        self.con.execute(
+                            'UPDATE "SyncRow" SET "uid" = ? '
+                            'WHERE "tbl" = \'Budget\' AND "obj_id" = ?',
+                            (uid, same[0])
+                        )
+                    continue
+            if obj_id is None:
+                obj_id = self.con.execute(
+                    'INSERT INTO "Budget" ("period", "limit", "param", "category_id") '
+                    'VALUES (?, ?, ?, ?)',
+                    (period, limit, param, cat_id)
+                ).lastrowid
+            else:
+                self.con.execute(
+                    'UPDATE "Budget" SET "period" = ?, "limit" = ?, "param" = ?, '
+                    '"category_id" = ? WHERE "obj_id" = ?',
+                    (period, limit, param, cat_id, obj_id)
+                )
+            _adopt(self.con, "Budget", obj_id, change)
+
+    def expenses(self, changes: Iterable[Change]) -> None:
+        for change in changes:
+            local: tuple | None = _local(self.con, "Expense", change.uid)
+            if not self._wins(change, local):
+                continue
+            if change.deleted:
+                if local is not None and local[0] is not None:
+                    self.con.execute(
+                        'DELETE FROM "Expense" WHERE "obj_id" = ?', (local[0],)
+                    )
+                _bury(self.con, "Expense", change)
+                continue
+
+            amount, expense_date, comment, cat_uid, cat_name, currency = change.data
+            cat_id: int | None = (
+                None if cat_uid is None else _category_id(self.con, cat_uid, cat_name)
+            )
+            if cat_id is None:
+                # расход без категории в исходной базе (см. Presenter.category_repair)
+                self.stats["applied"] -= 1
+                self.stats["conflicts"] += 1
+                continue
+            values: tuple = (
+                amount, cat_id, expense_date, comment, currency,
+                duplicates.fingerprint(
+                    amount, datetime.fromisoformat(expense_date), cat_id, comment,
+                    currency
+                )
+            )
+            if local is not None and local[0] is not None:
+                obj_id: int = local[0]
+                self.con.execute(
+                    'UPDATE "Expense" SET "amount" = ?, "category_id" = ?, '
+                    '"expense_date" = ?, "comment" = ?, "currency" = ?, '
+                    '"fingerprint" = ? WHERE "obj_id" = ?',
+                    values + (obj_id,)
+                )
+            else:
+                obj_id = self.con.execute(
+                    'INSERT INTO "Expense" '
+                    '("amount", "category_id", "expense_date", "comment", "currency", '
+                    '"fingerprint") VALUES (?, ?, ?, ?, ?, ?)',
+                    values
+                ).lastrowid
+            _adopt(self.con, "Expense", obj_id, change)
+
+    def category_deletions(self, changes: Iterable[Change]) -> None:
+        for change in changes:
+            local: tuple | None = _local(self.con, "Category", change.uid)
+            if not self._wins(change, local):
+                continue
+            if local is not None and local[0] is not None:
+                in_use: bool = self.con.execute(
+                    'SELECT EXISTS (SELECT 1 FROM "Expense" WHERE "category_id" = :cat) '
+                    'OR EXISTS (SELECT 1 FROM "Budget" WHERE "category_id" = :cat) '
+                    'OR EXISTS '
+                    '(SELECT 1 FROM "RecurringExpense" WHERE "category_id" = :cat)',
+                    {"cat": local[0]}
+                ).fetchone()[0]
+                if in_use:
+                    # категория остаётся и с новым временем вернётся в другую базу
+                    self.con.execute(
+                        f'UPDATE "SyncRow" SET "revision" = {_NEXT_REVISION}, '
+                        f'"stamp" = {_NOW}, "origin" = {_ORIGIN} '
+                        'WHERE "tbl" = \'Category\' AND "obj_id" = ?',
+                        (local[0],)
+                    )
+                    self.stats["applied"] -= 1
+                    self.stats["kept"] += 1
+                    continue
+                self.con.execute('DELETE FROM "Category" WHERE "obj_id" = ?', (local[0],))
+            _bury(self.con, "Category", change)
+
+
+def apply_changes(
+        con: sqlite3.Connection, change_set: ChangeSet, relabel: dict[str, str]
+) -> dict[str, int]:
+    """
+    Применяет изменения другой базы одной транзакцией
+    и запоминает, до какого номера они получены.
+    relabel --- новые uid расходов этой базы, совпавших с расходами другой.
+    Возвращает число применённых изменений, конфликтов, в которых
+    победила эта база, и сохранённых категорий.
+    """
+
+    applier: _Applier = _Applier(con)
+    changes: dict[str, list[Change]] = change_set.changes
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.executemany(
+            'UPDATE "SyncRow" SET "uid" = ? WHERE "tbl" = \'Expense\' AND "uid" = ?',
+            [(new, old) for old, new in relabel.items()]
+        )
+        # сначала категории, на которые могут ссылаться расходы и бюджеты,
+        # а удаление категорий --- когда ссылки на них уже перенесены
+        applier.categories(c for c in changes["Category"] if not c.deleted)
+        applier.budgets(changes["Budget"])
+        applier.expenses(changes["Expense"])
+        applier.category_deletions(c for c in changes["Category"] if c.deleted)
+        con.execute(
+            'INSERT INTO "SyncPeer" ("peer", "revision") VALUES (?, ?) '
+            'ON CONFLICT ("peer") DO UPDATE SET "revision" = excluded."revision"',
+            (change_set.origin, change_set.revision)
+        )
+        con.execute("COMMIT")
+    except sqlite3.Error:
+        con.execute("ROLLBACK")
+        raise
+    return applier.stats
+
+
+def _new_expenses(
+        changes: list[Change], other: sqlite3.Connection
+) -> dict[str, list[Change]]:
+    """
+    Группирует по отпечатку расходы, которых другая база ещё не видела
+    """
+
+    groups: dict[str, list[Change]] = {}
+    for change in changes:
+        if change.deleted or change.data[3] is None:
+            continue
+        if _local(other, "Expense", change.uid) is not None:
+            continue
+        amount, expense_date, comment, cat_uid, _, currency = change.data
+        key: str = duplicates.fingerprint(
+            amount, datetime.fromisoformat(expense_date), cat_uid, comment, currency
+        )
+        groups.setdefault(key, []).append(change)
+    return groups
+
+
+def pair_new_expenses(
+        con_a: sqlite3.Connection,
+        set_a: ChangeSet,
+        con_b: sqlite3.Connection,
+        set_b: ChangeSet
+) -> tuple[dict[str, str], dict[str, str]]:
+    """
+    Находит пары одинаковых новых расходов, внесённых в обе базы независимо.
+    Такие расходы убираются из наборов изменений, а каждая пара получает
+    меньший из двух uid. Возвращает новые uid для расходов базы a и базы b.
+    """
+
+    new_a: dict[str, list[Change]] = _new_expenses(set_a.changes["Expense"], con_b)
+    new_b: dict[str, list[Change]] = _new_expenses(set_b.changes["Expense"], con_a)
+    relabel_a: dict[str, str] = {}
+    relabel_b: dict[str, str] = {}
+    paired: set[str] = set()
+    for key in new_a.keys() & new_b.keys():
+        for change_a, change_b in zip(
+                sorted(new_a[key], key=lambda c: c.uid),
+                sorted(new_b[key], key=lambda c: c.uid)
+        ):
+            uid: str = min(change_a.uid, change_b.uid)
+            if change_a.uid != uid:
+                relabel_a[change_a.uid] = uid
+            if change_b.uid != uid:
+                relabel_b[change_b.uid] = uid
+            paired.update((change_a.uid, change_b.uid))
+
+    for change_set in (set_a, set_b):
+        change_set.changes["Expense"][:] = [
+            change for change in change_set.changes["Expense"] if change.uid not in paired
+        ]
+    return relabel_a, relabel_b
+
+
+def sync(db_a: str, db_b: str) -> dict[str, int]:
+    """
+    Синхронизирует две базы, в которых включено отслеживание изменений.
+    Возвращает число изменений, полученных базой a и отправленных в базу b,
+    конфликтов, сохранённых категорий и совпавших новых расходов.
+    """
+
+    con_a: sqlite3.Connection = _connect(db_a)
+    con_b: sqlite3.Connection = _connect(db_b)
+    try:
+        if origin(con_a) == origin(con_b):
+            # копия файла: базам нужны разные идентификаторы
+            con_b.execute(
+                f'UPDATE "SyncMeta" SET "value" = {_RANDOM_UID} WHERE "key" = \'origin\''
+            )
+        set_a: ChangeSet = collect_changes(con_a, received(con_b, origin(con_a)))
+        set_b: ChangeSet = collect_changes(con_b, received(con_a, origin(con_b)))
+        relabel_a, relabel_b = pair_new_expenses(con_a, set_a, con_b, set_b)
+
+        sent: dict[str, int] = apply_changes(con_b, set_a, relabel_b)
+        got: dict[str, int] = apply_changes(con_a, set_b, relabel_a)
+    finally:
+        con_a.close()
+        con_b.close()
+    return {
+        "received": got["applied"],
+        "sent": sent["applied"],
+        "conflicts": got["conflicts"] + sent["conflicts"],
+        "kept": got["kept"] + sent["kept"],
+        "paired": len(relabel_a) + len(relabel_b),
+    }
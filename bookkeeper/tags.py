@@ -0,0 +1,444 @@
+"""
+Метки расходов и битовые индексы по ним.
+
+Расходу можно поставить любое число меток ("отпуск", "к возмещению"),
+связи хранятся в таблице ExpenseTag. Для запросов по меткам
+("отпуск AND NOT к_возмещению") у каждой метки есть битовая карта
+id расходов: бит с номером id установлен, если у расхода есть метка.
+Метка 0 (ALL_EXPENSES) --- карта всех расходов, она нужна для NOT.
+Запрос вычисляется побитовыми операциями над картами целиком,
+без соединений таблиц.
+
+Карты хранятся в таблице TagBitmap, сжатые zlib, вместе с номером
+записи журнала, по которую они верны. Триггеры на Expense и ExpenseTag
+пишут каждое изменение в журнал TagLog, и карты в памяти (TagIndex)
+достраиваются по новым записям журнала, когда база изменилась.
+Когда журнал вырастает больше CHECKPOINT_SIZE записей, изменённые
+карты сохраняются, а учтённые записи журнала удаляются.
+Архивирование удаляет расходы из оперативной базы,
+поэтому их метки не сохраняются.
+"""
+
+import json
+import re
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+from typing import Any, Iterator
+
+from bookkeeper import rates
+
+# Номер карты всех расходов
+ALL_EXPENSES: int = 0
+
+# Сколько записей журнала накапливается до сохранения карт
+CHECKPOINT_SIZE: int = 10000
+
+TAGS_SCHEMA: str = """
+    CREATE TABLE IF NOT EXISTS "Tag" (
+        "obj_id" INTEGER PRIMARY KEY AUTOINCREMENT,
+        "name" TEXT UNIQUE NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS "ExpenseTag" (
+        "tag_id" INTEGER NOT NULL,
+        "expense_id" INTEGER NOT NULL,
+        PRIMARY KEY ("tag_id", "expense_id")
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS "idx_expensetag__expense_id"
+        ON "ExpenseTag" ("expense_id");
+
+    CREATE TABLE IF NOT EXISTS "TagLog" (
+        "seq" INTEGER PRIMARY KEY AUTOINCREMENT,
+        "tag_id" INTEGER NOT NULL,
+        "expense_id" INTEGER NOT NULL,
+        "added" INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS "TagBitmap" (
+        "tag_id" INTEGER PRIMARY KEY,
+        "seq" INTEGER NOT NULL,
+        "bitmap" BLOB NOT NULL
+    );
+
+    CREATE TRIGGER IF NOT EXISTS "trg_expensetag_insert_log"
+    AFTER INSERT ON "ExpenseTag" BEGIN
+        INSERT INTO "TagLog" ("tag_id", "expense_id", "added")
+        VALUES (NEW."tag_id", NEW."expense_id", 1);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_expensetag_delete_log"
+    AFTER DELETE ON "ExpenseTag" BEGIN
+        INSERT INTO "TagLog" ("tag_id", "expense_id", "added")
+        VALUES (OLD."tag_id", OLD."expense_id", 0);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_expense_insert_tag_log"
+    AFTER INSERT ON "Expense" BEGIN
+        INSERT INTO "TagLog" ("tag_id", "expense_id", "added")
+        VALUES (0, NEW."obj_id", 1);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_expense_delete_tags"
+    AFTER DELETE ON "Expense" BEGIN
+        DELETE FROM "ExpenseTag" WHERE "expense_id" = OLD."obj_id";
+        INSERT INTO "TagLog" ("tag_id", "expense_id", "added")
+        VALUES (0, OLD."obj_id", 0);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS "trg_tag_delete"
+    AFTER DELETE ON "Tag" BEGIN
+        DELETE FROM "ExpenseTag" WHERE "tag_id" = OLD."obj_id";
+        DELETE FROM "TagBitmap" WHERE "tag_id" = OLD."obj_id";
+    END;
+"""
+
+
+def install_tags(con: sqlite3.Connection) -> None:
+    """
+    Создаёт таблицы меток, журнал и поддерживающие его триггеры.
+    Карта всех расходов строится при первом обращении к индексу.
+    """
+
+    with con:
+        con.executescript("BEGIN;" + TAGS_SCHEMA)
+
+
+def _set(bitmap: bytearray, bit: int, value: bool) -> None:
+    byte: int = bit >> 3
+    if byte >= len(bitmap):
+        if not value:
+            return
+        bitmap.extend(bytes(byte - len(bitmap) + 1))
+    if value:
+        bitmap[byte] |= 1 << (bit & 7)
+    else:
+        bitmap[byte] &= ~(1 << (bit & 7)) & 0xFF
+
+
+def bits(value: int) -> Iterator[int]:
+    """
+    Номера установленных битов value по возрастанию
+    """
+
+    data: bytes = value.to_bytes((value.bit_length() + 7) // 8, "little")
+    for byte_num, byte in enumerate(data):
+        while byte:
+            low: int = byte & -byte
+            yield byte_num * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+# Лексемы запроса: скобки, имена в кавычках и слова
+_TOKEN: re.Pattern = re.compile(r'\s*(?:([()])|"([^"]*)"|([^\s()"]+))')
+
+
+def parse(query: str) -> list[tuple[str, str]]:
+    """
+    Разбирает запрос по меткам на лексемы (вид, значение).
+    Виды: "(" и ")", "op" (AND, OR, NOT без учёта регистра), "tag".
+    """
+
+    tokens: list[tuple[str, str]] = []
+    position: int = 0
+    query = query.strip()
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if match is None:
+            raise ValueError(f"Wrong tag query: {query}")
+        bracket, quoted, word = match.groups()
+        if bracket:
+            tokens.append((bracket, bracket))
+        elif quoted is not None:
+            tokens.append(("tag", quoted))
+        elif word.upper() in ("AND", "OR", "NOT"):
+            tokens.append(("op", word.upper()))
+        else:
+            tokens.append(("tag", word))
+        position = match.end()
+    return tokens
+
+
+class _QueryParser:
+    """
+    Разбор запроса по меткам рекурсивным спуском в дерево из кортежей
+    ("tag", имя), ("NOT", узел), ("AND", узел, узел), ("OR", узел, узел)
+    """
+
+    def __init__(self, query: str):
+        self.query: str = query
+        self.tokens: list[tuple[str, str]] = parse(query)
+        self.position: int = 0
+
+    def tree(self) -> tuple:
+        """
+        Дерево всего запроса
+        """
+
+        result: tuple = self._union()
+        if self._peek() is not None:
+            raise ValueError(f"Unexpected {self._peek()[1]} in tag query: {self.query}")
+        return result
+
+    def _peek(self) -> tuple[str, str] | None:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _take(self) -> tuple[str, str]:
+        token: tuple[str, str] | None = self._peek()
+        if token is None:
+            raise ValueError(f"Unexpected end of tag query: {self.query}")
+        self.position += 1
+        return token
+
+    def _factor(self) -> tuple:
+        kind, value = self._take()
+        if (kind, value) == ("op", "NOT"):
+            return ("NOT", self._factor())
+        if kind == "(":
+            result: tuple = self._union()
+            if self._take()[0] != ")":
+                raise ValueError(f"Unbalanced brackets in tag query: {self.query}")
+            return result
+        if kind == "tag":
+            return ("tag", value)
+        raise ValueError(f"Unexpected {value} in tag query: {self.query}")
+
+    def _intersection(self) -> tuple:
+        result: tuple = self._factor()
+        while self._peek() == ("op", "AND"):
+            self._take()
+            result = ("AND", result, self._factor())
+        return result
+
+    def _union(self) -> tuple:
+        result: tuple = self._intersection()
+        while self._peek() == ("op", "OR"):
+            self._take()
+            result = ("OR", result, self._intersection())
+        return result
+
+
+class TagIndex:
+    """
+    Битовые карты меток в памяти: id метки -> bytearray.
+    Строятся по сохранённым картам и журналу TagLog
+    и достраиваются по новым записям журнала, когда
+    PRAGMA data_version показывает, что база изменилась.
+    """
+
+    def __init__(self, db_filename: str):
+        # ожидание короткое: сохранение карт откладывается, если база занята
+        self._con: sqlite3.Connection = sqlite3.connect(
+            db_filename, check_same_thread=False, isolation_level=None, timeout=0.1
+        )
+        self._lock: threading.Lock = threading.Lock()
+        self._version: int | None = None
+        self._checkpoint: int = -1
+        self._seq: int = 0
+        # карта всех расходов построена заново и ещё не сохранена
+        self._unsaved: bool = False
+        self._bitmaps: dict[int, bytearray] = {}
+        # карты, изменившиеся после сохранения
+        self._dirty: set[int] = set()
+        self._names: dict[str, int] = {}
+
+    def _load(self) -> None:
+        """
+        Загружает сохранённые карты; карту всех расходов при первом
+        обращении строит по таблице расходов. Вызывается внутри
+        читающей транзакции.
+        """
+
+        self._bitmaps = {
+            tag_id: bytearray(zlib.decompress(bitmap))
+            for tag_id, bitmap in self._con.execute(
+                'SELECT "tag_id", "bitmap" FROM "TagBitmap"'
+            )
+        }
+        self._seq = 0
+        self._dirty = set()
+        if ALL_EXPENSES not in self._bitmaps:
+            # журнал поверх снимка таблицы применять можно: последняя
+            # запись о расходе совпадает с тем, что видно в снимке
+            universe: bytearray = bytearray()
+            for (obj_id,) in self._con.execute('SELECT "obj_id" FROM "Expense"'):
+                _set(universe, obj_id, True)
+            self._bitmaps[ALL_EXPENSES] = universe
+            self._dirty = set(self._bitmaps)
+            self._unsaved = True
+
+    def _replay(self, after: int) -> None:
+        for seq, tag_id, expense_id, added in self._con.execute(
+                'SELECT "seq", "tag_id", "expense_id", "added" FROM "TagLog" '
+                'WHERE "seq" > ? ORDER BY "seq"',
+                (after,)
+        ):
+            _set(self._bitmaps.setdefault(tag_id, bytearray()), expense_id, bool(added))
+            self._dirty.add(tag_id)
+            self._seq = seq
+
+    def refresh(self) -> None:
+        """
+        Достраивает карты, если база изменилась с прошлого раза
+        """
+
+        with self._lock:
+            version: int = self._con.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._version:
+                return
+            self._con.execute("BEGIN")
+            try:
+                checkpoint: int = self._con.execute(
+                    'SELECT coalesce(max("seq"), 0) FROM "TagBitmap"'
+                ).fetchone()[0]
+                if checkpoint != self._checkpoint:
+                    # карты сохранены заново (возможно, другим процессом),
+                    # журнал до них удалён
+                    self._load()
+                    self._checkpoint = checkpoint
+                self._replay(max(self._seq, checkpoint))
+                self._names = dict(
+                    self._con.execute('SELECT "name", "obj_id" FROM "Tag"')
+                )
+            finally:
+                self._con.execute("COMMIT")
+            self._version = version
+            if self._unsaved or self._seq - self._checkpoint >= CHECKPOINT_SIZE:
+                self._save()
+
+    def _save(self) -> None:
+        """
+        Сохраняет изменившиеся карты и удаляет учтённые записи журнала.
+        Если база занята другим процессом, сохранение откладывается.
+        """
+
+        try:
+            self._con.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            return
+        try:
+            # пока ждали блокировку, журнал мог пополниться
+            self._replay(self._seq)
+            tag_ids: set[int] = {
+                tag_id for (tag_id,) in self._con.execute('SELECT "obj_id" FROM "Tag"')
+            } | {ALL_EXPENSES}
+            # карты удалённых меток больше не нужны
+            for tag_id in set(self._bitmaps) - tag_ids:
+                del self._bitmaps[tag_id]
+            self._con.executemany(
+                'INSERT OR REPLACE INTO "TagBitmap" ("tag_id", "seq", "bitmap") '
+                'VALUES (?, ?, ?)',
+                [
+                    (tag_id, self._seq, zlib.compress(bytes(self._bitmaps[tag_id])))
+                    for tag_id in self._dirty & set(self._bitmaps)
+                ]
+            )
+            self._con.execute('DELETE FROM "TagLog" WHERE "seq" <= ?', (self._seq,))
+            self._con.execute("COMMIT")
+        except sqlite3.OperationalError:
+            # база занята читателями дольше, чем мы готовы ждать
+            self._con.execute("ROLLBACK")
+            return
+        self._checkpoint = self._con.execute(
+            'SELECT coalesce(max("seq"), 0) FROM "TagBitmap"'
+        ).fetchone()[0]
+        self._dirty = set()
+        self._unsaved = False
+        self._version = self._con.execute("PRAGMA data_version").fetchone()[0]
+
+    def reset(self) -> None:
+        """
+        Забывает карты: при следующем обращении они загружаются заново.
+        Нужно, если база заменена целиком (см. bookkeeper.writebehind).
+        """
+
+        with self._lock:
+            self._version = None
+            self._checkpoint = -1
+
+    def _bitmap(self, tag_id: int) -> int:
+        # вызывается под self._lock: карты меняются на месте при обновлении
+        return int.from_bytes(self._bitmaps.get(tag_id, b""), "little")
+
+    def bitmap(self, tag_id: int) -> int:
+        """
+        Карта метки tag_id в виде целого числа
+        """
+
+        with self._lock:
+            return self._bitmap(tag_id)
+
+    def counts(self) -> dict[str, int]:
+        """
+        Число расходов с каждой меткой: имя -> число
+        """
+
+        self.refresh()
+        with self._lock:
+            return {
+                name: self._bitmap(tag_id).bit_count()
+                for name, tag_id in self._names.items()
+            }
+
+    def evaluate(self, query: str) -> int:
+        """
+        Вычисляет запрос по меткам: имена меток, AND, OR, NOT и скобки
+        (NOT сильнее AND, AND сильнее OR). Имена с пробелами и именами
+        операций записываются в кавычках, неизвестная метка ничего не отбирает.
+        Возвращает карту подходящих расходов.
+        Запрос вычисляется под блокировкой, чтобы обновление из другого
+        потока не изменило карты посреди вычисления.
+        """
+
+        tree: tuple = _QueryParser(query).tree()
+        self.refresh()
+        with self._lock:
+            return self._apply(tree)
+
+    def _apply(self, node: tuple) -> int:
+        # вызывается под self._lock
+        kind: str = node[0]
+        if kind == "tag":
+            return self._bitmap(self._names[node[1]]) if node[1] in self._names else 0
+        if kind == "NOT":
+            return self._bitmap(ALL_EXPENSES) & ~self._apply(node[1])
+        left: int = self._apply(node[1])
+        right: int = self._apply(node[2])
+        return left & right if kind == "AND" else left | right
+
+    def sum_by_category(
+            self, query: str, start: datetime | None = None, end: datetime | None = None
+    ) -> dict[int, float]:
+        """
+        Вычисляет суммы расходов в основной валюте по id категорий
+        за промежуток [start, end) для расходов, отобранных запросом по меткам.
+        Расходы читаются по id из карты, без соединения с таблицей меток.
+        """
+
+        ids: list[int] = list(bits(self.evaluate(query)))
+        if not ids:
+            return {}
+        conditions: list[str] = ['e."obj_id" IN (SELECT "value" FROM json_each(?))']
+        params: list[Any] = [json.dumps(ids)]
+        if start is not None:
+            conditions.append('e."expense_date" >= ?')
+            params.append(start.isoformat(" ", "microseconds"))
+        if end is not None:
+            conditions.append('e."expense_date" < ?')
+            params.append(end.isoformat(" ", "microseconds"))
+        with self._lock:
+            return dict(self._con.execute(
+                f'SELECT e."category_id", total({rates.converted("e")}) '
+                'FROM "Expense" AS e '
+                f'WHERE {" AND ".join(conditions)} GROUP BY e."category_id"',
+                params
+            ))
+
+    def close(self) -> None:
+        """
+        Закрывает соединение с базой
+        """
+
+        self._con.close()
@@ -1,22 +1,58 @@
 """
-Графическое окно
+Графическое окно.
+
+Окно показывается сразу, а данные загружаются после первой отрисовки:
+бюджет и первая страница расходов. Следующие страницы расходов
+загружаются, только когда таблицу прокручивают до конца
+(canFetchMore и fetchMore модели ExpenseTableModel). Данные
+незавершённых миграций базы заполняются порциями, не блокируя цикл
+событий. Сортировка по щелчку на заголовке и строка отбора над таблицей
+расходов переводятся в запрос (см. bookkeeper.listing), таблица
+показывает только его результат. Презентер (и вместе с ним ORM)
+импортируется и создаётся тоже после показа окна.
+Дерево категорий загружается по уровням, при раскрытии узлов
+(см. bookkeeper.hierarchy).
+Флаг --profile-startup печатает время этапов запуска.
 """
 
 import sys
+import time
 from datetime import datetime
 from PySide6 import QtCore, QtWidgets
 
 import typing
 
 import os.path
-sys.path.insert(0, os.path.dirname(sys.argv[0]) + '/..')
+sys.path.insert(0, os.path.dirname(sys.argv[0]) + '/../..')
 
-import presenter
+if typing.TYPE_CHECKING:
+    from bookkeeper import budgets, hierarchy, listing, migrations, presenter
+
+# Отсчёт времени запуска для --profile-startup
+STARTUP_STARTED: float = time.perf_counter()
 
 
 SUGGESTED_ACTION_COLOR = "#CCCCCC"
 DESTRUCTIVE_COLOR = "#AA0000"
 
+UNKNOWN_CATEGORY: str = "Неизвестная категория"
+
+# Сколько расходов загружается в таблицу за одно обращение к базе
+EXPENSES_PAGE_SIZE: int = 200
+
+# Сколько строк заполняется миграциями базы за один проход цикла событий
+MIGRATION_BATCH_SIZE: int = 1000
+
+# Прогноз превышения бюджетов пересчитывается не чаще, чем раз
+# в столько миллисекунд: изменения за это время учитываются вместе
+FORECAST_INTERVAL_MS: int = 2000
+
+# Ключи сортировки расходов по столбцам таблицы (см. bookkeeper.listing)
+EXPENSE_SORT_KEYS: tuple[str, ...] = ("date", "amount", "category", "comment")
+
+# Формат даты расхода в таблице
+EXPENSE_DATE_FORMAT: str = "%d.%m.%y %H:%M:%S"
+
 
 class TitledTable(QtWidgets.QWidget):
     """
@@ -45,7 +81,10 @@ class TitledTable(QtWidgets.QWidget):
         self.hheaders: list[str] = hheaders
         self.vheaders: list[str] = vheaders
 
-        self.refresh()
+        # до загрузки данных таблица пуста, но заголовки уже видны
+        if self.hheaders:
+            self.table.setColumnCount(len(self.hheaders))
+            self.table.setHorizontalHeaderLabels(self.hheaders)
 
         self.layout: QtWidgets.QVBoxLayout = QtWidgets.QVBoxLayout(self)
         self.layout.addWidget(self.text_title)
@@ -60,7 +99,19 @@ class TitledTable(QtWidgets.QWidget):
         """
 
         content: list[list[str]] = self.request_content()
-        self.table.setRowCount(len(content))
+        self.set_rows(0, content)
+        self.set_row_count(len(content))
+
+    def set_rows(self, first_row: int, content: list[list[str]]) -> None:
+        """
+        Записывает строки content в таблицу, начиная со строки first_row.
+        Таблица при необходимости удлиняется.
+        """
+
+        # заполнение ячеек не должно выглядеть как правка пользователя
+        self.table.blockSignals(True)
+        if self.table.rowCount() < first_row + len(content):
+            self.table.setRowCount(first_row + len(content))
         if content:
             self.table.setColumnCount(len(content[0]))
 
@@ -69,13 +120,21 @@ class TitledTable(QtWidgets.QWidget):
         if self.vheaders:
             self.table.setVerticalHeaderLabels(self.vheaders)
 
-        for i, line in enumerate(content):
+        for i, line in enumerate(content, start=first_row):
             for j, item_text in enumerate(line):
                 self.table.setItem(i, j, QtWidgets.QTableWidgetItem(item_text))
+        self.table.blockSignals(False)
 
         self.table.setSizeAdjustPolicy(QtWidgets.QAbstractScrollArea.AdjustToContents)
         self.table.resizeColumnsToContents()
 
+    def set_row_count(self, count: int) -> None:
+        """
+        Обрезает таблицу до count строк
+        """
+
+        self.table.setRowCount(count)
+
     def get_selected_rows(self):
         """
         Возвращает список индексов выделенных строк
@@ -99,115 +158,644 @@ class TitledTable(QtWidgets.QWidget):
         self.notify_item_changed(row, column, new_text)
 
 
-class Window(QtWidgets.QWidget):
+class RefreshScheduler(QtCore.QObject):
     """
-    Класс главного окна приложения.
-    Создаёт всю структуру графического интерфейса,
-    а также отвечает за наполнение его данными
+    Планировщик перерисовки представлений окна.
+    Запрос перерисовки только помечает представление устаревшим;
+    все помеченные представления перерисовываются по одному разу,
+    когда цикл событий освободится (таймер с нулевой задержкой).
+    Так несколько изменений подряд приводят к одной перерисовке.
+
+    requested - сколько раз запрашивалась перерисовка каждого представления
+    performed - сколько раз оно действительно перерисовывалось
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, parent: QtCore.QObject | None = None):
+        super().__init__(parent)
+        self._views: dict[str, typing.Callable[[], None]] = dict()
+        self._dirty: list[str] = list()
+        self.requested: dict[str, int] = dict()
+        self.performed: dict[str, int] = dict()
 
-        self.presenter: presenter.Presenter = presenter.Presenter()
+        self._timer: QtCore.QTimer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self.flush)
 
-        self.categories_ids_list: list[int] = list()
-        self.expenses_ids_list: list[int] = list()
-        self.budgets_ids_list: list[int] = list()
+    def register(self, name: str, refresh: typing.Callable[[], None]) -> None:
+        """
+        Регистрирует представление name с функцией перерисовки refresh
+        """
 
-        def change_exspense_item(row: int, column: int, new_text: str) -> None:
-            """
-            Вызывается при изменении содержимого элемента таблицы
-            (например, после редактирования пользователем).
-            Обеспечивает обработку введённых пользователем данных
-            """
+        self._views[name] = refresh
+        self.requested[name] = 0
+        self.performed[name] = 0
 
-            changed_exp_id: int = self.expenses_ids_list[row]
-
-            old_expense: presenter.Expense = self.presenter.expense_get_by_id(changed_exp_id)
-            match column:
-                case 0:
-                    old_text: str = old_expense.expense_date.strftime("%d.%m.%y %H:%M:%S")
-                case 1:
-                    old_text: str = str(old_expense.amount)
-                case 2:
-                    try:
-                        old_text: str = self.presenter.category_get_by_id(
-                            old_expense.category_id
-                        ).name
-                    except ValueError:
-                        old_text: str = "Неизвестная категория"
-                case 3:
-                    old_text: str = old_expense.comment
-                case _:
-                    raise ValueError("Wrong column index")
+    def request(self, *names: str) -> None:
+        """
+        Помечает представления устаревшими
+        """
 
-            if old_text == new_text:
+        for name in names:
+            if name not in self._views:
+                raise ValueError(f"Unknown view: {name}")
+            self.requested[name] += 1
+            if name not in self._dirty:
+                self._dirty.append(name)
+        if self._dirty and not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self) -> None:
+        """
+        Сразу перерисовывает все устаревшие представления
+        """
+
+        self._timer.stop()
+        dirty: list[str] = self._dirty
+        self._dirty = list()
+        for name in dirty:
+            self.performed[name] += 1
+            self._views[name]()
+
+
+class CategoryListModel(QtCore.QAbstractListModel):
+    """
+    Список категорий, общий для выпадающего списка и таблицы категорий.
+    Загружается из презентера один раз, а при добавлении, переименовании
+    и удалении категории меняется только соответствующая строка.
+    """
+
+    # Сообщение об ошибке при переименовании категории
+    rename_failed: QtCore.Signal = QtCore.Signal(str)
+
+    def __init__(
+            self, bookkeeper_presenter: "presenter.Presenter | None" = None, parent=None
+    ):
+        super().__init__(parent)
+        self.presenter: presenter.Presenter | None = bookkeeper_presenter
+        self._categories: list[tuple[int, str]] = list()
+        self.reload()
+
+    def reload(self) -> None:
+        """
+        Заново загружает все категории из базы.
+        Пока презентер не задан, список пуст.
+        """
+
+        self.beginResetModel()
+        self._categories = [] if self.presenter is None else [
+            (cat.obj_id, cat.name) for cat in self.presenter.categories_get_list()
+        ]
+        self.endResetModel()
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._categories)
+
+    def data(self, index: QtCore.QModelIndex, role: int = QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return self._categories[index.row()][1]
+        if role == QtCore.Qt.UserRole:
+            return self._categories[index.row()][0]
+        return None
+
+    def headerData(
+            self, section: int, orientation: QtCore.Qt.Orientation,
+            role: int = QtCore.Qt.DisplayRole
+    ):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return "Название категории"
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index: QtCore.QModelIndex) -> QtCore.Qt.ItemFlags:
+        return super().flags(index) | QtCore.Qt.ItemIsEditable
+
+    def setData(
+            self, index: QtCore.QModelIndex, value: typing.Any,
+            role: int = QtCore.Qt.EditRole
+    ) -> bool:
+        """
+        Переименовывает категорию.
+        При ошибке испускает rename_failed и оставляет старое имя.
+        """
+
+        if role != QtCore.Qt.EditRole or not index.isValid():
+            return False
+        cat_id, old_name = self._categories[index.row()]
+        new_name: str = str(value)
+        if new_name == old_name:
+            return False
+        if not new_name:
+            self.rename_failed.emit("Имя категории не должно быть пустым")
+            return False
+        try:
+            self.presenter.category_edit_name(cat_id, new_name)
+        except NameError:
+            self.rename_failed.emit(f"Категория \"{new_name}\" уже существует")
+            return False
+        self._categories[index.row()] = (cat_id, new_name)
+        self.dataChanged.emit(index, index, [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole])
+        return True
+
+    def add(self, name: str) -> int:
+        """
+        Создаёт категорию и добавляет её в конец списка.
+        Возвращает номер строки.
+        """
+
+        cat_id: int = self.presenter.category_add(name)
+        row: int = len(self._categories)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self._categories.append((cat_id, name))
+        self.endInsertRows()
+        return row
+
+    def remove(
+            self, row: int, reassign_to: int | None = None, cascade: bool = False
+    ) -> None:
+        """
+        Удаляет категорию из строки row (см. Presenter.category_delete)
+        """
+
+        self.presenter.category_delete(self._categories[row][0], reassign_to, cascade)
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self._categories[row]
+        self.endRemoveRows()
+
+    def category_id(self, row: int) -> int:
+        """
+        id категории в строке row
+        """
+
+        return self._categories[row][0]
+
+    def names(self) -> dict[int, str]:
+        """
+        Словарь "id категории - имя" без обращения к базе
+        """
+
+        return dict(self._categories)
+
+
+class CategoryTreeModel(QtCore.QAbstractItemModel):
+    """
+    Дерево категорий с суммами расходов за период бюджета:
+    собственными и по всему поддереву (см. bookkeeper.hierarchy).
+    Дочерние категории узла загружаются из презентера одним запросом,
+    только когда узел раскрывают, поэтому большое дерево открывается сразу.
+    Внутренний id индекса --- id категории.
+    """
+
+    HEADERS: tuple[str, ...] = ("Категория", "Своё за месяц", "Всего за месяц")
+
+    def __init__(
+            self, bookkeeper_presenter: "presenter.Presenter | None" = None, parent=None
+    ):
+        super().__init__(parent)
+        self.presenter: presenter.Presenter | None = bookkeeper_presenter
+        # Период бюджета, за который показываются суммы (месяц)
+        self.period: int = 2
+        # Загруженные уровни: id родителя (None --- верхний уровень) -> id детей
+        self._children: dict[int | None, list[int]] = dict()
+        self._nodes: dict[int, hierarchy.CategoryNode] = dict()
+        self._parents: dict[int, int | None] = dict()
+        self._rows: dict[int, int] = dict()
+
+    def reload(self) -> None:
+        """
+        Забывает загруженные уровни; верхний уровень
+        загрузится заново, когда его запросит представление
+        """
+
+        self.beginResetModel()
+        self._children = dict()
+        self._nodes = dict()
+        self._parents = dict()
+        self._rows = dict()
+        self.endResetModel()
+
+    def refresh(self) -> None:
+        """
+        Пересчитывает суммы загруженных уровней, по запросу на уровень,
+        не сворачивая раскрытые узлы. Если дерево изменилось
+        (категории добавлены, удалены или перенесены), загружает его заново.
+        """
+
+        if self.presenter is None:
+            return
+        for parent_id, children in list(self._children.items()):
+            nodes: list[hierarchy.CategoryNode] = self.presenter.categories_get_children(
+                parent_id, self.period
+            )
+            if [node.obj_id for node in nodes] != children or any(
+                    node.has_children != self._nodes[node.obj_id].has_children
+                    or node.name != self._nodes[node.obj_id].name
+                    for node in nodes
+            ):
+                self.reload()
                 return
+            for node in nodes:
+                self._nodes[node.obj_id] = node
+            if nodes:
+                self.dataChanged.emit(
+                    self.createIndex(0, 1, nodes[0].obj_id),
+                    self.createIndex(len(nodes) - 1, 2, nodes[-1].obj_id),
+                    [QtCore.Qt.DisplayRole]
+                )
 
-            correct_data: bool = True
+    def _parent_id(self, index: QtCore.QModelIndex) -> int | None:
+        return index.internalId() if index.isValid() else None
+
+    def index(
+            self, row: int, column: int, parent: QtCore.QModelIndex = QtCore.QModelIndex()
+    ) -> QtCore.QModelIndex:
+        children: list[int] = self._children.get(self._parent_id(parent), [])
+        if not 0 <= row < len(children) or not 0 <= column < len(self.HEADERS):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, children[row])
+
+    def parent(self, index: QtCore.QModelIndex) -> QtCore.QModelIndex:
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        parent_id: int | None = self._parents[index.internalId()]
+        if parent_id is None:
+            return QtCore.QModelIndex()
+        return self.createIndex(self._rows[parent_id], 0, parent_id)
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        if parent.column() > 0:
+            return 0
+        return len(self._children.get(self._parent_id(parent), []))
+
+    def columnCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return len(self.HEADERS)
+
+    def hasChildren(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> bool:
+        if not parent.isValid():
+            return self.presenter is not None
+        return parent.column() == 0 and self._nodes[parent.internalId()].has_children
+
+    def canFetchMore(self, parent: QtCore.QModelIndex) -> bool:
+        return self.hasChildren(parent) and self._parent_id(parent) not in self._children
+
+    def fetchMore(self, parent: QtCore.QModelIndex) -> None:
+        """
+        Загружает дочерние категории узла parent одним запросом
+        """
 
-            if column == 0:
+        parent_id: int | None = self._parent_id(parent)
+        nodes: list[hierarchy.CategoryNode] = self.presenter.categories_get_children(
+            parent_id, self.period
+        )
+        if nodes:
+            self.beginInsertRows(parent, 0, len(nodes) - 1)
+        self._children[parent_id] = [node.obj_id for node in nodes]
+        for row, node in enumerate(nodes):
+            self._nodes[node.obj_id] = node
+            self._parents[node.obj_id] = parent_id
+            self._rows[node.obj_id] = row
+        if nodes:
+            self.endInsertRows()
+
+    def data(self, index: QtCore.QModelIndex, role: int = QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node: hierarchy.CategoryNode = self._nodes[index.internalId()]
+        if role == QtCore.Qt.DisplayRole:
+            return (node.name, str(node.own), str(node.total))[index.column()]
+        if role == QtCore.Qt.UserRole:
+            return node.obj_id
+        return None
+
+    def headerData(
+            self, section: int, orientation: QtCore.Qt.Orientation,
+            role: int = QtCore.Qt.DisplayRole
+    ):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+
+class ExpenseTableModel(QtCore.QAbstractTableModel):
+    """
+    Таблица расходов в порядке и с отбором, заданными для запроса
+    (см. Presenter.expenses_get_sorted_page). Сразу загружается только
+    первая страница; следующая загружается, когда представление
+    прокручено до конца и запрашивает её (canFetchMore, fetchMore).
+    Правка ячейки меняет расход в базе и только эту строку таблицы.
+    """
+
+    HEADERS: tuple[str, ...] = ("Дата", "Сумма", "Категория", "Комментарий")
+
+    # Сообщение об ошибке при правке расхода
+    edit_failed: QtCore.Signal = QtCore.Signal(str)
+    # Расход изменён или удалён
+    expenses_changed: QtCore.Signal = QtCore.Signal()
+
+    def __init__(
+            self, categories: CategoryListModel,
+            bookkeeper_presenter: "presenter.Presenter | None" = None, parent=None
+    ):
+        super().__init__(parent)
+        self.presenter: presenter.Presenter | None = bookkeeper_presenter
+        self.categories: CategoryListModel = categories
+        self.sort: str = "id"
+        self.descending: bool = False
+        self.filters: listing.ExpenseFilter | None = None
+        self._expenses: list[presenter.Expense] = list()
+        self._exhausted: bool = True
+
+    def reload(
+            self, sort: str = "id", descending: bool = False,
+            filters: "listing.ExpenseFilter | None" = None
+    ) -> None:
+        """
+        Задаёт порядок и отбор и загружает первую страницу расходов.
+        Пока презентер не задан, таблица пуста.
+        """
+
+        self.beginResetModel()
+        self.sort = sort
+        self.descending = descending
+        self.filters = filters
+        self._expenses = list()
+        self._exhausted = self.presenter is None
+        self.endResetModel()
+        if not self._exhausted:
+            self.fetchMore(QtCore.QModelIndex())
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._expenses)
+
+    def columnCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent: QtCore.QModelIndex) -> bool:
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent: QtCore.QModelIndex) -> None:
+        """
+        Загружает следующую страницу расходов одним запросом
+        """
+
+        if not self.canFetchMore(parent):
+            return
+        page: list[presenter.Expense] = self.presenter.expenses_get_sorted_page(
+            self.sort, self.descending, self.filters,
+            self._expenses[-1].obj_id if self._expenses else 0, EXPENSES_PAGE_SIZE
+        )
+        self._exhausted = len(page) < EXPENSES_PAGE_SIZE
+        if page:
+            row: int = len(self._expenses)
+            self.beginInsertRows(QtCore.QModelIndex(), row, row + len(page) - 1)
+            self._expenses.extend(page)
+            self.endInsertRows()
+
+    def _text(self, expense: "presenter.Expense", column: int) -> str:
+        match column:
+            case 0:
+                return expense.expense_date.strftime(EXPENSE_DATE_FORMAT)
+            case 1:
+                return str(expense.amount)
+            case 2:
+                return self.categories.names().get(expense.category_id, UNKNOWN_CATEGORY)
+            case 3:
+                return expense.comment
+            case _:
+                raise ValueError("Wrong column index")
+
+    def data(self, index: QtCore.QModelIndex, role: int = QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        expense: presenter.Expense = self._expenses[index.row()]
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return self._text(expense, index.column())
+        if role == QtCore.Qt.UserRole:
+            return expense.obj_id
+        return None
+
+    def headerData(
+            self, section: int, orientation: QtCore.Qt.Orientation,
+            role: int = QtCore.Qt.DisplayRole
+    ):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index: QtCore.QModelIndex) -> QtCore.Qt.ItemFlags:
+        return super().flags(index) | QtCore.Qt.ItemIsEditable
+
+    def setData(
+            self, index: QtCore.QModelIndex, value: typing.Any,
+            role: int = QtCore.Qt.EditRole
+    ) -> bool:
+        """
+        Изменяет расход по введённому в ячейку тексту.
+        При ошибке испускает edit_failed и оставляет старое значение.
+        Порядок строк не меняется до следующей перезагрузки таблицы.
+        """
+
+        if role != QtCore.Qt.EditRole or not index.isValid():
+            return False
+        expense: presenter.Expense = self._expenses[index.row()]
+        new_text: str = str(value)
+        if new_text == self._text(expense, index.column()):
+            return False
+
+        match index.column():
+            case 0:
                 try:
-                    new_date: datetime = datetime.strptime(new_text, "%d.%m.%y %H:%M:%S")
+                    new_date: datetime = datetime.strptime(new_text, EXPENSE_DATE_FORMAT)
                 except ValueError:
-                    show_dialog(
-                        self,
-                        "Не удалось изменить данные",
-                        f"Некорректная дата: {new_text}"
-                    )
-                    correct_data = False
-            elif column == 1:
+                    self.edit_failed.emit(f"Некорректная дата: {new_text}")
+                    return False
+                self.presenter.expense_edit_date(expense.obj_id, new_date)
+            case 1:
                 try:
                     new_cost: float = float(new_text)
                 except ValueError:
-                    show_dialog(
-                        self,
-                        "Не удалось изменить данные",
-                        f"Некорректная сумма: {new_text}"
-                    )
-                    correct_data = False
+                    self.edit_failed.emit(f"Некорректная сумма: {new_text}")
+                    return False
+                self.presenter.expense_edit_cost(expense.obj_id, new_cost)
+            case 2:
+                try:
+                    self.presenter.expense_edit_category_by_name(expense.obj_id, new_text)
+                except NameError:
+                    self.edit_failed.emit(f"Некорректная категория: {new_text}")
+                    return False
+            case 3:
+                self.presenter.expense_edit_comment(expense.obj_id, new_text)
+            case _:
+                raise ValueError("Wrong column index")
+
+        self._expenses[index.row()] = self.presenter.expense_get_by_id(expense.obj_id)
+        self.dataChanged.emit(
+            self.index(index.row(), 0), self.index(index.row(), len(self.HEADERS) - 1),
+            [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole]
+        )
+        self.expenses_changed.emit()
+        return True
 
-            if correct_data:
-                match column:
-                    case 0:
-                        self.presenter.expense_edit_date(changed_exp_id, new_date)
-                    case 1:
-                        self.presenter.expense_edit_cost(changed_exp_id, new_cost)
-                    case 2:
-                        try:
-                            self.presenter.expense_edit_category_by_name(
-                                changed_exp_id, new_text
-                            )
-                        except NameError:
-                            show_dialog(
-                                self,
-                                "Не удалось изменить данные",
-                                f"Некорректная категория: {new_text}"
-                            )
-                    case 3:
-                        self.presenter.expense_edit_comment(changed_exp_id, new_text)
-                    case _:
-                        raise ValueError("Wrong column index")
-
-            self.table_expenses.refresh()
-            self.table_budget.refresh()
-
-        self.table_expenses: TitledTable = TitledTable(
-            "Последние расходы",
-            self.get_expences_list,
-            change_exspense_item,
-            hheaders=("Дата", "Сумма", "Категория", "Комментарий")
+    def remove(self, row: int) -> None:
+        """
+        Удаляет расход из строки row
+        """
+
+        self.presenter.expense_delete(self._expenses[row].obj_id)
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self._expenses[row]
+        self.endRemoveRows()
+        self.expenses_changed.emit()
+
+
+class TitledView(QtWidgets.QWidget):
+    """
+    Таблица с заголовком, показывающая готовую модель
+    """
+
+    def __init__(self, title: str, model: QtCore.QAbstractItemModel):
+        super().__init__()
+
+        self.title: str = title
+        self.text_title: QtWidgets.QLabel = QtWidgets.QLabel(self.title)
+        self.table: QtWidgets.QTableView = QtWidgets.QTableView(self)
+        self.table.setModel(model)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setSizeAdjustPolicy(QtWidgets.QAbstractScrollArea.AdjustToContents)
+
+        self.layout: QtWidgets.QVBoxLayout = QtWidgets.QVBoxLayout(self)
+        self.layout.addWidget(self.text_title)
+        self.layout.addWidget(self.table)
+
+    def get_selected_rows(self):
+        """
+        Возвращает список индексов выделенных строк
+        """
+
+        return sorted(
+            [selected.row() for selected in self.table.selectionModel().selectedRows()]
+        )
+
+
+class TitledTree(QtWidgets.QWidget):
+    """
+    Дерево с заголовком, показывающее готовую модель
+    """
+
+    def __init__(self, title: str, model: QtCore.QAbstractItemModel):
+        super().__init__()
+
+        self.title: str = title
+        self.text_title: QtWidgets.QLabel = QtWidgets.QLabel(self.title)
+        self.tree: QtWidgets.QTreeView = QtWidgets.QTreeView(self)
+        self.tree.setModel(model)
+        self.tree.setUniformRowHeights(True)
+        self.tree.header().setStretchLastSection(True)
+
+        self.layout: QtWidgets.QVBoxLayout = QtWidgets.QVBoxLayout(self)
+        self.layout.addWidget(self.text_title)
+        self.layout.addWidget(self.tree)
+
+
+class Window(QtWidgets.QWidget):
+    """
+    Класс главного окна приложения.
+    Создаёт всю структуру графического интерфейса,
+    а также отвечает за наполнение его данными
+    """
+
+    def __init__(self, profile_startup: bool = False, in_memory: bool = False):
+        super().__init__()
+
+        # Презентер создаётся в load_data, после показа окна
+        self.presenter: presenter.Presenter | None = None
+
+        # Время этапов запуска в секундах от STARTUP_STARTED
+        self.startup_times: dict[str, float] = dict()
+        self.profile_startup: bool = profile_startup
+        # Работать с копией базы в памяти, записывая изменения на диск в фоне
+        self.in_memory: bool = in_memory
+        # Порядок таблицы расходов; до щелчка на заголовке --- порядок внесения
+        self.expenses_sort: str = "id"
+        self.expenses_descending: bool = False
+        # Категория, выбранная в строке отбора; None --- все категории
+        self.filter_category_id: int | None = None
+
+        self.categories_model: CategoryListModel = CategoryListModel(parent=self)
+        self.category_tree_model: CategoryTreeModel = CategoryTreeModel(parent=self)
+        self.refresh_scheduler: RefreshScheduler = RefreshScheduler(self)
+        self.budgets_ids_list: list[int] = list()
+        # Вероятности превышения бюджетов по их id
+        self.budget_risks: dict[int, float] = dict()
+
+        self.expenses_model: ExpenseTableModel = ExpenseTableModel(
+            self.categories_model, parent=self
+        )
+        self.expenses_model.edit_failed.connect(
+            lambda message: show_dialog(self, "Не удалось изменить данные", message)
+        )
+        self.expenses_model.expenses_changed.connect(
+            lambda: self.refresh_scheduler.request("budget")
+        )
+        self.table_expenses: TitledView = TitledView(
+            "Последние расходы", self.expenses_model
+        )
+        # таблица не растягивается по всем строкам: иначе представление
+        # не прокручивается и само запрашивает все страницы расходов
+        self.table_expenses.table.setSizeAdjustPolicy(
+            QtWidgets.QAbstractScrollArea.AdjustIgnored
+        )
+        header: QtWidgets.QHeaderView = self.table_expenses.table.horizontalHeader()
+        header.setSectionsClickable(True)
+        header.sectionClicked.connect(self.sort_expenses)
+
+        # begin 'filter expenses' box
+        self.filter_category_combo_box: QtWidgets.QComboBox = QtWidgets.QComboBox()
+        self.filter_category_combo_box.setModel(self.categories_model)
+        self.filter_category_combo_box.setPlaceholderText("Все категории")
+        self.filter_category_combo_box.setCurrentIndex(-1)
+        # выбор пользователя; при изменении списка категорий выпадающий список
+        # сам меняет текущую строку, и она восстанавливается по filter_category_id
+        self.filter_category_combo_box.activated.connect(self.filter_by_category)
+        for signal in (
+                self.categories_model.modelReset,
+                self.categories_model.rowsInserted,
+                self.categories_model.rowsRemoved
+        ):
+            signal.connect(self._show_filter_category)
+        self.filter_min_entry: QtWidgets.QLineEdit = QtWidgets.QLineEdit()
+        self.filter_min_entry.setPlaceholderText("сумма от")
+        self.filter_max_entry: QtWidgets.QLineEdit = QtWidgets.QLineEdit()
+        self.filter_max_entry.setPlaceholderText("сумма до")
+        self.filter_comment_entry: QtWidgets.QLineEdit = QtWidgets.QLineEdit()
+        self.filter_comment_entry.setPlaceholderText("комментарий содержит")
+        self.filter_entries: tuple[QtWidgets.QLineEdit, ...] = (
+            self.filter_min_entry, self.filter_max_entry, self.filter_comment_entry
         )
+        for entry in self.filter_entries:
+            entry.editingFinished.connect(self.reload_expenses)
+
+        self.filter_reset_button: QtWidgets.QPushButton = QtWidgets.QPushButton(
+            "Сбросить"
+        )
+        self.filter_reset_button.clicked.connect(self.reset_expenses_filter)
+
+        self.filter_expenses_box: QtWidgets.QHBoxLayout = QtWidgets.QHBoxLayout()
+        self.filter_expenses_box.addWidget(QtWidgets.QLabel("Отбор:"))
+        self.filter_expenses_box.addWidget(self.filter_category_combo_box)
+        self.filter_expenses_box.addWidget(self.filter_min_entry)
+        self.filter_expenses_box.addWidget(self.filter_max_entry)
+        self.filter_expenses_box.addWidget(self.filter_comment_entry)
+        self.filter_expenses_box.addWidget(self.filter_reset_button)
+        # end 'filter expenses' box
 
         # begin 'add expense' box
         self.cost_label: QtWidgets.QLabel = QtWidgets.QLabel("Сумма:")
         self.cost_entry: QtWidgets.QLineEdit = QtWidgets.QLineEdit()
         self.category_label: QtWidgets.QLabel = QtWidgets.QLabel("Категория:")
         self.category_combo_box: QtWidgets.QComboBox = QtWidgets.QComboBox()
-        self.category_combo_box.addItems(
-            [line[0] for line in self.get_categories_list(update_inds=False)]
-        )
+        self.category_combo_box.setModel(self.categories_model)
         self.comment_label: QtWidgets.QLabel = QtWidgets.QLabel("Комментарий:")
         self.comment_entry: QtWidgets.QLineEdit = QtWidgets.QLineEdit()
 
@@ -236,13 +824,9 @@ class Window(QtWidgets.QWidget):
             Обеспечивает удаление расходов из базы
             """
 
-            deleted: int = 0
-            for index in self.table_expenses.get_selected_rows():
-                exp_id = self.expenses_ids_list.pop(index - deleted)
-                self.presenter.expense_delete(exp_id)
-                deleted += 1
-            self.table_expenses.refresh()
-            self.table_budget.refresh()
+            # с конца, чтобы удаление строки не сдвигало следующие
+            for row in reversed(self.table_expenses.get_selected_rows()):
+                self.expenses_model.remove(row)
 
         self.delete_expenses_button: QtWidgets.QPushButton = QtWidgets.QPushButton(
             "Удалить выделенные расходы"
@@ -252,49 +836,23 @@ class Window(QtWidgets.QWidget):
         )
         self.delete_expenses_button.clicked.connect(delete_expenses)
 
-        def change_category_item(row: int, column: int, new_text: str) -> None:
-            """
-            Вызывается, когда меняется содержимое ячейки таблицы категорий
-            (при редактировании пользователем)
-            Обеспечивает изменение данных в базе
-            """
-
-            changed_cat_id: presenter.Category = self.categories_ids_list[row]
-            old_text: str = self.presenter.category_get_by_id(changed_cat_id).name
-            if old_text == new_text:
-                return
-
-            correct_data: bool = True
-            if not new_text:
-                show_dialog(
-                    self,
-                    "Не удалось изменить категорию",
-                    "Имя категории не должно быть пустым"
-                )
-                correct_data = False
-
-            if correct_data:
-                try:
-                    self.presenter.category_edit_name(changed_cat_id, new_text)
-                except NameError:
-                    show_dialog(
-                        self,
-                        "Не удалось изменить категорию",
-                        f"Категория \"{new_text}\" уже существует"
-                    )
-                else:
-                    self.category_combo_box.removeItem(row)
-                    self.category_combo_box.insertItem(row, new_text)
-
-            self.table_categories.refresh()
-            self.table_expenses.refresh()
-
-        self.table_categories: TitledTable = TitledTable(
-            "Категории",
-            self.get_categories_list,
-            change_category_item,
-            hheaders=["Название категории"]
+        self.table_categories: TitledView = TitledView("Категории", self.categories_model)
+        self.categories_model.rename_failed.connect(
+            lambda message: show_dialog(self, "Не удалось изменить категорию", message)
+        )
+        self.categories_model.dataChanged.connect(
+            lambda *args: self.refresh_scheduler.request("expenses")
         )
+        # дерево категорий с суммами; меняется вместе со списком категорий
+        self.tree_categories: TitledTree = TitledTree(
+            "Дерево категорий", self.category_tree_model
+        )
+        for signal in (
+                self.categories_model.dataChanged,
+                self.categories_model.rowsInserted,
+                self.categories_model.rowsRemoved
+        ):
+            signal.connect(lambda *args: self.refresh_scheduler.request("category_tree"))
 
         # begin 'add category' box
         self.new_category_label: QtWidgets.QLabel = QtWidgets.QLabel("Новая категория:")
@@ -321,14 +879,21 @@ class Window(QtWidgets.QWidget):
             Обеспечивает удаление категории из базы
             """
 
-            deleted: int = 0
-            for index in self.table_categories.get_selected_rows():
-                cat_id: presenter.Category = self.categories_ids_list.pop(index - deleted)
-                self.presenter.category_delete(cat_id)
-                self.category_combo_box.removeItem(index - deleted)
-                deleted += 1
-            self.table_categories.refresh()
-            self.table_expenses.refresh()
+            # с конца, чтобы удаление строки не сдвигало следующие
+            for row in reversed(self.table_categories.get_selected_rows()):
+                try:
+                    self.categories_model.remove(row)
+                except ValueError:
+                    # у категории есть расходы: спрашиваем, что с ними сделать
+                    names: dict[int, str] = self.categories_model.names()
+                    answer: tuple[bool, int | None] | None = ask_expenses_fate(
+                        self, names.pop(self.categories_model.category_id(row)), names
+                    )
+                    if answer is None:
+                        continue
+                    cascade, reassign_to = answer
+                    self.categories_model.remove(row, reassign_to, cascade)
+            self.refresh_scheduler.request("expenses", "budget")
 
         self.delete_categories_button = QtWidgets.QPushButton(
             "Удалить выделенные категории"
@@ -344,7 +909,7 @@ class Window(QtWidgets.QWidget):
                 return
 
             if column != 1:
-                self.table_budget.refresh()
+                self.refresh_scheduler.request("budget")
                 return
 
             correct_data: bool = True
@@ -362,7 +927,7 @@ class Window(QtWidgets.QWidget):
 
             if correct_data:
                 self.presenter.budget_edit_limit(self.budgets_ids_list[row], limit)
-            self.table_budget.refresh()
+            self.refresh_scheduler.request("budget")
 
         table_budget_hheaders: tuple[str] = ("Сумма", "Бюджет", "Статус")
         table_budget_vheaders: tuple[str] = ("День", "Неделя", "Месяц")
@@ -374,7 +939,19 @@ class Window(QtWidgets.QWidget):
             vheaders=table_budget_vheaders
         )
 
+        self.refresh_scheduler.register("expenses", self.reload_expenses)
+        self.refresh_scheduler.register("budget", self.refresh_budget)
+        self.refresh_scheduler.register("forecast", self.refresh_forecast)
+        self._forecast_timer: QtCore.QTimer = QtCore.QTimer(self)
+        self._forecast_timer.setSingleShot(True)
+        self._forecast_timer.setInterval(FORECAST_INTERVAL_MS)
+        self._forecast_timer.timeout.connect(
+            lambda: self.refresh_scheduler.request("forecast")
+        )
+        self.refresh_scheduler.register("category_tree", self.category_tree_model.refresh)
+
         self.layout: QtWidgets.QVBoxLayout = QtWidgets.QVBoxLayout(self)
+        self.layout.addLayout(self.filter_expenses_box)
         self.layout.addWidget(self.table_expenses)
         self.layout.addLayout(self.add_expense_box)
         self.layout.addWidget(
@@ -385,8 +962,222 @@ class Window(QtWidgets.QWidget):
         self.layout.addWidget(
             self.delete_categories_button, alignment=QtCore.Qt.AlignRight
         )
+        self.layout.addWidget(self.tree_categories)
         self.layout.addWidget(self.table_budget)
 
+        # последнее оповещение о пройденном пороге бюджета
+        self.budget_alert_label: QtWidgets.QLabel = QtWidgets.QLabel()
+        self.budget_alert_label.setStyleSheet(f"color: {DESTRUCTIVE_COLOR}")
+        self.budget_alert_label.hide()
+        self.layout.addWidget(self.budget_alert_label)
+
+        # ход заполнения данных миграций базы, виден только во время заполнения
+        self.migration_label: QtWidgets.QLabel = QtWidgets.QLabel()
+        self.migration_label.hide()
+        self.layout.addWidget(self.migration_label)
+
+        # до загрузки данных окно показывается, но не принимает ввод
+        self.setEnabled(False)
+        self._mark_startup("window_created")
+
+    def showEvent(self, event) -> None:
+        """
+        При первом показе окна запускает загрузку данных
+        """
+
+        super().showEvent(event)
+        if "window_shown" not in self.startup_times:
+            self._mark_startup("window_shown")
+            QtCore.QTimer.singleShot(0, self.load_data)
+
+    def _mark_startup(self, stage: str) -> None:
+        self.startup_times[stage] = time.perf_counter() - STARTUP_STARTED
+
+    def load_data(self) -> None:
+        """
+        Создаёт презентер и показывает бюджет и первую страницу расходов.
+        Затем запускает заполнение данных незавершённых миграций базы.
+        """
+
+        # пустое окно отрисовывается до начала долгой работы
+        self.repaint()
+        from bookkeeper.presenter import Presenter
+
+        self.presenter = Presenter(in_memory=self.in_memory)
+        self.presenter.budgets_subscribe(self.show_budget_alert)
+        self._mark_startup("presenter_ready")
+
+        self.categories_model.presenter = self.presenter
+        self.categories_model.reload()
+        self.category_tree_model.presenter = self.presenter
+        self.category_tree_model.reload()
+        self.refresh_budget()
+        self._mark_startup("budget_loaded")
+
+        self.setEnabled(True)
+        self.expenses_model.presenter = self.presenter
+        self.reload_expenses()
+        self._mark_startup("first_page_loaded")
+        if self.profile_startup:
+            self.print_startup_profile()
+        QtCore.QTimer.singleShot(0, self.migrate_step)
+
+    def refresh_budget(self) -> None:
+        """
+        Перерисовывает таблицу бюджета.
+        Прогноз превышения пересчитывается не сразу, а по таймеру:
+        одно пересчитывание на все изменения за FORECAST_INTERVAL_MS.
+        """
+
+        self.table_budget.refresh()
+        # суммы в дереве категорий меняются вместе с суммами бюджета
+        self.refresh_scheduler.request("category_tree")
+        if not self._forecast_timer.isActive():
+            self._forecast_timer.start()
+
+    def refresh_forecast(self) -> None:
+        """
+        Пересчитывает вероятности превышения бюджетов
+        и показывает их в таблице бюджета. Если дневные суммы и бюджеты
+        не изменились, презентер возвращает прошлый прогноз.
+        """
+
+        self.budget_risks = self.presenter.budgets_forecast([
+            self.presenter.budget_get_by_period(period) for period in range(3)
+        ])
+        self.table_budget.refresh()
+
+    def reload_expenses(self) -> None:
+        """
+        Перезагружает таблицу расходов с текущими порядком и отбором.
+        Загружается только первая страница, остальные --- при прокрутке.
+        """
+
+        if self.presenter is None:
+            return
+        self.expenses_model.reload(
+            self.expenses_sort, self.expenses_descending, self.expenses_filter()
+        )
+
+    def sort_expenses(self, column: int) -> None:
+        """
+        Сортирует расходы по столбцу column; повторный щелчок
+        по тому же столбцу меняет направление сортировки
+        """
+
+        sort: str = EXPENSE_SORT_KEYS[column]
+        self.expenses_descending = (
+            sort == self.expenses_sort and not self.expenses_descending
+        )
+        self.expenses_sort = sort
+        self.table_expenses.table.horizontalHeader().setSortIndicator(
+            column,
+            QtCore.Qt.DescendingOrder if self.expenses_descending
+            else QtCore.Qt.AscendingOrder
+        )
+        self.table_expenses.table.horizontalHeader().setSortIndicatorShown(True)
+        self.reload_expenses()
+
+    def filter_by_category(self, row: int) -> None:
+        """
+        Оставляет в таблице расходы категории из строки row списка категорий
+        """
+
+        self.filter_category_id = self.categories_model.category_id(row)
+        self.reload_expenses()
+
+    def _show_filter_category(self, *args) -> None:
+        ids: list[int] = list(self.categories_model.names())
+        if self.filter_category_id not in ids and self.filter_category_id is not None:
+            # категория удалена
+            self.filter_category_id = None
+            self.refresh_scheduler.request("expenses")
+        self.filter_category_combo_box.setCurrentIndex(
+            -1 if self.filter_category_id is None else ids.index(self.filter_category_id)
+        )
+
+    def reset_expenses_filter(self) -> None:
+        """
+        Снимает все условия отбора расходов
+        """
+
+        for entry in self.filter_entries:
+            entry.clear()
+        self.filter_category_id = None
+        self.filter_category_combo_box.setCurrentIndex(-1)
+        self.reload_expenses()
+
+    def expenses_filter(self) -> "listing.ExpenseFilter":
+        """
+        Условия отбора из строки над таблицей расходов.
+        Некорректные границы суммы не учитываются и подсвечиваются.
+        """
+
+        from bookkeeper.listing import ExpenseFilter
+
+        bounds: list[float | None] = []
+        for entry in (self.filter_min_entry, self.filter_max_entry):
+            try:
+                bounds.append(float(entry.text()) if entry.text() else None)
+                entry.setStyleSheet("")
+            except ValueError:
+                bounds.append(None)
+                entry.setStyleSheet(f"color: {DESTRUCTIVE_COLOR}")
+        return ExpenseFilter(
+            category_ids=None if self.filter_category_id is None else (
+                self.filter_category_id,
+            ),
+            min_amount=bounds[0],
+            max_amount=bounds[1],
+            comment=self.filter_comment_entry.text() or None
+        )
+
+    def migrate_step(self) -> None:
+        """
+        Заполняет одну порцию данных незавершённых миграций базы.
+        Следующая порция заполняется на следующем проходе цикла событий,
+        поэтому окно остаётся отзывчивым.
+        """
+
+        if self.presenter.migrate(
+                MIGRATION_BATCH_SIZE, self._show_migration, max_batches=1
+        ):
+            self.migration_label.hide()
+            return
+        QtCore.QTimer.singleShot(0, self.migrate_step)
+
+    def _show_migration(self, progress: "migrations.Progress") -> None:
+        total: int = progress.done + progress.remaining
+        self.migration_label.setText(
+            f"Обновление базы данных: {progress.done} из {total}"
+        )
+        self.migration_label.show()
+
+    def show_budget_alert(self, alert: "budgets.BudgetAlert") -> None:
+        """
+        Показывает оповещение о том, что расходы бюджета дошли до порога лимита
+        """
+
+        names: dict[int, str] = dict(zip(
+            self.budgets_ids_list,
+            ("бюджета на день", "бюджета на неделю", "бюджета на месяц")
+        ))
+        name: str = names.get(alert.budget_id, f"бюджета №{alert.budget_id}")
+        self.budget_alert_label.setText(
+            f"Расходы {name} достигли {alert.threshold:.0%} лимита: "
+            f"{alert.spent:g} из {alert.limit:g}"
+        )
+        self.budget_alert_label.show()
+
+    def print_startup_profile(self) -> None:
+        """
+        Печатает время этапов запуска в стандартный поток ошибок
+        """
+
+        for stage, seconds in self.startup_times.items():
+            print(f"{stage:>20}: {seconds * 1000:8.1f} ms", file=sys.stderr)
+        print(f"{'expenses':>20}: {self.expenses_model.rowCount():8d}", file=sys.stderr)
+
     def add_expense_cb(self) -> None:
         """
         Вызывается при нажатии кнопки "добавить расход".
@@ -412,6 +1203,18 @@ class Window(QtWidgets.QWidget):
             return
 
         try:
+            # повторное нажатие кнопки не должно незаметно удваивать расход
+            duplicate: int | None = self.presenter.expense_find_duplicate(
+                fcoast, category, comment
+            )
+            if duplicate is not None:
+                answer = QtWidgets.QMessageBox.question(
+                    self,
+                    "Повторный расход",
+                    "Такой расход сегодня уже внесён. Добавить ещё один?"
+                )
+                if answer != QtWidgets.QMessageBox.StandardButton.Yes:
+                    return
             self.presenter.expense_add(fcoast, category, comment)
         except NameError:
             show_dialog(
@@ -420,8 +1223,7 @@ class Window(QtWidgets.QWidget):
                 f"Некорректная категория: {category}"
             )
 
-        self.table_expenses.refresh()
-        self.table_budget.refresh()
+        self.refresh_scheduler.request("expenses", "budget")
 
         self.cost_entry.clear()
         self.comment_entry.clear()
@@ -443,7 +1245,7 @@ class Window(QtWidgets.QWidget):
             return
 
         try:
-            self.presenter.category_add(category_name)
+            self.categories_model.add(category_name)
         except NameError:
             show_dialog(
                 self,
@@ -452,51 +1254,8 @@ class Window(QtWidgets.QWidget):
             )
             return
 
-        self.table_categories.refresh()
-        self.category_combo_box.addItem(category_name)
-
         self.new_category_entry.clear()
 
-    def get_expences_list(self) -> list[list[str]]:
-        """
-        Запрашивает список всех расходов из базы.
-        """
-
-        self.expenses_ids_list = list()
-        res: list[list[str]] = list()
-
-        for expense in self.presenter.expenses_get_list():
-            self.expenses_ids_list.append(expense.obj_id)
-
-            try:
-                cat_name: str = self.presenter.category_get_by_id(expense.category_id).name
-            except ValueError:
-                cat_name: str = "Неизвестная категория"
-
-            res.append([
-                expense.expense_date.strftime("%d.%m.%y %H:%M:%S"),
-                str(expense.amount),
-                cat_name,
-                expense.comment
-            ])
-
-        return res
-
-    def get_categories_list(self, update_inds: bool = True) -> list[list[str]]:
-        """
-        Запрашивает список всех категорий из базы.
-        """
-
-        if update_inds:
-            self.categories_ids_list = list()
-
-        res: list[list[str]] = list()
-        for category in self.presenter.categories_get_list():
-            if update_inds:
-                self.categories_ids_list.append(category.obj_id)
-            res.append([category.name])
-        return res
-
     def get_budget(self) -> list[list[str]]:
         """
         Запрашивает данные о бюджете
@@ -518,17 +1277,68 @@ class Window(QtWidgets.QWidget):
 
         self.budgets_ids_list = [day_bdg.obj_id, week_bdg.obj_id, month_bdg.obj_id]
 
-        warning: str = "Расходы превышают установленный бюджет"
         return [
-            [str(bdg_day), str(day_limit), "" if bdg_day <= day_limit else warning],
-            [str(bdg_week), str(week_limit), "" if bdg_week <= week_limit else warning],
+            [
+                str(bdg_day),
+                str(day_limit),
+                self._budget_status(day_bdg.obj_id, bdg_day, day_limit)
+            ],
+            [
+                str(bdg_week),
+                str(week_limit),
+                self._budget_status(week_bdg.obj_id, bdg_week, week_limit)
+            ],
             [
                 str(bdg_month),
                 str(month_limit),
-                "" if bdg_month <= month_limit else warning
+                self._budget_status(month_bdg.obj_id, bdg_month, month_limit)
             ]
         ]
 
+    def _budget_status(self, bdg_id: int, spent: float, limit: float) -> str:
+        if spent > limit:
+            return "Расходы превышают установленный бюджет"
+        if bdg_id in self.budget_risks:
+            return f"Вероятность превышения: {self.budget_risks[bdg_id]:.0%}"
+        return ""
+
+
+def ask_expenses_fate(
+        widget: Window, cat_name: str, other_names: dict[int, str]
+) -> tuple[bool, int | None] | None:
+    """
+    Спрашивает, что сделать с расходами удаляемой категории:
+    удалить их или перенести в одну из категорий other_names.
+    Возвращает пару (удалить ли расходы, id категории для переноса)
+    или None, если пользователь передумал удалять категорию.
+    """
+
+    dialog: QtWidgets.QMessageBox = QtWidgets.QMessageBox(widget)
+    dialog.setWindowTitle("Удаление категории")
+    dialog.setText(f"В категории \"{cat_name}\" есть расходы. Что с ними сделать?")
+    cascade_button = dialog.addButton(
+        "Удалить расходы", QtWidgets.QMessageBox.DestructiveRole
+    )
+    reassign_button = dialog.addButton(
+        "Перенести в другую категорию", QtWidgets.QMessageBox.AcceptRole
+    )
+    reassign_button.setEnabled(bool(other_names))
+    dialog.addButton(QtWidgets.QMessageBox.Cancel)
+    dialog.exec()
+
+    if dialog.clickedButton() is cascade_button:
+        return True, None
+    if dialog.clickedButton() is not reassign_button:
+        return None
+
+    name, ok = QtWidgets.QInputDialog.getItem(
+        widget, "Удаление категории", "Перенести расходы в категорию:",
+        list(other_names.values()), 0, False
+    )
+    if not ok:
+        return None
+    return False, next(cat_id for cat_id, other in other_names.items() if other == name)
+
 
 def show_dialog(widget: Window, title: str, message: str):
     """
@@ -548,9 +1358,12 @@ def show_dialog(widget: Window, title: str, message: str):
 
 
 if __name__ == "__main__":
-    app: QtWidgets.QApplication = QtWidgets.QApplication([])
+    app: QtWidgets.QApplication = QtWidgets.QApplication(sys.argv)
 
-    widget: Window = Window()
+    widget: Window = Window(
+        profile_startup="--profile-startup" in app.arguments(),
+        in_memory="--in-memory" in app.arguments()
+    )
     widget.setWindowTitle("The Bookkeeper App")
     widget.resize(800, 600)
     widget.show()
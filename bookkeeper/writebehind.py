@@ -0,0 +1,401 @@
+"""
+Работа с рабочей копией базы в памяти и отложенной записью на диск.
+
+В этом режиме презентер работает с копией базы, загруженной при запуске
+через backup API в файл в оперативной памяти (каталог /dev/shm, если он есть),
+поэтому изменения в таблицах окна не ждут диска. Диск видит изменения так:
+
+    1. Триггеры рабочей копии отмечают в таблице Dirty ключи изменённых
+       строк отслеживаемых таблиц (TRACKED_TABLES).
+    2. После каждой транзакции записи (см. presenter.retry_locked)
+       capture дописывает в журнал на диске образы этих строк
+       (или отметки об удалении) одной строкой JSON и вызывает fsync.
+       После этого изменение не потеряется и при падении процесса.
+    3. Фоновый поток раз в FLUSH_INTERVAL секунд переносит в файл базы
+       все новые записи журнала одной транзакцией (групповая фиксация)
+       и запоминает в таблице WriteBehind номер последней перенесённой
+       записи. Полностью перенесённый журнал очищается.
+
+При любом запуске, в том числе без рабочей копии (см. presenter.bind_database),
+recover переносит в файл базы записи журнала, оставшиеся после падения.
+Производные таблицы (дневные суммы, журналы синхронизации и меток)
+на диске пересчитываются его собственными триггерами.
+Пока работает рабочая копия, другие процессы не должны писать в файл базы:
+такие изменения обнаруживаются, и перенос останавливается с ошибкой.
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Any, Iterator
+
+# Как часто фоновый поток переносит журнал в файл базы, секунды
+FLUSH_INTERVAL: float = 1.0
+
+# Таблицы, изменения которых переносятся в файл базы.
+# Остальные либо производные, либо меняются только операциями,
+# работающими с файлом базы напрямую (курсы, архив, синхронизация).
+TRACKED_TABLES: tuple[str, ...] = (
+    "Budget", "Category", "Expense", "RecurringExpense", "Tag", "ExpenseTag"
+)
+
+WRITE_BEHIND_SCHEMA: str = """
+    CREATE TABLE IF NOT EXISTS "WriteBehind" (
+        "id" INTEGER PRIMARY KEY CHECK ("id" = 1),
+        "seq" INTEGER NOT NULL
+    )
+"""
+
+DIRTY_SCHEMA: str = """
+    CREATE TABLE IF NOT EXISTS "Dirty" (
+        "tbl" TEXT NOT NULL,
+        "key" TEXT NOT NULL,
+        PRIMARY KEY ("tbl", "key")
+    ) WITHOUT ROWID
+"""
+
+
+def install_write_behind(con: sqlite3.Connection) -> None:
+    """
+    Создаёт таблицу с номером последней перенесённой записи журнала
+    """
+
+    with con:
+        con.execute(WRITE_BEHIND_SCHEMA)
+
+
+def journal_path(db_filename: str) -> str:
+    """
+    Путь к журналу отложенной записи базы db_filename
+    """
+
+    stem, _ = os.path.splitext(db_filename)
+    return f"{stem}.journal.jsonl"
+
+
+def working_path(db_filename: str) -> str:
+    """
+    Путь к рабочей копии базы db_filename в оперативной памяти
+    """
+
+    directory: str = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(
+        directory, f"bookkeeper-{os.getpid()}-{os.path.basename(db_filename)}"
+    )
+
+
+def _keys(con: sqlite3.Connection, table: str) -> tuple[list[str], list[str]]:
+    """
+    Столбцы таблицы и столбцы её первичного ключа
+    """
+
+    info: list[tuple] = con.execute(f'PRAGMA table_info("{table}")').fetchall()
+    columns: list[str] = [row[1] for row in info]
+    key: list[str] = [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]]
+    return columns, key
+
+
+def _quoted(columns: list[str], prefix: str = "") -> str:
+    return ", ".join(f'{prefix}"{column}"' for column in columns)
+
+
+def _install_tracking(con: sqlite3.Connection) -> None:
+    """
+    Создаёт в рабочей копии таблицу Dirty и триггеры, отмечающие в ней
+    ключи вставленных, изменённых и удалённых строк
+    """
+
+    statements: list[str] = [DIRTY_SCHEMA]
+    for table in TRACKED_TABLES:
+        _, key = _keys(con, table)
+        new: str = f"'{table}', json_array({_quoted(key, 'NEW.')})"
+        old: str = f"'{table}', json_array({_quoted(key, 'OLD.')})"
+        for event, rows in (("INSERT", [new]), ("UPDATE", [new, old]), ("DELETE", [old])):
+            statements.append(
+                'CREATE TRIGGER IF NOT EXISTS '
+                f'"trg_{table.lower()}_{event.lower()}_dirty" '
+                f'AFTER {event} ON "{table}" BEGIN '
+                + "".join(
+                    f'INSERT OR IGNORE INTO "Dirty" VALUES ({row}); ' for row in rows
+                )
+                + "END"
+            )
+    with con:
+        for statement in statements:
+            con.execute(statement)
+
+
+def _apply(con: sqlite3.Connection, entry: dict[str, Any]) -> None:
+    """
+    Переносит одну запись журнала: удаляет и вставляет или обновляет строки
+    по первичному ключу. Вызывается внутри транзакции.
+    """
+
+    for table, change in entry["tables"].items():
+        columns: list[str] = change["columns"]
+        key: list[str] = change["key"]
+        where: str = f'({_quoted(key)}) = ({", ".join("?" * len(key))})'
+        con.executemany(f'DELETE FROM "{table}" WHERE {where}', change["delete"])
+        rest: list[str] = [column for column in columns if column not in key]
+        update: str = (
+            "DO UPDATE SET " + ", ".join(f'"{c}" = excluded."{c}"' for c in rest)
+            if rest else "DO NOTHING"
+        )
+        con.executemany(
+            f'INSERT INTO "{table}" ({_quoted(columns)}) '
+            f'VALUES ({", ".join("?" * len(columns))}) '
+            f"ON CONFLICT ({_quoted(key)}) {update}",
+            change["upsert"]
+        )
+
+
+def _read_journal(filename: str, offset: int = 0) -> tuple[list[dict[str, Any]], int]:
+    """
+    Читает записи журнала начиная с позиции offset.
+    Недописанная последняя строка (процесс упал во время записи) пропускается.
+    Возвращает записи и позицию после последней прочитанной.
+    """
+
+    entries: list[dict[str, Any]] = []
+    if not os.path.exists(filename):
+        return entries, offset
+    with open(filename, "rb") as journal:
+        journal.seek(offset)
+        for line in journal:
+            if not line.endswith(b"\n"):
+                break
+            entries.append(json.loads(line))
+            offset += len(line)
+    return entries, offset
+
+
+def _applied_seq(con: sqlite3.Connection) -> int:
+    row: tuple | None = con.execute('SELECT "seq" FROM "WriteBehind"').fetchone()
+    return row[0] if row else 0
+
+
+def _apply_entries(con: sqlite3.Connection, entries: list[dict[str, Any]]) -> int:
+    """
+    Переносит записи журнала, ещё не перенесённые в базу, одной транзакцией.
+    Возвращает номер последней перенесённой записи.
+    """
+
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        applied: int = _applied_seq(con)
+        for entry in entries:
+            if entry["seq"] > applied:
+                _apply(con, entry)
+                applied = entry["seq"]
+        con.execute(
+            'INSERT OR REPLACE INTO "WriteBehind" ("id", "seq") VALUES (1, ?)', (applied,)
+        )
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return applied
+
+
+def recover(db_filename: str) -> int:
+    """
+    Переносит в базу db_filename записи журнала, оставшиеся после
+    прошлого запуска, и удаляет журнал.
+    Возвращает число перенесённых записей.
+    """
+
+    filename: str = journal_path(db_filename)
+    entries, _ = _read_journal(filename)
+    if not entries:
+        if os.path.exists(filename):
+            os.remove(filename)
+        return 0
+    con: sqlite3.Connection = sqlite3.connect(db_filename, isolation_level=None)
+    try:
+        before: int = _applied_seq(con)
+        _apply_entries(con, entries)
+    finally:
+        con.close()
+    os.remove(filename)
+    return sum(entry["seq"] > before for entry in entries)
+
+
+class WriteBehind:
+    """
+    Рабочая копия базы db_filename в памяти с журналом и фоновым
+    переносом изменений в файл базы
+    """
+
+    def __init__(self, db_filename: str, interval: float = FLUSH_INTERVAL):
+        self.db_filename: str = db_filename
+        self.journal_filename: str = journal_path(db_filename)
+        self.filename: str = working_path(db_filename)
+        self._interval: float = interval
+
+        recover(db_filename)
+        self._disk: sqlite3.Connection = sqlite3.connect(
+            db_filename, isolation_level=None, check_same_thread=False
+        )
+        self._con: sqlite3.Connection = sqlite3.connect(
+            self.filename, isolation_level=None, check_same_thread=False
+        )
+        # номера записей продолжают нумерацию прошлых запусков
+        self._seq: int = _applied_seq(self._disk)
+        self._applied: int = self._seq
+        self._offset: int = 0
+        self._error: Exception | None = None
+        self._version: int = 0
+        self._journal_lock: threading.Lock = threading.Lock()
+        self._apply_lock: threading.Lock = threading.Lock()
+        self._load()
+
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self._thread.start()
+
+    def _load(self) -> None:
+        """
+        Копирует файл базы в рабочую копию и включает отслеживание изменений
+        """
+
+        self._disk.backup(self._con)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        _install_tracking(self._con)
+        self._version = self._disk.execute("PRAGMA data_version").fetchone()[0]
+
+    def capture(self) -> int:
+        """
+        Дописывает в журнал изменения, сделанные в рабочей копии
+        после прошлого вызова. Возвращает число записанных строк.
+        """
+
+        with self._journal_lock:
+            self._con.execute("BEGIN IMMEDIATE")
+            try:
+                dirty: list[tuple[str, str]] = self._con.execute(
+                    'SELECT "tbl", "key" FROM "Dirty"'
+                ).fetchall()
+                if not dirty:
+                    self._con.execute("COMMIT")
+                    return 0
+                tables: dict[str, dict[str, Any]] = {}
+                for table, key_text in dirty:
+                    if table not in tables:
+                        columns, key = _keys(self._con, table)
+                        tables[table] = {
+                            "columns": columns, "key": key, "upsert": [], "delete": []
+                        }
+                    change: dict[str, Any] = tables[table]
+                    values: list = json.loads(key_text)
+                    placeholders: str = ", ".join("?" * len(values))
+                    row: tuple | None = self._con.execute(
+                        f'SELECT {_quoted(change["columns"])} FROM "{table}" '
+                        f'WHERE ({_quoted(change["key"])}) = ({placeholders})',
+                        values
+                    ).fetchone()
+                    if row is None:
+                        change["delete"].append(values)
+                    else:
+                        change["upsert"].append(list(row))
+                line: bytes = json.dumps(
+                    {"seq": self._seq + 1, "tables": tables}, ensure_ascii=False
+                ).encode("utf-8") + b"\n"
+                with open(self.journal_filename, "ab") as journal:
+                    journal.write(line)
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                self._con.execute('DELETE FROM "Dirty"')
+                self._con.execute("COMMIT")
+            except BaseException:
+                self._con.execute("ROLLBACK")
+                raise
+            self._seq += 1
+            return len(dirty)
+
+    def _apply_pending(self) -> None:
+        """
+        Переносит новые записи журнала в файл базы одной транзакцией
+        """
+
+        with self._apply_lock:
+            if self._error is not None:
+                raise self._error
+            with self._journal_lock:
+                entries, offset = _read_journal(self.journal_filename, self._offset)
+            if not entries:
+                return
+            if self._disk.execute("PRAGMA data_version").fetchone()[0] != self._version:
+                self._error = ValueError(
+                    f"{self.db_filename} was changed by another process, "
+                    f"changes are kept in {self.journal_filename}"
+                )
+                raise self._error
+            self._applied = _apply_entries(self._disk, entries)
+            self._offset = offset
+            with self._journal_lock:
+                # всё записанное перенесено --- журнал можно начать заново
+                if self._applied == self._seq:
+                    os.truncate(self.journal_filename, 0)
+                    self._offset = 0
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            try:
+                self.capture()
+                self._apply_pending()
+            except Exception:
+                # база занята --- перенос повторится на следующем шаге;
+                # после чужих изменений файла перенос останавливается,
+                # а ошибка возвращается вызывающему flush
+                if self._error is not None:
+                    return
+
+    def flush(self) -> None:
+        """
+        Записывает в журнал и переносит в файл базы все изменения рабочей копии
+        """
+
+        self.capture()
+        self._apply_pending()
+
+    @contextlib.contextmanager
+    def direct(self) -> Iterator[str]:
+        """
+        Контекст для операций, изменяющих файл базы напрямую
+        (архивирование, курсы, синхронизация). Переносит в файл все
+        изменения рабочей копии, на время операции приостанавливает
+        фоновый перенос, а после неё заново копирует файл в рабочую копию.
+        Возвращает путь к файлу базы.
+        """
+
+        self.flush()
+        with self._apply_lock:
+            try:
+                yield self.db_filename
+            finally:
+                with self._journal_lock:
+                    self._load()
+
+    def close(self) -> None:
+        """
+        Переносит изменения в файл базы, останавливает фоновый поток
+        и удаляет рабочую копию
+        """
+
+        self._stop.set()
+        self._thread.join()
+        try:
+            self.flush()
+            if os.path.exists(self.journal_filename):
+                os.remove(self.journal_filename)
+        finally:
+            self._con.close()
+            self._disk.close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.filename + suffix):
+                    os.remove(self.filename + suffix)
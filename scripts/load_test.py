@@ -0,0 +1,120 @@
+"""
+Нагрузочный тест локального JSON API.
+
+Открывает несколько keep-alive соединений с сервером и в течение заданного
+времени отправляет запросы, после чего печатает число запросов в секунду.
+Пример:
+    python -m bookkeeper.server --port 8080 &
+    python scripts/load_test.py --port 8080 --connections 16 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+async def _request(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        method: str,
+        path: str,
+        body: dict | None = None
+) -> int:
+    data: bytes = json.dumps(body).encode() if body is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+    )
+    await writer.drain()
+
+    status: int = int((await reader.readline()).split()[1])
+    length: int = 0
+    chunked: bool = False
+    while True:
+        line: bytes = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+        elif name.lower() == "transfer-encoding":
+            chunked = True
+
+    if not chunked:
+        await reader.readexactly(length)
+        return status
+    while True:
+        size: int = int(await reader.readline(), 16)
+        await reader.readexactly(size + 2)
+        if size == 0:
+            return status
+
+
+async def _worker(
+        host: str, port: int, deadline: float, write_ratio: float, stats: dict[str, int]
+) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.monotonic() < deadline:
+            if random.random() < write_ratio:
+                status: int = await _request(
+                    reader, writer, "POST", "/expenses",
+                    {"amount": random.randint(1, 1000), "category": "load-test"}
+                )
+            else:
+                path: str = random.choice(["/budget", "/categories", "/report"])
+                status = await _request(reader, writer, "GET", path)
+            stats["requests"] += 1
+            if status != 200:
+                stats["errors"] += 1
+    finally:
+        writer.close()
+
+
+async def run(
+        host: str, port: int, connections: int, duration: float, write_ratio: float
+) -> dict[str, float]:
+    """
+    Выполняет нагрузочный тест и возвращает статистику
+    """
+
+    reader, writer = await asyncio.open_connection(host, port)
+    await _request(reader, writer, "POST", "/categories", {"name": "load-test"})
+    writer.close()
+
+    stats: dict[str, int] = {"requests": 0, "errors": 0}
+    started: float = time.monotonic()
+    await asyncio.gather(*(
+        _worker(host, port, started + duration, write_ratio, stats)
+        for _ in range(connections)
+    ))
+    elapsed: float = time.monotonic() - started
+    return {
+        "requests": stats["requests"],
+        "errors": stats["errors"],
+        "seconds": elapsed,
+        "requests_per_second": stats["requests"] / elapsed,
+    }
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument(
+        "--write-ratio", type=float, default=0.1, help="доля запросов на запись"
+    )
+    args: argparse.Namespace = parser.parse_args()
+
+    result: dict[str, float] = asyncio.run(
+        run(args.host, args.port, args.connections, args.duration, args.write_ratio)
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Общие фикстуры для тестов презентера
+"""
+
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import os
+import re
+import sqlite3
+
+import pytest
+from pony import orm
+
+from bookkeeper import archive
+from bookkeeper.presenter import Presenter, bind_database, db
+
+
+@pytest.fixture(scope='session')
+def db_filename(tmp_path_factory):
+    """
+    Pony позволяет привязать базу только один раз за процесс,
+    поэтому все тесты используют один временный файл
+    """
+    return str(tmp_path_factory.mktemp('db') / 'database.sqlite')
+
+
+@pytest.fixture
+def presenter(db_filename):
+    bind_database(db_filename)
+    with orm.db_session:
+        for entity in reversed(list(db.entities.values())):
+            entity.select().delete(bulk=True)
+        db.execute('DELETE FROM "DailyTotal"')
+        db.execute('DELETE FROM "SyncRow"')
+        db.execute('DELETE FROM "SyncPeer"')
+        db.execute('DELETE FROM "Rate"')
+        db.execute('DELETE FROM "TagLog"')
+        db.execute('DELETE FROM "TagBitmap"')
+        db.execute('DELETE FROM "DailyTotalLog"')
+    for path in archive.list_archives(db_filename).values():
+        os.remove(path)
+    return Presenter(db_filename)
+
+
+class QueryRecorder:
+    """
+    Собирает SQL, выполненный презентером, и строит планы этих запросов
+    (EXPLAIN QUERY PLAN) на отдельном соединении с той же базой
+    """
+
+    # таблица и необязательный псевдоним после FROM или JOIN
+    TABLE_PATTERN = re.compile(
+        r'(?:FROM|JOIN)\s+(?:\w+\.)?"?(\w+)"?(?:\s+(?:AS\s+)?"?(\w+)"?)?', re.IGNORECASE
+    )
+    # операторы, для которых строится план
+    PLANNED_PATTERN = re.compile(
+        r'\s*(SELECT|WITH|UPDATE|DELETE|INSERT\s.*\sSELECT\s)', re.IGNORECASE | re.DOTALL
+    )
+    NOT_ALIASES = {'WHERE', 'ORDER', 'GROUP', 'LEFT', 'INNER', 'JOIN', 'ON', 'LIMIT'}
+
+    def __init__(self, db_filename):
+        self.db_filename = db_filename
+        # соединение для планов не должно само попадать в запись
+        self.connect = sqlite3.connect
+        self.statements = []
+        self.attached = {}
+
+    def __call__(self, sql):
+        # операторы внутри триггеров приходят комментариями
+        if sql.lstrip().startswith('--'):
+            return
+        # архивы, подключённые запросами, нужны и для построения плана
+        attach = re.match(r"\s*ATTACH DATABASE '(.*)' AS (\w+)", sql, re.I)
+        if attach:
+            self.attached[attach[2]] = attach[1]
+            return
+        if self.PLANNED_PATTERN.match(sql):
+            if sql not in self.statements:
+                self.statements.append(sql)
+
+    def record(self, func, *args, **kwargs):
+        """
+        Вызывает func и возвращает планы выполненных ею запросов:
+        список пар (запрос, строки плана)
+        """
+        self.statements = []
+        func(*args, **kwargs)
+        con = self.connect(self.db_filename)
+        for schema, path in self.attached.items():
+            con.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        try:
+            return [
+                (sql, [row[3] for row in con.execute('EXPLAIN QUERY PLAN ' + sql)])
+                for sql in self.statements
+            ]
+        finally:
+            con.close()
+
+    @classmethod
+    def tables(cls, sql):
+        """
+        Псевдонимы таблиц запроса: псевдоним -> таблица
+        """
+        names = {}
+        for table, alias in cls.TABLE_PATTERN.findall(sql):
+            names[table] = table
+            if alias and alias.upper() not in cls.NOT_ALIASES:
+                names[alias] = table
+        return names
+
+    @classmethod
+    def scanned(cls, plans):
+        """
+        Таблицы, которые просматриваются целиком (SCAN)
+        """
+        result = set()
+        for sql, plan in plans:
+            names = cls.tables(sql)
+            for detail in plan:
+                match = re.match(r'SCAN (?:\w+\.)?(\w+)', detail)
+                if match:
+                    result.add(names.get(match[1], match[1]))
+        return result
+
+    @staticmethod
+    def indexes(plans):
+        """
+        Индексы, которые используют запросы
+        """
+        return {
+            match[1] for _, plan in plans for detail in plan
+            for match in [re.search(r'USING (?:COVERING )?INDEX (\w+)', detail)] if match
+        }
+
+
+@pytest.fixture
+def query_recorder(presenter, monkeypatch):
+    """
+    Записывает SQL, выполняемый через Pony и через прямые соединения sqlite3
+    """
+    recorder = QueryRecorder(presenter.db_filename)
+    connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        con = connect(*args, **kwargs)
+        con.set_trace_callback(recorder)
+        return con
+
+    monkeypatch.setattr(sqlite3, 'connect', traced_connect)
+    with orm.db_session:
+        pony_con = db.get_connection()
+    pony_con.set_trace_callback(recorder)
+    presenter._daily_totals._con.set_trace_callback(recorder)
+    presenter._tags._con.set_trace_callback(recorder)
+    presenter._budget_tracker._con.set_trace_callback(recorder)
+    yield recorder
+    pony_con.set_trace_callback(None)
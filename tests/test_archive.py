@@ -0,0 +1,72 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from pony import orm
+
+from bookkeeper import archive, periods
+from bookkeeper.presenter import Expense
+
+
+def add_expense(presenter, amount, date, category='food'):
+    with orm.db_session:
+        exists = presenter.categories_get_by_name(category)
+    if not exists:
+        presenter.category_add(category)
+    presenter.expense_add(amount, category, '')
+    with orm.db_session:
+        exp = Expense.select().order_by(orm.desc(Expense.obj_id)).first()
+        exp.expense_date = date
+
+
+def test_archive_moves_old_expenses(presenter, db_filename):
+    add_expense(presenter, 1, datetime(2015, 3, 1))
+    add_expense(presenter, 2, datetime(2016, 5, 1))
+    add_expense(presenter, 3, datetime(2016, 7, 1))
+    add_expense(presenter, 4, datetime.now())
+
+    assert presenter.expenses_archive(datetime(2016, 6, 1)) == 2
+
+    assert list(archive.list_archives(db_filename)) == [2015, 2016]
+    assert [exp.amount for exp in presenter.expenses_get_list()] == [3, 4]
+    assert os.path.exists(archive.archive_path(db_filename, 2015))
+
+
+def test_history_fans_out_across_archives(presenter):
+    for year in range(2005, 2020):
+        add_expense(presenter, year, datetime(year, 6, 1))
+    add_expense(presenter, 1, datetime.now())
+    presenter.expenses_archive(datetime(2019, 1, 1))
+
+    history = presenter.expenses_get_history()
+    assert [exp.amount for exp in history] == list(range(2005, 2020)) + [1]
+    assert isinstance(history[0].expense_date, datetime)
+
+    history = presenter.expenses_get_history(datetime(2010, 1, 1), datetime(2012, 1, 1))
+    assert [exp.amount for exp in history] == [2010, 2011]
+
+    assert presenter.expenses_get_sum_history() == sum(range(2005, 2020)) + 1
+    assert presenter.expenses_get_sum_history(end=datetime(2007, 1, 1)) == 2005 + 2006
+
+
+def test_archive_is_repeatable(presenter, db_filename):
+    add_expense(presenter, 1, datetime(2015, 3, 1))
+    presenter.expenses_archive(datetime(2016, 1, 1))
+    add_expense(presenter, 2, datetime(2015, 4, 1))
+    presenter.expenses_archive(datetime(2016, 1, 1))
+
+    assert presenter.expenses_get_list() == []
+    assert [exp.amount for exp in presenter.expenses_get_history()] == [1, 2]
+
+
+def test_cannot_archive_budget_period(presenter):
+    with pytest.raises(ValueError):
+        presenter.expenses_archive(datetime.now() - timedelta(days=7))
+    presenter.expenses_archive(datetime.now() - timedelta(days=60))
+    presenter.budget_add(periods.PERIOD_DAYS, 1000, 90)
+    with pytest.raises(ValueError):
+        presenter.expenses_archive(datetime.now() - timedelta(days=60))
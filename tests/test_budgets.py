@@ -0,0 +1,108 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from bookkeeper import budgets, periods
+
+TODAY = datetime.now().replace(microsecond=0)
+
+
+@pytest.fixture
+def food(presenter):
+    food = presenter.category_add('food')
+    fruit = presenter.category_add('fruit', food)
+    presenter.category_add('apple', fruit)
+    presenter.category_add('rent')
+    alerts = []
+    presenter.budgets_subscribe(alerts.append)
+    return presenter, food, alerts
+
+
+def add_elsewhere(db_filename, amount, cat_id, when=TODAY):
+    # запись другого процесса, мимо презентера
+    con = sqlite3.connect(db_filename)
+    with con:
+        con.execute(
+            'INSERT INTO "Expense" ("amount", "category_id", "expense_date", "comment", '
+            '"fingerprint") VALUES (?, ?, ?, \'\', \'\')',
+            (amount, cat_id, when.isoformat(' ', 'microseconds'))
+        )
+    con.close()
+
+
+def test_subcategory_budgets(food):
+    presenter, food_id, alerts = food
+    presenter.expense_add(10, 'apple', 'яблоки', TODAY)
+    presenter.expense_add(500, 'apple', 'давно', TODAY - timedelta(days=60))
+    with_children = presenter.budget_add(periods.PERIOD_MONTH, 100, 0, food_id, True)
+    own = presenter.budget_add(periods.PERIOD_WEEK, 100, 0, food_id)
+
+    presenter.expense_add(20, 'fruit', 'груши', TODAY)
+    presenter.expense_add(5, 'food', 'хлеб', TODAY)
+    presenter.expense_add(1000, 'rent', 'аренда', TODAY)
+    budgets = presenter.budgets_get_list()
+    sums = {bdg.obj_id: presenter.budget_get_sum(bdg) for bdg in budgets}
+    assert sums[with_children] == 35 and sums[own] == 5
+    assert presenter.budget_get_sum_for_period(periods.PERIOD_MONTH) == 1035
+    assert [bdg.subcategories for bdg in budgets][-2:] == [True, False]
+
+    # новая подкатегория сразу учитывается бюджетом
+    presenter.category_add('pear', food_id)
+    presenter.expense_add(4, 'pear', 'груша', TODAY)
+    assert presenter.budget_get_sum(presenter.budgets_get_list()[-2]) == 39
+    assert alerts == []
+
+
+def test_alerts_on_threshold_crossing(food, db_filename):
+    presenter, food_id, alerts = food
+    bdg_id = presenter.budget_add(periods.PERIOD_MONTH, 100, 0, food_id, True)
+
+    presenter.expense_add(70, 'apple', 'яблоки', TODAY)
+    assert alerts == []
+    exp_id = presenter.expense_add(15, 'fruit', 'груши', TODAY)
+    assert alerts == [budgets.BudgetAlert(bdg_id, 0.8, 85, 100)]
+    presenter.expense_delete(exp_id)
+    presenter.expense_add(40, 'food', 'ужин', TODAY)
+    assert [alert.threshold for alert in alerts] == [0.8, 0.8, 1.0]
+
+    # запись другого процесса замечается при следующем чтении сумм
+    presenter.budget_edit_limit(bdg_id, 1000)
+    add_elsewhere(db_filename, 700, food_id)
+    assert alerts[3:] == []
+    assert presenter.budget_get_sum(presenter.budgets_get_list()[-1]) == 810
+    assert alerts[3:] == [budgets.BudgetAlert(bdg_id, 0.8, 810, 1000)]
+
+
+def test_short_log_is_reloaded(food, db_filename, monkeypatch):
+    presenter, food_id, alerts = food
+    monkeypatch.setattr(budgets, 'LOG_SIZE', 4)
+    bdg_id = presenter.budget_add(periods.PERIOD_DAY, 1000, 0, food_id)
+    for _ in range(10):
+        presenter.expense_add(1, 'food', 'хлеб', TODAY)
+    # другой процесс успел записать и очистить журнал
+    presenter._budget_tracker._seq = 0
+    presenter._budget_tracker._version = None
+    add_elsewhere(db_filename, 5, food_id)
+    bdg = next(bdg for bdg in presenter.budgets_get_list() if bdg.obj_id == bdg_id)
+    assert presenter.budget_get_sum(bdg) == 15
+
+
+def test_many_budgets_need_no_aggregates(food, db_filename, query_recorder):
+    presenter, food_id, alerts = food
+    for days in range(1, 201):
+        presenter.budget_add(periods.PERIOD_DAYS, 1000, days, food_id, True)
+    presenter.expense_add(10, 'apple', 'яблоки', TODAY - timedelta(days=50))
+
+    add_elsewhere(db_filename, 1, food_id)
+    bdgs = presenter.budgets_get_list()
+    plans = query_recorder.record(lambda: [presenter.budget_get_sum(bdg) for bdg in bdgs])
+    assert len(plans) <= 3, plans
+    assert not any('"DailyTotal"' in sql or 'sum(' in sql for sql, _ in plans), plans
+    assert [presenter.budget_get_sum(bdg) for bdg in bdgs][-200:] == [
+        1 if days <= 50 else 11 for days in range(1, 201)
+    ]
@@ -0,0 +1,92 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+from datetime import datetime
+
+import pytest
+
+from bookkeeper import cache
+
+TODAY = datetime.now().replace(microsecond=0)
+
+
+def test_lru_counters():
+    entity_cache = cache.EntityCache(2)
+    loaded = []
+
+    def load(key):
+        return lambda: loaded.append(key) or key * 10
+
+    assert entity_cache.get(1, load(1)) == 10
+    assert entity_cache.get(2, load(2)) == 20
+    assert entity_cache.get(1, load(1)) == 10
+    # вытесняется 2, к которому дольше не обращались
+    assert entity_cache.get(3, load(3)) == 30
+    assert entity_cache.get(1, load(1)) == 10
+    assert entity_cache.get(2, load(2)) == 20
+    assert loaded == [1, 2, 3, 2]
+    stats = entity_cache.stats()
+    assert stats == (2, 2, 2, 4, 2)
+    assert stats.hit_rate == pytest.approx(1 / 3)
+
+    entity_cache.resize(0)
+    assert entity_cache.get(1, load(1)) == 10
+    assert entity_cache.stats() == (0, 0, 2, 5, 4)
+    with pytest.raises(ValueError):
+        entity_cache.resize(-1)
+
+
+def test_value_loaded_before_invalidation_is_not_kept():
+    entity_cache = cache.EntityCache()
+
+    def load():
+        # значение прочитано, но запись успела измениться
+        entity_cache.defer('key')
+        entity_cache.invalidate_deferred()
+        return 'old'
+
+    assert entity_cache.get('key', load) == 'old'
+    assert entity_cache.get('key', lambda: 'new') == 'new'
+
+
+def test_mutations_invalidate(presenter):
+    cat_id = presenter.category_add('food')
+    presenter.category_add('rent')
+    exp_id = presenter.expense_add(10, 'food', 'хлеб', TODAY)
+    assert presenter.expense_get_by_id(exp_id).amount == 10
+    assert presenter.category_get_by_id(cat_id).name == 'food'
+
+    presenter.expense_edit_cost(exp_id, 20)
+    presenter.expense_edit_comment(exp_id, 'булка')
+    presenter.category_edit_name(cat_id, 'bread')
+    exp = presenter.expense_get_by_id(exp_id)
+    assert (exp.amount, exp.comment) == (20, 'булка')
+    assert presenter.category_get_by_id(cat_id).name == 'bread'
+
+    rent_id = presenter.categories_get_by_name('rent')[0].obj_id
+    presenter.category_delete(cat_id, reassign_to=rent_id)
+    assert presenter.expense_get_by_id(exp_id).category_id == rent_id
+    with pytest.raises(ValueError):
+        presenter.category_get_by_id(cat_id)
+    presenter.expense_delete(exp_id)
+    with pytest.raises(ValueError):
+        presenter.expense_get_by_id(exp_id)
+
+
+def test_hot_lookups_need_no_queries(presenter, query_recorder):
+    cat_id = presenter.category_add('food')
+    exp_ids = [presenter.expense_add(cost, 'food', 'хлеб', TODAY) for cost in range(5)]
+    lookups = [presenter.expense_get_by_id(exp_id) for exp_id in exp_ids]
+    presenter.category_get_by_id(cat_id)
+    before = presenter.entity_cache_stats()
+
+    plans = query_recorder.record(lambda: [
+        (presenter.expense_get_by_id(exp_id), presenter.category_get_by_id(cat_id))
+        for exp_id in exp_ids
+    ])
+    assert plans == []
+    stats = presenter.entity_cache_stats()
+    assert stats.hits - before.hits == 10
+    assert stats.misses == before.misses
+    assert [exp.amount for exp in lookups] == list(range(5))
@@ -0,0 +1,258 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import json
+
+import pytest
+
+from bookkeeper import cli, duplicates, export, periods, rates
+from bookkeeper import presenter as presenter_module
+
+
+def test_constants_match_their_sources():
+    # cli не импортирует модули с ORM, поэтому хранит копии констант
+    assert cli.PERIODS == {
+        'day': periods.PERIOD_DAY,
+        'week': periods.PERIOD_WEEK,
+        'month': periods.PERIOD_MONTH,
+        'calendar-week': periods.PERIOD_CALENDAR_WEEK,
+        'calendar-month': periods.PERIOD_CALENDAR_MONTH,
+        'since-day': periods.PERIOD_SINCE_DAY_OF_MONTH,
+        'days': periods.PERIOD_DAYS,
+    }
+    assert set(cli.PERIODS.values()) == set(periods.PERIOD_TYPES)
+    assert cli.DUPLICATE_POLICIES == duplicates.POLICIES
+    assert cli.BASE_CURRENCY == rates.BASE_CURRENCY
+    assert cli.UNKNOWN_CATEGORY == export.UNKNOWN_CATEGORY
+    assert cli.UNKNOWN_CATEGORY == presenter_module.UNKNOWN_CATEGORY
+
+
+@pytest.fixture
+def run(presenter, db_filename, capsys):
+    def run(*args):
+        code = cli.main(['--db', db_filename, '--json', *args])
+        return code, json.loads(capsys.readouterr().out)
+    return run
+
+
+def test_expense_crud(run):
+    code, category = run('category', 'add', 'food')
+    assert code == 0 and isinstance(category['id'], int)
+    code, added = run('expense', 'add', '100', 'food', '--comment', 'bread')
+    assert code == 0
+
+    code, expenses = run('expense', 'list')
+    assert [(e['id'], e['amount'], e['category'], e['comment']) for e in expenses] == [
+        (added['id'], 100, 'food', 'bread')
+    ]
+
+    code, edited = run('expense', 'edit', str(added['id']), '--amount', '50')
+    assert edited['amount'] == 50
+
+    assert run('expense', 'delete', str(added['id']))[0] == 0
+    assert run('expense', 'list') == (0, [])
+
+
+def test_expense_with_date_and_report(run):
+    run('category', 'add', 'food')
+    run('category', 'add', 'rent')
+    run('expense', 'add', '10', 'food', '--date', '2020-01-05')
+    run('expense', 'add', '20', 'food', '--date', '2020-02-05')
+    run('expense', 'add', '300', 'rent', '--date', '2020-02-01')
+
+    code, report = run('report', '--from', '2020-02-01', '--to', '2020-03-01')
+    assert report == [
+        {'category': 'food', 'total': 20}, {'category': 'rent', 'total': 300}
+    ]
+
+    code, expenses = run('expense', 'list', '--to', '2020-01-31')
+    assert [e['amount'] for e in expenses] == [10]
+
+
+def test_budget(run):
+    run('category', 'add', 'food')
+    run('expense', 'add', '100', 'food')
+    assert run('budget', 'set', 'week', '50')[0] == 0
+
+    code, status = run('budget', 'status')
+    week = next(row for row in status if row['period'] == 'week')
+    assert (week['spent'], week['limit'], week['exceeded']) == (100, 50, True)
+    assert 'exceed_probability' not in week
+
+    pytest.importorskip('numpy')
+    code, status = run('budget', 'status', '--forecast')
+    week = next(row for row in status if row['period'] == 'week')
+    assert week['exceed_probability'] == 1
+    assert all(0 <= row['exceed_probability'] <= 1 for row in status)
+
+
+def test_category_budget(run):
+    run('category', 'add', 'food')
+    run('category', 'add', 'rent')
+    run('expense', 'add', '100', 'food')
+    run('expense', 'add', '500', 'rent')
+    code, added = run('budget', 'add', 'calendar-month', '300', '--category', 'food')
+    assert code == 0
+
+    code, status = run('budget', 'status')
+    row = next(row for row in status if row['id'] == added['id'])
+    assert (row['category'], row['spent'], row['exceeded']) == ('food', 100, False)
+
+    assert run('budget', 'add', 'calendar-month', '1', '--category', 'food')[0] == 1
+    assert run('budget', 'delete', str(added['id']))[0] == 0
+    assert len(run('budget', 'status')[1]) == 3
+
+
+def test_errors_are_reported(run):
+    code, result = run('expense', 'add', '100', 'missing')
+    assert code == 1
+    assert 'missing' in result['error']
+
+    code, result = run('category', 'rename', '12345', 'x')
+    assert code == 1
+
+
+def test_cli_does_not_import_qt():
+    import subprocess
+    out = subprocess.run(
+        [sys.executable, '-c',
+         'import sys, bookkeeper.cli; print("PySide6" in sys.modules)'],
+        capture_output=True, text=True, check=True
+    ).stdout
+    assert out.strip() == 'False'
+
+
+def test_export(run, tmp_path):
+    run('category', 'add', 'food')
+    run('category', 'add', 'rent')
+    run('expense', 'add', '10', 'food')
+    run('expense', 'add', '300', 'rent')
+    filename = str(tmp_path / 'food.jsonl.gz')
+
+    code, result = run('export', filename, '--category', 'food')
+    assert code == 0
+    assert (result['format'], result['gzip'], result['rows']) == ('jsonl', True, 1)
+    assert run('export', filename, '--category', 'unknown')[0] == 1
+
+
+def test_import_skips_duplicates(run, tmp_path):
+    run('category', 'add', 'food')
+    run('expense', 'add', '10', 'food', '--date', '2024-01-01')
+    run('expense', 'add', '10', 'food', '--date', '2024-01-01', '--duplicates', 'flag')
+    filename = str(tmp_path / 'statement.csv')
+    with open(filename, 'w', encoding='utf-8') as statement:
+        statement.write(
+            'date,amount,category,comment\n'
+            '2024-01-01 12:00:00,10,food,-\n'
+            '2024-01-02 12:00:00,5,rent,bus\n'
+            '2024-01-02 18:00:00,5,rent,Bus\n'
+        )
+
+    code, result = run('import', filename)
+    assert (code, result['added'], result['skipped']) == (0, 1, 2)
+    assert run('import', filename)[1]['skipped'] == 3
+
+    code, groups = run('expense', 'duplicates')
+    assert [[e['amount'] for e in group] for group in groups] == [[10, 10]]
+    with open(filename, 'a', encoding='utf-8') as statement:
+        statement.write('yesterday,10,food,-\n')
+    assert run('import', filename)[0] == 1
+
+
+def test_recurring(run):
+    run('category', 'add', 'rent')
+    code, rule = run(
+        'recurring', 'add', '500', 'rent', 'monthly:1',
+        '--from', '2021-01-01', '--until', '2021-02-15'
+    )
+    assert code == 0
+    code, expenses = run('expense', 'list')
+    assert [e['date'] for e in expenses] == ['2021-01-01 00:00:00', '2021-02-01 00:00:00']
+
+    code, rules = run('recurring', 'list')
+    assert (rules[0]['schedule'], rules[0]['next_date']) == ('monthly:1', None)
+    assert run('recurring', 'add', '1', 'rent', 'never')[0] == 1
+    assert run('recurring', 'delete', str(rule['id'])) == (0, {'deleted': [rule['id']]})
+
+
+def test_category_delete_with_expenses(run):
+    food = run('category', 'add', 'food')[1]['id']
+    run('category', 'add', 'rent')
+    run('expense', 'add', '10', 'food')
+
+    assert run('category', 'delete', str(food))[0] == 1
+    assert run('category', 'delete', str(food), '--reassign', 'rent') == (
+        0, {'deleted': [food], 'expenses': 1}
+    )
+    assert [e['category'] for e in run('expense', 'list')[1]] == ['rent']
+    assert run('category', 'repair') == (0, {'repaired': 0})
+
+
+def test_sync(run, tmp_path):
+    code, result = run('sync', str(tmp_path / 'missing.sqlite'))
+    assert code == 1 and 'error' in result
+
+    run('category', 'add', 'food')
+    run('snapshot', 'save', str(tmp_path / 'db.snap'))
+    run('snapshot', 'restore', str(tmp_path / 'db.snap'), str(tmp_path / 'copy.sqlite'))
+    run('expense', 'add', '100', 'food')
+    code, result = run('sync', str(tmp_path / 'copy.sqlite'))
+    assert code == 0 and result['sent'] == 1 and result['received'] == 0
+
+
+def test_migrate(run):
+    assert run('migrate', '--batch-size', '10') == (0, {'finished': True})
+
+
+def test_tags(run):
+    run('category', 'add', 'food')
+    ids = [
+        str(run('expense', 'add', amount, 'food')[1]['id'])
+        for amount in ('10', '20', '30')
+    ]
+    assert run('tag', 'add', 'trip', *ids) == (0, {'tagged': 3})
+    assert run('tag', 'add', 'paid back', ids[0]) == (0, {'tagged': 1})
+
+    code, expenses = run('expense', 'list', '--tags', 'trip AND NOT "paid back"')
+    assert [e['amount'] for e in expenses] == [20, 30]
+    assert run('report', '--tags', '"paid back"')[1] == [
+        {'category': 'food', 'total': 10}
+    ]
+    code, status = run('budget', 'status', '--tags', 'trip')
+    assert {row['tagged'] for row in status} == {60}
+
+    assert run('tag', 'remove', 'trip', ids[1]) == (0, {'untagged': 1})
+    assert run('tag', 'delete', 'paid back')[0] == 0
+    assert run('tag', 'list')[1] == [{'name': 'trip', 'expenses': 2}]
+
+
+def test_category_tree(run):
+    food = run('category', 'add', 'food')[1]['id']
+    fruit = run('category', 'add', 'fruit', '--parent', 'food')[1]['id']
+    run('category', 'add', 'rent')
+    run('expense', 'add', '10', 'fruit')
+
+    code, tree = run('category', 'tree', '--period', 'day')
+    assert [(node['name'], node['has_children'], node['total']) for node in tree] == [
+        ('food', True, 10), ('rent', False, 0)
+    ]
+    assert run('category', 'tree', '--parent', 'food')[1][0]['own'] == 10
+    assert run('category', 'move', str(food), '--parent', 'fruit')[0] == 1
+    assert run('category', 'move', str(fruit)) == (0, {'id': fruit, 'parent_id': None})
+    assert {cat['name']: cat['parent_id'] for cat in run('category', 'list')[1]} == {
+        'food': None, 'fruit': None, 'rent': None
+    }
+
+
+def test_duplicates_text_output(run, db_filename, capsys):
+    run('category', 'add', 'food')
+    for amount in ('10', '10', '5', '5'):
+        run('expense', 'add', amount, 'food', '--date', '2024-01-01',
+            '--duplicates', 'flag')
+
+    assert cli.main(['--db', db_filename, 'expense', 'duplicates']) == 0
+    groups = capsys.readouterr().out.split('\n\n')
+    assert [
+        [line.split('\t')[2] for line in group.splitlines()] for group in groups
+    ] == [['10.0', '10.0'], ['5.0', '5.0']]
@@ -0,0 +1,71 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import csv
+import gzip
+import io
+import json
+import sqlite3
+from datetime import datetime
+
+from bookkeeper import export
+
+
+def fill(presenter):
+    presenter.category_add('food')
+    rent_id = presenter.category_add('rent')
+    presenter.expense_add(10, 'food', 'bread, milk', datetime(2015, 3, 1))
+    presenter.expense_add(300, 'rent', '', datetime(2020, 2, 1))
+    presenter.expense_add(20, 'food', '"quoted"', datetime(2020, 2, 5, 12, 30))
+    return rent_id
+
+
+def test_csv_export_with_archives(presenter, tmp_path):
+    fill(presenter)
+    presenter.expenses_archive(datetime(2016, 1, 1))
+    filename = str(tmp_path / 'out.csv')
+
+    assert presenter.expenses_export(filename) == 3
+    with open(filename, newline='', encoding='utf-8') as file:
+        rows = list(csv.DictReader(file))
+    assert [(row['amount'], row['category'], row['comment']) for row in rows] == [
+        ('10.0', 'food', 'bread, milk'), ('300.0', 'rent', '-'),
+        ('20.0', 'food', '"quoted"')
+    ]
+    assert rows[2]['date'] == '2020-02-05 12:30:00'
+
+
+def test_jsonl_gzip_export_with_filters(presenter, tmp_path):
+    rent_id = fill(presenter)
+    # расход с несуществующей категорией, как в базах прежних версий
+    con = sqlite3.connect(presenter.db_filename)
+    with con:
+        con.execute('UPDATE "Expense" SET "category_id" = 999 WHERE "amount" = 300')
+    con.close()
+    filename = str(tmp_path / 'out.jsonl.gz')
+
+    presenter.expenses_export(
+        filename, 'jsonl', start=datetime(2020, 1, 1), compress=True
+    )
+    with gzip.open(filename, 'rt', encoding='utf-8') as file:
+        rows = [json.loads(line) for line in file]
+    assert [(row['amount'], row['category']) for row in rows] == [
+        (300, export.UNKNOWN_CATEGORY), (20, 'food')
+    ]
+
+    chunks = presenter.expenses_export_chunks('jsonl', category_ids=[999, rent_id])
+    assert [json.loads(line)['amount'] for line in b''.join(chunks).splitlines()] == [300]
+
+
+def test_export_is_streamed_in_chunks(presenter, monkeypatch):
+    presenter.category_add('food')
+    for i in range(50):
+        presenter.expense_add(i, 'food', 'x' * 100, datetime(2020, 1, 1, 0, i))
+    monkeypatch.setattr(export, 'EXPORT_BATCH_SIZE', 10)
+    monkeypatch.setattr(export, 'CHUNK_SIZE', 1000)
+
+    chunks = list(presenter.expenses_export_chunks('csv'))
+    assert len(chunks) > 3
+    rows = list(csv.reader(io.StringIO(b''.join(chunks).decode())))
+    assert [float(row[2]) for row in rows[1:]] == list(range(50))
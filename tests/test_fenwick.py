@@ -0,0 +1,42 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import random
+
+import pytest
+
+from bookkeeper.fenwick import FenwickTree
+
+
+def test_range_sums_match_naive():
+    values = [random.randint(-100, 100) for _ in range(200)]
+    tree = FenwickTree.from_values(values)
+    for _ in range(100):
+        index = random.randrange(len(values))
+        delta = random.randint(-10, 10)
+        values[index] += delta
+        tree.add(index, delta)
+        start = random.randrange(len(values))
+        stop = random.randrange(start, len(values) + 1)
+        assert tree.range_sum(start, stop) == sum(values[start:stop])
+
+
+def test_bounds_are_clamped():
+    tree = FenwickTree.from_values([1, 2, 3])
+    assert tree.range_sum(-5, 100) == 6
+    assert tree.range_sum(2, 1) == 0
+    assert FenwickTree(0).range_sum(0, 10) == 0
+
+
+def test_add_out_of_range():
+    with pytest.raises(IndexError):
+        FenwickTree(3).add(3, 1)
+
+
+def test_values_roundtrip():
+    values = [random.randint(-100, 100) for _ in range(50)]
+    tree = FenwickTree.from_values(values)
+    tree.add(7, 5)
+    values[7] += 5
+    assert tree.values() == values
@@ -0,0 +1,94 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+from datetime import date, datetime
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from bookkeeper import forecast
+from bookkeeper.periods import ALL_CATEGORIES
+
+TODAY = date(2024, 1, 10)
+
+
+@pytest.fixture
+def history(presenter):
+    """
+    Девять дней до TODAY: еда каждый день по 100, аренда один раз 1000
+    """
+    food = presenter.category_add('food')
+    rent = presenter.category_add('rent')
+    for day in range(1, 10):
+        presenter.expense_add(100, 'food', '', datetime(2024, 1, day, 12))
+    presenter.expense_add(1000, 'rent', '', datetime(2024, 1, 5, 12))
+    presenter.expense_add(40, 'food', '', datetime(2024, 1, 10, 9))
+    return food, rent
+
+
+def test_load_history(history, db_filename):
+    food, rent = history
+    days, spent_today = forecast.load_history(db_filename, TODAY)
+    assert days[food].tolist() == [100] * 9
+    assert days[rent].tolist() == [0, 0, 0, 0, 1000, 0, 0, 0, 0]
+    assert spent_today == {food: 40}
+
+
+def test_simulate_category():
+    task = forecast.CategoryTask(
+        1.0, np.array([10.0]), 4.0, 3, 5, np.random.SeedSequence(0)
+    )
+    totals = forecast.simulate_category(task)
+    assert totals.shape == (4, 5)
+    assert totals[:, 0].tolist() == [6, 16, 26, 36]
+
+    empty = task._replace(amounts=np.array([]), chance=0.0)
+    assert not forecast.simulate_category(empty).any()
+
+
+def test_exceed_probabilities(history, db_filename, monkeypatch):
+    food, rent = history
+    end = date(2024, 1, 12)
+    budgets = [
+        # 40 уже потрачено, остаток дня 60 и ещё два дня по 100:
+        # ровно 300 в каждом испытании
+        forecast.BudgetState(food, end, 290, 40),
+        forecast.BudgetState(food, end, 310, 40),
+        forecast.BudgetState(food, end, 30, 40),
+        forecast.BudgetState(ALL_CATEGORIES, end, 350, 40),
+    ]
+    probabilities = forecast.exceed_probabilities(db_filename, budgets, TODAY, seed=1)
+    assert probabilities[:3] == [1.0, 0.0, 1.0]
+    # аренда бывает в одном дне из девяти: за три дня примерно 1 - (8/9)**3
+    assert probabilities[3] == pytest.approx(1 - (8 / 9) ** 3, abs=0.02)
+
+    monkeypatch.setattr(forecast, 'PARALLEL_MIN_CATEGORIES', 1)
+    assert forecast.exceed_probabilities(
+        db_filename, budgets, TODAY, max_workers=2, seed=1
+    ) == probabilities
+
+
+def test_budgets_forecast(presenter):
+    presenter.category_add('food')
+    presenter.expense_add(100, 'food', '')
+    presenter.budget_edit_limit(presenter.budget_get_by_period(1).obj_id, 50)
+    risks = presenter.budgets_forecast(simulations=100, seed=0)
+    assert set(risks) == {bdg.obj_id for bdg in presenter.budgets_get_list()}
+    assert risks[presenter.budget_get_by_period(1).obj_id] == 1.0
+
+
+def test_forecast_is_cached_until_totals_change(presenter, monkeypatch):
+    presenter.category_add('food')
+    presenter.expense_add(100, 'food', '')
+    calls = []
+    exceed = forecast.exceed_probabilities
+    monkeypatch.setattr(
+        forecast, 'exceed_probabilities', lambda *args: calls.append(1) or exceed(*args)
+    )
+    first = presenter.budgets_forecast(simulations=100)
+    assert presenter.budgets_forecast(simulations=100) == first and len(calls) == 1
+    presenter.expense_add(10, 'food', '')
+    presenter.budgets_forecast(simulations=100)
+    assert len(calls) == 2
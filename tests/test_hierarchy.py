@@ -0,0 +1,81 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+from datetime import datetime, timedelta
+
+import pytest
+
+TODAY = datetime.now().replace(microsecond=0)
+
+
+@pytest.fixture
+def tree(presenter):
+    food = presenter.category_add('food')
+    fruit = presenter.category_add('fruit', food)
+    apple = presenter.category_add('apple', fruit)
+    rent = presenter.category_add('rent')
+    presenter.expense_add(100, 'food', 'обед', TODAY)
+    presenter.expense_add(30, 'fruit', 'груши', TODAY)
+    presenter.expense_add(20, 'apple', 'яблоки', TODAY)
+    # вне текущего месяца
+    presenter.expense_add(1000, 'apple', 'ящик', TODAY - timedelta(days=100))
+    return presenter, {'food': food, 'fruit': fruit, 'apple': apple, 'rent': rent}
+
+
+def summary(nodes):
+    return [(node.name, node.has_children, node.own, node.total) for node in nodes]
+
+
+def test_children_have_own_and_subtree_totals(tree):
+    presenter, ids = tree
+    assert summary(presenter.categories_get_children()) == [
+        ('food', True, 100, 150), ('rent', False, 0, 0)
+    ]
+    assert summary(presenter.categories_get_children(ids['food'])) == [
+        ('fruit', True, 30, 50)
+    ]
+    assert summary(presenter.categories_get_children(ids['apple'])) == []
+    assert summary(presenter.categories_get_children(ids['fruit'], 0)) == [
+        ('apple', False, 20, 20)
+    ]
+
+
+def test_moving_categories(tree):
+    presenter, ids = tree
+    with pytest.raises(ValueError):
+        presenter.category_set_parent(ids['food'], ids['apple'])
+    with pytest.raises(ValueError):
+        presenter.category_set_parent(ids['food'], ids['food'])
+    with pytest.raises(ValueError):
+        presenter.category_add('pear', 12345)
+
+    presenter.category_set_parent(ids['apple'], ids['rent'])
+    assert summary(presenter.categories_get_children()) == [
+        ('food', True, 100, 130), ('rent', True, 0, 20)
+    ]
+    presenter.category_set_parent(ids['fruit'], None)
+    assert [node.name for node in presenter.categories_get_children()] == [
+        'food', 'fruit', 'rent'
+    ]
+
+
+def test_children_of_deleted_category_move_up(tree):
+    presenter, ids = tree
+    presenter.category_delete(ids['fruit'], reassign_to=ids['food'])
+    assert summary(presenter.categories_get_children(ids['food'])) == [
+        ('apple', False, 20, 20)
+    ]
+    assert summary(presenter.categories_get_children()) == [
+        ('food', True, 130, 150), ('rent', False, 0, 0)
+    ]
+
+
+def test_children_query_reads_indexes(tree, query_recorder):
+    presenter, ids = tree
+    for parent_id in (None, ids['food']):
+        plans = query_recorder.record(presenter.categories_get_children, parent_id)
+        assert plans
+        scanned = query_recorder.scanned(plans)
+        assert not {'Category', 'Expense', 'DailyTotal'} & scanned, plans
+        assert 'idx_category__parent_id' in query_recorder.indexes(plans)
@@ -0,0 +1,89 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from bookkeeper.listing import ExpenseFilter
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def filled(presenter):
+    for name in ('rent', 'food', 'fun'):
+        presenter.category_add(name)
+    for i in range(40):
+        presenter.expense_add(
+            (i * 7) % 13, ('rent', 'food', 'fun')[i % 3], f'#{i % 5}',
+            START + timedelta(days=i % 11)
+        )
+    return presenter
+
+
+def all_pages(presenter, sort, descending=False, filters=None, limit=6):
+    result, after_id = [], 0
+    while True:
+        page = presenter.expenses_get_sorted_page(
+            sort, descending, filters, after_id, limit
+        )
+        result.extend(page)
+        if len(page) < limit:
+            return result
+        after_id = page[-1].obj_id
+
+
+@pytest.mark.parametrize('sort, key', [
+    ('id', lambda e, names: ()),
+    ('date', lambda e, names: (e.expense_date,)),
+    ('amount', lambda e, names: (e.amount,)),
+    ('category', lambda e, names: (names[e.category_id], e.category_id)),
+    ('comment', lambda e, names: (e.comment,)),
+])
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_follow_sort_order(filled, sort, key, descending):
+    names = {cat.obj_id: cat.name for cat in filled.categories_get_list()}
+    expected = sorted(
+        filled.expenses_get_list(),
+        key=lambda e: key(e, names) + (e.obj_id,), reverse=descending
+    )
+    assert [e.obj_id for e in all_pages(filled, sort, descending)] == [
+        e.obj_id for e in expected
+    ]
+
+
+def test_filters_are_combined(filled):
+    food = filled.categories_get_by_name('food')[0].obj_id
+    filters = ExpenseFilter(
+        start=START + timedelta(days=2), end=START + timedelta(days=9),
+        category_ids=(food,), min_amount=3, max_amount=10, comment='#1'
+    )
+    expected = [
+        e.obj_id for e in filled.expenses_get_list()
+        if filters.start <= e.expense_date < filters.end and e.category_id == food
+        and 3 <= e.amount <= 10 and '#1' in e.comment
+    ]
+    assert expected
+    assert [e.obj_id for e in all_pages(filled, 'amount', True, filters, 2)] == sorted(
+        expected, key=lambda exp_id: (filled.expense_get_by_id(exp_id).amount, exp_id),
+        reverse=True
+    )
+    assert filled.expenses_get_sorted_page(filters=ExpenseFilter(category_ids=())) == []
+
+
+def test_unknown_sort_key(filled):
+    with pytest.raises(ValueError):
+        filled.expenses_get_sorted_page('fingerprint')
+
+
+@pytest.mark.parametrize('sort', ['date', 'amount', 'category', 'comment'])
+def test_sorted_page_reads_index(filled, query_recorder, sort):
+    after_id = filled.expenses_get_sorted_page(sort, True, limit=10)[-1].obj_id
+    plans = query_recorder.record(
+        filled.expenses_get_sorted_page, sort, True, None, after_id, 10
+    )
+    assert plans
+    assert 'Expense' not in query_recorder.scanned(plans), plans
+    assert not any('TEMP B-TREE' in detail for _, plan in plans for detail in plan), plans
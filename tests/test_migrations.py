@@ -0,0 +1,110 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from bookkeeper import duplicates, migrations
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    """
+    База первой версии программы с десятью расходами
+    """
+    filename = str(tmp_path / 'legacy.sqlite')
+    con = sqlite3.connect(filename)
+    migrations._create_tables(con)
+    con.execute('INSERT INTO "Category" ("name") VALUES (\'food\')')
+    con.executemany(
+        'INSERT INTO "Expense" ("amount", "category_id", "expense_date", "comment") '
+        'VALUES (?, 1, \'2020-01-01 00:00:00\', \'\')',
+        [(amount,) for amount in range(10)]
+    )
+    con.commit()
+    yield con
+    con.close()
+
+
+def test_backfill_runs_in_resumable_batches(legacy):
+    assert migrations.migrate(legacy) == [
+        migration.version for migration in migrations.MIGRATIONS
+    ]
+    # производные таблицы создаются пустыми, расходы обрабатываются заполнением
+    assert legacy.execute('SELECT count(*) FROM "DailyTotal"').fetchone() == (0,)
+    assert legacy.execute(
+        'SELECT count(*) FROM "SyncRow" WHERE "tbl" = \'Expense\''
+    ).fetchone() == (0,)
+
+    reports = []
+    assert not migrations.run_backfills(legacy, 3, reports.append, max_batches=2)
+    assert [(p.name, p.done, p.remaining) for p in reports] == [
+        ('expense_fingerprints', 3, 7), ('expense_fingerprints', 6, 4)
+    ]
+
+    # заполнение продолжается в новом процессе с того же места
+    reports.clear()
+    assert migrations.run_backfills(legacy, 3, reports.append)
+    assert [(p.name, p.done, p.remaining) for p in reports] == [
+        (name, done, 10 - done)
+        for name in ('expense_fingerprints', 'daily_totals', 'change_tracking')
+        for done in ((9, 10, 10) if name == 'expense_fingerprints' else (3, 6, 9, 10, 10))
+    ]
+    assert migrations.pending_backfills(legacy) == []
+    assert legacy.execute(
+        'SELECT "fingerprint" FROM "Expense" WHERE "amount" = 5'
+    ).fetchone() == (duplicates.fingerprint(5, datetime(2020, 1, 1), 1, ''),)
+    assert legacy.execute('SELECT "day", "amount" FROM "DailyTotal"').fetchall() == [
+        ('2020-01-01', 45)
+    ]
+    # заполнение не считается изменением расходов для синхронизации
+    assert legacy.execute(
+        'SELECT count(*), max("revision") FROM "SyncRow" WHERE "tbl" = \'Expense\''
+    ).fetchone() == (10, 1)
+
+
+def test_writes_during_backfill_are_counted_once(legacy):
+    migrations.migrate(legacy)
+    migrations.run_backfills(legacy, 4, max_batches=5)
+    # отпечатки заполнены, дневные суммы --- по первым четырём расходам,
+    # записи отслеживания расходов ещё не заведены
+    with legacy:
+        legacy.execute('UPDATE "Expense" SET "amount" = 100 WHERE "obj_id" IN (2, 8)')
+        legacy.execute('DELETE FROM "Expense" WHERE "obj_id" IN (3, 9)')
+        legacy.execute(
+            'INSERT INTO "Expense" ("amount", "category_id", "expense_date", "comment") '
+            'VALUES (1000, 1, \'2020-01-01 00:00:00\', \'\')'
+        )
+    assert migrations.run_backfills(legacy, 4)
+
+    total = legacy.execute('SELECT sum("amount") FROM "Expense"').fetchone()[0]
+    assert total == 45 - 1 - 7 + 100 + 100 - 2 - 8 + 1000
+    assert legacy.execute('SELECT sum("amount") FROM "DailyTotal"').fetchone() == (total,)
+    rows = dict(legacy.execute(
+        'SELECT "uid", "deleted" FROM "SyncRow" WHERE "tbl" = \'Expense\''
+    ).fetchall())
+    # удалённый до заполнения расход оставил надгробие под прежним идентификатором
+    assert rows['legacy:9:2020-01-01 00:00:00:8.0'] == 1
+    assert sum(rows.values()) == 2 and len(rows) == 11
+
+
+def test_new_database_has_nothing_to_fill(tmp_path):
+    con = sqlite3.connect(str(tmp_path / 'new.sqlite'))
+    migrations.migrate(con)
+    assert migrations.pending_backfills(con) == []
+    assert set(migrations.applied(con).values()) != {None}
+    con.close()
+
+
+def test_newer_database_is_rejected(legacy):
+    migrations.migrate(legacy)
+    legacy.execute(
+        'INSERT INTO "SchemaVersion" ("version", "name", "applied") '
+        'VALUES (?, \'future\', \'\')',
+        (migrations.LATEST_VERSION + 1,)
+    )
+    with pytest.raises(ValueError):
+        migrations.migrate(legacy)
@@ -0,0 +1,36 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+from datetime import date
+
+import pytest
+
+from bookkeeper import periods
+
+
+@pytest.mark.parametrize('code, param, today, bounds', [
+    (periods.PERIOD_DAY, 0, date(2023, 3, 15), (date(2023, 3, 15), date(2023, 3, 15))),
+    (periods.PERIOD_WEEK, 0, date(2023, 3, 15), (date(2023, 3, 9), date(2023, 3, 15))),
+    (periods.PERIOD_MONTH, 0, date(2023, 3, 15), (date(2023, 2, 14), date(2023, 3, 15))),
+    (periods.PERIOD_CALENDAR_WEEK, 0, date(2023, 3, 15),
+     (date(2023, 3, 13), date(2023, 3, 19))),
+    (periods.PERIOD_CALENDAR_MONTH, 0, date(2024, 2, 10),
+     (date(2024, 2, 1), date(2024, 2, 29))),
+    (periods.PERIOD_SINCE_DAY_OF_MONTH, 25, date(2023, 3, 15),
+     (date(2023, 2, 25), date(2023, 3, 24))),
+    (periods.PERIOD_SINCE_DAY_OF_MONTH, 25, date(2023, 12, 25),
+     (date(2023, 12, 25), date(2024, 1, 24))),
+    (periods.PERIOD_SINCE_DAY_OF_MONTH, 31, date(2023, 3, 1),
+     (date(2023, 2, 28), date(2023, 3, 30))),
+    (periods.PERIOD_DAYS, 3, date(2023, 3, 1), (date(2023, 2, 27), date(2023, 3, 1))),
+])
+def test_bounds(code, param, today, bounds):
+    assert periods.make_period(code, param).bounds(today) == bounds
+
+
+@pytest.mark.parametrize('code, param', [(100, 0), (periods.PERIOD_DAYS, 0),
+                                         (periods.PERIOD_SINCE_DAY_OF_MONTH, 32)])
+def test_wrong_period(code, param):
+    with pytest.raises(ValueError):
+        periods.make_period(code, param)
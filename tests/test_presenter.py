@@ -0,0 +1,333 @@
+"""
+Тесты презентера
+"""
+
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+from pony import orm
+
+from bookkeeper import duplicates, migrations, periods
+from bookkeeper import presenter as presenter_module
+from bookkeeper.presenter import Budget, Presenter
+
+
+def test_budgets_are_created_once(presenter, db_filename):
+    Presenter(db_filename)
+    Presenter(db_filename)
+    with orm.db_session:
+        assert sorted(bdg.period for bdg in Budget.select()) == [0, 1, 2]
+
+
+def test_budget_cache_is_invalidated_on_edit(presenter):
+    bdg = presenter.budget_get_by_period(1)
+    assert presenter.budget_get_by_period(1) is bdg
+
+    presenter.budget_edit_limit(bdg.obj_id, 100)
+    assert presenter.budget_get_limit_for_period(1) == 100
+    assert presenter.budget_get_by_period(1) is not bdg
+
+
+def test_budget_limits_are_read_from_cache(presenter, monkeypatch):
+    presenter.budget_get_limit_for_period(0)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("database should not be queried")
+
+    monkeypatch.setattr(Budget, 'select', fail)
+    for period in presenter_module.BUDGET_PERIODS:
+        assert presenter.budget_get_limit_for_period(period) == 0
+
+
+def test_wrong_budget_period(presenter):
+    with pytest.raises(ValueError):
+        presenter.budget_get_by_period(10)
+    assert presenter.budgets_get_by_period(10) == []
+
+
+def test_upgrade_collapses_duplicate_budgets(tmp_path):
+    filename = str(tmp_path / 'old.sqlite')
+    con = sqlite3.connect(filename)
+    con.execute(
+        'CREATE TABLE "Budget" ("obj_id" INTEGER PRIMARY KEY AUTOINCREMENT, '
+        '"period" INTEGER NOT NULL, "limit" REAL NOT NULL)'
+    )
+    con.executemany(
+        'INSERT INTO "Budget" ("period", "limit") VALUES (?, ?)',
+        [(0, 10), (1, 20), (2, 30), (0, 0), (1, 0), (2, 0), (0, 0), (1, 0), (2, 0)]
+    )
+    con.commit()
+    con.close()
+
+    con = sqlite3.connect(filename)
+    migrations.migrate(con)
+    con.execute('DELETE FROM "SchemaVersion"')
+    migrations.migrate(con)
+
+    assert con.execute(
+        'SELECT "obj_id", "period", "limit", "param", "category_id" '
+        'FROM "Budget" ORDER BY "period"'
+    ).fetchall() == [(1, 0, 10, 0, 0), (2, 1, 20, 0, 0), (3, 2, 30, 0, 0)]
+    with pytest.raises(sqlite3.IntegrityError):
+        con.execute(
+            'INSERT INTO "Budget" ("period", "limit", "param", "category_id") '
+            'VALUES (0, 1, 0, 0)'
+        )
+    con.execute(
+        'INSERT INTO "Budget" ("period", "limit", "param", "category_id") '
+        'VALUES (0, 1, 0, 5)'
+    )
+    con.close()
+
+
+@pytest.fixture
+def food(presenter):
+    return presenter.category_add('food')
+
+
+def test_sum_for_rolling_periods(presenter, food):
+    now = datetime.now()
+    presenter.expense_add(1, 'food', '', now)
+    presenter.expense_add(10, 'food', '', now - timedelta(days=3))
+    presenter.expense_add(100, 'food', '', now - timedelta(days=20))
+    presenter.expense_add(1000, 'food', '', now - timedelta(days=40))
+
+    assert presenter.budget_get_sum_for_period(0) == 1
+    assert presenter.budget_get_sum_for_period(1) == 11
+    assert presenter.budget_get_sum_for_period(2) == 111
+    with pytest.raises(ValueError):
+        presenter.budget_get_sum_for_period(100)
+
+
+def test_sums_follow_mutations(presenter, food):
+    rent = presenter.category_add('rent')
+    today = date.today()
+    exp_id = presenter.expense_add(10, 'food', '')
+    assert presenter.expenses_get_sum(today, today) == 10
+
+    presenter.expense_edit_cost(exp_id, 15)
+    assert presenter.expenses_get_sum(today, today) == 15
+
+    presenter.expense_edit_category_by_name(exp_id, 'rent')
+    assert presenter.expenses_get_sum(today, today, food) == 0
+    assert presenter.expenses_get_sum(today, today, rent) == 15
+
+    presenter.expense_edit_date(exp_id, datetime(2020, 5, 5))
+    assert presenter.expenses_get_sum(today, today) == 0
+    assert presenter.expenses_get_sum(date(2020, 5, 1), date(2020, 5, 31)) == 15
+
+    presenter.expense_delete(exp_id)
+    assert presenter.expenses_get_sum(date(2020, 1, 1), today) == 0
+
+
+def test_sums_see_writes_from_other_connections(presenter, food, db_filename):
+    presenter.expense_add(10, 'food', '')
+    assert presenter.budget_get_sum_for_period(0) == 10
+
+    con = sqlite3.connect(db_filename)
+    with con:
+        con.execute('UPDATE "Expense" SET "amount" = 25')
+    con.close()
+    assert presenter.budget_get_sum_for_period(0) == 25
+
+
+def test_category_budget(presenter, food):
+    presenter.category_add('rent')
+    presenter.expense_add(10, 'food', '')
+    presenter.expense_add(500, 'rent', '')
+
+    bdg_id = presenter.budget_add(periods.PERIOD_CALENDAR_MONTH, 100, category_id=food)
+    bdg = next(bdg for bdg in presenter.budgets_get_list() if bdg.obj_id == bdg_id)
+    assert presenter.budget_get_sum(bdg) == 10
+
+    with pytest.raises(ValueError):
+        presenter.budget_add(periods.PERIOD_CALENDAR_MONTH, 1, category_id=food)
+    with pytest.raises(ValueError):
+        presenter.budget_add(periods.PERIOD_DAYS, 1, param=0)
+    with pytest.raises(ValueError):
+        presenter.budget_add(periods.PERIOD_DAY, 1, category_id=12345)
+
+    presenter.budget_delete(bdg_id)
+    assert len(presenter.budgets_get_list()) == 3
+    with pytest.raises(ValueError):
+        presenter.budget_delete(presenter.budget_get_by_period(0).obj_id)
+
+
+def test_foreign_key_is_installed_on_legacy_table(tmp_path):
+    filename = str(tmp_path / 'old.sqlite')
+    con = sqlite3.connect(filename)
+    con.execute(
+        'CREATE TABLE "Expense" ("obj_id" INTEGER PRIMARY KEY AUTOINCREMENT, '
+        '"amount" REAL NOT NULL, "category_id" INTEGER NOT NULL, '
+        '"expense_date" DATETIME NOT NULL, "comment" TEXT NOT NULL)'
+    )
+    con.execute(
+        'INSERT INTO "Expense" VALUES (7, 1, 42, \'2020-01-01 00:00:00.000000\', \'-\')'
+    )
+    con.commit()
+    assert migrations.migrate(con) == [m.version for m in migrations.MIGRATIONS]
+    assert [m.name for m in migrations.pending_backfills(con)] == [
+        'expense_fingerprints', 'daily_totals', 'change_tracking'
+    ]
+    assert migrations.run_backfills(con)
+    assert migrations.migrate(con) == [] and migrations.pending_backfills(con) == []
+
+    foreign_keys = con.execute('PRAGMA foreign_key_list("Expense")').fetchall()
+    assert foreign_keys[0][2] == 'Category'
+    assert con.execute(
+        'SELECT "obj_id", "category_id", "fingerprint", "duplicate_of" FROM "Expense"'
+    ).fetchall() == [
+        (7, 1, duplicates.fingerprint(1, datetime(2020, 1, 1), 1, '-'), None)
+    ]
+    assert {'idx_expense__category_id', 'idx_expense__fingerprint'} <= {
+        row[1] for row in con.execute('PRAGMA index_list("Expense")')
+    }
+    con.close()
+
+
+def test_orphan_expenses_are_repaired_before_foreign_key(tmp_path):
+    filename = str(tmp_path / 'old.sqlite')
+    con = sqlite3.connect(filename)
+    migrations._create_tables(con)
+    with con:
+        con.execute('INSERT INTO "Category" ("name") VALUES (\'food\')')
+        con.executemany(
+            'INSERT INTO "Expense" VALUES (?, 1, ?, \'2020-01-01 00:00:00\', \'-\')',
+            [(1, 1), (5, 42), (9, 1)]
+        )
+        con.execute('DELETE FROM "Expense" WHERE "obj_id" = 9')
+        con.execute(
+            'CREATE INDEX "idx_expense__expense_date" ON "Expense" ("expense_date")'
+        )
+    migrations.migrate(con)
+
+    assert con.execute('PRAGMA foreign_key_check').fetchall() == []
+    assert con.execute('SELECT "obj_id", "name" FROM "Category"').fetchall() == [
+        (1, 'food'), (2, presenter_module.UNKNOWN_CATEGORY)
+    ]
+    assert con.execute('SELECT "obj_id", "category_id" FROM "Expense"').fetchall() == [
+        (1, 1), (5, 2)
+    ]
+    assert 'idx_expense__expense_date' in {
+        row[1] for row in con.execute('PRAGMA index_list("Expense")')
+    }
+    with con:
+        new_id = con.execute(
+            'INSERT INTO "Expense" ("amount", "category_id", "expense_date", "comment") '
+            'VALUES (1, 1, \'2020-01-02 00:00:00\', \'-\')'
+        ).lastrowid
+    assert new_id == 10
+    con.close()
+
+
+def test_category_delete_modes(presenter, food):
+    rent = presenter.category_add('rent')
+    empty = presenter.category_add('empty')
+    presenter.expense_add(10, 'food', '', datetime(2015, 1, 1))
+    presenter.expense_add(20, 'food', '')
+    presenter.expense_add(300, 'rent', '')
+    presenter.budget_add(periods.PERIOD_CALENDAR_MONTH, 100, category_id=food)
+    presenter.expenses_archive(datetime(2016, 1, 1))
+
+    presenter.category_delete(empty)
+    with pytest.raises(ValueError):
+        presenter.category_delete(food)
+    with pytest.raises(ValueError):
+        presenter.category_delete(food, reassign_to=food)
+
+    assert presenter.category_delete(food, reassign_to=rent) == 2
+    assert [exp.category_id for exp in presenter.expenses_get_history()] == [rent] * 3
+    assert [bdg.category_id for bdg in presenter.budgets_get_list()] == [0, 0, 0]
+    assert presenter.expenses_get_sum(date.today(), date.today(), rent) == 320
+
+    assert presenter.category_delete(rent, cascade=True) == 3
+    assert presenter.expenses_get_history() == []
+    assert presenter.categories_get_list() == []
+    assert presenter.expenses_get_sum(date.today(), date.today()) == 0
+
+
+def test_category_repair(presenter, food, db_filename):
+    presenter.expense_add(10, 'food', '', datetime(2015, 1, 1))
+    presenter.expense_add(20, 'food', '')
+    presenter.expenses_archive(datetime(2016, 1, 1))
+    con = sqlite3.connect(db_filename)
+    with con:
+        con.execute('DELETE FROM "Category"')
+    con.close()
+
+    assert presenter.category_repair() == 2
+    unknown = presenter.categories_get_by_name(presenter_module.UNKNOWN_CATEGORY)[0]
+    history = presenter.expenses_get_history()
+    assert {exp.category_id for exp in history} == {unknown.obj_id}
+    assert presenter.category_repair() == 0
+
+    with pytest.raises(orm.core.TransactionIntegrityError):
+        with orm.db_session:
+            presenter_module.Expense(
+                amount=1, category_id=12345, expense_date=datetime.now(), comment='-'
+            )
+
+
+def test_duplicate_policies(presenter, food):
+    moment = datetime(2024, 3, 1, 9)
+    first = presenter.expense_add(100, 'food', 'Кофе', moment)
+    later = moment + timedelta(hours=3)
+
+    assert presenter.expense_find_duplicate(100, 'food', ' кофе ', later) == first
+    next_day = later + timedelta(days=1)
+    assert presenter.expense_find_duplicate(100, 'food', 'кофе', next_day) is None
+    assert presenter.expense_add(100, 'food', 'кофе', later, duplicates.SKIP) == first
+    assert presenter.expense_add(100, 'food', 'кофе', later, duplicates.MERGE) == first
+    merged = presenter.expense_get_by_id(first)
+    assert (merged.expense_date, merged.comment) == (later, 'кофе')
+
+    flagged = presenter.expense_add(100, 'food', 'кофе', moment, duplicates.FLAG)
+    assert presenter.expense_get_by_id(flagged).duplicate_of == first
+    allowed = presenter.expense_add(100, 'food', 'кофе', moment)
+    presenter.expense_add(100, 'food', 'чай', moment)
+    assert presenter.expenses_find_duplicates() == [[first, flagged, allowed]]
+
+    # отпечаток пересчитывается при правке и при переносе в другую категорию
+    presenter.expense_edit_cost(allowed, 50)
+    assert presenter.expenses_find_duplicates() == [[first, flagged]]
+    rent = presenter.category_add('rent')
+    presenter.expense_add(100, 'rent', 'кофе', moment)
+    presenter.category_delete(food, reassign_to=rent)
+    assert presenter.expense_find_duplicate(100, 'rent', 'кофе', moment) == first
+    assert len(presenter.expenses_find_duplicates()[0]) == 3
+
+    with pytest.raises(ValueError):
+        presenter.expense_add(1, 'rent', '', moment, 'ignore')
+
+
+def test_locked_transaction_is_retried(monkeypatch):
+    monkeypatch.setattr(presenter_module, 'RETRY_DELAY', 0.001)
+    calls = []
+
+    @presenter_module.retry_locked
+    def flaky(fails):
+        calls.append(1)
+        if len(calls) <= fails:
+            raise sqlite3.OperationalError('database is locked')
+        return len(calls)
+
+    assert flaky(3) == 4
+    calls.clear()
+    with pytest.raises(sqlite3.OperationalError):
+        flaky(presenter_module.RETRY_ATTEMPTS)
+    assert len(calls) == presenter_module.RETRY_ATTEMPTS
+
+    @presenter_module.retry_locked
+    def broken():
+        calls.append(1)
+        raise sqlite3.OperationalError('no such table')
+
+    calls.clear()
+    with pytest.raises(sqlite3.OperationalError):
+        broken()
+    assert len(calls) == 1
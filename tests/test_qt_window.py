@@ -0,0 +1,193 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import os
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PySide6.QtWidgets')
+
+from bookkeeper.view import qt_window
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def model(app, presenter):
+    presenter.category_add('food')
+    return qt_window.CategoryListModel(presenter)
+
+
+def test_category_model_is_updated_in_place(model, presenter, monkeypatch):
+    combo = QtWidgets.QComboBox()
+    combo.setModel(model)
+    resets = []
+    model.modelReset.connect(lambda: resets.append(1))
+
+    def fail(*args):
+        raise AssertionError('categories must not be reloaded')
+    monkeypatch.setattr(presenter, 'categories_get_list', fail)
+
+    row = model.add('rent')
+    assert [combo.itemText(i) for i in range(combo.count())] == ['food', 'rent']
+
+    errors = []
+    model.rename_failed.connect(errors.append)
+    assert not model.setData(model.index(row), 'food')
+    assert model.setData(model.index(row), 'flat')
+    assert combo.itemText(row) == 'flat'
+    assert presenter.category_get_by_id(model.category_id(row)).name == 'flat'
+
+    model.remove(0)
+    assert list(model.names().values()) == ['flat'] and combo.count() == 1
+    assert len(errors) == 1 and resets == []
+
+
+def test_refresh_scheduler_coalesces_requests(app):
+    scheduler = qt_window.RefreshScheduler()
+    calls = []
+    scheduler.register('expenses', lambda: calls.append('expenses'))
+    scheduler.register('budget', lambda: calls.append('budget'))
+
+    for _ in range(3):
+        scheduler.request('expenses', 'budget')
+    scheduler.request('expenses')
+    assert calls == []
+    app.processEvents()
+    assert calls == ['expenses', 'budget']
+    assert scheduler.requested == {'expenses': 4, 'budget': 3}
+    assert scheduler.performed == {'expenses': 1, 'budget': 1}
+
+    app.processEvents()
+    assert len(calls) == 2
+    with pytest.raises(ValueError):
+        scheduler.request('unknown')
+
+
+def test_expenses_are_fetched_page_by_page(app, presenter, monkeypatch):
+    monkeypatch.setattr(qt_window, 'EXPENSES_PAGE_SIZE', 2)
+    presenter.category_add('food')
+    for cost in range(5):
+        presenter.expense_add(cost + 1, 'food', '')
+    model = qt_window.ExpenseTableModel(qt_window.CategoryListModel(presenter), presenter)
+    root = qt_window.QtCore.QModelIndex()
+
+    model.reload()
+    assert model.rowCount() == 2 and model.canFetchMore(root)
+    model.fetchMore(root)
+    model.fetchMore(root)
+    assert model.rowCount() == 5 and not model.canFetchMore(root)
+    assert [model.index(row, 1).data() for row in range(5)] == [
+        '1.0', '2.0', '3.0', '4.0', '5.0'
+    ]
+    assert model.index(0, 2).data() == 'food'
+
+    errors = []
+    model.edit_failed.connect(errors.append)
+    assert not model.setData(model.index(0, 1), 'много')
+    assert model.setData(model.index(0, 1), '7')
+    assert model.index(0, 1).data() == '7.0' and len(errors) == 1
+    model.remove(0)
+    assert model.rowCount() == 4
+    assert sum(expense.amount for expense in presenter.expenses_get_list()) == 14
+
+
+def test_window_loads_data_after_show(app, presenter, db_filename, monkeypatch):
+    monkeypatch.setattr(qt_window, 'EXPENSES_PAGE_SIZE', 2)
+    monkeypatch.setattr(
+        'bookkeeper.presenter.Presenter.__init__.__defaults__', (db_filename, False)
+    )
+    presenter.category_add('food')
+    for cost in range(5):
+        presenter.expense_add(cost + 1, 'food', '')
+
+    window = qt_window.Window()
+    assert window.presenter is None and not window.isEnabled()
+    assert window.expenses_model.rowCount() == 0
+
+    window.show()
+    while 'first_page_loaded' not in window.startup_times:
+        app.processEvents()
+    assert window.isEnabled()
+    assert window.expenses_model.rowCount() >= 2
+    assert window.expenses_model.index(1, 1).data() == '2.0'
+    assert list(window.startup_times)[-1] == 'first_page_loaded'
+    window.close()
+
+
+def test_expenses_are_sorted_and_filtered_by_query(
+        app, presenter, db_filename, monkeypatch
+):
+    monkeypatch.setattr(
+        'bookkeeper.presenter.Presenter.__init__.__defaults__', (db_filename, False)
+    )
+    presenter.category_add('food')
+    presenter.category_add('rent')
+    for cost, category in ((5, 'food'), (1, 'rent'), (3, 'food')):
+        presenter.expense_add(cost, category, '')
+
+    window = qt_window.Window()
+    window.show()
+    while 'first_page_loaded' not in window.startup_times:
+        app.processEvents()
+    model = window.expenses_model
+
+    def amounts():
+        return [model.index(row, 1).data() for row in range(model.rowCount())]
+
+    window.table_expenses.table.horizontalHeader().sectionClicked.emit(1)
+    assert amounts() == ['1.0', '3.0', '5.0']
+    window.sort_expenses(1)
+    assert amounts() == ['5.0', '3.0', '1.0']
+
+    window.filter_by_category(0)
+    window.filter_min_entry.setText('4')
+    window.filter_min_entry.editingFinished.emit()
+    assert amounts() == ['5.0']
+
+    window.reset_expenses_filter()
+    assert amounts() == ['5.0', '3.0', '1.0']
+    window.close()
+
+
+def test_category_tree_fetches_levels_on_expand(app, presenter, monkeypatch):
+    food = presenter.category_add('food')
+    presenter.category_add('fruit', food)
+    presenter.category_add('rent')
+    presenter.expense_add(10, 'fruit', 'груши')
+    levels = []
+    get_children = presenter.categories_get_children
+    monkeypatch.setattr(
+        presenter, 'categories_get_children',
+        lambda parent_id, period: (
+            levels.append(parent_id) or get_children(parent_id, period)
+        )
+    )
+    tree = QtWidgets.QTreeView()
+    model = qt_window.CategoryTreeModel(presenter)
+    tree.setModel(model)
+
+    root = qt_window.QtCore.QModelIndex()
+    assert model.canFetchMore(root)
+    model.fetchMore(root)
+    names = [model.index(row, 0).data() for row in range(model.rowCount())]
+    assert names == ['food', 'rent']
+    assert model.index(0, 2).data() == '10.0' and levels == [None]
+    assert not model.hasChildren(model.index(1, 0))
+
+    tree.expand(model.index(0, 0))
+    model.fetchMore(model.index(0, 0))
+    child = model.index(0, 0, model.index(0, 0))
+    assert child.data() == 'fruit' and model.parent(child).data() == 'food'
+    assert levels == [None, food]
+
+    presenter.expense_add(5, 'fruit', 'яблоки')
+    model.refresh()
+    assert model.index(0, 2).data() == '15.0'
+    assert model.index(0, 1, model.index(0, 0)).data() == '15.0'
+    assert tree.isExpanded(model.index(0, 0))
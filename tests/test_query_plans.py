@@ -0,0 +1,92 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+from datetime import datetime, timedelta
+
+import pytest
+
+START = datetime(2024, 1, 1)
+
+
+def at(days):
+    return START + timedelta(days=days)
+
+
+@pytest.fixture
+def seeded(presenter):
+    for name in ('food', 'rent', 'fun'):
+        presenter.category_add(name)
+    for day in range(300):
+        presenter.expense_add(
+            day % 50 + 1, ('food', 'rent', 'fun')[day % 3], f'#{day}', at(day)
+        )
+    presenter.expenses_archive(at(31))
+    return presenter
+
+
+HOT_PATHS = {
+    'name lookup': (
+        lambda p: p.categories_get_by_name('rent'), {'idx_category__name'}
+    ),
+    'expense add': (
+        lambda p: p.expense_add(10, 'food', 'x', on_duplicate='skip'),
+        {'idx_category__name', 'idx_expense__fingerprint'}
+    ),
+    'edit category': (
+        lambda p: p.expense_edit_category_by_name(
+            p.expenses_get_page(0, 1)[0].obj_id, 'fun'
+        ),
+        {'idx_category__name'}
+    ),
+    'page': (lambda p: p.expenses_get_page(100, 50), set()),
+    'page in date range': (
+        lambda p: p.expenses_get_page(0, 50, at(100), at(120)),
+        set()
+    ),
+    'history': (
+        lambda p: p.expenses_get_history(at(100), at(120)),
+        {'idx_expense__expense_date'}
+    ),
+    'sum history': (
+        lambda p: p.expenses_get_sum_history(at(10), at(60)),
+        {'idx_expense__expense_date', 'idx_archive_expense_date'}
+    ),
+    'report': (
+        lambda p: p.report_by_category(at(100), at(120)),
+        {'idx_expense__expense_date'}
+    ),
+}
+
+
+@pytest.mark.parametrize('name', HOT_PATHS)
+def test_hot_paths_use_indexes(seeded, query_recorder, name):
+    call, expected = HOT_PATHS[name]
+    plans = query_recorder.record(call, seeded)
+    assert plans
+    assert 'Expense' not in query_recorder.scanned(plans), plans
+    assert expected <= query_recorder.indexes(plans), plans
+
+
+def test_budget_sums_do_not_read_expenses(seeded, query_recorder):
+    for period in range(3):
+        plans = query_recorder.record(seeded.budget_get_sum_for_period, period)
+        assert not any('Expense' in query_recorder.tables(sql) for sql, _ in plans)
+        plans = query_recorder.record(
+            seeded.expenses_get_sum, START.date(), at(90).date()
+        )
+        assert not any('Expense' in query_recorder.tables(sql) for sql, _ in plans)
+
+
+def test_day_sums_are_updated_from_log(seeded, query_recorder):
+    end = at(400).date()
+    before = seeded.expenses_get_sum(START.date(), end)
+    seeded.expense_add(7, 'food', 'x', at(400))
+    plans = query_recorder.record(seeded.expenses_get_sum, START.date(), end)
+    assert not any('DailyTotal' in query_recorder.tables(sql) for sql, _ in plans)
+    assert seeded.expenses_get_sum(START.date(), end) == before + 7
+
+
+def test_scan_is_detected(seeded, query_recorder):
+    plans = query_recorder.record(seeded.expenses_get_list)
+    assert query_recorder.scanned(plans) == {'Expense'}
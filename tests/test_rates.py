@@ -0,0 +1,114 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from bookkeeper import archive, rates
+
+TODAY = datetime.now().replace(microsecond=0)
+
+
+def write_rates(tmp_path, rows, name='rates.csv'):
+    filename = tmp_path / name
+    filename.write_text(
+        'date,currency,rate\n'
+        + ''.join(f'{day},{code},{rate}\n' for day, code, rate in rows),
+        encoding='utf-8'
+    )
+    return str(filename)
+
+
+@pytest.fixture
+def travel(presenter, tmp_path):
+    presenter.category_add('food')
+    presenter.category_add('hotel')
+    presenter.rates_import(write_rates(tmp_path, [
+        (date(2020, 1, 1), 'eur', 80),
+        ((TODAY - timedelta(days=3)).date(), 'EUR', 100),
+        (date(2020, 1, 1), 'USD', 70),
+    ]))
+    return presenter
+
+
+def test_sums_are_converted_to_base_currency(travel):
+    travel.expense_add(500, 'food', 'обед')
+    travel.expense_add(10, 'food', 'кофе', currency='eur')
+    travel.expense_add(2, 'hotel', 'чаевые', currency='USD')
+
+    assert travel.budget_get_sum_for_period(0) == 500 + 10 * 100 + 2 * 70
+    assert travel.expenses_get_sum_history(TODAY - timedelta(days=1)) == 1640
+    assert travel.report_by_category(TODAY - timedelta(days=1)) == {
+        'food': 1500, 'hotel': 140
+    }
+    assert [exp.currency for exp in travel.expenses_get_list()] == ['RUB', 'EUR', 'USD']
+
+
+def test_rate_of_expense_day_is_used(travel):
+    travel.expense_add(1, 'food', 'старый', TODAY - timedelta(days=10), currency='EUR')
+    travel.expense_add(1, 'food', 'новый', TODAY - timedelta(days=1), currency='EUR')
+    # раньше самого раннего курса берётся самый ранний
+    travel.expense_add(1, 'food', 'до курсов', datetime(2019, 6, 1), currency='EUR')
+
+    week = (TODAY - timedelta(days=6)).date(), TODAY.date()
+    assert travel.expenses_get_sum(*week) == 100
+    assert travel.expenses_get_sum(date(2019, 1, 1), TODAY.date()) == 80 + 80 + 100
+
+
+def test_new_rates_recompute_daily_totals(travel, tmp_path):
+    exp_id = travel.expense_add(10, 'food', 'кофе', currency='EUR')
+    travel.expense_add(300, 'food', 'обед')
+    assert travel.budget_get_sum_for_period(0) == 1300
+
+    assert travel.rates_import(write_rates(tmp_path, [(TODAY.date(), 'EUR', 90)])) == 1
+    assert travel.budget_get_sum_for_period(0) == 1200
+
+    travel.expense_edit_currency(exp_id, 'usd')
+    assert travel.budget_get_sum_for_period(0) == 1000
+    travel.expense_delete(exp_id)
+    assert travel.budget_get_sum_for_period(0) == 300
+
+
+def test_unknown_currency_is_rejected(travel, tmp_path):
+    with pytest.raises(ValueError):
+        travel.expense_add(10, 'food', 'обед', currency='GBP')
+    with pytest.raises(ValueError):
+        travel.rates_import(write_rates(tmp_path, [(TODAY.date(), 'RUB', 2)]))
+    with pytest.raises(ValueError):
+        travel.rates_import(write_rates(tmp_path, [(TODAY.date(), 'EUR', 'много')]))
+    assert travel.expenses_get_list() == []
+
+
+def test_currency_distinguishes_duplicates(travel):
+    first = travel.expense_add(10, 'food', 'кофе', TODAY)
+    assert travel.expense_add(10, 'food', 'кофе', TODAY, 'skip', 'EUR') != first
+    assert travel.expense_add(10, 'food', 'кофе', TODAY, 'skip', 'EUR') != first
+    assert len(travel.expenses_get_list()) == 2
+
+
+def test_archived_expenses_keep_currency(travel, db_filename):
+    travel.expense_add(10, 'food', 'кофе', datetime(2021, 5, 1), currency='EUR')
+    travel.expenses_archive(datetime(2022, 1, 1))
+
+    assert [exp.currency for exp in travel.expenses_get_history()] == ['EUR']
+    assert travel.expenses_get_sum_history() == 800
+
+
+def test_old_archive_gets_currency_column(travel, db_filename):
+    con = sqlite3.connect(archive.archive_path(db_filename, 2010))
+    con.execute(
+        'CREATE TABLE "Expense" ("obj_id" INTEGER PRIMARY KEY, "amount" REAL NOT NULL, '
+        '"category_id" INTEGER NOT NULL, "expense_date" DATETIME NOT NULL, '
+        '"comment" TEXT NOT NULL)'
+    )
+    con.execute(
+        'INSERT INTO "Expense" VALUES (1, 5, 1, \'2010-01-01 00:00:00.000000\', \'-\')'
+    )
+    con.commit()
+    con.close()
+
+    assert travel.expenses_get_sum_history(end=datetime(2011, 1, 1)) == 5
+    assert travel.expenses_get_history()[0].currency == rates.BASE_CURRENCY
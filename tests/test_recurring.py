@@ -0,0 +1,69 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from bookkeeper.recurring import occurrences, parse_schedule
+
+
+def test_monthly_schedule_clamps_to_month_end():
+    schedule = parse_schedule('monthly:31')
+    assert list(occurrences(schedule, datetime(2023, 1, 15), datetime(2023, 4, 30))) == [
+        datetime(2023, 1, 31), datetime(2023, 2, 28),
+        datetime(2023, 3, 31), datetime(2023, 4, 30),
+    ]
+
+
+@pytest.mark.parametrize('expression, start, expected', [
+    ('30 9 * * 1-5', datetime(2023, 3, 3, 10), datetime(2023, 3, 6, 9, 30)),
+    ('*/15 * * * *', datetime(2023, 3, 3, 10, 1), datetime(2023, 3, 3, 10, 15)),
+    ('@yearly', datetime(2023, 3, 3), datetime(2024, 1, 1)),
+    ('0 0 29 2 *', datetime(2023, 3, 1), datetime(2024, 2, 29)),
+    # число и день недели ограничены оба: подходит любое
+    ('0 0 13 * 5', datetime(2023, 1, 1), datetime(2023, 1, 6)),
+    ('0 0 * * 7', datetime(2023, 1, 2), datetime(2023, 1, 8)),
+])
+def test_cron_schedule(expression, start, expected):
+    assert parse_schedule(expression).next_from(start) == expected
+
+
+@pytest.mark.parametrize('expression', ['monthly:0', '* * *', '60 * * * *', 'a b c d e'])
+def test_wrong_schedule(expression):
+    with pytest.raises(ValueError):
+        parse_schedule(expression)
+
+
+def test_rule_is_materialized_lazily(presenter):
+    presenter.category_add('rent')
+    start = datetime.now().replace(microsecond=0) - timedelta(days=95)
+    rule_id = presenter.recurring_add(100, 'rent', '', 'monthly:1', start)
+
+    expenses = presenter.expenses_get_list()
+    assert 3 <= len(expenses) <= 4
+    assert all(exp.expense_date <= datetime.now() for exp in expenses)
+    assert presenter.budget_get_sum_for_period(2) in (0, 100, 200)
+
+    rule = presenter.recurring_get_list()[0]
+    assert rule.next_date > datetime.now()
+    # повторный запуск не вносит расходы ещё раз
+    assert presenter.recurring_materialize() == 0
+    assert presenter.recurring_materialize(rule.next_date) == 1
+
+    presenter.recurring_delete(rule_id)
+    assert presenter.recurring_get_list() == []
+    assert len(presenter.expenses_get_list()) == len(expenses) + 1
+
+
+def test_rule_with_end_date(presenter):
+    presenter.category_add('loan')
+    presenter.recurring_add(
+        50, 'loan', 'credit', '0 12 10 * *', datetime(2020, 1, 1), datetime(2020, 3, 31)
+    )
+    assert presenter.recurring_materialize() == 3
+    assert [exp.expense_date for exp in presenter.expenses_get_list()] == [
+        datetime(2020, month, 10, 12) for month in (1, 2, 3)
+    ]
+    assert presenter.recurring_get_list()[0].next_date is None
@@ -0,0 +1,179 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import asyncio
+import json
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from bookkeeper import server as api
+
+
+async def request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = json.dumps(body).encode() if body is not None else b''
+    writer.write(
+        f'{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\n'
+        f'Connection: close\r\n\r\n'.encode() + data
+    )
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    status = int(head.split()[1])
+    if b'chunked' in head:
+        chunks = b''
+        while True:
+            size, _, payload = payload.partition(b'\r\n')
+            size = int(size, 16)
+            if size == 0:
+                break
+            chunks += payload[:size]
+            payload = payload[size + 2:]
+        payload = chunks
+    return status, json.loads(payload)
+
+
+@pytest.fixture
+def call(presenter, monkeypatch):
+    monkeypatch.setattr(api, 'STREAM_PAGE_SIZE', 2)
+
+    def call(*requests):
+        async def run():
+            server = api.ApiServer(presenter, readers=2)
+            await server.start(port=0)
+            try:
+                return [await request(server.port, *args) for args in requests]
+            finally:
+                await server.close()
+        return asyncio.run(run())
+    return call
+
+
+def test_crud(call):
+    results = call(
+        ('POST', '/categories', {'name': 'food'}),
+        ('POST', '/expenses', {'amount': 10, 'category': 'food'}),
+        ('POST', '/expenses', {'amount': 20, 'category': 'food', 'comment': 'x'}),
+        ('POST', '/expenses', {'amount': 30, 'category': 'food'}),
+        ('GET', '/expenses'),
+        ('PUT', '/budget/day', {'limit': 50}),
+        ('GET', '/budget'),
+    )
+    assert [status for status, _ in results] == [200] * 7
+    expenses = results[4][1]
+    assert [e['amount'] for e in expenses] == [10, 20, 30]
+    day = results[6][1][0]
+    assert (day['period'], day['spent'], day['limit'], day['exceeded']) == (
+        'day', 60, 50, True
+    )
+
+    exp_id = expenses[0]['id']
+    (status, edited), (status2, _), (status3, listed) = call(
+        ('PATCH', f'/expenses/{exp_id}', {'comment': 'new'}),
+        ('DELETE', f'/expenses/{exp_id}'),
+        ('GET', '/expenses'),
+    )
+    assert edited['comment'] == 'new'
+    assert [e['amount'] for e in listed] == [20, 30]
+
+
+def test_duplicates(call):
+    date = '2024-01-01 10:00:00'
+    results = call(
+        ('POST', '/categories', {'name': 'food'}),
+        ('POST', '/expenses', {'amount': 10, 'category': 'food', 'date': date}),
+        ('POST', '/expenses', {
+            'amount': 10, 'category': 'food', 'date': date, 'duplicates': 'skip'
+        }),
+        ('POST', '/expenses', {
+            'amount': 10, 'category': 'food', 'date': date, 'duplicates': 'flag'
+        }),
+        ('GET', '/expenses/duplicates'),
+        ('POST', '/expenses', {'amount': 1, 'category': 'food', 'duplicates': 'x'}),
+    )
+    assert results[1][1] == results[2][1]
+    assert [[e['id'] for e in group] for group in results[4][1]] == [
+        [results[1][1]['id'], results[3][1]['id']]
+    ]
+    assert results[5][0] == 400
+
+
+def test_empty_listing(call):
+    assert call(('GET', '/expenses')) == [(200, [])]
+
+
+def test_errors(call):
+    (missing, _), (method, _), (bad, error), (body, _) = call(
+        ('GET', '/nothing'),
+        ('PUT', '/categories'),
+        ('POST', '/expenses', {'amount': 1, 'category': 'unknown'}),
+        ('POST', '/categories', {}),
+    )
+    assert (missing, method, bad, body) == (404, 405, 400, 400)
+    assert 'unknown' in error['error']
+
+
+def test_export(presenter, call):
+    presenter.category_add('food')
+    presenter.category_add('rent')
+    presenter.expense_add(10, 'food', '')
+    presenter.expense_add(300, 'rent', '')
+
+    async def raw(port, path):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'GET {path} HTTP/1.1\r\nConnection: close\r\n\r\n'.encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def run():
+        server = api.ApiServer(presenter, readers=2)
+        await server.start(port=0)
+        try:
+            return (
+                await raw(server.port, '/expenses/export?format=csv&category=rent'),
+                await request(server.port, 'GET', '/expenses/export?category=unknown'),
+            )
+        finally:
+            await server.close()
+
+    exported, (status, _) = asyncio.run(run())
+    head, _, body = exported.partition(b'\r\n\r\n')
+    assert b'text/csv' in head and b'chunked' in head
+    assert b',300.0,' in body and b'rent' in body and b'food' not in body
+    assert status == 400
+
+
+def test_unexpected_error_is_reported(call, monkeypatch):
+    def fail(presenter, args):
+        raise TypeError('boom')
+
+    monkeypatch.setattr(api.cli, 'category_list', fail)
+    (failed, error), (bad_date, _), (listed, _) = call(
+        ('GET', '/categories'),
+        ('POST', '/expenses', {'amount': 1, 'category': 'food', 'date': 5}),
+        ('GET', '/expenses'),
+    )
+    assert (failed, bad_date, listed) == (500, 400, 200)
+    assert error == {'error': 'Internal server error'}
+
+
+def test_due_recurring_expenses_are_written_by_writer(presenter, call, monkeypatch):
+    presenter.category_add('rent')
+    presenter.recurring_add(100, 'rent', '', '@daily', datetime.now() - timedelta(days=3))
+    threads = []
+    materialize = presenter.recurring_materialize
+
+    def recording(*args):
+        threads.append(threading.current_thread().name)
+        return materialize(*args)
+
+    monkeypatch.setattr(presenter, 'recurring_materialize', recording)
+    (status, budget), = call(('GET', '/budget'))
+    assert status == 200 and threads
+    assert all(name.startswith('bookkeeper-writer') for name in threads)
+    assert not presenter.recurring_is_due()
+    assert budget[0]['spent'] == 100
@@ -0,0 +1,86 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from bookkeeper import snapshot
+
+
+def dump(filename):
+    con = sqlite3.connect(filename)
+    tables = [name for (name,) in con.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"
+    )]
+    result = {
+        table: sorted(con.execute(f'SELECT * FROM "{table}"').fetchall(), key=repr)
+        for table in tables
+    }
+    result['schema'] = sorted(
+        con.execute("SELECT type, name, sql FROM sqlite_master").fetchall(), key=repr
+    )
+    con.close()
+    return result
+
+
+@pytest.fixture
+def ledger(presenter):
+    presenter.category_add('food')
+    presenter.category_add('рент')
+    for i in range(50):
+        presenter.expense_add(
+            i * 1.5, 'food' if i % 2 else 'рент', f'comment {i % 7}',
+            datetime(2020, 1, 1 + i % 28, 12, 30, 15, 123456 + i)
+        )
+    presenter.budget_edit_limit(presenter.budget_get_by_period(1).obj_id, 123.5)
+    return presenter
+
+
+def test_roundtrip(ledger, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, 'ROW_GROUP_SIZE', 16)
+    path = str(tmp_path / 'ledger.snap')
+    saved = ledger.snapshot_save(path)
+    assert saved['Expense'] == 50
+
+    restored = str(tmp_path / 'restored.sqlite')
+    assert snapshot.restore(path, restored) == saved
+    assert dump(restored) == dump(ledger.db_filename)
+
+
+def test_restore_keeps_autoincrement(ledger, tmp_path):
+    path = str(tmp_path / 'ledger.snap')
+    ledger.snapshot_save(path)
+    restored = str(tmp_path / 'restored.sqlite')
+    snapshot.restore(path, restored)
+
+    con = sqlite3.connect(restored)
+    con.execute(
+        'INSERT INTO "Category" ("name") VALUES (\'new\')'
+    )
+    (max_id,) = con.execute('SELECT max("obj_id") FROM "Category"').fetchone()
+    assert con.execute('SELECT count(*) FROM sqlite_sequence').fetchone()[0] == \
+        con.execute('SELECT count(DISTINCT name) FROM sqlite_sequence').fetchone()[0]
+    con.close()
+    assert max_id == max(cat.obj_id for cat in ledger.categories_get_list()) + 1
+
+
+def test_corrupted_snapshot(ledger, tmp_path):
+    path = tmp_path / 'ledger.snap'
+    ledger.snapshot_save(str(path))
+    data = bytearray(path.read_bytes())
+    data[len(data) // 2] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.restore(str(path), str(tmp_path / 'restored.sqlite'))
+    assert not (tmp_path / 'restored.sqlite').exists()
+
+
+def test_restore_does_not_overwrite(ledger, tmp_path):
+    path = str(tmp_path / 'ledger.snap')
+    ledger.snapshot_save(path)
+    with pytest.raises(FileExistsError):
+        snapshot.restore(path, ledger.db_filename)
@@ -0,0 +1,12 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+from bookkeeper import stress
+
+
+def test_concurrent_processes_do_not_fail(tmp_path):
+    report = stress.run(str(tmp_path / 'stress.sqlite'), processes=3, operations=40)
+    assert report['errors'] == 0, report['error_details']
+    assert report['operations'] == 120
+    assert report['latency_ms']['add']['p99'] >= report['latency_ms']['add']['p50']
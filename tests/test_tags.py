@@ -0,0 +1,120 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from bookkeeper import tags
+from bookkeeper.presenter import Presenter
+
+TODAY = datetime.now().replace(microsecond=0)
+
+
+@pytest.fixture
+def trip(presenter):
+    presenter.category_add('food')
+    presenter.category_add('hotel')
+    ids = [
+        presenter.expense_add(100, 'food', 'обед', TODAY),
+        presenter.expense_add(3000, 'hotel', 'отель', TODAY),
+        presenter.expense_add(50, 'food', 'кофе', TODAY - timedelta(days=40)),
+        presenter.expense_add(700, 'food', 'ужин', TODAY),
+    ]
+    presenter.expenses_tag(ids[:3], 'отпуск')
+    presenter.expenses_tag([ids[1], ids[3]], 'к возмещению')
+    return presenter, ids
+
+
+def test_tag_queries(trip):
+    presenter, ids = trip
+    assert presenter.tags_get_list() == {'к возмещению': 2, 'отпуск': 3}
+    assert presenter.expenses_find_by_tags('отпуск') == ids[:3]
+    assert presenter.expenses_find_by_tags('отпуск AND NOT "к возмещению"') == [
+        ids[0], ids[2]
+    ]
+    assert presenter.expenses_find_by_tags('NOT отпуск') == [ids[3]]
+    assert presenter.expenses_find_by_tags(
+        '"к возмещению" or (отпуск and not "к возмещению")'
+    ) == ids
+    assert presenter.expenses_find_by_tags('командировка') == []
+    assert presenter.expense_get_tags(ids[1]) == ['к возмещению', 'отпуск']
+    for query in ('отпуск AND', '(отпуск', 'отпуск )', 'NOT', 'отпуск отпуск'):
+        with pytest.raises(ValueError):
+            presenter.expenses_find_by_tags(query)
+
+
+def test_tagging_is_incremental(trip):
+    presenter, ids = trip
+    assert presenter.expenses_tag(ids + [10 ** 6], 'отпуск') == 1
+    assert presenter.expenses_untag(ids[:2], 'отпуск') == 2
+    presenter.expense_delete(ids[2])
+    assert presenter.expenses_find_by_tags('отпуск') == [ids[3]]
+    assert presenter.expenses_find_by_tags('NOT отпуск') == ids[:2]
+
+    presenter.tag_delete('к возмещению')
+    assert presenter.tags_get_list() == {'отпуск': 1}
+    assert presenter.expense_get_tags(ids[1]) == []
+    with pytest.raises(NameError):
+        presenter.expenses_untag(ids, 'к возмещению')
+    with pytest.raises(ValueError):
+        presenter.expenses_tag(ids, ' ')
+
+
+def test_bitmaps_are_saved_and_log_is_trimmed(trip, db_filename, monkeypatch):
+    presenter, ids = trip
+    monkeypatch.setattr(tags, 'CHECKPOINT_SIZE', 3)
+    presenter.expenses_find_by_tags('отпуск')
+    presenter.expenses_untag([ids[0]], 'отпуск')
+    # другой процесс достраивает свои карты по журналу после сохранения
+    other = tags.TagIndex(db_filename)
+    assert list(tags.bits(other.evaluate('отпуск'))) == ids[1:3]
+
+    presenter.expenses_tag([ids[3]], 'отпуск')
+    assert presenter.expenses_find_by_tags('отпуск') == ids[1:]
+    presenter.expenses_tag([ids[0]], 'к возмещению')
+    presenter.expense_delete(ids[1])
+    found = other.evaluate('отпуск OR "к возмещению"')
+    assert list(tags.bits(found)) == [ids[0]] + ids[2:]
+    other.close()
+    assert Presenter(db_filename).expenses_find_by_tags('NOT отпуск') == [ids[0]]
+
+
+def test_tagged_totals(trip, tmp_path):
+    presenter, ids = trip
+    week = TODAY - timedelta(days=6), TODAY + timedelta(days=1)
+    assert presenter.expenses_get_sum_by_tags('отпуск') == 3150
+    assert presenter.expenses_get_sum_by_tags('отпуск', *week) == 3100
+    food = presenter.categories_get_by_name('food')[0].obj_id
+    assert presenter.expenses_get_sum_by_tags('"к возмещению"', category_id=food) == 700
+    assert presenter.report_by_category(*week, tag_query='NOT "к возмещению"') == {
+        'food': 100
+    }
+    day_budget = presenter.budget_get_by_period(0)
+    assert presenter.budget_get_sum_by_tags(day_budget, 'отпуск') == 3100
+
+
+def test_tagged_totals_read_expenses_by_id(trip, query_recorder):
+    presenter, ids = trip
+    # карта всех расходов строится по таблице один раз, при первом запросе
+    presenter.expenses_find_by_tags('отпуск')
+    presenter.expenses_tag(ids, 'отпуск')
+    plans = query_recorder.record(presenter.expenses_get_sum_by_tags, 'отпуск')
+    assert plans
+    assert 'Expense' not in query_recorder.scanned(plans), plans
+    assert 'ExpenseTag' not in query_recorder.tables(plans[-1][0]).values()
+
+
+def test_query_is_evaluated_under_lock(trip, monkeypatch):
+    presenter, ids = trip
+    index = presenter._tags
+    read = index._bitmap
+
+    def locked_read(tag_id):
+        assert index._lock.locked()
+        return read(tag_id)
+    monkeypatch.setattr(index, '_bitmap', locked_read)
+    assert list(tags.bits(index.evaluate('отпуск AND NOT "к возмещению"'))) == [
+        ids[0], ids[2]
+    ]
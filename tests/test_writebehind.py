@@ -0,0 +1,161 @@
+# Костыли.
+import sys
+sys.path.insert(0, sys.path[0] + '/..')
+
+import os
+import sqlite3
+import subprocess
+
+import pytest
+
+from bookkeeper import migrations, writebehind
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+EXPENSE = (
+    'INSERT INTO "Expense" ("amount", "category_id", "expense_date", "comment", '
+    '"fingerprint") VALUES (?, 1, \'2024-01-01 00:00:00.000000\', \'-\', \'-\')'
+)
+
+
+def rows(filename, sql):
+    con = sqlite3.connect(filename)
+    try:
+        return con.execute(sql).fetchall()
+    finally:
+        con.close()
+
+
+def open_working(tmp_path):
+    db_filename = str(tmp_path / 'database.sqlite')
+    con = sqlite3.connect(db_filename)
+    migrations.migrate(con)
+    con.close()
+    # фоновый поток в тестах не мешает: переносом управляет тест
+    wb = writebehind.WriteBehind(db_filename, interval=3600)
+    return wb, sqlite3.connect(wb.filename, isolation_level=None)
+
+
+@pytest.fixture
+def working(tmp_path):
+    wb, con = open_working(tmp_path)
+    yield wb, con
+    con.close()
+    wb.close()
+
+
+def test_changes_are_journaled_and_flushed(working):
+    wb, con = working
+    con.executemany(EXPENSE, [(10,), (20,), (30,)])
+    con.execute('UPDATE "Expense" SET "amount" = 25 WHERE "amount" = 20')
+    con.execute('DELETE FROM "Expense" WHERE "amount" = 30')
+    con.execute('INSERT INTO "Tag" ("name") VALUES (\'trip\')')
+    con.execute('INSERT INTO "ExpenseTag" VALUES (1, 1)')
+
+    assert wb.capture() == 5
+    assert rows(wb.db_filename, 'SELECT count(*) FROM "Expense"') == [(0,)]
+    assert len(open(wb.journal_filename).readlines()) == 1
+
+    wb.flush()
+    assert rows(wb.db_filename, 'SELECT "obj_id", "amount" FROM "Expense"') == [
+        (1, 10), (2, 25)
+    ]
+    assert rows(wb.db_filename, 'SELECT * FROM "ExpenseTag"') == [(1, 1)]
+    # производные таблицы пересчитаны триггерами файла базы
+    assert rows(wb.db_filename, 'SELECT sum("amount") FROM "DailyTotal"') == [(35,)]
+    assert os.path.getsize(wb.journal_filename) == 0
+
+
+def test_journal_is_replayed_after_crash(working):
+    wb, con = working
+    con.execute(EXPENSE, (10,))
+    wb.capture()
+    con.execute(EXPENSE, (20,))
+    wb.capture()
+    # падение во время записи оставляет недописанную строку
+    with open(wb.journal_filename, 'a') as journal:
+        journal.write('{"seq": 3, "tab')
+
+    assert writebehind.recover(wb.db_filename) == 2
+    assert rows(wb.db_filename, 'SELECT "amount" FROM "Expense"') == [(10,), (20,)]
+    assert rows(wb.db_filename, 'SELECT "seq" FROM "WriteBehind"') == [(2,)]
+    assert not os.path.exists(wb.journal_filename)
+
+
+def test_changes_by_other_process_stop_flushing(tmp_path):
+    wb, con = open_working(tmp_path)
+    other = sqlite3.connect(wb.db_filename)
+    other.execute(EXPENSE, (99,))
+    other.commit()
+    other.close()
+
+    con.execute(EXPENSE, (10,))
+    with pytest.raises(ValueError):
+        wb.flush()
+    con.close()
+    with pytest.raises(ValueError):
+        wb.close()
+    # журнал сохраняется и переносится при следующем запуске
+    assert not os.path.exists(wb.filename)
+    assert writebehind.recover(wb.db_filename) == 1
+
+
+def test_presenter_in_memory_survives_crash(tmp_path):
+    db_filename = str(tmp_path / 'database.sqlite')
+    script = (
+        'import os, sys\n'
+        'from bookkeeper import writebehind\n'
+        'from bookkeeper.presenter import Presenter\n'
+        'writebehind.FLUSH_INTERVAL = 3600\n'
+        'presenter = Presenter(sys.argv[1], in_memory=True)\n'
+        'if not presenter.categories_get_by_name("food"):\n'
+        '    presenter.category_add("food")\n'
+        'for amount in range(1, 11):\n'
+        '    presenter.expense_add(amount, "food", "-")\n'
+        'if sys.argv[2] == "crash":\n'
+        '    os._exit(0)\n'
+        'presenter.expense_delete(1)\n'
+    )
+    for mode in ('crash', 'exit'):
+        subprocess.run(
+            [sys.executable, '-c', script, db_filename, mode], cwd=ROOT, check=True
+        )
+        if mode == 'crash':
+            assert rows(db_filename, 'SELECT count(*) FROM "Expense"') == [(0,)]
+            assert os.path.getsize(writebehind.journal_path(db_filename)) > 0
+
+    # второй запуск перенёс журнал первого, а его изменения перенесены при выходе
+    assert rows(db_filename, 'SELECT count(*), sum("amount") FROM "Expense"') == [
+        (19, 109)
+    ]
+    assert rows(db_filename, 'SELECT count(*) FROM "Category"') == [(1,)]
+    assert not os.path.exists(writebehind.journal_path(db_filename))
+
+
+def test_journal_is_replayed_before_normal_start(tmp_path):
+    db_filename = str(tmp_path / 'database.sqlite')
+    script = (
+        'import os, sys\n'
+        'from bookkeeper import writebehind\n'
+        'from bookkeeper.presenter import Presenter\n'
+        'writebehind.FLUSH_INTERVAL = 3600\n'
+        'presenter = Presenter(sys.argv[1], in_memory=sys.argv[2] != "normal")\n'
+        'if sys.argv[2] == "crash":\n'
+        '    presenter.category_add("food")\n'
+        '    presenter.expense_add(111, "food", "crashed")\n'
+        '    os._exit(0)\n'
+        'if sys.argv[2] == "normal":\n'
+        '    presenter.expense_edit_cost(1, 222)\n'
+    )
+    for mode in ('crash', 'normal', 'memory'):
+        subprocess.run(
+            [sys.executable, '-c', script, db_filename, mode], cwd=ROOT, check=True
+        )
+        if mode == 'normal':
+            assert not os.path.exists(writebehind.journal_path(db_filename))
+
+    # запуск в памяти не возвращает расход к состоянию из журнала упавшего запуска
+    assert rows(db_filename, 'SELECT "amount", "comment" FROM "Expense"') == [
+        (222, 'crashed')
+    ]
+    assert rows(db_filename, 'SELECT sum("amount") FROM "DailyTotal"') == [(222,)]